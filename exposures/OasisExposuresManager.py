@@ -12,20 +12,30 @@ __all__ = [
 ]
 
 import io
+import itertools
 import json
 import logging
 import os
 import shutil
 import subprocess
 import sys
+import threading
 
-from datetime import datetime
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
-import pandas as pd
+from datetime import datetime
 
 from interface import implements
 
 from OasisExposuresManagerInterface import OasisExposuresManagerInterface
+from OasisExposuresTransformer import (
+    OasisExposuresTransformer,
+    OasisTransformationNotSupported,
+)
+from OasisFilesBuilder import OasisFilesBuilder
 from OasisFilesPipeline import OasisFilesPipeline
 
 if os.getcwd().split(os.path.sep)[-1] == 'exposures':
@@ -40,6 +50,56 @@ from oasis_utils import (
 from keys import OasisKeysLookupFactory as oklf
 
 
+def _iter_in_thread(iterable, max_items=2):
+    """
+    Generates the items of ``iterable``, which is consumed in a background
+    thread, so that the items are produced while the consumer of this
+    generator processes the previous ones. At most ``max_items`` items are
+    buffered. Exceptions raised in the background thread are re-raised in
+    the consumer, and closing the generator stops the background thread.
+    """
+    items = queue.Queue(maxsize=max_items)
+    stop = threading.Event()
+    end = object()
+
+    def put(item, error=None):
+        while not stop.is_set():
+            try:
+                items.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(end)
+        except Exception as e:
+            put(end, e)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
 class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
 
 
@@ -218,6 +278,142 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             self._models.clear()
 
 
+    def get_exposures_transformer(
+        self,
+        transformation_file_path,
+        validation_file_path=None,
+        oasis_model=None,
+        transformation_plans_cache_path=None
+    ):
+        """
+        Returns a native exposures transformer - a compiled transformation
+        plan - for a transformation (XSLT) file and validation (XSD) file.
+
+        Plans are keyed by the hash of the contents of the files. If an
+        ``oasis_model`` is given then its plans are cached in its resources
+        dict, under ``transformation_plans``, so that repeated
+        transformations for the model (e.g. for a batch of portfolios) reuse
+        the compiled plan. If a ``transformation_plans_cache_path`` directory
+        is given then plans are also persisted as JSON in that directory (see
+        ``OasisExposuresTransformer.to_json``), and loaded from it in later
+        runs, which skips reading and parsing the files. Plans which cannot be
+        loaded are compiled again from the files.
+        """
+        plan_key = OasisExposuresTransformer.get_plan_key(transformation_file_path, validation_file_path)
+
+        plans = None
+        if oasis_model is not None:
+            plans = oasis_model.resources.setdefault('transformation_plans', {})
+            if plan_key in plans:
+                return plans[plan_key]
+
+        transformer = None
+
+        plan_file_path = None
+        if transformation_plans_cache_path:
+            plan_file_path = os.path.join(transformation_plans_cache_path, '{}.json'.format(plan_key))
+            if os.path.exists(plan_file_path):
+                try:
+                    with io.open(plan_file_path, 'rb') as f:
+                        transformer = OasisExposuresTransformer.from_json(f.read().decode('utf-8'))
+                except (IOError, OSError, OasisException) as e:
+                    self.logger.info('Unable to load the exposures transformation plan {}: {}'.format(plan_file_path, str(e)))
+
+        if transformer is None:
+            transformer = OasisExposuresTransformer.create(transformation_file_path, validation_file_path)
+
+            if plan_file_path:
+                try:
+                    if not os.path.exists(transformation_plans_cache_path):
+                        os.makedirs(transformation_plans_cache_path)
+                    temporary_file_path = OasisFilesBuilder.get_temporary_file_path(plan_file_path)
+                    with io.open(temporary_file_path, 'wb') as f:
+                        f.write(transformer.to_json().encode('utf-8'))
+                    OasisFilesBuilder.commit_file(temporary_file_path, plan_file_path)
+                except (IOError, OSError) as e:
+                    raise OasisException('Error saving the exposures transformation plan {}: {}'.format(plan_file_path, str(e)))
+        else:
+            self.logger.info('Loaded exposures transformation plan {} for {}'.format(plan_file_path, transformation_file_path))
+
+        if plans is not None:
+            plans[plan_key] = transformer
+
+        return transformer
+
+
+    def transform_exposures_file(
+        self,
+        input_file_path,
+        validation_file_path,
+        transformation_file_path,
+        output_file_path,
+        sequence_numbers=False,
+        transformation_engine=None,
+        xtrans_path=None,
+        oasis_model=None,
+        transformation_plans_cache_path=None
+    ):
+        """
+        Applies an exposures transformation (XSLT), with validation (XSD), to
+        an exposures CSV file and writes the result to ``output_file_path``.
+        If ``sequence_numbers`` is set then a ``ROW_ID`` column is added to
+        the output.
+
+        The ``transformation_engine`` is either ``xtrans`` (the default), in
+        which case the transformation is run by the ``xtrans`` (Mono)
+        executable at ``xtrans_path``, or ``native``, in which case it is run
+        in process by ``OasisExposuresTransformer``. If the native
+        engine does not support the transformation or validation files then
+        it falls back to ``xtrans``, if an ``xtrans_path`` is given. The
+        native transformation plans are cached on the optional
+        ``oasis_model`` and in the optional plans cache directory
+        ``transformation_plans_cache_path`` (see
+        ``get_exposures_transformer``).
+        """
+        transformation_engine = transformation_engine or 'xtrans'
+        if transformation_engine not in ('native', 'xtrans'):
+            raise OasisException('Invalid exposures transformation engine "{}" - choices are "native" and "xtrans"'.format(transformation_engine))
+
+        if transformation_engine == 'native':
+            try:
+                transformer = self.get_exposures_transformer(
+                    transformation_file_path,
+                    validation_file_path,
+                    oasis_model=oasis_model,
+                    transformation_plans_cache_path=transformation_plans_cache_path
+                )
+            except OasisTransformationNotSupported as e:
+                if not xtrans_path:
+                    raise OasisException(
+                        'Exposures transformation {} not supported by the native engine, and no xtrans path given: {}'.format(transformation_file_path, str(e))
+                    )
+                self.logger.info(
+                    'Exposures transformation {} not supported by the native engine ({}) - using xtrans'.format(transformation_file_path, str(e))
+                )
+            else:
+                transformer.transform(input_file_path, output_file_path, sequence_numbers=sequence_numbers)
+                return output_file_path
+
+        if not xtrans_path:
+            raise OasisException('No xtrans path given for the exposures transformation {}'.format(transformation_file_path))
+
+        xtrans_args = {
+            'd': validation_file_path,
+            'c': input_file_path,
+            't': transformation_file_path,
+            'o': output_file_path
+        }
+        if sequence_numbers:
+            xtrans_args['s'] = ''
+
+        try:
+            run_mono_executable(os.path.abspath(xtrans_path), xtrans_args)
+        except OasisException as e:
+            raise e
+
+        return output_file_path
+
+
     def transform_source_to_canonical(self, oasis_model, with_model_resources=True, **kwargs):
         """
         Transforms the source exposures/locations file for a given
@@ -241,20 +437,23 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
         tfp = omr['oasis_files_pipeline']
 
         if not with_model_resources:
-            xtrans_path = kwargs['xtrans_path']
+            xtrans_path = kwargs.get('xtrans_path')
+            transformation_engine = kwargs.get('transformation_engine')
+            transformation_plans_cache_path = kwargs.get('transformation_plans_cache_path')
             input_file_path = kwargs['source_exposures_file_path']
             validation_file_path = kwargs['source_exposures_validation_file_path']
             transformation_file_path = kwargs['source_to_canonical_exposures_transformation_file_path']
             output_file_path = kwargs['canonical_exposures_file_path']
         else:
-            xtrans_path = omr['xtrans_path']
+            xtrans_path = omr.get('xtrans_path')
+            transformation_engine = omr.get('transformation_engine')
+            transformation_plans_cache_path = omr.get('transformation_plans_cache_path')
             input_file_path = tfp.source_exposures_file.name
             validation_file_path = omr['source_exposures_validation_file_path']
             transformation_file_path = omr['source_to_canonical_exposures_transformation_file_path']
             output_file_path = tfp.canonical_exposures_file.name
 
         (
-            xtrans_path,
             input_file_path,
             validation_file_path,
             transformation_file_path,
@@ -262,7 +461,6 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
         ) = map(
             os.path.abspath,
             [
-                xtrans_path,
                 input_file_path,
                 validation_file_path,
                 transformation_file_path,
@@ -270,18 +468,17 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             ]
         )        
 
-        xtrans_args = {
-            'd': validation_file_path,
-            'c': input_file_path,
-            't': transformation_file_path,
-            'o': output_file_path,
-            's': ''
-        }
-
-        try:
-            run_mono_executable(xtrans_path, xtrans_args)
-        except OasisException as e:
-            raise e
+        self.transform_exposures_file(
+            input_file_path,
+            validation_file_path,
+            transformation_file_path,
+            output_file_path,
+            sequence_numbers=True,
+            transformation_engine=transformation_engine,
+            xtrans_path=xtrans_path,
+            oasis_model=oasis_model,
+            transformation_plans_cache_path=transformation_plans_cache_path
+        )
 
         with io.open(output_file_path, 'r', encoding='utf-8') as f:
             if not with_model_resources:
@@ -315,20 +512,23 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
         tfp = omr['oasis_files_pipeline']
 
         if not with_model_resources:
-            xtrans_path = kwargs['xtrans_path']
+            xtrans_path = kwargs.get('xtrans_path')
+            transformation_engine = kwargs.get('transformation_engine')
+            transformation_plans_cache_path = kwargs.get('transformation_plans_cache_path')
             input_file_path = kwargs['canonical_exposures_file_path']
             validation_file_path = kwargs['canonical_exposures_validation_file_path']
             transformation_file_path = kwargs['canonical_to_model_exposures_transformation_file_path']
             output_file_path = kwargs['model_exposures_file_path']
         else:
-            xtrans_path = omr['xtrans_path']
+            xtrans_path = omr.get('xtrans_path')
+            transformation_engine = omr.get('transformation_engine')
+            transformation_plans_cache_path = omr.get('transformation_plans_cache_path')
             input_file_path = tfp.canonical_exposures_file.name
             validation_file_path = omr['canonical_exposures_validation_file_path']
             transformation_file_path = omr['canonical_to_model_exposures_transformation_file_path']
             output_file_path = tfp.model_exposures_file.name
 
         (
-            xtrans_path,
             input_file_path,
             validation_file_path,
             transformation_file_path,
@@ -336,7 +536,6 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
         ) = map(
             os.path.abspath,
             [
-                xtrans_path,
                 input_file_path,
                 validation_file_path,
                 transformation_file_path,
@@ -344,17 +543,16 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             ]
         )
 
-        xtrans_args = {
-            'd': validation_file_path,
-            'c': input_file_path,
-            't': transformation_file_path,
-            'o': output_file_path
-        }
-
-        try:
-            run_mono_executable(xtrans_path, xtrans_args)
-        except OasisException as e:
-            raise e
+        self.transform_exposures_file(
+            input_file_path,
+            validation_file_path,
+            transformation_file_path,
+            output_file_path,
+            transformation_engine=transformation_engine,
+            xtrans_path=xtrans_path,
+            oasis_model=oasis_model,
+            transformation_plans_cache_path=transformation_plans_cache_path
+        )
 
         with io.open(output_file_path, 'r', encoding='utf-8') as f:
             if not with_model_resources:
@@ -386,18 +584,61 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
         which case all the resources required for the transformation should be
         present in the optional ``kwargs`` dict as named arguments. In this
         case only the generated canonical file is returned.
+
+        If a ``keys_lookup_num_processes`` greater than 1 is provided (in
+        ``kwargs`` or the model resources) then the lookup is run in parallel
+        in that many worker processes, each of which creates its own lookup
+        service instance from the ``keys_data_path``,
+        ``model_version_file_path`` and ``lookup_package_path`` resources.
+        If a ``keys_cache_path`` is provided then the lookup results are
+        cached in a persistent keys lookup cache at that path, bounded by the
+        optional ``keys_cache_max_entries``, and only locations not in the
+        cache are looked up - the cache is keyed by the location columns
+        ``keys_cache_columns`` (a list, or a string of comma-separated
+        columns) if they are provided, or else by all the location columns
+        except the ID.
+
+        The model exposures can also be given in ``kwargs``, in either mode,
+        as an iterable of chunks ``model_exposures_chunks`` of model exposures
+        file contents, which are looked up as they are generated (see
+        ``stream_exposures_to_keys``).
         """
         omr = oasis_model.resources
         tfp = omr['oasis_files_pipeline']        
 
+        model_exposures_chunks = kwargs['model_exposures_chunks'] if 'model_exposures_chunks' in kwargs else None
+
         if not with_model_resources:
             model_exposures_file_path = kwargs['model_exposures_file_path'] if 'model_exposures_file_path' in kwargs else None
             lookup = kwargs['lookup']
             keys_file_path = kwargs['keys_file_path']
+            lookup_resources = kwargs
         else:
             model_exposures_file_path = tfp.model_exposures_file.name if tfp.model_exposures_file else None
             lookup = omr['lookup']
             keys_file_path = tfp.keys_file.name
+            lookup_resources = omr
+
+        (
+            keys_lookup_num_processes,
+            keys_data_path,
+            model_version_file_path,
+            lookup_package_path,
+            keys_cache_path,
+            keys_cache_max_entries,
+            keys_cache_columns
+        ) = [
+            lookup_resources[k] if k in lookup_resources else None
+            for k in [
+                'keys_lookup_num_processes',
+                'keys_data_path',
+                'model_version_file_path',
+                'lookup_package_path',
+                'keys_cache_path',
+                'keys_cache_max_entries',
+                'keys_cache_columns'
+            ]
+        ]
 
         (
             model_exposures_file_path,
@@ -408,7 +649,15 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             lookup=lookup,
             model_exposures_file_path=model_exposures_file_path,
             output_file_path=keys_file_path,
-            format='oasis_keys'
+            format='oasis_keys',
+            num_processes=(int(keys_lookup_num_processes) if keys_lookup_num_processes else 1),
+            model_keys_data_path=keys_data_path,
+            model_version_file_path=model_version_file_path,
+            lookup_package_path=lookup_package_path,
+            keys_cache_path=keys_cache_path,
+            keys_cache_max_entries=keys_cache_max_entries,
+            keys_cache_columns=keys_cache_columns,
+            model_exposures_chunks=model_exposures_chunks
         )
 
         if not with_model_resources:
@@ -419,6 +668,149 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
         return oasis_model
 
 
+    def stream_exposures_to_keys(self, oasis_model, with_model_resources=True, **kwargs):
+        """
+        Generates the canonical exposures, model exposures and Oasis keys
+        files for a given model object in a single streaming pass, in which
+        the source -> canonical transformation, the canonical -> model
+        transformation and the keys lookup run as concurrent stages - each
+        stage consumes the output of the previous stage chunk by chunk (in
+        the chunks in which ``xtrans`` processes files) while it is being
+        generated, instead of waiting for the whole output file. The
+        intermediate files are still written, and are identical to the files
+        generated by ``transform_source_to_canonical``,
+        ``transform_canonical_to_model`` and ``get_keys``.
+
+        The transformations are run in background threads by the native
+        transformation engine, which must be selected - with the default
+        ``xtrans`` engine, or if the native engine does not support the
+        transformation or validation files, the three steps are run in
+        sequence instead.
+
+        The resources are looked up as in the individual methods - in the
+        model object's resources dict and files pipeline by default, or in
+        ``kwargs`` if ``with_model_resources`` is ``False``, in which case
+        the triple of the canonical exposures, model exposures and keys
+        files is returned.
+        """
+        omr = oasis_model.resources
+        tfp = omr['oasis_files_pipeline']
+
+        if not with_model_resources:
+            resources = kwargs
+            source_exposures_file_path = kwargs['source_exposures_file_path']
+            canonical_exposures_file_path = kwargs['canonical_exposures_file_path']
+            model_exposures_file_path = kwargs['model_exposures_file_path']
+        else:
+            resources = omr
+            source_exposures_file_path = tfp.source_exposures_file.name
+            canonical_exposures_file_path = tfp.canonical_exposures_file.name
+            model_exposures_file_path = tfp.model_exposures_file.name
+
+        (
+            source_exposures_file_path,
+            canonical_exposures_file_path,
+            model_exposures_file_path
+        ) = map(
+            os.path.abspath,
+            [
+                source_exposures_file_path,
+                canonical_exposures_file_path,
+                model_exposures_file_path
+            ]
+        )
+
+        transformation_engine = resources.get('transformation_engine') or 'xtrans'
+
+        try:
+            if transformation_engine != 'native':
+                raise OasisTransformationNotSupported('The {} transformation engine cannot be streamed'.format(transformation_engine))
+
+            source_to_canonical_transformer = self.get_exposures_transformer(
+                os.path.abspath(resources['source_to_canonical_exposures_transformation_file_path']),
+                os.path.abspath(resources['source_exposures_validation_file_path']),
+                oasis_model=oasis_model,
+                transformation_plans_cache_path=resources.get('transformation_plans_cache_path')
+            )
+            canonical_to_model_transformer = self.get_exposures_transformer(
+                os.path.abspath(resources['canonical_to_model_exposures_transformation_file_path']),
+                os.path.abspath(resources['canonical_exposures_validation_file_path']),
+                oasis_model=oasis_model,
+                transformation_plans_cache_path=resources.get('transformation_plans_cache_path')
+            )
+        except OasisTransformationNotSupported as e:
+            self.logger.info('Unable to stream the exposures transformations ({}) - running them in sequence'.format(str(e)))
+
+            if not with_model_resources:
+                return (
+                    self.transform_source_to_canonical(oasis_model, with_model_resources=False, **kwargs),
+                    self.transform_canonical_to_model(oasis_model, with_model_resources=False, **kwargs),
+                    self.get_keys(oasis_model, with_model_resources=False, **kwargs)
+                )
+
+            self.transform_source_to_canonical(oasis_model)
+            self.transform_canonical_to_model(oasis_model)
+            self.get_keys(oasis_model)
+
+            return oasis_model
+
+        canonical_exposures_chunks = _iter_in_thread(
+            OasisExposuresTransformer.write_chunks(
+                source_to_canonical_transformer.iter_transform(
+                    OasisExposuresTransformer.read_chunks(source_exposures_file_path),
+                    sequence_numbers=True,
+                    source=source_exposures_file_path
+                ),
+                canonical_exposures_file_path
+            )
+        )
+
+        model_exposures_chunks = _iter_in_thread(
+            OasisExposuresTransformer.write_chunks(
+                canonical_to_model_transformer.iter_transform(
+                    OasisExposuresTransformer.iter_record_chunks(
+                        OasisExposuresTransformer.split_lines(itertools.chain.from_iterable(canonical_exposures_chunks)),
+                        source=canonical_exposures_file_path
+                    ),
+                    source=canonical_exposures_file_path
+                ),
+                model_exposures_file_path
+            )
+        )
+
+        def model_exposures():
+            header = None
+            for lines in model_exposures_chunks:
+                if header is None and lines:
+                    header, lines = lines[0], lines[1:]
+                if any(lines):
+                    yield u'\n'.join([header] + lines) + u'\n'
+
+        try:
+            keys_kwargs = dict(kwargs)
+            keys_kwargs['model_exposures_chunks'] = model_exposures()
+            keys_kwargs['model_exposures_file_path'] = model_exposures_file_path
+
+            keys_file = self.get_keys(oasis_model, with_model_resources=with_model_resources, **keys_kwargs)
+        finally:
+            model_exposures_chunks.close()
+            canonical_exposures_chunks.close()
+
+        with io.open(canonical_exposures_file_path, 'r', encoding='utf-8') as f:
+            canonical_exposures_file = f
+
+        with io.open(model_exposures_file_path, 'r', encoding='utf-8') as f:
+            model_exposures_file = f
+
+        if not with_model_resources:
+            return canonical_exposures_file, model_exposures_file, keys_file
+
+        tfp.canonical_exposures_file = canonical_exposures_file
+        tfp.model_exposures_file = model_exposures_file
+
+        return oasis_model
+
+
     def load_canonical_profile(self, oasis_model, with_model_resources=True, **kwargs):
         """
         Loads a JSON string or JSON file representation of the canonical
@@ -456,6 +848,29 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
         return oasis_model
 
 
+    def get_oasis_files_builder(self, oasis_model, canonical_exposures_file_path, keys_file_path, canonical_exposures_profile):
+        """
+        Returns the Oasis files builder for the given ``oasis_model`` and
+        inputs. The builder is cached in the model's Oasis files pipeline, so
+        that the canonical exposures and keys files are parsed and joined only
+        once for all the Oasis files generated from them - a new builder is
+        created only if there is none in the pipeline or if the cached
+        builder is for different (or changed) inputs.
+        """
+        tfp = oasis_model.resources['oasis_files_pipeline']
+
+        builder = tfp.oasis_files_builder
+
+        if not (builder and builder.is_built_from(canonical_exposures_file_path, keys_file_path, canonical_exposures_profile)):
+            builder = tfp.oasis_files_builder = OasisFilesBuilder.create(
+                canonical_exposures_file_path=canonical_exposures_file_path,
+                keys_file_path=keys_file_path,
+                canonical_exposures_profile=canonical_exposures_profile
+            )
+
+        return builder
+
+
     def generate_items_file(self, oasis_model, with_model_resources=True, **kwargs):
         """
         Generates an items file for the given ``oasis_model``.
@@ -480,17 +895,6 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             items_file_path = omr['items_file_path']
             items_timestamped_file_path = omr['items_timestamped_file_path']
 
-        with io.open(canonical_exposures_file_path, 'r', encoding='utf-8') as cf:
-            with io.open(keys_file_path, 'r', encoding='utf-8') as kf:
-                canexp_df = pd.read_csv(io.StringIO(cf.read()))
-                canexp_df = canexp_df.where(canexp_df.notnull(), None)
-                canexp_df.columns = map(str.lower, canexp_df.columns)
-
-                keys_df = pd.read_csv(io.StringIO(kf.read()))
-                keys_df = keys_df.rename(columns={'CoverageID': 'CoverageType'})
-                keys_df = keys_df.where(keys_df.notnull(), None)
-                keys_df.columns = map(str.lower, keys_df.columns)
-
         if not canonical_exposures_profile:
             if canonical_exposures_profile_json:
                 omr['canonical_exposures_profile_json'] = canonical_exposures_profile_json
@@ -499,62 +903,29 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
 
             canonical_exposures_profile = self.load_canonical_profile(oasis_model, with_model_resources=with_model_resources)
 
-        tiv_fields = sorted(map(
-            lambda f: canonical_exposures_profile[f],
-            filter(lambda k: canonical_exposures_profile[k]['FieldName'] == 'TIV' if 'FieldName' in canonical_exposures_profile[k] else None, canonical_exposures_profile)
-        ))
-
-        columns = ['item_id', 'coverage_id', 'areaperil_id', 'vulnerability_id', 'group_id']
-        items_df = pd.DataFrame(columns=columns)
-
-        records = []
-        ii = 0
-        for i in range(len(keys_df)):
-            ki = keys_df.iloc[i]
-
-            ci_df = canexp_df[canexp_df['row_id'] == ki['locid']]
-
-            if ci_df.empty:
-                raise OasisException("No matching canonical exposure item found in canonical exposures data frame for keys item {}.".format(ki))
-            elif len(ci_df) > 1:
-                raise OasisException("Duplicate canonical exposure items found in canonical exposures data frame for keys item {}.".format(ki))
-
-            ci = ci_df.iloc[0]
-
-            tiv_field = filter(
-                    lambda f: f['CoverageTypeID'] == ki['coveragetype'],
-                    tiv_fields
-            )[0]
-
-            if ci[tiv_field['ProfileElementName'].lower()] > 0:
-                ii += 1
-                rec = {
-                    'item_id': ii,
-                    'coverage_id': ii,
-                    'areaperil_id': ki['areaperilid'],
-                    'vulnerability_id': ki['vulnerabilityid'],
-                    'group_id': ii
-                }
-                records.append(rec)
+        builder = self.get_oasis_files_builder(
+            oasis_model, canonical_exposures_file_path, keys_file_path, canonical_exposures_profile
+        )
 
-        items_df = items_df.append(records)
+        columns = builder.items_columns
+        items_df = builder.items_data_frame
 
         items_df = items_df.astype(int)
 
-        items_df.to_csv(
-            columns=columns,
-            path_or_buf=items_file_path,
-            encoding='utf-8', 
-            chunksize=1000,
-            index=False
-        )
-        items_df.to_csv(
-            columns=columns,
-            path_or_buf=items_timestamped_file_path,
-            encoding='utf-8', 
-            chunksize=1000,
-            index=False
-        )
+        items_temporary_file_path = builder.get_temporary_file_path(items_file_path)
+
+        try:
+            items_df.to_csv(
+                columns=columns,
+                path_or_buf=items_temporary_file_path,
+                encoding='utf-8',
+                chunksize=1000,
+                index=False
+            )
+            builder.commit_file(items_temporary_file_path, items_file_path, items_timestamped_file_path)
+        finally:
+            if os.path.exists(items_temporary_file_path):
+                os.remove(items_temporary_file_path)
 
         with io.open(items_file_path, 'r', encoding='utf-8') as f:
             if not with_model_resources:
@@ -589,17 +960,6 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             coverages_file_path = omr['coverages_file_path']
             coverages_timestamped_file_path = omr['coverages_timestamped_file_path']
 
-        with io.open(canonical_exposures_file_path, 'r', encoding='utf-8') as cf:
-            with io.open(keys_file_path, 'r', encoding='utf-8') as kf:
-                canexp_df = pd.read_csv(io.StringIO(cf.read()))
-                canexp_df = canexp_df.where(canexp_df.notnull(), None)
-                canexp_df.columns = map(str.lower, canexp_df.columns)
-
-                keys_df = pd.read_csv(io.StringIO(kf.read()))
-                keys_df = keys_df.rename(columns={'CoverageID': 'CoverageType'})
-                keys_df = keys_df.where(keys_df.notnull(), None)
-                keys_df.columns = map(str.lower, keys_df.columns)
-
         if not canonical_exposures_profile:
             if canonical_exposures_profile_json:
                 omr['canonical_exposures_profile_json'] = canonical_exposures_profile_json
@@ -608,59 +968,29 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
 
             canonical_exposures_profile = self.load_canonical_profile(oasis_model, with_model_resources=with_model_resources)
 
-        tiv_fields = sorted(map(
-            lambda f: canonical_exposures_profile[f],
-            filter(lambda k: canonical_exposures_profile[k]['FieldName'] == 'TIV' if 'FieldName' in canonical_exposures_profile[k] else None, canonical_exposures_profile)
-        ))
-
-        columns = ['coverage_id', 'tiv']
-        coverages_df = pd.DataFrame(columns=columns)
-
-        records = []
-        ii = 0
-        for i in range(len(keys_df)):
-            ki = keys_df.iloc[i]
-
-            ci_df = canexp_df[canexp_df['row_id'] == ki['locid']]
-
-            if ci_df.empty:
-                raise OasisException("No matching canonical exposure item found in canonical exposures data frame for keys item {}.".format(ki))
-            elif len(ci_df) > 1:
-                raise OasisException("Duplicate canonical exposure items found in canonical exposures data frame for keys item {}.".format(ki))
-
-            ci = ci_df.iloc[0]
-
-            tiv_field = filter(
-                    lambda f: f['CoverageTypeID'] == ki['coveragetype'],
-                    tiv_fields
-            )[0]
-
-            if ci[tiv_field['ProfileElementName'].lower()] > 0:
-                ii += 1
-                rec = {
-                    'coverage_id': ii,
-                    'tiv': ci[tiv_field['ProfileElementName'].lower()]
-                }
-                records.append(rec)
+        builder = self.get_oasis_files_builder(
+            oasis_model, canonical_exposures_file_path, keys_file_path, canonical_exposures_profile
+        )
 
-        coverages_df = coverages_df.append(records)
+        columns = builder.coverages_columns
+        coverages_df = builder.coverages_data_frame
 
         coverages_df = coverages_df.astype(int)
 
-        coverages_df.to_csv(
-            columns=columns,
-            path_or_buf=coverages_file_path,
-            encoding='utf-8', 
-            chunksize=1000,
-            index=False
-        )
-        coverages_df.to_csv(
-            columns=columns,
-            path_or_buf=coverages_timestamped_file_path,
-            encoding='utf-8', 
-            chunksize=1000,
-            index=False
-        )
+        coverages_temporary_file_path = builder.get_temporary_file_path(coverages_file_path)
+
+        try:
+            coverages_df.to_csv(
+                columns=columns,
+                path_or_buf=coverages_temporary_file_path,
+                encoding='utf-8',
+                chunksize=1000,
+                index=False
+            )
+            builder.commit_file(coverages_temporary_file_path, coverages_file_path, coverages_timestamped_file_path)
+        finally:
+            if os.path.exists(coverages_temporary_file_path):
+                os.remove(coverages_temporary_file_path)
 
         with io.open(coverages_file_path, 'r', encoding='utf-8') as f:
             if not with_model_resources:
@@ -695,17 +1025,6 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             gulsummaryxref_file_path = omr['gulsummaryxref_file_path']
             gulsummaryxref_timestamped_file_path = omr['gulsummaryxref_timestamped_file_path']
 
-        with io.open(canonical_exposures_file_path, 'r', encoding='utf-8') as cf:
-            with io.open(keys_file_path, 'r', encoding='utf-8') as kf:
-                canexp_df = pd.read_csv(io.StringIO(cf.read()))
-                canexp_df = canexp_df.where(canexp_df.notnull(), None)
-                canexp_df.columns = map(str.lower, canexp_df.columns)
-
-                keys_df = pd.read_csv(io.StringIO(kf.read()))
-                keys_df = keys_df.rename(columns={'CoverageID': 'CoverageType'})
-                keys_df = keys_df.where(keys_df.notnull(), None)
-                keys_df.columns = map(str.lower, keys_df.columns)
-
         if not canonical_exposures_profile:
             if canonical_exposures_profile_json:
                 omr['canonical_exposures_profile_json'] = canonical_exposures_profile_json
@@ -714,60 +1033,29 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
 
             canonical_exposures_profile = self.load_canonical_profile(oasis_model, with_model_resources=with_model_resources)
 
-        tiv_fields = sorted(map(
-            lambda f: canonical_exposures_profile[f],
-            filter(lambda k: canonical_exposures_profile[k]['FieldName'] == 'TIV' if 'FieldName' in canonical_exposures_profile[k] else None, canonical_exposures_profile)
-        ))
-
-        columns = ['coverage_id', 'summary_id', 'summaryset_id']
-        gulsummaryxref_df = pd.DataFrame(columns=columns)
-
-        records = []
-        ii = 0
-        for i in range(len(keys_df)):
-            ki = keys_df.iloc[i]
-
-            ci_df = canexp_df[canexp_df['row_id'] == ki['locid']]
-
-            if ci_df.empty:
-                raise OasisException("No matching canonical exposure item found in canonical exposures data frame for keys item {}.".format(ki))
-            elif len(ci_df) > 1:
-                raise OasisException("Duplicate canonical exposure items found in canonical exposures data frame for keys item {}.".format(ki))
-
-            ci = ci_df.iloc[0]
-
-            tiv_field = filter(
-                    lambda f: f['CoverageTypeID'] == ki['coveragetype'],
-                    tiv_fields
-            )[0]
-
-            if ci[tiv_field['ProfileElementName'].lower()] > 0:
-                ii += 1
-                rec = {
-                    'coverage_id': ii,
-                    'summary_id': 1,
-                    'summaryset_id': 1
-                }
-                records.append(rec)
+        builder = self.get_oasis_files_builder(
+            oasis_model, canonical_exposures_file_path, keys_file_path, canonical_exposures_profile
+        )
 
-        gulsummaryxref_df = gulsummaryxref_df.append(records)
+        columns = builder.gulsummaryxref_columns
+        gulsummaryxref_df = builder.gulsummaryxref_data_frame
 
         gulsummaryxref_df = gulsummaryxref_df.astype(int)
 
-        gulsummaryxref_df.to_csv(
-            columns=columns,
-            path_or_buf=gulsummaryxref_file_path,
-            encoding='utf-8', 
-            chunksize=1000,
-            index=False
-        )
-        gulsummaryxref_df.to_csv(
-            columns=columns,
-            path_or_buf=gulsummaryxref_timestamped_file_path,
-            encoding='utf-8', 
-            chunksize=1000,
-            index=False
-        )
+        gulsummaryxref_temporary_file_path = builder.get_temporary_file_path(gulsummaryxref_file_path)
+
+        try:
+            gulsummaryxref_df.to_csv(
+                columns=columns,
+                path_or_buf=gulsummaryxref_temporary_file_path,
+                encoding='utf-8',
+                chunksize=1000,
+                index=False
+            )
+            builder.commit_file(gulsummaryxref_temporary_file_path, gulsummaryxref_file_path, gulsummaryxref_timestamped_file_path)
+        finally:
+            if os.path.exists(gulsummaryxref_temporary_file_path):
+                os.remove(gulsummaryxref_temporary_file_path)
 
         with io.open(gulsummaryxref_file_path, 'r', encoding='utf-8') as f:
             if not with_model_resources:
@@ -791,6 +1079,22 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             ``coverages.csv``
             ``gulsummaryxref.csv``
 
+        If an ``oasis_files_chunk_size`` (number of keys rows) is provided in
+        the model resources or ``kwargs`` then the files are generated in
+        streaming mode - the keys are processed in chunks of this size, and the
+        Oasis files appended to chunk by chunk, so that memory usage is
+        bounded. In this mode the canonical exposures ``ROW_ID`` and TIV
+        columns are indexed in memory, or on disk in the Oasis files directory
+        if the index would exceed the optional ``oasis_files_max_memory``
+        (in MB).
+
+        The optional ``oasis_files_format`` resource sets the format of the
+        generated files - ``csv`` (the default), ``bin`` for the ktools binary
+        files (``items.bin``, ``coverages.bin`` and ``gulsummaryxref.bin``,
+        written straight from the master data frame next to the CSV file paths
+        given, so that the ktools CSV -> binary conversion can be skipped), or
+        ``both``. If no CSV files are written then the binary files are
+        returned (or stored in the pipeline) instead.
         """
         omr = oasis_model.resources
         tfp = omr['oasis_files_pipeline']
@@ -807,6 +1111,9 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             coverages_timestamped_file_path = kwargs['coverages_timestamped_file_path']
             gulsummaryxref_file_path = kwargs['gulsummaryxref_file_path']
             gulsummaryxref_timestamped_file_path = kwargs['gulsummaryxref_timestamped_file_path']
+            oasis_files_chunk_size = kwargs['oasis_files_chunk_size'] if 'oasis_files_chunk_size' in kwargs else None
+            oasis_files_max_memory = kwargs['oasis_files_max_memory'] if 'oasis_files_max_memory' in kwargs else None
+            oasis_files_format = kwargs['oasis_files_format'] if 'oasis_files_format' in kwargs else None
         else:
             canonical_exposures_file_path = tfp.canonical_exposures_file.name
             keys_file_path = tfp.keys_file.name
@@ -819,17 +1126,9 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
             coverages_timestamped_file_path = omr['coverages_timestamped_file_path']
             gulsummaryxref_file_path = omr['gulsummaryxref_file_path']
             gulsummaryxref_timestamped_file_path = omr['gulsummaryxref_timestamped_file_path']
-
-        with io.open(canonical_exposures_file_path, 'r', encoding='utf-8') as cf:
-            with io.open(keys_file_path, 'r', encoding='utf-8') as kf:
-                canexp_df = pd.read_csv(io.StringIO(cf.read()))
-                canexp_df = canexp_df.where(canexp_df.notnull(), None)
-                canexp_df.columns = map(str.lower, canexp_df.columns)
-
-                keys_df = pd.read_csv(io.StringIO(kf.read()))
-                keys_df = keys_df.rename(columns={'CoverageID': 'CoverageType'})
-                keys_df = keys_df.where(keys_df.notnull(), None)
-                keys_df.columns = map(str.lower, keys_df.columns)
+            oasis_files_chunk_size = omr['oasis_files_chunk_size'] if 'oasis_files_chunk_size' in omr else None
+            oasis_files_max_memory = omr['oasis_files_max_memory'] if 'oasis_files_max_memory' in omr else None
+            oasis_files_format = omr['oasis_files_format'] if 'oasis_files_format' in omr else None
 
         if not canonical_exposures_profile:
             if canonical_exposures_profile_json:
@@ -839,120 +1138,119 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
 
             canonical_exposures_profile = self.load_canonical_profile(oasis_model, with_model_resources=with_model_resources)
 
-        tiv_fields = sorted(map(
-            lambda f: canonical_exposures_profile[f],
-            filter(lambda k: canonical_exposures_profile[k]['FieldName'] == 'TIV' if 'FieldName' in canonical_exposures_profile[k] else None, canonical_exposures_profile)
-        ))
-
-        columns = [
-            'item_id',
-            'coverage_id',
-            'tiv',
-            'areaperil_id',
-            'vulnerability_id',
-            'group_id',
-            'summary_id',
-            'summaryset_id'
-        ]
-        master_df = pd.DataFrame(columns=columns)
-        master_df
-
-        records = []
-        ii = 0
-        for i in range(len(keys_df)):
-            ki = keys_df.iloc[i]
-
-            ci_df = canexp_df[canexp_df['row_id'] == ki['locid']]
-
-            if ci_df.empty:
-                raise OasisException("No matching canonical exposure item found in canonical exposures data frame for keys item {}.".format(ki))
-            elif len(ci_df) > 1:
-                raise OasisException("Duplicate canonical exposure items found in canonical exposures data frame for keys item {}.".format(ki))
-
-            ci = ci_df.iloc[0]
-
-            tiv_field = filter(
-                    lambda f: f['CoverageTypeID'] == ki['coveragetype'],
-                    tiv_fields
-            )[0]
-
-            if ci[tiv_field['ProfileElementName'].lower()] > 0:
-                ii += 1
-                rec = {
-                    'item_id': ii,
-                    'coverage_id': ii,
-                    'tiv': ci[tiv_field['ProfileElementName'].lower()],
-                    'areaperil_id': ki['areaperilid'],
-                    'vulnerability_id': ki['vulnerabilityid'],
-                    'group_id': ii,
-                    'summary_id': 1,
-                    'summaryset_id': 1
-                }
-                records.append(rec)
-
-        master_df = master_df.append(records)
+        oasis_files_format = oasis_files_format or 'csv'
+        if oasis_files_format not in ['csv', 'bin', 'both']:
+            raise OasisException("Invalid Oasis files format '{}' - should be one of 'csv', 'bin' or 'both'.".format(oasis_files_format))
 
-        columns = ['item_id', 'coverage_id', 'areaperil_id', 'vulnerability_id', 'group_id']
-        for col in columns:
-            master_df[col] = master_df[col].astype(int)
+        write_csv = oasis_files_format in ['csv', 'both']
+        write_binary = oasis_files_format in ['bin', 'both']
 
-        master_df.to_csv(
-            columns=columns,
-            path_or_buf=items_file_path,
-            encoding='utf-8', 
-            chunksize=1000,
-            index=False
-        )
-        master_df.to_csv(
-            columns=columns,
-            path_or_buf=items_timestamped_file_path,
-            encoding='utf-8', 
-            chunksize=1000,
-            index=False
+        csv_file_paths = {
+            'items': [items_file_path, items_timestamped_file_path],
+            'coverages': [coverages_file_path, coverages_timestamped_file_path],
+            'gulsummaryxref': [gulsummaryxref_file_path, gulsummaryxref_timestamped_file_path]
+        }
+        binary_file_paths = dict(
+            (file_type, [os.path.splitext(file_path)[0] + '.bin' for file_path in file_paths])
+            for file_type, file_paths in csv_file_paths.items()
         )
 
-        columns = ['coverage_id', 'tiv']
-        master_df['coverage_id'] = master_df['coverage_id'].astype(int)
+        builder = self.get_oasis_files_builder(
+            oasis_model, canonical_exposures_file_path, keys_file_path, canonical_exposures_profile
+        )
 
-        master_df.to_csv(
-            columns=columns,
-            float_format='%.5f',
-            path_or_buf=coverages_file_path,
-            encoding='utf-8',
-            chunksize=1000,
-            index=False
+        if oasis_files_chunk_size:
+            master_dfs = builder.iter_master_data_frame_chunks(
+                chunksize=int(oasis_files_chunk_size),
+                max_index_memory=(int(oasis_files_max_memory) if oasis_files_max_memory else None),
+                index_dir=os.path.dirname(os.path.abspath(items_file_path))
+            )
+        else:
+            master_dfs = [builder.master_data_frame]
+
+        # Each file is written once, to a temporary file, which is renamed
+        # to the file path once complete - the timestamped file is then a
+        # snapshot (hard link, reflink or copy) of the file
+        files = (
+            (list(csv_file_paths.items()) if write_csv else []) +
+            ([('{}.bin'.format(k), v) for k, v in binary_file_paths.items()] if write_binary else [])
         )
-        master_df.to_csv(
-            columns=columns,
-            float_format='%.5f',
-            path_or_buf=coverages_timestamped_file_path,
-            encoding='utf-8',
-            chunksize=1000,
-            index=False
+        temporary_file_paths = dict(
+            (k, builder.get_temporary_file_path(file_path)) for k, (file_path, _) in files
         )
 
-        columns = ['coverage_id', 'summary_id', 'summaryset_id']
-        for col in columns:
-            master_df[col] = master_df[col].astype(int)
+        try:
+            for i, master_df in enumerate(master_dfs):
+                mode, header = ('w', True) if i == 0 else ('a', False)
+
+                if write_csv:
+                    columns = builder.items_columns
+
+                    master_df.to_csv(
+                        columns=columns,
+                        path_or_buf=temporary_file_paths['items'],
+                        mode=mode,
+                        header=header,
+                        encoding='utf-8',
+                        chunksize=1000,
+                        index=False
+                    )
+
+                    columns = builder.coverages_columns
+
+                    master_df.to_csv(
+                        columns=columns,
+                        float_format='%.5f',
+                        path_or_buf=temporary_file_paths['coverages'],
+                        mode=mode,
+                        header=header,
+                        encoding='utf-8',
+                        chunksize=1000,
+                        index=False
+                    )
+
+                    columns = builder.gulsummaryxref_columns
 
-        master_df.to_csv(
-            columns=columns,
-            path_or_buf=gulsummaryxref_file_path,
-            encoding='utf-8',
-            chunksize=1000,
-            index=False
-        )
-        master_df.to_csv(
-            columns=columns,
-            path_or_buf=gulsummaryxref_timestamped_file_path,
-            encoding='utf-8',
-            chunksize=1000,
-            index=False
-        )
+                    master_df.to_csv(
+                        columns=columns,
+                        path_or_buf=temporary_file_paths['gulsummaryxref'],
+                        mode=mode,
+                        header=header,
+                        encoding='utf-8',
+                        chunksize=1000,
+                        index=False
+                    )
+
+                if write_binary:
+                    for file_type in binary_file_paths:
+                        builder.write_binary_file(
+                            master_df, file_type, temporary_file_paths['{}.bin'.format(file_type)], append=(i > 0)
+                        )
+
+            for k, (file_path, snapshot_file_path) in files:
+                builder.commit_file(temporary_file_paths[k], file_path, snapshot_file_path)
+
+            # Binary files of an earlier generation would otherwise be used
+            # by ``generate_losses.py`` instead of the new CSV files
+            if not write_binary:
+                for binary_file_path in itertools.chain.from_iterable(binary_file_paths.values()):
+                    if os.path.exists(binary_file_path):
+                        os.remove(binary_file_path)
+        finally:
+            for temporary_file_path in temporary_file_paths.values():
+                if os.path.exists(temporary_file_path):
+                    os.remove(temporary_file_path)
+
+        if not write_csv:
+            items_file_path, coverages_file_path, gulsummaryxref_file_path = [
+                binary_file_paths[file_type][0] for file_type in ['items', 'coverages', 'gulsummaryxref']
+            ]
 
-        with io.open(items_file_path, 'r', encoding='utf-8') as itf:
-            with io.open(coverages_file_path, 'r', encoding='utf-8') as cvf:
-                with io.open(gulsummaryxref_file_path, 'r', encoding='utf-8') as gsf:
+        file_mode, encoding = ('r', 'utf-8') if write_csv else ('rb', None)
+
+        with io.open(items_file_path, file_mode, encoding=encoding) as itf:
+            with io.open(coverages_file_path, file_mode, encoding=encoding) as cvf:
+                with io.open(gulsummaryxref_file_path, file_mode, encoding=encoding) as gsf:
                     if not with_model_resources:
                         return itf, cvf, gsf
 
@@ -1040,26 +1338,32 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
 
                 utcnow = get_utctimestamp(fmt='%Y%m%d%H%M%S')
 
-                target_file_path = os.path.join(oasis_files_path, 'canexp-{}.csv'.format(utcnow))
-                kwargs['canonical_exposures_file_path'] = target_file_path
+                kwargs['canonical_exposures_file_path'] = os.path.join(oasis_files_path, 'canexp-{}.csv'.format(utcnow))
+                kwargs['model_exposures_file_path'] = os.path.join(oasis_files_path, 'modexp-{}.csv'.format(utcnow))
+                kwargs['keys_file_path'] = os.path.join(oasis_files_path, 'oasiskeys-{}.csv'.format(utcnow))
 
-                self.logger.info('Generating canonical exposures file {}'.format(target_file_path))
+                if 'stream_exposures' in kwargs and kwargs['stream_exposures']:
+                    self.logger.info(
+                        'Generating canonical exposures file {}, model exposures file {} and keys file {} in streaming mode'.format(
+                            kwargs['canonical_exposures_file_path'], kwargs['model_exposures_file_path'], kwargs['keys_file_path']
+                        )
+                    )
 
-                canonical_exposures_file = self.transform_source_to_canonical(oasis_model, with_model_resources=False, **kwargs)
-                
-                target_file_path = os.path.join(oasis_files_path, 'modexp-{}.csv'.format(utcnow))
-                kwargs['model_exposures_file_path'] = target_file_path
+                    canonical_exposures_file, model_exposures_file, keys_file = self.stream_exposures_to_keys(
+                        oasis_model, with_model_resources=False, **kwargs
+                    )
+                else:
+                    self.logger.info('Generating canonical exposures file {}'.format(kwargs['canonical_exposures_file_path']))
 
-                self.logger.info('Generating model exposures file {}'.format(target_file_path))
+                    canonical_exposures_file = self.transform_source_to_canonical(oasis_model, with_model_resources=False, **kwargs)
 
-                model_exposures_file = self.transform_canonical_to_model(oasis_model, with_model_resources=False, **kwargs)
+                    self.logger.info('Generating model exposures file {}'.format(kwargs['model_exposures_file_path']))
 
-                target_file_path = os.path.join(oasis_files_path, 'oasiskeys-{}.csv'.format(utcnow))
-                kwargs['keys_file_path'] = target_file_path
+                    model_exposures_file = self.transform_canonical_to_model(oasis_model, with_model_resources=False, **kwargs)
 
-                self.logger.info('Generating keys file {}'.format(target_file_path))
+                    self.logger.info('Generating keys file {}'.format(kwargs['keys_file_path']))
 
-                keys_file = self.get_keys(oasis_model, with_model_resources=False, **kwargs)
+                    keys_file = self.get_keys(oasis_model, with_model_resources=False, **kwargs)
                 
                 self.logger.info('Checking for canonical exposures profile source for model')
 
@@ -1126,35 +1430,46 @@ class OasisExposuresManager(implements(OasisExposuresManagerInterface)):
 
                 utcnow = get_utctimestamp(fmt='%Y%m%d%H%M%S')
 
-                target_file_path = os.path.join(oasis_files_path, 'canexp-{}.csv'.format(utcnow))
-                with io.open(target_file_path, 'w', encoding='utf-8') as f:
+                canonical_exposures_file_path = os.path.join(oasis_files_path, 'canexp-{}.csv'.format(utcnow))
+                with io.open(canonical_exposures_file_path, 'w', encoding='utf-8') as f:
                     tfp.canonical_exposures_file = f
 
-                self.logger.info('Generating canonical exposures file')
+                model_exposures_file_path = os.path.join(oasis_files_path, 'modexp-{}.csv'.format(utcnow))
+                with io.open(model_exposures_file_path, 'w', encoding='utf-8') as f:
+                    tfp.model_exposures_file = f
 
-                self.transform_source_to_canonical(oasis_model)
+                keys_file_path = os.path.join(oasis_files_path, 'oasiskeys-{}.csv'.format(utcnow))
+                with io.open(keys_file_path, 'w', encoding='utf-8') as f:
+                    tfp.keys_file = f
 
-                self.logger.info('Generated canonical exposures file {}'.format(target_file_path))
-                
-                target_file_path = os.path.join(oasis_files_path, 'modexp-{}.csv'.format(utcnow))
-                with io.open(target_file_path, 'w', encoding='utf-8') as f:
-                    tfp.model_exposures_file = f
+                if 'stream_exposures' in omr and omr['stream_exposures']:
+                    self.logger.info('Generating canonical exposures, model exposures and keys files in streaming mode')
 
-                self.logger.info('Generating model exposures file')
+                    self.stream_exposures_to_keys(oasis_model)
 
-                self.transform_canonical_to_model(oasis_model)
+                    self.logger.info(
+                        'Generated canonical exposures file {}, model exposures file {} and keys file {}'.format(
+                            canonical_exposures_file_path, model_exposures_file_path, keys_file_path
+                        )
+                    )
+                else:
+                    self.logger.info('Generating canonical exposures file')
 
-                self.logger.info('Generated model exposures file {}'.format(target_file_path))
+                    self.transform_source_to_canonical(oasis_model)
 
-                target_file_path = os.path.join(oasis_files_path, 'oasiskeys-{}.csv'.format(utcnow))
-                with io.open(target_file_path, 'w', encoding='utf-8') as f:
-                    tfp.keys_file = f
+                    self.logger.info('Generated canonical exposures file {}'.format(canonical_exposures_file_path))
+
+                    self.logger.info('Generating model exposures file')
+
+                    self.transform_canonical_to_model(oasis_model)
+
+                    self.logger.info('Generated model exposures file {}'.format(model_exposures_file_path))
 
-                self.logger.info('Generating keys file')
+                    self.logger.info('Generating keys file')
 
-                self.get_keys(oasis_model)
+                    self.get_keys(oasis_model)
 
-                self.logger.info('Generated keys file {}'.format(target_file_path))
+                    self.logger.info('Generated keys file {}'.format(keys_file_path))
                 
                 self.logger.info('Checking for canonical exposures profile for model')
 
@@ -0,0 +1,1893 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+__all__ = [
+    'OasisExposuresTransformer',
+    'OasisTransformationNotSupported'
+]
+
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import sys
+
+from collections import OrderedDict
+from decimal import Decimal
+from xml.parsers import expat
+
+if os.getcwd().split(os.path.sep)[-1] == 'exposures':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+
+class OasisTransformationNotSupported(OasisException):
+    """
+    Raised when an exposures transformation (XSLT) or validation (XSD) file
+    uses features which are not supported by the native exposures
+    transformer - the transformation should then be run with ``xtrans``.
+    """
+    pass
+
+
+XSL_NS = 'http://www.w3.org/1999/XSL/Transform'
+XSD_NS = 'http://www.w3.org/2001/XMLSchema'
+
+_text_type = type(u'')
+
+_nan = float('nan')
+_inf = float('inf')
+
+
+def _xsl(name):
+    return '{{{}}}{}'.format(XSL_NS, name)
+
+
+def _xsd(name):
+    return '{{{}}}{}'.format(XSD_NS, name)
+
+
+def _text(s):
+    if s is None:
+        return u''
+    return s if isinstance(s, _text_type) else s.decode('utf-8')
+
+
+class _XmlElement(object):
+    """
+    An element of a parsed XSLT or XSD file - ``ElementTree`` is not used
+    as it does not preserve the order of attributes on Python 2, and the
+    order of attributes of literal result elements is the order of the
+    columns of the output.
+    """
+
+    __slots__ = ('tag', 'attributes', 'text', 'tail', 'children')
+
+    def __init__(self, tag, attributes):
+        self.tag = tag
+        self.attributes = attributes
+        self.text = None
+        self.tail = None
+        self.children = []
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def __getitem__(self, i):
+        return self.children[i]
+
+    def get(self, name, default=None):
+        for k, v in self.attributes:
+            if k == name:
+                return v
+        return default
+
+    def items(self):
+        return list(self.attributes)
+
+    def keys(self):
+        return [k for k, _ in self.attributes]
+
+    def find(self, tag):
+        return next((c for c in self.children if c.tag == tag), None)
+
+    def findall(self, tag):
+        return [c for c in self.children if c.tag == tag]
+
+
+def _parse_xml(data, file_path):
+    """
+    Parses an XML document into a tree of ``_XmlElement`` - element and
+    attribute names in a namespace are in ``{namespace}name`` form, and
+    comments and processing instructions are dropped.
+    """
+    parser = expat.ParserCreate(namespace_separator='}')
+    parser.ordered_attributes = True
+
+    def qname(name):
+        return '{' + name if '}' in name else name
+
+    stack = []
+    roots = []
+
+    def start(tag, attributes):
+        e = _XmlElement(
+            qname(str(tag)),
+            [(qname(str(attributes[i])), _text(attributes[i + 1])) for i in range(0, len(attributes), 2)]
+        )
+        if stack:
+            stack[-1].children.append(e)
+        else:
+            roots.append(e)
+        stack.append(e)
+
+    def end(tag):
+        stack.pop()
+
+    def data_handler(s):
+        parent = stack[-1]
+        if parent.children:
+            last = parent.children[-1]
+            last.tail = (last.tail or u'') + _text(s)
+        else:
+            parent.text = (parent.text or u'') + _text(s)
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data_handler
+
+    try:
+        parser.Parse(data, True)
+    except expat.ExpatError as e:
+        raise OasisException('Invalid XML file {}: {}'.format(file_path, str(e)))
+
+    return roots[0]
+
+
+def _xml_to_json(e):
+    """
+    Converts a tree of ``_XmlElement`` into nested lists which can be
+    serialised as JSON.
+    """
+    return [e.tag, [list(a) for a in e.attributes], e.text, e.tail, [_xml_to_json(c) for c in e.children]]
+
+
+def _xml_from_json(o):
+    """
+    Converts the nested lists of a tree of ``_XmlElement`` serialised as
+    JSON (see ``_xml_to_json``) back into the tree.
+    """
+    tag, attributes, text, tail, children = o
+    e = _XmlElement(str(tag), [(str(k), _text(v)) for k, v in attributes])
+    e.text = _text(text) if text is not None else None
+    e.tail = _text(tail) if tail is not None else None
+    e.children = [_xml_from_json(c) for c in children]
+    return e
+
+
+# ---------------------------------------------------------------------------
+# Source and result trees
+# ---------------------------------------------------------------------------
+
+class _Node(object):
+    """
+    A node in the (minimal) XPath data model of the source and result trees
+    - a root, element, attribute or text node.
+    """
+
+    __slots__ = ('kind', 'name', 'value', 'parent', 'attributes', 'children', 'order')
+
+    def __init__(self, kind, name=None, value=None, parent=None, order=0):
+        self.kind = kind
+        self.order = order
+        self.name = name
+        self.value = value
+        self.parent = parent
+        self.attributes = []
+        self.children = []
+
+    @property
+    def string_value(self):
+        if self.kind in ('attribute', 'text'):
+            return self.value
+        return u''.join(c.string_value for c in self.children if c.kind in ('element', 'text'))
+
+
+def _source_document(records):
+    """
+    Builds the source document for a chunk of CSV records, in the form
+    ``xtrans`` builds it - a ``root`` element with a ``rec`` element per
+    record, with an attribute per (non-empty) record value.
+    """
+    doc = _Node('root')
+    root = _Node('element', 'root', parent=doc, order=1)
+    doc.children.append(root)
+
+    order = 2
+    for record in records:
+        rec = _Node('element', 'rec', parent=root, order=order)
+        rec.attributes = [
+            _Node('attribute', name, value, rec, order + i) for i, (name, value) in enumerate(record, 1)
+        ]
+        root.children.append(rec)
+        order += len(record) + 1
+
+    return doc
+
+
+class _ResultElement(object):
+
+    __slots__ = ('name', 'attributes', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.attributes = OrderedDict()
+        self.children = []
+
+
+class _ResultBuilder(object):
+    """
+    Builds the result tree of a transformation - only elements and their
+    attributes are kept, as text content does not contribute to the output
+    CSV.
+    """
+
+    def __init__(self):
+        self.root = _ResultElement(None)
+        self._stack = [self.root]
+
+    def start_element(self, name):
+        e = _ResultElement(name)
+        self._stack[-1].children.append(e)
+        self._stack.append(e)
+
+    def end_element(self):
+        self._stack.pop()
+
+    def attribute(self, name, value):
+        current = self._stack[-1]
+        if current is not self.root and not current.children:
+            current.attributes[name] = value
+
+    def text(self, value):
+        pass
+
+    def elements(self, name):
+        """
+        Generates the result elements with the given name in document order.
+        """
+        stack = list(reversed(self.root.children))
+        while stack:
+            e = stack.pop()
+            if e.name == name:
+                yield e
+            stack.extend(reversed(e.children))
+
+
+class _TextBuilder(object):
+    """
+    Captures the text output of a sequence constructor, e.g. the content of
+    an ``xsl:attribute`` or of a variable.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._depth = 0
+
+    def start_element(self, name):
+        self._depth += 1
+
+    def end_element(self):
+        self._depth -= 1
+
+    def attribute(self, name, value):
+        pass
+
+    def text(self, value):
+        self._parts.append(value)
+
+    @property
+    def value(self):
+        return u''.join(self._parts)
+
+
+# ---------------------------------------------------------------------------
+# XPath 1.0 (subset) - values, conversions and functions
+# ---------------------------------------------------------------------------
+
+_number_re = re.compile(r'^\s*(-?(\d+(\.\d*)?|\.\d+))\s*$')
+
+
+def _string_to_number(s):
+    m = _number_re.match(s)
+    return float(m.group(1)) if m else _nan
+
+
+def _number_to_string(n):
+    if n != n:
+        return u'NaN'
+    if n in (_inf, -_inf):
+        return u'Infinity' if n > 0 else u'-Infinity'
+    if n == int(n):
+        return _text_type(int(n))
+    s = _text_type('{:f}'.format(Decimal(repr(n))))
+    if '.' in s:
+        s = s.rstrip('0').rstrip('.')
+    return s
+
+
+def _to_string(v):
+    if isinstance(v, list):
+        return v[0].string_value if v else u''
+    if isinstance(v, bool):
+        return u'true' if v else u'false'
+    if isinstance(v, float):
+        return _number_to_string(v)
+    return v
+
+
+def _to_number(v):
+    if isinstance(v, bool):
+        return 1.0 if v else 0.0
+    if isinstance(v, float):
+        return v
+    return _string_to_number(_to_string(v))
+
+
+def _to_boolean(v):
+    if isinstance(v, list):
+        return len(v) > 0
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, float):
+        return v != 0 and v == v
+    return len(v) > 0
+
+
+def _round(n):
+    if n != n or n in (_inf, -_inf):
+        return n
+    if -0.5 <= n < 0:
+        return -0.0
+    return float(math.floor(n + 0.5))
+
+
+def _compare_atoms(op, a, b):
+    if op in ('=', '!='):
+        if isinstance(a, bool) or isinstance(b, bool):
+            a, b = _to_boolean(a), _to_boolean(b)
+        elif isinstance(a, float) or isinstance(b, float):
+            a, b = _to_number(a), _to_number(b)
+        else:
+            a, b = _to_string(a), _to_string(b)
+        return (a == b) if op == '=' else (a != b)
+
+    a, b = _to_number(a), _to_number(b)
+    if op == '<':
+        return a < b
+    if op == '<=':
+        return a <= b
+    if op == '>':
+        return a > b
+    return a >= b
+
+
+def _compare(op, a, b):
+    a_is_nodes, b_is_nodes = isinstance(a, list), isinstance(b, list)
+
+    if a_is_nodes and b_is_nodes:
+        return any(
+            _compare_atoms(op, x.string_value, y.string_value) for x in a for y in b
+        )
+    if a_is_nodes or b_is_nodes:
+        nodes, other = (a, b) if a_is_nodes else (b, a)
+        if isinstance(other, bool):
+            return _compare_atoms(op, _to_boolean(a), _to_boolean(b))
+        convert = _string_to_number if isinstance(other, float) else (lambda s: s)
+        if a_is_nodes:
+            return any(_compare_atoms(op, convert(n.string_value), other) for n in nodes)
+        return any(_compare_atoms(op, other, convert(n.string_value)) for n in nodes)
+
+    return _compare_atoms(op, a, b)
+
+
+def _substring(s, start, length=None):
+    start = _round(start)
+    end = _inf if length is None else start + _round(length)
+    return u''.join(c for p, c in enumerate(s, 1) if p >= start and p < end)
+
+
+def _substring_before(s, t):
+    i = s.find(t)
+    return s[:i] if i >= 0 else u''
+
+
+def _substring_after(s, t):
+    i = s.find(t)
+    return s[i + len(t):] if i >= 0 else u''
+
+
+def _translate(s, src, dst):
+    table = {}
+    for i, c in enumerate(src):
+        if c not in table:
+            table[c] = dst[i] if i < len(dst) else None
+    return u''.join(table.get(c, c) or u'' for c in s if table.get(c, c) is not None)
+
+
+_string_fns = {
+    'concat': (2, None, lambda *args: u''.join(_to_string(a) for a in args)),
+    'contains': (2, 2, lambda s, t: _to_string(t) in _to_string(s)),
+    'starts-with': (2, 2, lambda s, t: _to_string(s).startswith(_to_string(t))),
+    'substring-before': (2, 2, lambda s, t: _substring_before(_to_string(s), _to_string(t))),
+    'substring-after': (2, 2, lambda s, t: _substring_after(_to_string(s), _to_string(t))),
+    'substring': (2, 3, lambda s, *args: _substring(_to_string(s), *[_to_number(a) for a in args])),
+    'translate': (3, 3, lambda s, a, b: _translate(_to_string(s), _to_string(a), _to_string(b))),
+    'boolean': (1, 1, _to_boolean),
+    'not': (1, 1, lambda v: not _to_boolean(v)),
+    'true': (0, 0, lambda: True),
+    'false': (0, 0, lambda: False),
+    'round': (1, 1, lambda v: _round(_to_number(v))),
+    'floor': (1, 1, lambda v: float(math.floor(_to_number(v))) if _to_number(v) == _to_number(v) and abs(_to_number(v)) != _inf else _to_number(v)),
+    'ceiling': (1, 1, lambda v: float(math.ceil(_to_number(v))) if _to_number(v) == _to_number(v) and abs(_to_number(v)) != _inf else _to_number(v)),
+    'sum': (1, 1, lambda v: float(sum(_string_to_number(n.string_value) for n in v))),
+    'count': (1, 1, lambda v: float(len(v))),
+}
+
+
+# ---------------------------------------------------------------------------
+# XPath 1.0 (subset) - tokenizer, parser and compiler
+# ---------------------------------------------------------------------------
+
+_token_re = re.compile(
+    r'\s*(?:'
+    r'(?P<number>\d+(?:\.\d*)?|\.\d+)|'
+    r'(?P<literal>"[^"]*"|\'[^\']*\')|'
+    r'(?P<variable>\$[^\W\d][\w.\-]*(?::[^\W\d][\w.\-]*)?)|'
+    r'(?P<name>[^\W\d][\w.\-]*(?::(?:[^\W\d][\w.\-]*|\*))?)|'
+    r'(?P<op>\.\.|::|//|!=|<=|>=|[()\[\]@,/|+\-=<>*.])'
+    r')',
+    re.UNICODE
+)
+
+_operator_names = ('and', 'or', 'mod', 'div')
+
+
+def _tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = _token_re.match(expr, pos)
+        if not m or m.end() == pos:
+            raise OasisTransformationNotSupported('Unable to parse XPath expression "{}"'.format(expr))
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind in ('name', 'op') and value in _operator_names + ('*',):
+            prev = tokens[-1] if tokens else None
+            if prev and not (prev[0] == 'op' and prev[1] in ('@', '::', '(', '[', ',', '/', '//', '|', '+', '-', '=', '!=', '<', '<=', '>', '>=')) and not (prev[0] == 'operator'):
+                kind = 'operator'
+            elif value == '*':
+                kind = 'name'
+        tokens.append((kind, value))
+    tokens.append(('end', None))
+    return tokens
+
+
+class _Context(object):
+
+    __slots__ = ('node', 'position', 'size', 'variables', 'current')
+
+    def __init__(self, node, position=1, size=1, variables=None, current=None):
+        self.node = node
+        self.position = position
+        self.size = size
+        self.variables = variables if variables is not None else {}
+        self.current = current if current is not None else node
+
+
+def _node_test(test):
+    """
+    Returns a predicate for a node test (``*``, a name, ``node()`` or
+    ``text()``) on the principal node type of an axis.
+    """
+    if test == 'node()':
+        return lambda n: True
+    if test == 'text()':
+        return lambda n: n.kind == 'text'
+    if test == '*':
+        return lambda n: n.kind in ('element', 'attribute')
+    if ':' in test:
+        raise OasisTransformationNotSupported('Namespaced node test "{}"'.format(test))
+    return lambda n: n.kind in ('element', 'attribute') and n.name == test
+
+
+def _step(axis, test):
+    matches = _node_test(test)
+
+    if axis == 'child':
+        return lambda node: [c for c in node.children if matches(c)]
+    if axis == 'attribute':
+        return lambda node: [a for a in node.attributes if matches(a)]
+    if axis == 'self':
+        return lambda node: [node] if (test == 'node()' or (node.kind == 'element' and matches(node))) else []
+    if axis == 'parent':
+        return lambda node: [node.parent] if node.parent is not None and (test == 'node()' or matches(node.parent)) else []
+
+    raise OasisTransformationNotSupported('XPath axis "{}"'.format(axis))
+
+
+def _path(absolute, steps):
+    def evaluate(ctx):
+        nodes = [ctx.node]
+        if absolute:
+            node = ctx.node
+            while node.parent is not None:
+                node = node.parent
+            nodes = [node]
+        for step in steps:
+            result = []
+            seen = set()
+            for node in nodes:
+                for n in step(node):
+                    if id(n) not in seen:
+                        seen.add(id(n))
+                        result.append(n)
+            nodes = result
+        return nodes
+    return evaluate
+
+
+class _XPathParser(object):
+    """
+    A recursive descent parser for a subset of XPath 1.0, which compiles an
+    expression into a function of an evaluation context. Predicates, the
+    ``//`` abbreviation and axes other than ``child``, ``attribute``,
+    ``self`` and ``parent`` are not supported.
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = _tokenize(expr)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        return self.tokens[self.pos + offset]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        token = self.next()
+        if token[1] != value:
+            raise OasisTransformationNotSupported('Unable to parse XPath expression "{}"'.format(self.expr))
+
+    def unsupported(self, feature):
+        raise OasisTransformationNotSupported('XPath {} in expression "{}"'.format(feature, self.expr))
+
+    def parse(self):
+        f = self.parse_or()
+        if self.peek()[0] != 'end':
+            raise OasisTransformationNotSupported('Unable to parse XPath expression "{}"'.format(self.expr))
+        return f
+
+    def _binary(self, parse_operand, operators, combine):
+        f = parse_operand()
+        while self.peek()[0] in ('operator', 'op') and self.peek()[1] in operators:
+            op = self.next()[1]
+            g = parse_operand()
+            f = combine(op, f, g)
+        return f
+
+    def parse_or(self):
+        return self._binary(
+            self.parse_and, ('or',),
+            lambda op, f, g: lambda ctx: _to_boolean(f(ctx)) or _to_boolean(g(ctx))
+        )
+
+    def parse_and(self):
+        return self._binary(
+            self.parse_equality, ('and',),
+            lambda op, f, g: lambda ctx: _to_boolean(f(ctx)) and _to_boolean(g(ctx))
+        )
+
+    def parse_equality(self):
+        return self._binary(
+            self.parse_relational, ('=', '!='),
+            lambda op, f, g: lambda ctx: _compare(op, f(ctx), g(ctx))
+        )
+
+    def parse_relational(self):
+        return self._binary(
+            self.parse_additive, ('<', '<=', '>', '>='),
+            lambda op, f, g: lambda ctx: _compare(op, f(ctx), g(ctx))
+        )
+
+    def parse_additive(self):
+        def combine(op, f, g):
+            if op == '+':
+                return lambda ctx: _to_number(f(ctx)) + _to_number(g(ctx))
+            return lambda ctx: _to_number(f(ctx)) - _to_number(g(ctx))
+        return self._binary(self.parse_multiplicative, ('+', '-'), combine)
+
+    def parse_multiplicative(self):
+        def divide(a, b):
+            if b == 0:
+                if a != a or a == 0:
+                    return _nan
+                return math.copysign(_inf, a) * math.copysign(1, b)
+            return a / b
+
+        def modulo(a, b):
+            if b == 0 or a != a or b != b or a in (_inf, -_inf):
+                return _nan
+            return math.fmod(a, b)
+
+        def combine(op, f, g):
+            if op == '*':
+                return lambda ctx: _to_number(f(ctx)) * _to_number(g(ctx))
+            if op == 'div':
+                return lambda ctx: divide(_to_number(f(ctx)), _to_number(g(ctx)))
+            return lambda ctx: modulo(_to_number(f(ctx)), _to_number(g(ctx)))
+        return self._binary(self.parse_unary, ('*', 'div', 'mod'), combine)
+
+    def parse_unary(self):
+        if self.peek() == ('op', '-'):
+            self.next()
+            f = self.parse_unary()
+            return lambda ctx: -_to_number(f(ctx))
+        return self.parse_union()
+
+    def parse_union(self):
+        f = self.parse_path_expr()
+        while self.peek() == ('op', '|'):
+            self.next()
+            g = self.parse_path_expr()
+            f = (lambda f, g: lambda ctx: self._union(f(ctx), g(ctx)))(f, g)
+        return f
+
+    @staticmethod
+    def _union(a, b):
+        if not (isinstance(a, list) and isinstance(b, list)):
+            raise OasisException('XPath union of non node-set values')
+        seen = set(id(n) for n in a)
+        return sorted(a + [n for n in b if id(n) not in seen], key=lambda n: n.order)
+
+    def parse_path_expr(self):
+        kind, value = self.peek()
+
+        if kind == 'op' and value == '//':
+            self.unsupported('"//" abbreviation')
+
+        if kind == 'op' and value == '/':
+            self.next()
+            if self.peek()[0] in ('name',) or self.peek()[1] in ('@', '.', '..'):
+                return _path(True, self.parse_relative_path())
+            return _path(True, [])
+
+        if kind == 'variable':
+            self.next()
+            name = value[1:]
+            f = lambda ctx: self._variable(ctx, name)
+            return self.parse_filter_tail(f)
+
+        if kind == 'literal':
+            self.next()
+            s = _text(value[1:-1])
+            return self.parse_filter_tail(lambda ctx: s)
+
+        if kind == 'number':
+            self.next()
+            n = float(value)
+            return self.parse_filter_tail(lambda ctx: n)
+
+        if kind == 'op' and value == '(':
+            self.next()
+            f = self.parse_or()
+            self.expect(')')
+            return self.parse_filter_tail(f)
+
+        if kind == 'name' and self.peek(1) == ('op', '(') and value not in ('node', 'text', 'comment', 'processing-instruction'):
+            return self.parse_filter_tail(self.parse_function_call())
+
+        return _path(False, self.parse_relative_path())
+
+    def parse_filter_tail(self, f):
+        if self.peek() == ('op', '['):
+            self.unsupported('predicates')
+        if self.peek()[1] in ('/', '//'):
+            self.unsupported('paths from filter expressions')
+        return f
+
+    @staticmethod
+    def _variable(ctx, name):
+        try:
+            return ctx.variables[name]
+        except KeyError:
+            raise OasisException('Undefined XSLT variable ${}'.format(name))
+
+    def parse_relative_path(self):
+        steps = [self.parse_step()]
+        while self.peek()[1] in ('/', '//'):
+            if self.next()[1] == '//':
+                self.unsupported('"//" abbreviation')
+            steps.append(self.parse_step())
+        return steps
+
+    def parse_step(self):
+        kind, value = self.peek()
+
+        if value == '.':
+            self.next()
+            return _step('self', 'node()')
+        if value == '..':
+            self.next()
+            return _step('parent', 'node()')
+
+        axis = 'child'
+        if value == '@':
+            self.next()
+            axis = 'attribute'
+        elif kind == 'name' and self.peek(1) == ('op', '::'):
+            axis = self.next()[1]
+            self.next()
+
+        kind, value = self.next()
+        if kind != 'name':
+            self.unsupported('location step')
+        if value in ('node', 'text') and self.peek() == ('op', '('):
+            self.next()
+            self.expect(')')
+            value = '{}()'.format(value)
+
+        if self.peek() == ('op', '['):
+            self.unsupported('predicates')
+
+        return _step(axis, value)
+
+    def parse_function_call(self):
+        name = self.next()[1]
+        self.expect('(')
+        args = []
+        if self.peek() != ('op', ')'):
+            args.append(self.parse_or())
+            while self.peek() == ('op', ','):
+                self.next()
+                args.append(self.parse_or())
+        self.expect(')')
+
+        nargs = len(args)
+
+        if name == 'position' and nargs == 0:
+            return lambda ctx: float(ctx.position)
+        if name == 'last' and nargs == 0:
+            return lambda ctx: float(ctx.size)
+        if name == 'current' and nargs == 0:
+            return lambda ctx: [ctx.current]
+        if name in ('string', 'number', 'string-length', 'normalize-space', 'name', 'local-name') and nargs <= 1:
+            arg = args[0] if args else (lambda ctx: [ctx.node])
+            if name == 'string':
+                return lambda ctx: _to_string(arg(ctx))
+            if name == 'number':
+                return lambda ctx: _to_number(arg(ctx))
+            if name == 'string-length':
+                return lambda ctx: float(len(_to_string(arg(ctx))))
+            if name == 'normalize-space':
+                return lambda ctx: u' '.join(_to_string(arg(ctx)).split())
+            return lambda ctx: (lambda v: (v[0].name or u'') if v else u'')(arg(ctx))
+
+        if name not in _string_fns:
+            self.unsupported('function {}()'.format(name))
+
+        min_args, max_args, fn = _string_fns[name]
+        if nargs < min_args or (max_args is not None and nargs > max_args):
+            raise OasisTransformationNotSupported('Wrong number of arguments for XPath function {}() in "{}"'.format(name, self.expr))
+
+        return lambda ctx: fn(*[a(ctx) for a in args])
+
+
+def _compile_xpath(expr):
+    return _XPathParser(_text(expr)).parse()
+
+
+def _compile_avt(avt):
+    """
+    Compiles an attribute value template into a function of an evaluation
+    context returning a string.
+    """
+    avt = _text(avt)
+    parts = []
+    i = 0
+    literal = []
+    while i < len(avt):
+        c = avt[i]
+        if c == '{':
+            if avt[i + 1:i + 2] == '{':
+                literal.append('{')
+                i += 2
+                continue
+            j = avt.find('}', i)
+            if j < 0:
+                raise OasisTransformationNotSupported('Unable to parse attribute value template "{}"'.format(avt))
+            if literal:
+                s = u''.join(literal)
+                parts.append(lambda ctx, s=s: s)
+                literal = []
+            f = _compile_xpath(avt[i + 1:j])
+            parts.append(lambda ctx, f=f: _to_string(f(ctx)))
+            i = j + 1
+        elif c == '}' and avt[i + 1:i + 2] == '}':
+            literal.append('}')
+            i += 2
+        else:
+            literal.append(c)
+            i += 1
+    if literal:
+        s = u''.join(literal)
+        parts.append(lambda ctx, s=s: s)
+
+    if len(parts) == 1:
+        return parts[0]
+    return lambda ctx: u''.join(p(ctx) for p in parts)
+
+
+# ---------------------------------------------------------------------------
+# XSLT 1.0 (subset) compiler
+# ---------------------------------------------------------------------------
+
+def _compile_pattern(pattern):
+    """
+    Compiles an XSLT match pattern into a list of ``(matcher, default
+    priority)`` pairs, one for each alternative in the pattern.
+    """
+    alternatives = []
+    for alternative in _text(pattern).split('|'):
+        alternative = alternative.strip()
+        if '[' in alternative or '//' in alternative or '(' in alternative.replace('node()', '').replace('text()', ''):
+            raise OasisTransformationNotSupported('XSLT match pattern "{}"'.format(pattern))
+
+        if alternative == '/':
+            alternatives.append((lambda n: n.kind == 'root', 0.5))
+            continue
+
+        absolute = alternative.startswith('/')
+        steps = alternative.lstrip('/').split('/')
+
+        tests = []
+        for step in steps:
+            if step.startswith('@'):
+                test = step[1:]
+                tests.append((lambda t: lambda n: n.kind == 'attribute' and (t == '*' or n.name == t))(test))
+            elif step == 'node()':
+                tests.append(lambda n: n.kind in ('element', 'text'))
+            elif step == 'text()':
+                tests.append(lambda n: n.kind == 'text')
+            elif step == '*':
+                tests.append(lambda n: n.kind == 'element')
+            elif re.match(r'^[^\W\d][\w.\-]*$', step, re.UNICODE):
+                tests.append((lambda t: lambda n: n.kind == 'element' and n.name == t)(step))
+            else:
+                raise OasisTransformationNotSupported('XSLT match pattern "{}"'.format(pattern))
+
+        if len(steps) > 1 or absolute:
+            priority = 0.5
+        elif steps[0] in ('*', '@*', 'node()', 'text()'):
+            priority = -0.5
+        else:
+            priority = 0.0
+
+        def matcher(node, tests=tests, absolute=absolute):
+            for test in reversed(tests):
+                if node is None or not test(node):
+                    return False
+                node = node.parent
+            return (node is not None and node.kind == 'root') if absolute else True
+
+        alternatives.append((matcher, priority))
+
+    return alternatives
+
+
+class _Template(object):
+
+    def __init__(self, matchers, priority, mode, name, params, body, order):
+        self.matchers = matchers
+        self.priority = priority
+        self.mode = mode
+        self.name = name
+        self.params = params
+        self.body = body
+        self.order = order
+
+
+class _Stylesheet(object):
+    """
+    A compiled XSLT stylesheet. Only the subset of XSLT 1.0 used for
+    record-by-record exposures mappings is supported - templates (matched
+    and named, with parameters and modes), literal result elements,
+    ``xsl:for-each``, ``xsl:apply-templates``, ``xsl:call-template``,
+    ``xsl:attribute``, ``xsl:element``, ``xsl:value-of``, ``xsl:text``,
+    ``xsl:if``, ``xsl:choose``, ``xsl:variable``, ``xsl:param``,
+    ``xsl:copy`` and ``xsl:copy-of``. Anything else raises
+    ``OasisTransformationNotSupported`` when the stylesheet is compiled.
+    """
+
+    _ignored_top_level = ('output', 'strip-space', 'preserve-space', 'decimal-format', 'namespace-alias')
+
+    _instructions = (
+        'apply-templates', 'attribute', 'call-template', 'choose', 'copy', 'copy-of',
+        'element', 'for-each', 'if', 'text', 'value-of'
+    )
+
+    def __init__(self, root):
+        if root.tag not in (_xsl('stylesheet'), _xsl('transform')):
+            raise OasisTransformationNotSupported('Transformation file is not an XSLT stylesheet')
+
+        self.templates = []
+        self.named_templates = {}
+        self.global_variables = []
+
+        for i, child in enumerate(root):
+            if not child.tag.startswith('{{{}}}'.format(XSL_NS)):
+                continue
+
+            tag = child.tag.split('}')[1]
+            if tag == 'template':
+                self._add_template(child, i)
+            elif tag in ('variable', 'param'):
+                self.global_variables.append(self._compile_variable(child))
+            elif tag in self._ignored_top_level:
+                continue
+            else:
+                raise OasisTransformationNotSupported('XSLT top-level element xsl:{}'.format(tag))
+
+    def _add_template(self, e, order):
+        params = [self._compile_variable(child) for child in e if child.tag == _xsl('param')]
+        body = self._compile_sequence(e, skip=(_xsl('param'),))
+
+        name = e.get('name')
+        match = e.get('match')
+        mode = e.get('mode')
+
+        if name:
+            self.named_templates[name] = _Template(None, None, mode, name, params, body, order)
+        if match:
+            priority = e.get('priority')
+            for matcher, default_priority in _compile_pattern(match):
+                self.templates.append(_Template(
+                    matcher,
+                    float(priority) if priority is not None else default_priority,
+                    mode, name, params, body, order
+                ))
+
+    def _compile_variable(self, e):
+        name = e.get('name')
+        select = e.get('select')
+        if select is not None:
+            f = _compile_xpath(select)
+        else:
+            body = self._compile_sequence(e)
+            if not body:
+                f = lambda ctx: u''
+            else:
+                def f(ctx, body=body):
+                    out = _TextBuilder()
+                    self._run(body, ctx, out)
+                    rtf = _Node('root')
+                    rtf.children.append(_Node('text', value=out.value, parent=rtf))
+                    return [rtf]
+        return name, f
+
+    def _compile_sequence(self, e, skip=()):
+        """
+        Compiles the content of an element (a sequence constructor) into a
+        list of instructions - whitespace-only text nodes are stripped.
+        """
+        instructions = []
+
+        def add_text(s):
+            if s is not None and s.strip():
+                s = _text(s)
+                instructions.append(lambda ctx, out: out.text(s))
+
+        add_text(e.text)
+        for child in e:
+            if child.tag not in skip:
+                instructions.append(self._compile_instruction(child))
+            add_text(child.tail)
+
+        return instructions
+
+    def _run(self, instructions, ctx, out):
+        for instruction in instructions:
+            new_ctx = instruction(ctx, out)
+            if new_ctx is not None:
+                ctx = new_ctx
+
+    def _compile_instruction(self, e):
+        if not e.tag.startswith('{{{}}}'.format(XSL_NS)):
+            return self._compile_literal_element(e)
+
+        tag = e.tag.split('}')[1]
+        if tag in ('variable', 'param'):
+            return self._compile_variable_instruction(e)
+        if tag in ('comment', 'processing-instruction'):
+            return lambda ctx, out: None
+
+        if tag not in self._instructions:
+            raise OasisTransformationNotSupported('XSLT instruction xsl:{}'.format(tag))
+
+        return getattr(self, '_compile_{}'.format(tag.replace('-', '_')))(e)
+
+    def _compile_literal_element(self, e):
+        name = e.tag
+        if name.startswith('{'):
+            raise OasisTransformationNotSupported('Namespaced literal result element {}'.format(name))
+        if any(k == _xsl('use-attribute-sets') for k in e.keys()):
+            raise OasisTransformationNotSupported('XSLT attribute sets')
+
+        attributes = [
+            (k, _compile_avt(v)) for k, v in e.items() if not k.startswith('{')
+        ]
+        body = self._compile_sequence(e)
+
+        def instruction(ctx, out):
+            out.start_element(name)
+            for k, f in attributes:
+                out.attribute(k, f(ctx))
+            self._run(body, ctx, out)
+            out.end_element()
+
+        return instruction
+
+    def _compile_element(self, e):
+        if e.get('namespace') is not None or e.get('use-attribute-sets') is not None:
+            raise OasisTransformationNotSupported('XSLT xsl:element namespaces or attribute sets')
+        name = _compile_avt(e.get('name'))
+        body = self._compile_sequence(e)
+
+        def instruction(ctx, out):
+            out.start_element(name(ctx))
+            self._run(body, ctx, out)
+            out.end_element()
+
+        return instruction
+
+    def _compile_attribute(self, e):
+        if e.get('namespace') is not None:
+            raise OasisTransformationNotSupported('XSLT xsl:attribute namespaces')
+        name = _compile_avt(e.get('name'))
+        body = self._compile_sequence(e)
+
+        def instruction(ctx, out):
+            value = _TextBuilder()
+            self._run(body, ctx, value)
+            out.attribute(name(ctx), value.value)
+
+        return instruction
+
+    def _compile_value_of(self, e):
+        f = _compile_xpath(e.get('select'))
+        return lambda ctx, out: out.text(_to_string(f(ctx)))
+
+    def _compile_text(self, e):
+        s = _text(e.text)
+        return lambda ctx, out: out.text(s)
+
+    def _compile_if(self, e):
+        test = _compile_xpath(e.get('test'))
+        body = self._compile_sequence(e)
+
+        def instruction(ctx, out):
+            if _to_boolean(test(ctx)):
+                self._run(body, ctx, out)
+
+        return instruction
+
+    def _compile_choose(self, e):
+        branches = []
+        for child in e:
+            if child.tag == _xsl('when'):
+                branches.append((_compile_xpath(child.get('test')), self._compile_sequence(child)))
+            elif child.tag == _xsl('otherwise'):
+                branches.append((lambda ctx: True, self._compile_sequence(child)))
+            else:
+                raise OasisTransformationNotSupported('XSLT xsl:choose child {}'.format(child.tag))
+
+        def instruction(ctx, out):
+            for test, body in branches:
+                if _to_boolean(test(ctx)):
+                    self._run(body, ctx, out)
+                    return
+
+        return instruction
+
+    def _compile_variable_instruction(self, e):
+        name, f = self._compile_variable(e)
+
+        def instruction(ctx, out):
+            variables = dict(ctx.variables)
+            variables[name] = f(ctx)
+            return _Context(ctx.node, ctx.position, ctx.size, variables, ctx.current)
+
+        return instruction
+
+    def _compile_for_each(self, e):
+        if any(child.tag == _xsl('sort') for child in e):
+            raise OasisTransformationNotSupported('XSLT xsl:sort')
+        select = _compile_xpath(e.get('select'))
+        body = self._compile_sequence(e)
+
+        def instruction(ctx, out):
+            nodes = select(ctx)
+            if not isinstance(nodes, list):
+                raise OasisException('xsl:for-each select is not a node-set')
+            size = len(nodes)
+            for i, node in enumerate(nodes, 1):
+                self._run(body, _Context(node, i, size, ctx.variables, node), out)
+
+        return instruction
+
+    def _compile_with_params(self, e):
+        params = []
+        for child in e:
+            if child.tag == _xsl('with-param'):
+                params.append(self._compile_variable(child))
+            elif child.tag == _xsl('sort'):
+                raise OasisTransformationNotSupported('XSLT xsl:sort')
+        return params
+
+    def _compile_apply_templates(self, e):
+        select = _compile_xpath(e.get('select')) if e.get('select') else _path(False, [_step('child', 'node()')])
+        mode = e.get('mode')
+        params = self._compile_with_params(e)
+
+        def instruction(ctx, out):
+            nodes = select(ctx)
+            if not isinstance(nodes, list):
+                raise OasisException('xsl:apply-templates select is not a node-set')
+            args = dict((name, f(ctx)) for name, f in params)
+            self.apply_templates(nodes, ctx, out, mode, args)
+
+        return instruction
+
+    def _compile_call_template(self, e):
+        name = e.get('name')
+        params = self._compile_with_params(e)
+
+        def instruction(ctx, out):
+            try:
+                template = self.named_templates[name]
+            except KeyError:
+                raise OasisException('XSLT named template {} not found'.format(name))
+            args = dict((n, f(ctx)) for n, f in params)
+            self._call(template, ctx, out, args)
+
+        return instruction
+
+    def _compile_copy(self, e):
+        body = self._compile_sequence(e)
+
+        def instruction(ctx, out):
+            node = ctx.node
+            if node.kind == 'element':
+                out.start_element(node.name)
+                self._run(body, ctx, out)
+                out.end_element()
+            elif node.kind == 'attribute':
+                out.attribute(node.name, node.value)
+            elif node.kind == 'text':
+                out.text(node.value)
+            else:
+                self._run(body, ctx, out)
+
+        return instruction
+
+    def _compile_copy_of(self, e):
+        select = _compile_xpath(e.get('select'))
+
+        def copy(node, out):
+            if node.kind == 'element':
+                out.start_element(node.name)
+                for a in node.attributes:
+                    out.attribute(a.name, a.value)
+                for c in node.children:
+                    copy(c, out)
+                out.end_element()
+            elif node.kind == 'attribute':
+                out.attribute(node.name, node.value)
+            elif node.kind == 'text':
+                out.text(node.value)
+            else:
+                for c in node.children:
+                    copy(c, out)
+
+        def instruction(ctx, out):
+            v = select(ctx)
+            if isinstance(v, list):
+                for node in v:
+                    copy(node, out)
+            else:
+                out.text(_to_string(v))
+
+        return instruction
+
+    def _call(self, template, ctx, out, args):
+        variables = dict(ctx.variables)
+        for name, f in template.params:
+            variables[name] = args[name] if name in args else f(ctx)
+        self._run(template.body, _Context(ctx.node, ctx.position, ctx.size, variables, ctx.current), out)
+
+    def apply_templates(self, nodes, ctx, out, mode=None, args=None):
+        size = len(nodes)
+        for i, node in enumerate(nodes, 1):
+            node_ctx = _Context(node, i, size, self.globals, node)
+
+            best = None
+            for template in self.templates:
+                if template.mode != mode or not template.matchers(node):
+                    continue
+                if best is None or (template.priority, template.order) >= (best.priority, best.order):
+                    best = template
+
+            if best is not None:
+                self._call(best, node_ctx, out, args or {})
+            elif node.kind in ('root', 'element'):
+                self.apply_templates(node.children, node_ctx, out, mode)
+            else:
+                out.text(node.string_value)
+
+    def transform(self, doc):
+        """
+        Applies the stylesheet to a source document, and returns the result
+        tree builder.
+        """
+        self.globals = {}
+        for name, f in self.global_variables:
+            self.globals[name] = f(_Context(doc, variables=dict(self.globals)))
+
+        out = _ResultBuilder()
+        self.apply_templates([doc], _Context(doc, variables=self.globals), out)
+        return out
+
+
+# ---------------------------------------------------------------------------
+# XSD (subset) compiler
+# ---------------------------------------------------------------------------
+
+_xsd_integer_ranges = {
+    'integer': (None, None),
+    'long': (-2 ** 63, 2 ** 63 - 1),
+    'int': (-2 ** 31, 2 ** 31 - 1),
+    'short': (-2 ** 15, 2 ** 15 - 1),
+    'byte': (-2 ** 7, 2 ** 7 - 1),
+    'nonNegativeInteger': (0, None),
+    'positiveInteger': (1, None),
+    'nonPositiveInteger': (None, 0),
+    'negativeInteger': (None, -1),
+    'unsignedLong': (0, 2 ** 64 - 1),
+    'unsignedInt': (0, 2 ** 32 - 1),
+    'unsignedShort': (0, 2 ** 16 - 1),
+    'unsignedByte': (0, 2 ** 8 - 1),
+}
+
+_xsd_lexical_res = {
+    'boolean': re.compile(r'^(true|false|1|0)$'),
+    'decimal': re.compile(r'^[+-]?(\d+(\.\d*)?|\.\d+)$'),
+    'integer': re.compile(r'^[+-]?\d+$'),
+    'float': re.compile(r'^([+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?|INF|-INF|NaN)$'),
+    'date': re.compile(r'^-?\d{4,}-\d{2}-\d{2}(Z|[+-]\d{2}:\d{2})?$'),
+    'dateTime': re.compile(r'^-?\d{4,}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?$'),
+}
+
+_xsd_string_types = ('string', 'normalizedString', 'token', 'anySimpleType')
+
+
+class _SimpleType(object):
+    """
+    A compiled XSD simple type - a built-in base type plus facets.
+    """
+
+    def __init__(self, base, name):
+        self.base = base
+        self.name = name
+        self.enumerations = None
+        self.patterns = []
+        self.checks = []
+
+    def _value(self, s):
+        if self.base in _xsd_string_types:
+            if self.base == 'normalizedString':
+                return re.sub(r'[\t\n\r]', ' ', s)
+            if self.base == 'token':
+                return u' '.join(s.split())
+            return s
+        return s.strip()
+
+    def _number(self, s):
+        if self.base == 'float' or self.base == 'double':
+            return float(s.replace('INF', 'inf'))
+        return Decimal(s)
+
+    def is_valid(self, s):
+        value = self._value(s)
+
+        if self.base == 'boolean':
+            if not _xsd_lexical_res['boolean'].match(value):
+                return False
+        elif self.base in _xsd_integer_ranges:
+            if not _xsd_lexical_res['integer'].match(value):
+                return False
+            lo, hi = _xsd_integer_ranges[self.base]
+            n = int(value)
+            if (lo is not None and n < lo) or (hi is not None and n > hi):
+                return False
+        elif self.base == 'decimal':
+            if not _xsd_lexical_res['decimal'].match(value):
+                return False
+        elif self.base in ('float', 'double'):
+            if not _xsd_lexical_res['float'].match(value):
+                return False
+        elif self.base in ('date', 'dateTime'):
+            if not _xsd_lexical_res[self.base].match(value):
+                return False
+
+        if self.patterns and not all(p.match(value) for p in self.patterns):
+            return False
+
+        if self.enumerations is not None:
+            if self.base in _xsd_string_types or self.base in ('boolean', 'date', 'dateTime'):
+                if value not in self.enumerations:
+                    return False
+            elif self._number(value) not in [self._number(e) for e in self.enumerations]:
+                return False
+
+        return all(check(value) for check in self.checks)
+
+    def add_facet(self, facet, value):
+        value = _text(value)
+        numeric = self.base not in _xsd_string_types + ('boolean', 'date', 'dateTime')
+
+        if facet == 'enumeration':
+            self.enumerations = (self.enumerations or []) + [self._value(value)]
+        elif facet == 'pattern':
+            if re.search(r'\\[iIcC]|\\p\{|\\P\{|\(\?', value):
+                raise OasisTransformationNotSupported('XSD pattern "{}"'.format(value))
+            self.patterns.append(re.compile(u'^(?:{})$'.format(value.replace('$', r'\$').replace('^', r'\^')), re.UNICODE))
+        elif facet in ('length', 'minLength', 'maxLength'):
+            n = int(value)
+            self.checks.append({
+                'length': lambda v: len(v) == n,
+                'minLength': lambda v: len(v) >= n,
+                'maxLength': lambda v: len(v) <= n
+            }[facet])
+        elif facet in ('minInclusive', 'maxInclusive', 'minExclusive', 'maxExclusive') and numeric:
+            bound = self._number(value)
+            self.checks.append({
+                'minInclusive': lambda v: self._number(v) >= bound,
+                'maxInclusive': lambda v: self._number(v) <= bound,
+                'minExclusive': lambda v: self._number(v) > bound,
+                'maxExclusive': lambda v: self._number(v) < bound
+            }[facet])
+        elif facet == 'whiteSpace':
+            pass
+        else:
+            raise OasisTransformationNotSupported('XSD facet {} for type {}'.format(facet, self.base))
+
+
+class _Schema(object):
+    """
+    A compiled XSD schema for the ``root``/``rec`` documents built from
+    exposures CSV files. Only the attribute declarations of the ``rec``
+    element, with built-in or (named or anonymous) restricted simple types,
+    are supported.
+    """
+
+    def __init__(self, root):
+        if root.tag != _xsd('schema'):
+            raise OasisTransformationNotSupported('Validation file is not an XSD schema')
+
+        self._named_types = dict(
+            (st.get('name'), st) for st in root.findall(_xsd('simpleType'))
+        )
+        for tag in ('include', 'import', 'redefine', 'attributeGroup', 'group'):
+            if root.find(_xsd(tag)) is not None:
+                raise OasisTransformationNotSupported('XSD top-level xs:{}'.format(tag))
+
+        elements = dict((e.get('name'), e) for e in root.findall(_xsd('element')))
+        if 'root' not in elements:
+            raise OasisTransformationNotSupported('XSD without a root element declaration')
+
+        rec = self._find_rec(elements['root'], elements)
+
+        self.attributes = OrderedDict()
+        self.required = []
+        self.prohibited = []
+
+        complex_type = rec.find(_xsd('complexType'))
+        if complex_type is None:
+            raise OasisTransformationNotSupported('XSD rec element without a complex type')
+        for child in complex_type:
+            if child.tag == _xsd('attribute'):
+                name = child.get('name')
+                if name is None:
+                    raise OasisTransformationNotSupported('XSD attribute references')
+                use = child.get('use', 'optional')
+                if use == 'required':
+                    self.required.append(name)
+                elif use == 'prohibited':
+                    self.prohibited.append(name)
+                if child.get('fixed') is not None:
+                    raise OasisTransformationNotSupported('XSD fixed attribute values')
+                self.attributes[name] = self._compile_type(child)
+            elif child.tag in (_xsd('anyAttribute'), _xsd('annotation')):
+                continue
+            elif child.tag in (_xsd('sequence'), _xsd('all'), _xsd('choice')) and not len(child):
+                continue
+            else:
+                raise OasisTransformationNotSupported('XSD rec complex type content {}'.format(child.tag))
+
+    def _find_rec(self, root, elements):
+        complex_type = root.find(_xsd('complexType'))
+        if complex_type is None:
+            raise OasisTransformationNotSupported('XSD root element without a complex type')
+        group = complex_type.find(_xsd('sequence'))
+        if group is None:
+            group = complex_type.find(_xsd('choice'))
+        if group is None or len(group) != 1 or group[0].tag != _xsd('element'):
+            raise OasisTransformationNotSupported('XSD root element content other than a sequence of rec elements')
+        rec = group[0]
+        if rec.get('ref') == 'rec' and 'rec' in elements:
+            rec = elements['rec']
+        if rec.get('name') != 'rec':
+            raise OasisTransformationNotSupported('XSD root element content other than a sequence of rec elements')
+        return rec
+
+    def _compile_type(self, attribute):
+        type_name = attribute.get('type')
+        if type_name is not None:
+            return self._compile_named_type(type_name)
+
+        simple_type = attribute.find(_xsd('simpleType'))
+        if simple_type is None:
+            return _SimpleType('anySimpleType', 'anySimpleType')
+        return self._compile_simple_type(simple_type)
+
+    def _compile_named_type(self, type_name):
+        local_name = type_name.split(':')[-1]
+        if type_name in self._named_types or local_name in self._named_types and ':' not in type_name:
+            return self._compile_simple_type(self._named_types[type_name])
+        if local_name in _xsd_string_types or local_name in _xsd_integer_ranges or local_name in ('boolean', 'decimal', 'float', 'double', 'date', 'dateTime'):
+            return _SimpleType(local_name, type_name)
+        raise OasisTransformationNotSupported('XSD type {}'.format(type_name))
+
+    def _compile_simple_type(self, simple_type):
+        restriction = simple_type.find(_xsd('restriction'))
+        if restriction is None:
+            raise OasisTransformationNotSupported('XSD list or union simple types')
+
+        base_type = self._compile_named_type(restriction.get('base'))
+        t = _SimpleType(base_type.base, simple_type.get('name') or restriction.get('base'))
+        t.enumerations = base_type.enumerations
+        t.patterns = list(base_type.patterns)
+        t.checks = list(base_type.checks)
+
+        for facet in restriction:
+            if facet.tag != _xsd('annotation'):
+                t.add_facet(facet.tag.split('}')[1], facet.get('value'))
+        return t
+
+    def validate(self, doc, max_errors=20):
+        """
+        Validates a ``root``/``rec`` source document against the schema, and
+        returns a pair ``(count, messages)`` of the number of validation
+        errors and the messages of the first ``max_errors`` of them.
+        Attributes not declared in the schema are allowed.
+        """
+        count = 0
+        messages = []
+
+        def error(message):
+            if len(messages) < max_errors:
+                messages.append(message)
+
+        for rec in doc.children[0].children:
+            names = set()
+            for a in rec.attributes:
+                names.add(a.name)
+                if a.name in self.prohibited:
+                    count += 1
+                    error("The '{}' attribute is not allowed.".format(a.name))
+                elif a.name in self.attributes and not self.attributes[a.name].is_valid(a.value):
+                    count += 1
+                    error(
+                        "The '{}' attribute is invalid - The value '{}' is invalid according to its datatype '{}'.".format(
+                            a.name, a.value, self.attributes[a.name].name
+                        )
+                    )
+            for name in self.required:
+                if name not in names:
+                    count += 1
+                    error("The required attribute '{}' is missing.".format(name))
+
+        return count, messages
+
+
+# ---------------------------------------------------------------------------
+# Transformer
+# ---------------------------------------------------------------------------
+
+_csv_value_re = re.compile(r'(?:^|,)("(?:[^"]+|"")*"|[^,]*)')
+
+_xml_name_re = re.compile(r'^[^\W\d][\w.\-]*$', re.UNICODE)
+
+_line_break_re = re.compile(r'\r\n|\r|\n')
+
+
+class OasisExposuresTransformer(object):
+    """
+    A native exposures file transformer, which applies an XSLT transformation
+    (and optional XSD validation) to an exposures CSV file in the same way,
+    and with the same output, as the ``xtrans`` (Mono) executable, but in
+    process.
+
+    The XSLT and XSD files are compiled once into a transformation plan -
+    an XPath/XSLT 1.0 interpreter for the subset of XSLT used in exposures
+    mappings, and a set of attribute value checks for the XSD. The input
+    CSV rows are streamed through the plan in the same chunks as ``xtrans``
+    (so that ``position()`` and ``last()`` have the same values), only the
+    first chunk is validated, and the output is written with the same
+    header, ``ROW_ID`` sequence numbering and line endings. Unlike
+    ``xtrans``, validation errors raise an exception instead of being
+    printed, and the output file is overwritten rather than appended to.
+
+    Stylesheets or schemas which use features outside the supported subset
+    raise ``OasisTransformationNotSupported`` when the transformer is
+    created.
+
+    Transformers can be cached and reused by plan key (see
+    ``get_plan_key``), and saved as JSON (see ``to_json``) or pickled - only
+    the parsed files are saved, and the plan is compiled again when a
+    transformer is loaded.
+    """
+
+    first_chunk_size = 50001
+    chunk_size = 50000
+
+    plan_format_version = '2'
+
+    def __init__(self, transformation_file_path, validation_file_path=None):
+        self._transformation_file_path = transformation_file_path
+        self._validation_file_path = validation_file_path
+
+        with io.open(transformation_file_path, 'rb') as f:
+            self._transformation = _parse_xml(f.read(), transformation_file_path)
+
+        self._validation = None
+        if validation_file_path:
+            with io.open(validation_file_path, 'rb') as f:
+                self._validation = _parse_xml(f.read(), validation_file_path)
+
+        self._compile()
+
+
+    def _compile(self):
+        self._stylesheet = _Stylesheet(self._transformation)
+        self._schema = _Schema(self._validation) if self._validation is not None else None
+
+
+    def __getstate__(self):
+        # The compiled plan is made of closures, which cannot be pickled, so
+        # only the parsed transformation and validation files are pickled,
+        # and the plan is compiled again when unpickled
+        return {
+            'transformation_file_path': self._transformation_file_path,
+            'validation_file_path': self._validation_file_path,
+            'transformation': self._transformation,
+            'validation': self._validation
+        }
+
+
+    def __setstate__(self, state):
+        self._transformation_file_path = state['transformation_file_path']
+        self._validation_file_path = state['validation_file_path']
+        self._transformation = state['transformation']
+        self._validation = state['validation']
+        self._compile()
+
+
+    @classmethod
+    def create(cls, transformation_file_path, validation_file_path=None):
+        return cls(
+            transformation_file_path=transformation_file_path,
+            validation_file_path=validation_file_path
+        )
+
+
+    def to_json(self):
+        """
+        Returns the transformer as a JSON string - the parsed transformation
+        and validation files, and the plan format version. Unlike a pickle,
+        loading it (see ``from_json``) cannot run arbitrary code, so it is
+        safe to keep in a shared plans cache directory.
+        """
+        return json.dumps({
+            'plan_format_version': self.plan_format_version,
+            'transformation_file_path': self._transformation_file_path,
+            'validation_file_path': self._validation_file_path,
+            'transformation': _xml_to_json(self._transformation),
+            'validation': _xml_to_json(self._validation) if self._validation is not None else None
+        })
+
+
+    @classmethod
+    def from_json(cls, s):
+        """
+        Returns a transformer from a JSON string returned by ``to_json`` -
+        the plan is compiled again from the parsed files. Raises an
+        ``OasisException`` if the string is not a transformer of the current
+        plan format version.
+        """
+        try:
+            state = json.loads(s)
+            if state['plan_format_version'] != cls.plan_format_version:
+                raise OasisException('Unsupported plan format version {}'.format(state['plan_format_version']))
+            state['transformation'] = _xml_from_json(state['transformation'])
+            if state['validation'] is not None:
+                state['validation'] = _xml_from_json(state['validation'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise OasisException('Invalid exposures transformation plan: {}'.format(str(e)))
+
+        transformer = cls.__new__(cls)
+        transformer.__setstate__(state)
+        return transformer
+
+
+    @classmethod
+    def get_plan_key(cls, transformation_file_path, validation_file_path=None):
+        """
+        Returns the key of the transformation plan for a transformation file
+        and an (optional) validation file - a SHA-1 hash of the contents of
+        the files, so that plans can be cached and reused for as long as the
+        files do not change.
+        """
+        h = hashlib.sha1()
+        h.update(cls.plan_format_version.encode('utf-8'))
+        for file_path in [transformation_file_path, validation_file_path]:
+            h.update(b'\0')
+            if file_path:
+                with io.open(file_path, 'rb') as f:
+                    h.update(f.read())
+        return h.hexdigest()
+
+
+    @property
+    def transformation_file_path(self):
+        """
+        Transformation (XSLT) file path property - getter only.
+
+            :getter: Gets the transformation file path
+        """
+        return self._transformation_file_path
+
+
+    @property
+    def validation_file_path(self):
+        """
+        Validation (XSD) file path property - getter only.
+
+            :getter: Gets the validation file path
+        """
+        return self._validation_file_path
+
+
+    @classmethod
+    def iter_record_chunks(cls, lines, source=None):
+        """
+        Generates the chunks of CSV records in an iterable of lines (without
+        line terminators) as ``xtrans`` reads them - lists of records, each
+        a list of ``(column name, value)`` pairs for the non-empty values in
+        the row, with values kept verbatim (including any quotes). The first
+        line is the header. The optional ``source`` is used in error messages.
+        """
+        lines = iter(lines)
+
+        header = next(lines, None)
+        if header is None:
+            yield []
+            return
+
+        if not header:
+            raise OasisException('Empty header line in {}'.format(source))
+
+        names = header.split(',')
+
+        def record(line):
+            values = []
+            pos = 0
+            while pos <= len(line):
+                m = _csv_value_re.search(line, pos)
+                if not m:
+                    break
+                values.append(m.group(0))
+                # .NET regular expressions resume the search after an
+                # empty match one character on - so an empty first
+                # value also swallows the second one in ``xtrans``
+                pos = m.end() if m.end() > m.start() else m.end() + 1
+
+            if len(values) > len(names):
+                raise OasisException('Row has more values than the header in {}: {}'.format(source, line))
+            rec = []
+            seen = set()
+            for i, value in enumerate(values):
+                if i > 0:
+                    value = value[1:]
+                if value:
+                    name = names[i]
+                    if not _xml_name_re.match(name) or name in seen:
+                        raise OasisException('Invalid or duplicate column name "{}" in {}'.format(name, source))
+                    seen.add(name)
+                    rec.append((name, value))
+            return rec
+
+        def chunk_records(chunk_lines):
+            return [record(line) for line in chunk_lines if line]
+
+        chunk_lines = []
+        limit = cls.first_chunk_size
+        for line in lines:
+            chunk_lines.append(line)
+            if len(chunk_lines) == limit:
+                yield chunk_records(chunk_lines)
+                chunk_lines = []
+                limit = cls.chunk_size
+        yield chunk_records(chunk_lines)
+
+
+    @classmethod
+    def read_chunks(cls, input_file_path):
+        """
+        Generates the chunks of records of an input CSV file as ``xtrans``
+        reads them (see ``iter_record_chunks``).
+        """
+        with io.open(input_file_path, 'r', encoding='utf-8-sig', errors='replace') as f:
+            for records in cls.iter_record_chunks((line.rstrip('\n') for line in f), source=input_file_path):
+                yield records
+
+
+    @classmethod
+    def split_lines(cls, lines):
+        """
+        Generates the lines of an iterable of output lines as they would be
+        read back from an output file - output values containing line breaks
+        break the line.
+        """
+        for line in lines:
+            for l in _line_break_re.split(line):
+                yield l
+
+
+    def iter_transform(self, record_chunks, sequence_numbers=False, source=None):
+        """
+        Generates the output of the transformation of an iterable of chunks
+        of records (see ``iter_record_chunks``) chunk by chunk, as lists of
+        output lines (without line terminators) - the first list starts with
+        the header line. If ``sequence_numbers`` is set a ``ROW_ID`` column
+        is added as the first column of the output, numbered from 1 - this
+        is the ``xtrans`` ``-s`` option. Only the first chunk is validated.
+        """
+        row_id = 1
+        first = True
+
+        for records in record_chunks:
+            doc = _source_document(records)
+
+            if first and self._schema:
+                count, messages = self._schema.validate(doc)
+                if count:
+                    raise OasisException(
+                        'Validation of {} against {} failed with {} errors:\n{}'.format(
+                            source, self._validation_file_path, count, '\n'.join(messages)
+                        )
+                    )
+
+            result = self._stylesheet.transform(doc)
+
+            lines = []
+            for i, rec in enumerate(result.elements('rec')):
+                # As in ``xtrans`` a record without attributes is an
+                # empty line, and has no sequence number
+                if first and i == 0:
+                    names = list(rec.attributes.keys())
+                    if names and sequence_numbers:
+                        names.insert(0, u'ROW_ID')
+                    lines.append(u','.join(names))
+                values = list(rec.attributes.values())
+                if values and sequence_numbers:
+                    values.insert(0, _text_type(row_id))
+                    row_id += 1
+                lines.append(u','.join(values))
+
+            first = False
+
+            yield lines
+
+
+    @classmethod
+    def write_chunks(cls, output_chunks, output_file_path):
+        """
+        Writes chunks of output lines (see ``iter_transform``) to
+        ``output_file_path``, and generates the chunks as they are written,
+        so that the output of a transformation can be consumed (e.g. by the
+        next transformation) while it is being written.
+        """
+        newline = os.linesep
+        with io.open(output_file_path, 'wb') as f:
+            for lines in output_chunks:
+                if lines:
+                    f.write((newline.join(lines) + newline).encode('utf-8'))
+                    f.flush()
+                yield lines
+
+
+    def transform(self, input_file_path, output_file_path, sequence_numbers=False):
+        """
+        Transforms the CSV file at ``input_file_path`` and writes the result
+        to ``output_file_path``. If ``sequence_numbers`` is set a ``ROW_ID``
+        column is added as the first column of the output, numbered from 1 -
+        this is the ``xtrans`` ``-s`` option. Returns the number of output
+        rows.
+        """
+        output_chunks = self.write_chunks(
+            self.iter_transform(
+                self.read_chunks(input_file_path),
+                sequence_numbers=sequence_numbers,
+                source=input_file_path
+            ),
+            output_file_path
+        )
+
+        # The header line is only written if there are output rows
+        num_lines = sum(len(lines) for lines in output_chunks)
+
+        return max(num_lines - 1, 0)
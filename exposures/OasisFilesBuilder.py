@@ -0,0 +1,648 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisFilesBuilder'
+]
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+if os.getcwd().split(os.path.sep)[-1] == 'exposures':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+
+class OasisFilesBuilder(object):
+    """
+    Builds the Oasis files (items, coverages, GUL summary) for a model from
+    its canonical exposures file, keys file and canonical exposures profile.
+
+    The inputs are parsed and joined once, on first use, into a master data
+    frame of Oasis items, which is then cached in the builder - the items,
+    coverages and GUL summary data frames are projections of the master data
+    frame. A builder is usually attached to a model's Oasis files pipeline
+    so that all the Oasis files generated for the model in the lifetime of
+    the pipeline share the one join.
+    """
+
+    master_columns = [
+        'item_id',
+        'coverage_id',
+        'tiv',
+        'areaperil_id',
+        'vulnerability_id',
+        'group_id',
+        'summary_id',
+        'summaryset_id'
+    ]
+
+    items_columns = ['item_id', 'coverage_id', 'areaperil_id', 'vulnerability_id', 'group_id']
+
+    coverages_columns = ['coverage_id', 'tiv']
+
+    gulsummaryxref_columns = ['coverage_id', 'summary_id', 'summaryset_id']
+
+    # ktools binary file record layouts - headerless, little-endian, 4 byte
+    # fields. Coverages are in the ktools 3 format, i.e. only the TIVs are
+    # stored, with the coverage ID given by the (1-based) record position.
+    binary_dtypes = {
+        'items': np.dtype([
+            ('item_id', '<i4'),
+            ('coverage_id', '<i4'),
+            ('areaperil_id', '<u4'),
+            ('vulnerability_id', '<i4'),
+            ('group_id', '<i4')
+        ]),
+        'coverages': np.dtype([
+            ('tiv', '<f4')
+        ]),
+        'gulsummaryxref': np.dtype([
+            ('coverage_id', '<i4'),
+            ('summary_id', '<i4'),
+            ('summaryset_id', '<i4')
+        ])
+    }
+
+    def __init__(
+        self,
+        canonical_exposures_file_path=None,
+        keys_file_path=None,
+        canonical_exposures_profile=None
+    ):
+        self._canonical_exposures_file_path = canonical_exposures_file_path
+        self._keys_file_path = keys_file_path
+        self._canonical_exposures_profile = canonical_exposures_profile
+
+        self._inputs_signature = None
+        self._master_data_frame = None
+
+
+    @classmethod
+    def create(
+        cls,
+        canonical_exposures_file_path=None,
+        keys_file_path=None,
+        canonical_exposures_profile=None
+    ):
+        """
+        Class method that returns an instance of an Oasis files builder for
+        the given canonical exposures file, keys file and canonical exposures
+        profile.
+        """
+        return cls(
+            canonical_exposures_file_path=canonical_exposures_file_path,
+            keys_file_path=keys_file_path,
+            canonical_exposures_profile=canonical_exposures_profile
+        )
+
+
+    @classmethod
+    def get_tiv_fields(cls, canonical_exposures_profile):
+        """
+        Returns a dict of the (lowercase) TIV field names in the given
+        canonical exposures profile keyed by coverage type ID.
+        """
+        return dict(
+            (f['CoverageTypeID'], f['ProfileElementName'].lower())
+            for f in canonical_exposures_profile.values() if f.get('FieldName') == 'TIV'
+        )
+
+
+    @classmethod
+    def read_keys(cls, keys_file_path, chunksize=None):
+        """
+        Reads the keys file into a data frame with lowercase column names, and
+        with the ``CoverageID`` column renamed to ``coveragetype``. If
+        ``chunksize`` is given then an iterator of data frames of (at most)
+        this many keys rows is returned instead.
+        """
+        def normalise(keys_df):
+            keys_df = keys_df.rename(columns={'CoverageID': 'CoverageType'})
+            keys_df.columns = [c.lower() for c in keys_df.columns]
+            return keys_df
+
+        if not chunksize:
+            return normalise(pd.read_csv(keys_file_path, encoding='utf-8'))
+
+        return (normalise(df) for df in pd.read_csv(keys_file_path, encoding='utf-8', chunksize=chunksize))
+
+
+    @classmethod
+    def get_join_errors(cls, missing, duplicates, unknown):
+        """
+        Returns a list of error messages for the keys location IDs in
+        ``missing`` (no matching canonical exposure item) and ``duplicates``
+        (duplicate canonical exposure items), and the keys coverage types in
+        ``unknown`` (no TIV field in the canonical exposures profile).
+        """
+        errors = []
+
+        if len(missing) > 0:
+            errors.append(
+                '{} keys location IDs have no matching canonical exposure item, e.g. {}'.format(len(missing), np.asarray(missing[:20]).tolist())
+            )
+
+        if len(duplicates) > 0:
+            errors.append(
+                '{} keys location IDs have duplicate canonical exposure items, e.g. {}'.format(len(duplicates), np.asarray(duplicates[:20]).tolist())
+            )
+
+        if len(unknown) > 0:
+            errors.append(
+                'keys coverage types {} have no TIV field in the canonical exposures profile'.format(np.asarray(unknown).tolist())
+            )
+
+        return errors
+
+
+    @classmethod
+    def join(cls, keys_df, canexp_df, tiv_fields, item_id_offset=0):
+        """
+        Joins a keys data frame with a canonical exposures data frame, which
+        must have a ``row_id`` column and the TIV columns in ``tiv_fields``,
+        and returns the resulting master data frame. The join, the selection
+        of the TIV column for each keys item's coverage type and the filtering
+        out of zero-TIV items are done in bulk. Item IDs are numbered from
+        ``item_id_offset + 1``.
+        """
+        master_df = pd.merge(
+            keys_df[['locid', 'coveragetype', 'areaperilid', 'vulnerabilityid']],
+            canexp_df,
+            how='left',
+            left_on='locid',
+            right_on='row_id',
+            sort=False
+        )
+
+        tiv = np.select(
+            [(master_df['coveragetype'] == coverage_type).values for coverage_type in tiv_fields],
+            [master_df[tiv_fields[coverage_type]].values for coverage_type in tiv_fields],
+            default=0
+        )
+        master_df = master_df[tiv > 0]
+        tiv = tiv[tiv > 0]
+
+        ids = np.arange(item_id_offset + 1, item_id_offset + len(master_df) + 1)
+
+        return pd.DataFrame(
+            {
+                'item_id': ids,
+                'coverage_id': ids,
+                'tiv': tiv,
+                'areaperil_id': master_df['areaperilid'].values.astype(int),
+                'vulnerability_id': master_df['vulnerabilityid'].values.astype(int),
+                'group_id': ids,
+                'summary_id': 1,
+                'summaryset_id': 1
+            },
+            columns=cls.master_columns
+        )
+
+
+    @classmethod
+    def write_binary_file(cls, master_df, file_type, file_path, append=False):
+        """
+        Writes the ``items``, ``coverages`` or ``gulsummaryxref`` projection
+        (``file_type``) of a master data frame as a ktools binary file, as
+        produced by the ktools ``itemtobin``, ``coveragetobin`` and
+        ``gulsummaryxreftobin`` conversion tools, directly from the data frame
+        columns. If ``append`` is set the records are appended to the file,
+        which is how the file is built chunk by chunk in streaming mode.
+        """
+        dtype = cls.binary_dtypes[file_type]
+
+        records = np.empty(len(master_df), dtype=dtype)
+        for column in dtype.names:
+            records[column] = master_df[column].values
+
+        with open(file_path, 'ab' if append else 'wb') as f:
+            records.tofile(f)
+
+
+    @classmethod
+    def get_temporary_file_path(cls, file_path):
+        """
+        Returns the path of the temporary file in which the file at
+        ``file_path`` is written before being committed with `commit_file`.
+        """
+        return '{}.{}.tmp'.format(file_path, os.getpid())
+
+
+    @classmethod
+    def commit_file(cls, temporary_file_path, file_path, snapshot_file_path=None):
+        """
+        Renames a completely written temporary file to ``file_path``, and then
+        creates the optional snapshot of it at ``snapshot_file_path`` (see
+        `snapshot_file`). As the file is replaced by renaming, rather than
+        being rewritten in place, any snapshots of a previous version of the
+        file (which may share its storage) are not modified.
+        """
+        if os.name == 'nt' and os.path.exists(file_path):
+            os.remove(file_path)
+        os.rename(temporary_file_path, file_path)
+
+        if snapshot_file_path:
+            return cls.snapshot_file(file_path, snapshot_file_path)
+
+
+    @classmethod
+    def snapshot_file(cls, file_path, snapshot_file_path):
+        """
+        Creates a snapshot of the file at ``file_path`` at
+        ``snapshot_file_path``, without rewriting the file contents where the
+        filesystem allows it - the snapshot is a hard link to the file if
+        possible, otherwise a copy-on-write clone (reflink), and otherwise a
+        single buffered copy of the file. Returns the snapshot method used,
+        ``hardlink``, ``reflink`` or ``copy``.
+        """
+        if os.path.exists(snapshot_file_path):
+            os.remove(snapshot_file_path)
+
+        try:
+            os.link(file_path, snapshot_file_path)
+            return 'hardlink'
+        except (AttributeError, OSError):
+            pass
+
+        try:
+            import fcntl
+            with open(file_path, 'rb') as src:
+                with open(snapshot_file_path, 'wb') as dst:
+                    # The Linux ``FICLONE`` ioctl (btrfs, XFS, ...)
+                    fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())
+            return 'reflink'
+        except (ImportError, IOError, OSError):
+            pass
+
+        shutil.copyfile(file_path, snapshot_file_path)
+        return 'copy'
+
+
+    @classmethod
+    def get_master_data_frame(cls, canonical_exposures_file_path, keys_file_path, canonical_exposures_profile):
+        """
+        Joins the keys with the canonical exposures, on the keys ``LocID``
+        and the canonical exposures ``ROW_ID``, and returns a master data
+        frame of Oasis items with the columns
+
+            ``item_id``, ``coverage_id``, ``tiv``, ``areaperil_id``,
+            ``vulnerability_id``, ``group_id``, ``summary_id``, ``summaryset_id``
+
+        from which the items, coverages and GUL summary files can be written.
+
+        Keys items with no matching or with duplicate canonical exposure
+        items, or with coverage types which have no TIV field in the canonical
+        exposures profile, are all reported together in a single exception.
+        """
+        canexp_df = pd.read_csv(canonical_exposures_file_path, encoding='utf-8')
+        canexp_df.columns = [c.lower() for c in canexp_df.columns]
+
+        keys_df = cls.read_keys(keys_file_path)
+
+        tiv_fields = cls.get_tiv_fields(canonical_exposures_profile)
+
+        missing = keys_df.loc[~keys_df['locid'].isin(canexp_df['row_id']), 'locid'].unique()
+        duplicates = canexp_df.loc[
+            canexp_df['row_id'].duplicated() & canexp_df['row_id'].isin(keys_df['locid']), 'row_id'
+        ].unique()
+        unknown = keys_df.loc[~keys_df['coveragetype'].isin(list(tiv_fields)), 'coveragetype'].unique()
+
+        errors = cls.get_join_errors(missing, duplicates, unknown)
+        if errors:
+            raise OasisException(
+                'Error joining keys file {} to canonical exposures file {}: {}.'.format(
+                    keys_file_path, canonical_exposures_file_path, '; '.join(errors)
+                )
+            )
+
+        return cls.join(keys_df, canexp_df[['row_id'] + sorted(set(tiv_fields.values()))], tiv_fields)
+
+
+    def iter_master_data_frame_chunks(self, chunksize=100000, max_index_memory=None, index_dir=None):
+        """
+        Generator version of ``get_master_data_frame`` for portfolios which do
+        not fit in memory - the keys file is read in chunks of ``chunksize``
+        rows, and each chunk is joined against an index of the canonical
+        exposures ``ROW_ID`` and TIV columns, and yielded as a master data
+        frame chunk, with item IDs running on from the previous chunk. At least
+        one (possibly empty) chunk is always yielded.
+
+        The canonical exposures index is held in memory unless it grows beyond
+        ``max_index_memory`` MB, in which case it is moved to a temporary
+        SQLite database in ``index_dir`` (or the system temporary directory).
+
+        Join errors are collected over all the chunks and reported together
+        in a single exception at the end.
+        """
+        tiv_fields = self.get_tiv_fields(self.canonical_exposures_profile)
+
+        index = _CanonicalExposuresIndex(
+            self.canonical_exposures_file_path,
+            sorted(set(tiv_fields.values())),
+            chunksize=chunksize,
+            max_memory=max_index_memory,
+            index_dir=index_dir
+        )
+
+        try:
+            missing = set()
+            duplicates = set()
+            unknown = set()
+            item_id_offset = 0
+            yielded = False
+
+            for keys_df in self.read_keys(self.keys_file_path, chunksize=chunksize):
+                locids = keys_df['locid'].unique()
+                canexp_df = index.lookup(locids)
+
+                missing.update(np.setdiff1d(locids, canexp_df['row_id'].values).tolist())
+                duplicates.update(canexp_df.loc[canexp_df['row_id'].duplicated(), 'row_id'].tolist())
+                unknown.update(keys_df.loc[~keys_df['coveragetype'].isin(list(tiv_fields)), 'coveragetype'].tolist())
+
+                master_df = self.join(keys_df, canexp_df, tiv_fields, item_id_offset=item_id_offset)
+                item_id_offset += len(master_df)
+
+                yielded = True
+                yield master_df
+
+            if not yielded:
+                yield pd.DataFrame(columns=self.master_columns)
+
+            errors = self.get_join_errors(sorted(missing), sorted(duplicates), sorted(unknown))
+            if errors:
+                raise OasisException(
+                    'Error joining keys file {} to canonical exposures file {}: {}.'.format(
+                        self.keys_file_path, self.canonical_exposures_file_path, '; '.join(errors)
+                    )
+                )
+        finally:
+            index.close()
+
+
+    @classmethod
+    def get_inputs_signature(cls, canonical_exposures_file_path, keys_file_path):
+        """
+        Returns a signature of the builder input files - their absolute paths,
+        sizes and modification times - which is used to detect whether the
+        input files have changed since the master data frame was built.
+        """
+        signature = []
+        for fp in [canonical_exposures_file_path, keys_file_path]:
+            fp = os.path.abspath(fp)
+            st = os.stat(fp)
+            signature.append((fp, st.st_size, st.st_mtime))
+
+        return tuple(signature)
+
+
+    @property
+    def canonical_exposures_file_path(self):
+        """
+        Canonical exposures file path property - getter only.
+
+            :getter: Gets the path of the canonical exposures file
+        """
+        return self._canonical_exposures_file_path
+
+
+    @property
+    def keys_file_path(self):
+        """
+        Keys file path property - getter only.
+
+            :getter: Gets the path of the keys file
+        """
+        return self._keys_file_path
+
+
+    @property
+    def canonical_exposures_profile(self):
+        """
+        Canonical exposures profile property - getter only.
+
+            :getter: Gets the canonical exposures profile dict
+        """
+        return self._canonical_exposures_profile
+
+
+    @property
+    def master_data_frame(self):
+        """
+        Master data frame property - getter only.
+
+            :getter: Gets the master data frame of Oasis items, joining the
+                     builder inputs if they have not yet been joined
+        """
+        if self._master_data_frame is None:
+            self._inputs_signature = self.get_inputs_signature(self.canonical_exposures_file_path, self.keys_file_path)
+            self._master_data_frame = self.get_master_data_frame(
+                self.canonical_exposures_file_path,
+                self.keys_file_path,
+                self.canonical_exposures_profile
+            )
+
+        return self._master_data_frame
+
+
+    @property
+    def items_data_frame(self):
+        """
+        Items data frame property - getter only.
+
+            :getter: Gets the items projection of the master data frame
+        """
+        return self.master_data_frame[self.items_columns]
+
+
+    @property
+    def coverages_data_frame(self):
+        """
+        Coverages data frame property - getter only.
+
+            :getter: Gets the coverages projection of the master data frame
+        """
+        return self.master_data_frame[self.coverages_columns]
+
+
+    @property
+    def gulsummaryxref_data_frame(self):
+        """
+        GUL summary data frame property - getter only.
+
+            :getter: Gets the GUL summary projection of the master data frame
+        """
+        return self.master_data_frame[self.gulsummaryxref_columns]
+
+
+    def is_built_from(self, canonical_exposures_file_path, keys_file_path, canonical_exposures_profile):
+        """
+        Checks whether the builder is for the given inputs, and that the
+        input files have not changed since the master data frame was built.
+        """
+        if canonical_exposures_profile != self.canonical_exposures_profile:
+            return False
+
+        if self._inputs_signature is None:
+            return (
+                os.path.abspath(canonical_exposures_file_path) == os.path.abspath(self.canonical_exposures_file_path) and
+                os.path.abspath(keys_file_path) == os.path.abspath(self.keys_file_path)
+            )
+
+        try:
+            return self.get_inputs_signature(canonical_exposures_file_path, keys_file_path) == self._inputs_signature
+        except OSError:
+            return False
+
+
+    def clear(self):
+        """
+        Clears the cached master data frame.
+        """
+        self._inputs_signature = None
+        self._master_data_frame = None
+
+
+    def __str__(self):
+        return '{}: {}, {}'.format(self.__repr__(), self.canonical_exposures_file_path, self.keys_file_path)
+
+
+    def __repr__(self):
+        return '{}: {}'.format(
+            self.__class__,
+            dict((k, v) for k, v in self.__dict__.items() if k != '_master_data_frame')
+        )
+
+
+    def _repr_pretty_(self, p, cycle):
+       p.text(str(self) if not cycle else '...')
+
+
+class _CanonicalExposuresIndex(object):
+    """
+    An index of the ``ROW_ID`` and TIV columns of a canonical exposures file,
+    built by reading the file in chunks. The index is held in a data frame in
+    memory unless its size exceeds ``max_memory`` MB, in which case it is
+    moved to a temporary SQLite database on disk, indexed on ``row_id``.
+    """
+
+    def __init__(self, canonical_exposures_file_path, tiv_columns, chunksize=100000, max_memory=None, index_dir=None):
+        header = pd.read_csv(canonical_exposures_file_path, encoding='utf-8', nrows=0).columns
+        columns = dict((c.lower(), c) for c in header)
+
+        self._columns = ['row_id'] + tiv_columns
+        self._df = None
+        self._row_ids = None
+        self._db = None
+        self._db_file_path = None
+
+        max_memory = max_memory * 1024 * 1024 if max_memory else None
+        memory = 0
+        dfs = []
+
+        for df in pd.read_csv(
+            canonical_exposures_file_path,
+            encoding='utf-8',
+            usecols=[columns[c] for c in self._columns],
+            chunksize=chunksize
+        ):
+            df.columns = [c.lower() for c in df.columns]
+            df = df[self._columns]
+
+            if self._db is None:
+                dfs.append(df)
+                memory += df.memory_usage(index=True).sum()
+                if max_memory and memory > max_memory:
+                    self._open_db(index_dir)
+                    for df in dfs:
+                        self._insert(df)
+                    dfs = []
+            else:
+                self._insert(df)
+
+        if self._db is not None:
+            self._db.execute('CREATE INDEX canexp_row_id ON canexp (row_id)')
+            self._db.commit()
+        else:
+            df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=self._columns)
+            self._df = df.iloc[np.argsort(df['row_id'].values, kind='mergesort')]
+            self._row_ids = self._df['row_id'].values
+
+
+    def _open_db(self, index_dir):
+        fd, self._db_file_path = tempfile.mkstemp(prefix='canexp-', suffix='.db', dir=index_dir)
+        os.close(fd)
+        self._db = sqlite3.connect(self._db_file_path)
+
+
+    def _insert(self, df):
+        df.to_sql('canexp', self._db, if_exists='append', index=False)
+
+
+    def lookup(self, locids):
+        """
+        Returns a data frame of the index rows with ``row_id`` in ``locids``.
+        """
+        if self._db is None:
+            left = np.searchsorted(self._row_ids, locids, side='left')
+            counts = np.searchsorted(self._row_ids, locids, side='right') - left
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            return self._df.iloc[np.repeat(left, counts) + offsets]
+
+        self._db.execute('DROP TABLE IF EXISTS temp.locids')
+        self._db.execute('CREATE TEMP TABLE locids (locid INTEGER PRIMARY KEY)')
+        self._db.executemany('INSERT INTO temp.locids VALUES (?)', ((int(l),) for l in locids))
+
+        return pd.read_sql_query(
+            'SELECT {} FROM canexp c JOIN temp.locids l ON c.row_id = l.locid'.format(
+                ', '.join('c."{}"'.format(c) for c in self._columns)
+            ),
+            self._db
+        )
+
+
+    def close(self):
+        """
+        Closes and deletes the on-disk index, if any.
+        """
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.remove(self._db_file_path)
@@ -55,6 +55,8 @@ class OasisFilesPipeline(object):
         self._coverages_file = None
         self._gulsummaryxref_file = None
 
+        self._oasis_files_builder = None
+
         self._oasis_files = {
             'items': self._items_file,
             'coverages': self._coverages_file,
@@ -215,6 +217,24 @@ class OasisFilesPipeline(object):
         self._gulsummaryxref_file = self.oasis_files['gulsummaryxref'] = f
 
 
+    @property
+    def oasis_files_builder(self):
+        """
+        Oasis files builder property - caches the join of the canonical
+        exposures and keys files from which the Oasis files are generated,
+        for the lifetime of the pipeline.
+
+            :getter: Gets the builder object
+            :setter: Sets the builder to the specified builder object
+        """
+        return self._oasis_files_builder
+
+
+    @oasis_files_builder.setter
+    def oasis_files_builder(self, b):
+        self._oasis_files_builder = b
+
+
     @property
     def oasis_files(self):
         """
@@ -228,13 +248,16 @@ class OasisFilesPipeline(object):
 
     def clear(self):
         """
-        Clears all file attributes in the pipeline.
+        Clears all file attributes in the pipeline, and the Oasis files
+        builder.
         """
         map(
             lambda f: setattr(self, f, None),
             self._file_attrib_names
         )
 
+        self._oasis_files_builder = None
+
 
     def __str__(self):
         return '{}: {}'.format(self.__repr__(), self.model_key)
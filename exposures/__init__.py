@@ -1,3 +1,5 @@
 from .OasisExposuresManagerInterface import *
 from .OasisExposuresManager import *
+from .OasisExposuresTransformer import *
+from .OasisFilesBuilder import *
 from .OasisFilesPipeline import *
\ No newline at end of file
@@ -14,6 +14,10 @@ the following arguments (in no particular order)
                        -e /path/to/model/exposures/csv/file
                        -o /path/to/output/file
                        [-f <output format - 'oasis_keys' or 'list_keys'>]
+                       [-n <number of keys lookup worker processes>]
+                       [-q /path/to/keys/lookup/cache/file]
+                       [-z <maximum number of keys lookup cache entries>]
+                       [-Q <comma-separated keys lookup cache columns>]
 
 When calling the script this way paths can be given relative to the
 script, in particular, file paths should include the filename and
@@ -24,7 +28,25 @@ repository was created by or is managed by Oasis LMF then the lookup
 service package will usually be contained in the ``src/keys_server``
 Python subpackage and can be given as the path to that subpackage (see
 the OasisPiWind repository as a reference for how to structure an Oasis
-keys server repository)
+keys server repository).
+
+The following keys lookup options are optional:
+
+* ``-n`` - the number of keys lookup worker processes. If it is greater
+  than 1 then the model exposures are split into partitions which are
+  looked up in parallel in a pool of worker processes, each with its own
+  instance of the lookup service - the keys records are written in the
+  same order as for a single process lookup.
+* ``-q`` - the keys lookup cache file path. If given then the lookup
+  results are stored in a persistent cache, keyed by model and location
+  attributes, so that in later runs only new or changed locations are
+  sent to the lookup service.
+* ``-z`` - the maximum number of keys lookup cache entries, beyond which
+  the least recently used entries are evicted.
+* ``-Q`` - the keys lookup cache columns. By default the cache is keyed
+  by all the location columns except the ID - if the lookup only uses
+  some of the columns then these can be given instead, so that changes
+  to the other columns do not miss the cache.
 
 It is also possible to run the script by defining these arguments in a
 JSON configuration file and calling the script with option ``-f`` and
@@ -44,12 +66,25 @@ The JSON file should contain the following keys (in no particular order)
     "model_exposures_file_path"
     "output_file_path"
     "output_format"
+    "keys_lookup_num_processes"
+    "keys_cache_path"
+    "keys_cache_max_entries"
+    "keys_cache_columns"
 
 and the values of the path-related keys should be string paths, given
 relative to the location of JSON file. The JSON file is usually placed
 in the model keys server repository. The ``"output_format"`` key is
 optional - by default the script will generate an Oasis keys file.
 
+The following keys are also optional:
+
+* ``"keys_lookup_num_processes"`` - by default the lookup is run in a
+  single process.
+* ``"keys_cache_path"`` and ``"keys_cache_max_entries"`` - by default no
+  keys lookup cache is used.
+* ``"keys_cache_columns"`` - by default the keys lookup cache is keyed
+  by all the location columns except the ID.
+
 Keys records returned by an Oasis keys lookup service (see the PiWind
 lookup service for reference) will be Python dicts with the following
 structure
@@ -188,6 +223,39 @@ SCRIPT_ARGS_METADICT = {
         'help_text': 'Keys records file output format: choices are `oasis_keys` and `list_keys`',
         'required_on_command_line': False,
         'required_for_script': False
+    },
+    'keys_lookup_num_processes': {
+        'name': 'keys_lookup_num_processes',
+        'flag': 'n',
+        'type': int,
+        'help_text': 'Number of worker processes for the keys lookup - by default the lookup is run in a single process',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'keys_cache_path': {
+        'name': 'keys_cache_path',
+        'flag': 'q',
+        'type': str,
+        'help_text': 'Path of a persistent keys lookup cache (SQLite) file - only locations not in the cache are looked up',
+        'required_on_command_line': False,
+        'required_for_script': False,
+        'preexists': False
+    },
+    'keys_cache_max_entries': {
+        'name': 'keys_cache_max_entries',
+        'flag': 'z',
+        'type': int,
+        'help_text': 'Maximum number of keys lookup cache entries, beyond which the least recently used entries are evicted',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'keys_cache_columns': {
+        'name': 'keys_cache_columns',
+        'flag': 'Q',
+        'type': str,
+        'help_text': 'Comma-separated location columns used by the keys lookup, which key the keys lookup cache - by default all the location columns except the ID',
+        'required_on_command_line': False,
+        'required_for_script': False
     }
 }
 
@@ -232,12 +300,23 @@ if __name__ == '__main__':
             args['output_format'] if 'output_format' in args and args['output_format']
             else 'oasis_keys'
         )
+        keys_lookup_num_processes = (
+            args['keys_lookup_num_processes'] if 'keys_lookup_num_processes' in args and args['keys_lookup_num_processes']
+            else 1
+        )
         logging.info('Saving keys records to file')
         f, n = oklf.save_keys(
             lookup=model_klc,
             model_exposures_file_path=args['model_exposures_file_path'],
             output_file_path=args['output_file_path'],
-            format=output_format
+            format=output_format,
+            num_processes=keys_lookup_num_processes,
+            model_keys_data_path=args['keys_data_path'],
+            model_version_file_path=args['model_version_file_path'],
+            lookup_package_path=args['lookup_package_path'],
+            keys_cache_path=(args['keys_cache_path'] if 'keys_cache_path' in args else None),
+            keys_cache_max_entries=(args['keys_cache_max_entries'] if 'keys_cache_max_entries' in args else None),
+            keys_cache_columns=(args['keys_cache_columns'] if 'keys_cache_columns' in args else None)
         )
     except OasisException as e:
         logging.error(str(e))
@@ -15,7 +15,23 @@ following arguments (in no particular order)
                          -m /path/to/model/data
                          [-r /path/to/model/run/directory]
                          [-s <ktools script name (without file extension)>]
-                         [-n <number of ktools calculation processes to use>]
+                         [-n <number of ktools calculation processes to use, or 'auto'>]
+                         [--calibrate_ktools | --no-calibrate_ktools]
+                         [-B <maximum number of concurrent ktools processes>]
+                         [-E <ktools script executor - 'bash' or 'python'>]
+                         [-T <ktools transport - 'local' or transport class path>]
+                         [-N <number of ktools transport nodes>]
+                         [-R <number of retries of failed ktools partitions>]
+                         [--resume_ktools_run]
+                         [--trace_ktools]
+                         [--chrome_trace_ktools]
+                         [--balance_event_partitions]
+                         [--pin_ktools_partitions]
+                         [-S /path/to/ktools/scratch/directory]
+                         [-F <minimum free space of the ktools scratch directory (MB)>]
+                         [-C <ktools work file codec - 'lz4', 'zstd' or 'gzip'>]
+                         [-M <GUL stream mode - 'capture' or 'replay'>]
+                         [-G /path/to/gul/stream/directory]
                          [--execute | --no-execute]
 
 When calling the script this way paths can be given relative to the
@@ -30,6 +46,129 @@ automatically execute the ktools losses script it generates. If you
 don't want this provide the (optional) ``--no-execute`` argument. The
 default here is automatic execution.
 
+If the number of calculation processes is ``auto`` then it is chosen
+from the available cores and memory, the number of items and events, the
+number of samples and the summary outputs of the analysis settings (see
+``OasisKtoolsProcessTuner`` in ``ktools``) - for large event sets the
+CPU and memory use of a calculation process are measured by a short
+calibration run on a sample of the events (the memory use on Linux
+only), unless ``--no-calibrate_ktools`` is given. The number also keeps
+within the process budget (``-B``) if one is given, and if the
+partitions run with a ktools transport other than ``local`` then the
+cores and memory are those of its nodes (``-N``), each taken to be like
+this host. The plan and the reasons for it are written to
+``ktools_plan.json`` in the model run directory.
+
+The process budget (``-B``) is optional - if given then the ktools
+script is generated to run at most about this many concurrent processes,
+by deferring the outputs of the last summary sets until after the
+calculations and running them from work files in batches (see
+``OasisKtoolsScriptBuilder`` in ``ktools``). The expected peak number of
+ktools processes is logged before the script is run.
+
+The ktools script executor (``-E``) is optional - by default the script
+is run with ``bash``, but it can also be run by the in-process ktools
+orchestrator (``python``), which runs the script's processes as a graph
+without a shell or fifo files, starts each process as soon as its inputs
+are complete, copies the summarycalc streams to the summary outputs
+itself (with the Linux ``tee`` and ``splice`` calls and enlarged pipe
+buffers) instead of running ``tee`` processes, and reports the exit code
+of any failed process.
+
+If ``--balance_event_partitions`` is given then the events are split
+between the calculation processes by their estimated cost, from the
+model footprint and the portfolio's area perils, instead of into
+partitions of equal numbers of events by ``eve`` - the partitions are
+written to ``input/event_partitions``.
+
+If ``--pin_ktools_partitions`` is given then the calculation processes
+(partitions) are spread evenly across the NUMA nodes (sockets) of the
+host, and the whole chain of each partition - eve through summarycalc
+and its output processes - is pinned to a set of cores, preferring the
+memory of its NUMA node, with ``numactl`` (or to the cores with
+``taskset`` if ``numactl`` is not installed) - see
+``OasisKtoolsCpuLayout`` in ``ktools``. The layout is written to
+``ktools_cpu_layout.json`` in the model run directory. Partitions run by
+a transport other than ``local`` are not pinned, as the layout is of the
+local host.
+
+If a ktools scratch directory (``-S``) is given, e.g. ``/dev/shm`` or a
+local disk, then the ``fifo`` and ``work`` folders of the model run - the
+ktools fifos, the ``work/kat`` intermediates and the ``aalcalc`` and
+``leccalc`` work folders - are placed in a scratch folder of the model
+run in it, and linked into the model run directory, so that only the
+output files are written to the model run directory (see
+``OasisKtoolsScratchSpace`` in ``ktools``). The node directories of the
+``local`` transport are also placed in the scratch folder. The free space
+of the scratch directory is checked before the ktools run - if it is less
+than the minimum (``-F``, 1024 MB by default) then the folders are left
+in the model run directory. The scratch folder is removed after the run,
+except for the work files of a failed partitioned run, which are kept
+for resuming it.
+
+If a ktools work file codec (``-C``) is given then the ``leccalc`` work
+files - the full summarycalc streams of the summary sets with loss
+exceedance curves, usually the largest intermediate files of the run -
+are written compressed, by a ``lz4``, ``zstd`` or ``gzip`` process, and
+decompressed as they are read by ``leccalc``, so that the uncompressed
+streams are never written to disk (see ``OasisKtoolsScriptBuilder`` in
+``ktools``). The codec's command line tool must be installed - if it is
+not then the work files are not compressed. The uncompressed and
+compressed sizes of the work files of each summary set, the compression
+ratio and the throughput (uncompressed MB per second of the ktools run)
+are written to ``ktools_work_codec.json`` in the model run directory.
+
+If the GUL stream mode (``-M``) is ``capture`` then the ground up loss
+streams of ``gulcalc`` - the item and coverage streams of each
+calculation process - are also written to files in the GUL stream
+directory (``-G``, by default ``gul_stream`` in the model run directory),
+compressed with the ktools work file codec if one is given, and a
+manifest of the capture (``gul_stream.json``) is written when the run is
+complete. If the mode is ``replay`` then ``eve``, ``getmodel`` and
+``gulcalc`` are not run - ``fmcalc`` and ``summarycalc`` read the
+captured streams instead, so that other financial terms or summary
+options can be analysed without sampling the model again (see
+``OasisKtoolsGulStream`` in ``ktools``). A replay fails if there is no
+complete capture, or if the capture was of other inputs or with another
+number of samples, GUL threshold or model settings, and it has the
+number of calculation processes of the capture. With a transport other
+than ``local`` the GUL stream directory must be on storage shared by the
+nodes.
+
+If a ktools transport is given then the calculation processes
+(partitions) are run separately, each on a worker node of the transport,
+with its own eve -> getmodel -> gulcalc -> fmcalc -> summarycalc chain,
+and their eltcalc, pltcalc, summarycalc, aalcalc and leccalc work files
+are gathered back into the model run directory for the final ``kat``,
+``aalsummary`` and ``leccalc`` steps, which are run by a separate gather
+script (``<ktools script name>_gather.sh``). The ``local`` transport is a
+stand-in which runs each partition in a local process, in its own node
+directory (``nodes/P<n>``) - other transports can be given by the full
+dotted path of a transport class (see ``OasisKtoolsTransportInterface``
+in ``ktools``). The number of nodes is optional - by default it is the
+number of calculation processes.
+
+Each partition is marked complete, with a checkpoint file in
+``work/checkpoints``, as soon as its work files are in the model run
+directory. Failed partitions are run again up to the given number of
+retries (``-R``, 0 by default) before the run fails, and if
+``--resume_ktools_run`` is given then the work files of an earlier run in
+the same model run directory are kept and the partitions it completed
+are skipped. If retries or resuming are requested without a transport
+then the ``local`` transport is used.
+
+If ``--trace_ktools`` is given then the ktools script is run by the
+ktools orchestrator, which records the start and end times, CPU times,
+peak RSS and bytes read and written of each process, and writes them to
+``ktools_trace.json`` in the model run directory. The peak RSS is only
+recorded on Linux, where each process is started by a ``bash`` launcher
+so that it does not include the memory of the orchestrator, and it
+includes at most the few MB of ``bash``. If ``--chrome_trace_ktools`` is
+given then the trace is also written as a Chrome trace, which can be
+loaded in ``chrome://tracing`` or Perfetto, to
+``ktools_trace_chrome.json``. In a partitioned run only the gather script
+is traced.
+
 The script copies the analysis settings JSON file to the model run
 directory and sets up the following folder structure inside
 
@@ -45,7 +184,13 @@ directory and sets up the following folder structure inside
 Depending on the OS type the model data is symlinked (Linux, Darwin) or
 copied (Cygwin, Windows) into the ``static`` subfolder. The input files
 are kept in the ``input`` subfolder and the losses are generated as CSV
-files in the ``output`` subfolder.
+files in the ``output`` subfolder. If the Oasis files folder already
+contains the ktools binary files ``items.bin``, ``coverages.bin`` and
+``gulsummaryxref.bin`` (see the ``-t`` option of
+``generate_oasis_files.py``) then these are used as they are, and the
+conversion of the Oasis CSV files to ktools binary files is skipped - a
+binary file which is older than the CSV file of the same name beside it
+is from an earlier generation of the Oasis files, and is not used.
 
 It is also possible to run the script by defining these arguments in a
 JSON configuration file and calling the script using the path to this
@@ -66,6 +211,22 @@ The JSON file should contain the following keys (in no particular order)
     "model_run_dir_path"
     "ktools_script_name"
     "ktools_num_processes"
+    "calibrate_ktools"
+    "ktools_process_budget"
+    "ktools_executor"
+    "ktools_transport"
+    "ktools_num_nodes"
+    "ktools_partition_retries"
+    "resume_ktools_run"
+    "trace_ktools"
+    "chrome_trace_ktools"
+    "balance_event_partitions"
+    "pin_ktools_partitions"
+    "ktools_scratch_dir_path"
+    "ktools_scratch_min_free_mb"
+    "ktools_work_codec"
+    "ktools_gul_stream_mode"
+    "ktools_gul_stream_dir_path"
     "execute"
 
 and the values of the path-related keys should be string paths, given
@@ -75,11 +236,40 @@ key is optional - by default the script will create a timestamped folder
 in ``omdk/runs`` with the prefix ``ProgOasis``. The
 ``"ktools_script_name"`` and ``"ktools_num_processes"`` keys are
 optional - by default the script will create a ktools script named
-``run_tools.sh`` and set the number of calculation processes to 2. The
+``run_tools.sh`` and set the number of calculation processes to 2 - the
+number of calculation processes can also be ``"auto"``. The
 ``"execute"`` key is optional - if present it should be either ``true``
 or ``false`` depending on whether you want the generated ktools losses
 scripts to be automatically executed or not. The default here is
 automatic execution.
+
+The following keys are also optional:
+
+* ``"calibrate_ktools"`` - by default the ``auto`` number of calculation
+  processes may be calibrated.
+* ``"ktools_process_budget"`` - by default the number of concurrent
+  ktools processes is not limited.
+* ``"ktools_executor"`` - by default the ktools script is run with
+  ``bash``.
+* ``"ktools_transport"`` and ``"ktools_num_nodes"`` - by default all the
+  ktools calculation processes are run on the local host by the ktools
+  script.
+* ``"ktools_partition_retries"`` - by default failed partitions are not
+  retried.
+* ``"resume_ktools_run"`` - by default the ktools run is not resumed.
+* ``"trace_ktools"`` and ``"chrome_trace_ktools"`` - by default the
+  ktools run is not traced.
+* ``"balance_event_partitions"`` - by default the events are partitioned
+  by ``eve``.
+* ``"pin_ktools_partitions"`` - by default the ktools processes are not
+  pinned.
+* ``"ktools_scratch_dir_path"`` and ``"ktools_scratch_min_free_mb"`` -
+  by default the ktools fifo and work folders are in the model run
+  directory.
+* ``"ktools_work_codec"`` - by default the ktools work files are not
+  compressed.
+* ``"ktools_gul_stream_mode"`` and ``"ktools_gul_stream_dir_path"`` - by
+  default the GUL streams are neither captured nor replayed.
 """
 
 # BSD 3-Clause License
@@ -114,12 +304,15 @@ automatic execution.
 
 
 import argparse
+import importlib
 import io
 import json
 import logging
 import os
+import shutil
 import subprocess
 import sys
+import time
 
 from oasis_utils import (
     create_binary_files,
@@ -131,536 +324,263 @@ from oasis_utils import (
 )
 
 import utils as mdk_utils
+from ktools import (
+    OasisEventPartitionPlanner,
+    OasisKtoolsCpuLayout,
+    OasisKtoolsGulStream,
+    OasisKtoolsOrchestrator,
+    OasisKtoolsPartitionCheckpoints,
+    OasisKtoolsPartitionsError,
+    OasisKtoolsProcessTuner,
+    OasisKtoolsScratchSpace,
+    OasisKtoolsScriptBuilder,
+    OasisLocalKtoolsTransport,
+)
 
-pid_monitor_count = 0
-apid_monitor_count = 0
-lpid_monitor_count = 0
-kpid_monitor_count = 0
-command_file = ""
-
-
-def print_command(cmd):
-    with io.open(command_file, "a", encoding='utf-8') as myfile:
-        myfile.writelines(cmd.decode() + "\n")
-
-
-def leccalc_enabled(lec_options):
-    for option in lec_options["outputs"]:
-        if lec_options["outputs"][option]:
-            return True
-    return False
-
-
-def do_post_wait_processing(runtype, analysis_settings):
-    global apid_monitor_count
-    global lpid_monitor_count
-    summary_set = 0
-    if "{}_summaries".format(runtype) not in analysis_settings:
-        return
-
-    for summary in analysis_settings["{}_summaries".format(runtype)]:
-        if "id" in summary:
-            summary_set = summary["id"]
-            if summary.get("aalcalc"):
-                apid_monitor_count = apid_monitor_count + 1
-                print_command(
-                    "aalsummary -K{0}_S{1}_aalcalc > output/{0}_S{1}_aalcalc.csv & apid{2}=$!".format(
-                        runtype, summary_set, apid_monitor_count))
-            if summary.get("lec_output"):
-                if "leccalc" in summary:
-                    if leccalc_enabled(summary["leccalc"]):
-                        return_period_option = ""
-                        if summary["leccalc"]["return_period_file"]:
-                            return_period_option = "-r"
-                        cmd = "leccalc {} -K{}_S{}_summaryleccalc".format(return_period_option, runtype, summary_set)
-                        lpid_monitor_count = lpid_monitor_count + 1
-                        for option in summary["leccalc"]["outputs"]:
-                            switch = ""
-                            if summary["leccalc"]["outputs"][option]:
-                                if option == "full_uncertainty_aep":
-                                    switch = "-F"
-                                if option == "wheatsheaf_aep":
-                                    switch = "-W"
-                                if option == "sample_mean_aep":
-                                    switch = "-S"
-                                if option == "full_uncertainty_oep":
-                                    switch = "-f"
-                                if option == "wheatsheaf_oep":
-                                    switch = "-w"
-                                if option == "sample_mean_oep":
-                                    switch = "-s"
-                                if option == "wheatsheaf_mean_aep":
-                                    switch = "-M"
-                                if option == "wheatsheaf_mean_oep":
-                                    switch = "-m"
-                                cmd = cmd + " {} output/{}_S{}_leccalc_{}.csv".format(switch, runtype, summary_set, option)
-                        cmd = cmd + "  &  lpid{}=$!".format(lpid_monitor_count)
-                        print_command(cmd)
-
-
-def do_fifos(action, runtype, analysis_settings, process_id):
-
-    summary_set = 0
-    if "{}_summaries".format(runtype) not in analysis_settings:
-        return
-
-    print_command("{} fifo/{}_P{}".format(action, runtype, process_id))
-    print_command("")
-    for summary in analysis_settings["{}_summaries".format(runtype)]:
-        if "id" in summary:
-            summary_set = summary["id"]
-            print_command(
-                "{} fifo/{}_S{}_summary_P{}".format(
-                    action, runtype, summary_set, process_id))
-            if summary.get("eltcalc"):
-                print_command(
-                    "{} fifo/{}_S{}_summaryeltcalc_P{}".format(
-                        action, runtype, summary_set, process_id))
-                print_command(
-                    "{} fifo/{}_S{}_eltcalc_P{}".format(
-                        action, runtype, summary_set, process_id))
-            if summary.get("summarycalc"):
-                print_command(
-                    "{} fifo/{}_S{}_summarysummarycalc_P{}".format(
-                        action, runtype, summary_set, process_id))
-                print_command(
-                    "{} fifo/{}_S{}_summarycalc_P{}".format(
-                        action, runtype, summary_set, process_id))
-            if summary.get("pltcalc"):
-                print_command(
-                    "{} fifo/{}_S{}_summarypltcalc_P{}".format(
-                        action, runtype, summary_set, process_id))
-                print_command(
-                    "{} fifo/{}_S{}_pltcalc_P{}".format(
-                        action, runtype, summary_set, process_id))
-            if summary.get("aalcalc"):
-                print_command(
-                    "{} fifo/{}_S{}_summaryaalcalc_P{}".format(
-                        action, runtype, summary_set, process_id))
-
-    print_command("")
-
-
-def create_workfolders(runtype, analysis_settings):
-
-    if "{}_summaries".format(runtype) not in analysis_settings:
-        return
-    for summary in analysis_settings["{}_summaries".format(runtype)]:
-        if "id" in summary:
-            summary_set = summary["id"]
-            if summary.get("lec_output"):
-                if leccalc_enabled(summary["leccalc"]):
-                    print_command(
-                        "mkdir work/{}_S{}_summaryleccalc".format(
-                            runtype, summary_set))
-            if summary.get("aalcalc") is True:
-                print_command("mkdir work/{}_S{}_aalcalc".format(runtype, summary_set))
-
-
-def remove_workfolders(runtype, analysis_settings):
-    print_command("rm -rf work/kat")
-    if "{}_summaries".format(runtype) not in analysis_settings:
-        return
-    for summary in analysis_settings["{}_summaries".format(runtype)]:
-        if "id" in summary:
-            summary_set = summary["id"]
-            if summary.get("lec_output"):
-                if leccalc_enabled(summary["leccalc"]):
-                    print_command(
-                        "rm work/{}_S{}_summaryleccalc/*".format(
-                            runtype, summary_set))
-                    print_command(
-                        "rmdir work/{}_S{}_summaryleccalc".format(
-                            runtype, summary_set))
-            if summary.get("aalcalc"):
-                print_command(
-                    "rm work/{}_S{}_aalcalc/*".format(
-                        runtype, summary_set))
-                print_command("rmdir work/{}_S{}_aalcalc".format(
-                    runtype, summary_set))
-
-
-def do_make_fifos(runtype, analysis_settings, process_id):
-    do_fifos("mkfifo", runtype, analysis_settings, process_id)
-
-
-def do_remove_fifos(runtype, analysis_settings, process_id):
-    do_fifos("rm", runtype, analysis_settings, process_id)
-
-
-def do_kats(runtype, analysis_settings, max_process_id):
-    global kpid_monitor_count
-    anykats = False
-    if "{}_summaries".format(runtype) not in analysis_settings:
-        return anykats
-
-    for summary in analysis_settings["{}_summaries".format(runtype)]:
-        if "id" in summary:
-            summary_set = summary["id"]
-            if summary.get("eltcalc"):
-                anykats = True
-                cmd = "kat "
-                for process_id in range(1, max_process_id + 1):
-                    cmd = cmd + "work/kat/{}_S{}_eltcalc_P{} ".format(
-                        runtype, summary_set, process_id)
-                kpid_monitor_count = kpid_monitor_count + 1
-                cmd = cmd + "> output/{}_S{}_eltcalc.csv & kpid{}=$!".format(
-                    runtype, summary_set, kpid_monitor_count)
-                print_command(cmd)
-            if summary.get("pltcalc"):
-                anykats = True
-                cmd = "kat "
-                for process_id in range(1, max_process_id + 1):
-                    cmd = cmd + "work/kat/{}_S{}_pltcalc_P{} ".format(
-                        runtype, summary_set, process_id)
-                kpid_monitor_count = kpid_monitor_count + 1
-                cmd = cmd + "> output/{}_S{}_pltcalc.csv & kpid{}=$!".format(
-                    runtype, summary_set, kpid_monitor_count)
-                print_command(cmd)
-            if summary.get("summarycalc"):
-                anykats = True
-                cmd = "kat "
-                for process_id in range(1, max_process_id + 1):
-                    cmd = cmd + "work/kat/{}_S{}_summarycalc_P{} ".format(
-                        runtype, summary_set, process_id)
-                kpid_monitor_count = kpid_monitor_count + 1
-                cmd = cmd + "> output/{}_S{}_summarycalc.csv & kpid{}=$!".format(
-                    runtype, summary_set, kpid_monitor_count)
-                print_command(cmd)
-
-    return anykats
-
-
-def do_summarycalcs(runtype, analysis_settings, process_id):
-    summarycalc_switch = "-g"
-    if runtype == "il":
-        summarycalc_switch = "-f"
-    if "{}_summaries".format(runtype) in analysis_settings:
-        cmd = "summarycalc {} ".format(summarycalc_switch)
-        for summary in analysis_settings["{}_summaries".format(runtype)]:
-            if "id" in summary:
-                summary_set = summary["id"]
-                cmd = cmd + "-{0} fifo/{1}_S{0}_summary_P{2} ".format(
-                    summary_set, runtype, process_id)
-        cmd = cmd + " < fifo/{}_P{} &".format(runtype, process_id)
-        print_command(cmd)
-
-
-def do_tees(runtype, analysis_settings, process_id):
-    global pid_monitor_count
-    summary_set = 0
-    if "{}_summaries".format(runtype) not in analysis_settings:
-        return
-
-    for summary in analysis_settings["{}_summaries".format(runtype)]:
-        if "id" in summary:
-            pid_monitor_count = pid_monitor_count + 1
-            summary_set = summary["id"]
-            cmd = "tee < fifo/{}_S{}_summary_P{} ".format(
-                runtype, summary_set, process_id)
-            if summary.get("eltcalc"):
-                cmd = cmd + "fifo/{}_S{}_summaryeltcalc_P{} ".format(
-                    runtype, summary_set, process_id)
-            if summary.get("pltcalc"):
-                cmd = cmd + "fifo/{}_S{}_summarypltcalc_P{} ".format(
-                    runtype, summary_set, process_id)
-            if summary.get("summarycalc"):
-                cmd = cmd + "fifo/{}_S{}_summarysummarycalc_P{} ".format(
-                    runtype, summary_set, process_id)
-            if summary.get("aalcalc"):
-                cmd = cmd + "fifo/{}_S{}_summaryaalcalc_P{} ".format(
-                    runtype, summary_set, process_id)
-            if summary.get("lec_output") and leccalc_enabled(summary["leccalc"]):
-                cmd = cmd + "work/{}_S{}_summaryleccalc/P{}.bin ".format(
-                    runtype, summary_set, process_id)
-            cmd = cmd + " > /dev/null & pid{}=$!".format(
-                pid_monitor_count)
-            print_command(cmd)
-
-
-def do_any(runtype, analysis_settings, process_id):
-    global pid_monitor_count
-
-    summary_set = 0
-    if "{}_summaries".format(runtype) not in analysis_settings:
-        return
-
-    for summary in analysis_settings["{}_summaries".format(runtype)]:
-        if "id" in summary:
-            summary_set = summary["id"]
-            if summary.get("eltcalc"):
-                cmd = "eltcalc -s"
-                if process_id == 1:
-                    cmd = "eltcalc"
-                pid_monitor_count = pid_monitor_count + 1
-                print_command(
-                    "{3} < fifo/{0}_S{1}_summaryeltcalc_P{2} > work/kat/{0}_S{1}_eltcalc_P{2} & pid{4}=$!".format(
-                        runtype, summary_set, process_id, cmd,pid_monitor_count))
-            if summary.get("summarycalc"):
-                cmd = "summarycalctocsv -s"
-                if process_id == 1:
-                    cmd = "summarycalctocsv"
-                pid_monitor_count = pid_monitor_count + 1
-                print_command(
-                    "{3} < fifo/{0}_S{1}_summarysummarycalc_P{2} > work/kat/{0}_S{1}_summarycalc_P{2} & pid{4}=$!".format(
-                        runtype, summary_set, process_id, cmd,pid_monitor_count))
-            if summary.get("pltcalc"):
-                cmd = "pltcalc -s"
-                if process_id == 1:
-                    cmd = "pltcalc"
-                pid_monitor_count = pid_monitor_count + 1
-                print_command(
-                    "{3} < fifo/{0}_S{1}_summarypltcalc_P{2} > work/kat/{0}_S{1}_pltcalc_P{2} & pid{4}=$!".format(
-                        runtype, summary_set, process_id, cmd,pid_monitor_count))
-            if summary.get("aalcalc"):
-                pid_monitor_count = pid_monitor_count + 1
-                print_command(
-                    "aalcalc < fifo/{0}_S{1}_summaryaalcalc_P{2} > work/{0}_S{1}_aalcalc/P{2}.bin & pid{3}=$!".format(
-                        runtype, summary_set, process_id, pid_monitor_count))
-
-        print_command("")
-
-
-def do_il(analysis_settings, max_process_id):
-    for process_id in range(1, max_process_id + 1):
-        do_any("il", analysis_settings, process_id)
-
-    for process_id in range(1, max_process_id + 1):
-        do_tees("il", analysis_settings, process_id)
-
-    for process_id in range(1, max_process_id + 1):
-        do_summarycalcs("il", analysis_settings, process_id)
-
-
-def do_gul(analysis_settings, max_process_id):
-    for process_id in range(1, max_process_id + 1):
-        do_any("gul", analysis_settings, process_id)
-
-    for process_id in range(1, max_process_id + 1):
-        do_tees("gul", analysis_settings, process_id)
-
-    for process_id in range(1, max_process_id + 1):
-        do_summarycalcs("gul", analysis_settings, process_id)
-
-
-def do_il_make_fifo(analysis_settings, max_process_id):
-    for process_id in range(1, max_process_id + 1):
-        do_make_fifos("il", analysis_settings, process_id)
-
-
-def do_gul_make_fifo(analysis_settings, max_process_id):
-    for process_id in range(1, max_process_id + 1):
-        do_make_fifos("gul", analysis_settings, process_id)
-
-
-def do_il_remove_fifo(analysis_settings, max_process_id):
-    for process_id in range(1, max_process_id + 1):
-        do_remove_fifos("il", analysis_settings, process_id)
-
-
-def do_gul_remove_fifo(analysis_settings, max_process_id):
-    for process_id in range(1, max_process_id + 1):
-        do_remove_fifos("gul", analysis_settings, process_id)
-
+get_getmodel_cmd = OasisKtoolsScriptBuilder.get_getmodel_cmd
 
-def do_waits(wait_variable, wait_count):
-    if wait_count > 0:
-        cmd = "wait "
-        for pid in range(1, wait_count + 1):
-            cmd = cmd + "${}{} ".format(wait_variable, pid)
-        print_command(cmd)
-        print_command("")
 
+@oasis_log_utils.oasis_log()
+def genbash(
+        max_process_id=None,
+        analysis_settings=None,
+        output_filename=None,
+        get_getmodel_cmd=get_getmodel_cmd,
+        event_partition_file_paths=None,
+        max_num_processes=None,
+        pin_cmds=None,
+        work_codec=None,
+        gul_stream=None
+    ):
+    """
+    Generates a bash script containing ktools calculation instructions for an
+    Oasis model, provided its analysis settings JSON file, the number of processes
+    to use, and the path and name of the output script. The script is built
+    in memory (see ``OasisKtoolsScriptBuilder``) and written in one go, and
+    its lines are returned. If event partition files are given (one per
+    process) then the processes read their events from these instead of
+    from ``eve``. If a process budget (a maximum number of concurrent
+    processes) is given then summary sets are deferred to keep the script
+    within it. The expected peak number of processes of the script is
+    logged. If pinning commands are given (one per process, see
+    ``OasisKtoolsCpuLayout``) then the commands of each process are
+    prefixed with its pinning command. If a work file codec is given then
+    the ``leccalc`` work files are compressed with it. If a GUL stream is
+    given (see ``OasisKtoolsGulStream``) then the GUL streams are captured
+    to it or replayed from it.
+    """
+    logger = logging.getLogger()
+
+    script_builder = OasisKtoolsScriptBuilder.create(
+        analysis_settings,
+        max_process_id,
+        get_getmodel_cmd=get_getmodel_cmd,
+        event_partition_file_paths=event_partition_file_paths,
+        max_num_processes=max_num_processes,
+        pin_cmds=pin_cmds,
+        work_codec=work_codec,
+        gul_stream=gul_stream
+    )
+    peak_num_processes = script_builder.get_peak_num_processes()
+    deferred_summary_sets = script_builder.get_deferred_summary_sets()
+    logger.info('Expected peak number of ktools processes: {}'.format(peak_num_processes))
+    if deferred_summary_sets:
+        logger.info(
+            'Deferred summary sets (to keep within the process budget of {}): {}'.format(
+                max_num_processes,
+                ', '.join('{}_S{}'.format(runtype, summary_set) for runtype, summary_set in deferred_summary_sets)
+            )
+        )
+    if max_num_processes and peak_num_processes > max_num_processes:
+        logger.warning(
+            'The expected peak number of ktools processes {} is over the process budget of {} - '
+            'reduce the number of ktools calculation processes to keep within it'.format(
+                peak_num_processes, max_num_processes
+            )
+        )
 
-def do_pwaits():
-    do_waits("pid", pid_monitor_count)
+    return script_builder.write(output_filename)
 
 
-def do_awaits():
-    do_waits("apid", apid_monitor_count)
+def get_ktools_transport(transport_name, num_nodes=2, executor='bash', nodes_dir_path=None):
+    """
+    Returns a ktools transport (see ``OasisKtoolsTransportInterface``) for
+    running the ktools processes (partitions) of a model run on several
+    nodes - ``local`` is the local multi-process stand-in
+    (``OasisLocalKtoolsTransport``), which runs the partitions in node
+    directories in ``nodes_dir_path`` if it is given, and any other name
+    should be the full dotted path of a transport class with a ``create``
+    method taking the number of nodes and the partition script executor.
+    """
+    if transport_name == 'local':
+        return OasisLocalKtoolsTransport.create(num_nodes=num_nodes, executor=executor, nodes_dir_path=nodes_dir_path)
 
+    module_name, _, class_name = transport_name.rpartition('.')
+    try:
+        transport_class = getattr(importlib.import_module(module_name), class_name)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise OasisException('Invalid ktools transport {}: {}'.format(transport_name, str(e)))
 
-def do_lwaits():
-    do_waits("lpid", lpid_monitor_count)
+    return transport_class.create(num_nodes=num_nodes, executor=executor)
 
 
-def do_kwaits():
-    do_waits("kpid", kpid_monitor_count)
+def run_ktools_orchestrator(model_run_dir_path, script_lines, trace_file_path=None, chrome_trace_file_path=None):
+    """
+    Runs ktools script lines with the ktools orchestrator in the model run
+    directory and, if trace file paths are given, writes the trace of the
+    run (see ``OasisKtoolsOrchestrator.get_trace``) as JSON and/or as a
+    Chrome trace - also if the run fails.
+    """
+    orchestrator = OasisKtoolsOrchestrator.create(
+        model_run_dir_path,
+        script_lines=script_lines,
+        trace=bool(trace_file_path or chrome_trace_file_path)
+    )
+    try:
+        orchestrator.run()
+    finally:
+        if trace_file_path:
+            orchestrator.write_trace(trace_file_path)
+        if chrome_trace_file_path:
+            orchestrator.write_chrome_trace(chrome_trace_file_path)
+
+
+def run_ktools_partitions(
+        model_run_dir_path,
+        script_builder,
+        transport,
+        gather_script_path,
+        executor='bash',
+        max_retries=0,
+        resume=False,
+        trace_file_path=None,
+        chrome_trace_file_path=None
+    ):
+    """
+    Runs the ktools processes (partitions) of a model run separately with a
+    ktools transport, e.g. on several nodes, and then completes the run in
+    the model run directory with the gather script (the ``kat``,
+    ``aalsummary`` and ``leccalc`` steps), which is written to the given
+    path and run with the given executor.
+
+    Each partition is marked complete (see
+    ``OasisKtoolsPartitionCheckpoints``) as soon as its output files are in
+    the model run directory, and failed partitions are run again, up to
+    ``max_retries`` times, before the run fails. If ``resume`` is set then
+    the work files of an earlier run are kept and the partitions it
+    completed are skipped. The gather script is traced if trace file paths
+    are given (see ``run_ktools_orchestrator``), but only with the
+    ``python`` executor.
+    """
+    logger = logging.getLogger()
+
+    # The work folder may be a link to a scratch volume (see
+    # ``OasisKtoolsScratchSpace``), in which case its target is cleared
+    work_path = os.path.realpath(os.path.join(model_run_dir_path, 'work'))
+    if not resume and os.path.exists(work_path):
+        shutil.rmtree(work_path)
+    if not os.path.exists(work_path):
+        os.mkdir(work_path)
+
+    checkpoints = OasisKtoolsPartitionCheckpoints.create(model_run_dir_path)
+
+    partitions = []
+    for process_id in range(1, script_builder.max_process_id + 1):
+        partition = (
+            process_id,
+            script_builder.build_partition(process_id),
+            script_builder.get_partition_output_file_paths(process_id)
+        )
+        if resume and checkpoints.is_complete(*partition):
+            logger.info('ktools partition {} already complete - skipping'.format(process_id))
+            continue
+        partitions.append(partition)
 
+    retries = 0
+    while partitions:
+        try:
+            transport.run_partitions(model_run_dir_path, partitions)
+            error, failed_process_ids = None, []
+        except OasisKtoolsPartitionsError as e:
+            error, failed_process_ids = e, e.process_ids or [p for p, _, _ in partitions]
+        except OasisException as e:
+            error, failed_process_ids = e, [p for p, _, _ in partitions]
+
+        for partition in partitions:
+            if partition[0] not in failed_process_ids:
+                checkpoints.mark_complete(*partition)
+
+        partitions = [partition for partition in partitions if partition[0] in failed_process_ids]
+        if partitions:
+            if retries >= max_retries:
+                raise error
+            retries += 1
+            logger.warning(
+                'Retrying ktools partitions {} (retry {} of {})'.format(
+                    ', '.join(str(p) for p, _, _ in partitions), retries, max_retries
+                )
+            )
 
-def get_getmodel_cmd(
-        process_id_, max_process_id,
-        number_of_samples, gul_threshold,
-        use_random_number_file,
-        coverage_output, item_output):
-    #pylint: disable=I0011, W0613
-    cmd = "getmodel | gulcalc -S{} -L{}".format(number_of_samples, gul_threshold)
+    gather_script_lines = script_builder.write(gather_script_path, lines=script_builder.build_gather())
 
-    if use_random_number_file:
-        cmd = cmd + " -r"
-    if coverage_output != "":
-        cmd = cmd + " -c {}".format(coverage_output)
-    if item_output != "":
-        cmd = cmd + " -i {}".format(item_output)
+    if executor == 'python':
+        run_ktools_orchestrator(
+            model_run_dir_path,
+            gather_script_lines,
+            trace_file_path=trace_file_path,
+            chrome_trace_file_path=chrome_trace_file_path
+        )
+    else:
+        subprocess.check_call(['bash', gather_script_path], cwd=model_run_dir_path, stderr=subprocess.STDOUT)
 
-    return cmd
+    checkpoints.clear()
 
 
-@oasis_log_utils.oasis_log()
-def genbash(
-        max_process_id=None,
-        analysis_settings=None,
-        output_filename=None,
-        get_getmodel_cmd=get_getmodel_cmd
-    ):
+def get_binary_oasis_files(oasis_files_paths, binary_files_path):
     """
-    Generates a bash script containing ktools calculation instructions for an
-    Oasis model, provided its analysis settings JSON file, the number of processes
-    to use, and the path and name of the output script.
+    Places the ktools binary Oasis files (``items.bin``, ``coverages.bin``,
+    ``gulsummaryxref.bin``) written directly by the exposures manager (see
+    the ``oasis_files_format`` option in ``generate_oasis_files.py``) in
+    the model run inputs folder ``binary_files_path``, taking each from the
+    first of ``oasis_files_paths`` in which it is found - files in the run
+    directory are moved, others are copied. A binary file which is older
+    than the CSV file beside it (e.g. ``items.csv`` for ``items.bin``) is
+    left over from an earlier generation of the Oasis files, and is not
+    used. Returns ``True`` if all the binary files were found, in which
+    case the CSV -> binary conversion can be skipped, and ``False``
+    otherwise.
     """
-    #pylint: disable=I0011, W0621
-    global pid_monitor_count
-    pid_monitor_count = 0
-    global apid_monitor_count
-    apid_monitor_count = 0
-    global lpid_monitor_count
-    lpid_monitor_count = 0
-    global kpid_monitor_count
-    kpid_monitor_count = 0
-
-    global command_file
-    command_file = output_filename
-
-    gul_threshold = 0
-    number_of_samples = 0
-    use_random_number_file = False
-    gul_output = False
-    il_output = False
-
-    if "gul_threshold" in analysis_settings:
-        gul_threshold = analysis_settings["gul_threshold"]
-
-    if "number_of_samples" in analysis_settings:
-        number_of_samples = analysis_settings["number_of_samples"]
-
-    if "model_settings" in analysis_settings:
-        if "use_random_number_file" in analysis_settings["model_settings"]:
-            if analysis_settings["model_settings"]["use_random_number_file"]:
-                use_random_number_file = True
-
-    if "gul_output" in analysis_settings:
-        gul_output = analysis_settings["gul_output"]
-
-    if "il_output" in analysis_settings:
-        il_output = analysis_settings["il_output"]
-
-    print_command("#!/bin/bash")
-
-    print_command("")
-
-    print_command("rm -R -f output/*")
-    print_command("rm -R -f fifo/*")
-    print_command("rm -R -f work/*")
-    print_command("")
-
-    print_command("mkdir work/kat")
-
-    if gul_output:
-        do_gul_make_fifo(analysis_settings, max_process_id)
-        create_workfolders("gul", analysis_settings)
-
-    print_command("")
-
-    if il_output:
-        do_il_make_fifo(analysis_settings, max_process_id)
-        create_workfolders("il", analysis_settings)
-
-    print_command("")
-    print_command("# --- Do insured loss computes ---")
-    print_command("")
-    if il_output:
-        do_il(analysis_settings, max_process_id)
-
-    print_command("")
-    print_command("# --- Do ground up loss  computes ---")
-    print_command("")
-    if gul_output:
-        do_gul(analysis_settings, max_process_id)
-
-    print_command("")
-
-    for process_id in range(1, max_process_id + 1):
-        if gul_output and il_output:
-            getmodel_cmd = get_getmodel_cmd(
-                process_id, max_process_id,
-                number_of_samples, gul_threshold, use_random_number_file,
-                "fifo/gul_P{}".format(process_id),
-                "-")
-            print_command(
-                "eve {0} {1} | {2} | fmcalc > fifo/il_P{0}  &".format(
-                    process_id, max_process_id, getmodel_cmd))
+    binary_file_names = ['items.bin', 'coverages.bin', 'gulsummaryxref.bin']
 
+    def is_current(binary_file_path):
+        csv_file_path = '{}.csv'.format(os.path.splitext(binary_file_path)[0])
+        if os.path.exists(csv_file_path) and os.path.getmtime(binary_file_path) < os.path.getmtime(csv_file_path):
+            logging.getLogger().warning(
+                'Not using the ktools binary file {} - it is older than {}'.format(binary_file_path, csv_file_path)
+            )
+            return False
+        return True
+
+    sources = {}
+    for fn in binary_file_names:
+        paths = [
+            os.path.join(p, fn) for p in oasis_files_paths
+            if os.path.exists(os.path.join(p, fn)) and is_current(os.path.join(p, fn))
+        ]
+        if not paths:
+            return False
+        sources[fn] = paths[0]
+
+    for fn, src in sources.items():
+        dst = os.path.join(binary_files_path, fn)
+        if os.path.abspath(src) == os.path.abspath(dst):
+            continue
+        if os.path.abspath(src).startswith(os.path.abspath(binary_files_path) + os.path.sep):
+            shutil.move(src, dst)
         else:
-            #  Now the mainprocessing
-            if gul_output:
-                if "gul_summaries" in analysis_settings:
-                    getmodel_cmd = get_getmodel_cmd(
-                        process_id, max_process_id,
-                        number_of_samples, gul_threshold,
-                        use_random_number_file,
-                        "-",
-                        "")
-                    print_command(
-                        "eve {0} {1} | {2} > fifo/gul_P{0}  &".format(
-                            process_id, max_process_id, getmodel_cmd))
-
-            if il_output:
-                if "il_summaries" in analysis_settings:
-                    getmodel_cmd = get_getmodel_cmd(
-                        process_id, max_process_id,
-                        number_of_samples, gul_threshold,
-                        use_random_number_file,
-                        "",
-                        "-")
-                    print_command(
-                        "eve {0} {1} | {2} | fmcalc > fifo/il_P{0}  &".format(
-                            process_id, max_process_id, getmodel_cmd))
-
-    print_command("")
-
-    do_pwaits()
-
-    print_command("")
-    print_command("# --- Do insured loss kats ---")
-    print_command("")
-    if il_output:
-        do_kats("il", analysis_settings, max_process_id)
-
-
-    print_command("")
-    print_command("# --- Do ground up loss kats ---")
-    print_command("")
-    if gul_output:
-        do_kats("gul", analysis_settings, max_process_id)
-
-    do_kwaits()
-
-    print_command("")
-    do_post_wait_processing("il", analysis_settings)
-    do_post_wait_processing("gul", analysis_settings)
-
-    do_awaits()    # waits for aalcalc
-    do_lwaits()    # waits for leccalc
-
-    if gul_output:
-        do_gul_remove_fifo(analysis_settings, max_process_id)
-        remove_workfolders("gul", analysis_settings)
-
-    print_command("")
-
-    if il_output:
-        do_il_remove_fifo(analysis_settings, max_process_id)
-        remove_workfolders("il", analysis_settings)
+            shutil.copy2(src, dst)
+
+    return True
 
 
 SCRIPT_ARGS_METADICT = {
@@ -720,11 +640,147 @@ SCRIPT_ARGS_METADICT = {
     'ktools_num_processes': {
         'name': 'ktools_num_processes',
         'flag': 'n',
+        'type': str,
+        'help_text': 'Number of ktools calculation processes to use, or `auto` to choose it from the host and the model run',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'calibrate_ktools': {
+        'name': 'calibrate_ktools',
+        'dest': 'calibrate_ktools',
+        'type': bool,
+        'default': True,
+        'help_text': 'Whether the `auto` number of ktools calculation processes may be calibrated with a short run on a sample of the events',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_process_budget': {
+        'name': 'ktools_process_budget',
+        'flag': 'B',
         'type': int,
-        'help_text': 'Number of ktools calculation processes to use',
+        'help_text': 'Maximum number of concurrent ktools processes - summary set outputs are deferred and batched to keep within it',
         'required_on_command_line': False,
         'required_for_script': False
     },
+    'ktools_executor': {
+        'name': 'ktools_executor',
+        'flag': 'E',
+        'type': str,
+        'help_text': 'ktools script executor: choices are `bash` (default) and `python` (in-process ktools orchestrator)',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_transport': {
+        'name': 'ktools_transport',
+        'flag': 'T',
+        'type': str,
+        'help_text': 'Transport for running the ktools calculation processes on several nodes: `local` (local multi-process stand-in) or the full path of a transport class',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_num_nodes': {
+        'name': 'ktools_num_nodes',
+        'flag': 'N',
+        'type': int,
+        'help_text': 'Number of nodes for the ktools transport - by default the number of ktools calculation processes',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_partition_retries': {
+        'name': 'ktools_partition_retries',
+        'flag': 'R',
+        'type': int,
+        'help_text': 'Number of times to retry failed ktools calculation processes (partitions) - by default 0',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'resume_ktools_run': {
+        'name': 'resume_ktools_run',
+        'dest': 'resume_ktools_run',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to resume the ktools run in the model run directory, skipping the ktools calculation processes (partitions) it completed',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'trace_ktools': {
+        'name': 'trace_ktools',
+        'dest': 'trace_ktools',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to trace the ktools processes (timings, CPU time, peak RSS on Linux and bytes read and written) and write the trace to `ktools_trace.json` in the model run directory',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'chrome_trace_ktools': {
+        'name': 'chrome_trace_ktools',
+        'dest': 'chrome_trace_ktools',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to also write the ktools trace as a Chrome trace to `ktools_trace_chrome.json` in the model run directory',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'balance_event_partitions': {
+        'name': 'balance_event_partitions',
+        'dest': 'balance_event_partitions',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to partition the events between the ktools calculation processes by estimated cost (from the model footprint and the portfolio) instead of by number with eve',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'pin_ktools_partitions': {
+        'name': 'pin_ktools_partitions',
+        'dest': 'pin_ktools_partitions',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to pin the ktools calculation processes (partitions) to core sets and NUMA nodes, spread evenly across the sockets, and write the layout to `ktools_cpu_layout.json` in the model run directory',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_scratch_dir_path': {
+        'name': 'ktools_scratch_dir_path',
+        'flag': 'S',
+        'type': str,
+        'help_text': 'Scratch directory (e.g. `/dev/shm` or a local disk) for the ktools fifo and work folders, so that only the output files are written to the model run directory',
+        'required_on_command_line': False,
+        'required_for_script': False,
+        'preexists': False
+    },
+    'ktools_scratch_min_free_mb': {
+        'name': 'ktools_scratch_min_free_mb',
+        'flag': 'F',
+        'type': int,
+        'help_text': 'Minimum free space (MB) of the ktools scratch directory for using it - by default 1024',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_work_codec': {
+        'name': 'ktools_work_codec',
+        'flag': 'C',
+        'type': str,
+        'help_text': 'Codec for compressing the ktools leccalc work files - `lz4`, `zstd` or `gzip` - by default the work files are not compressed',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_gul_stream_mode': {
+        'name': 'ktools_gul_stream_mode',
+        'flag': 'M',
+        'type': str,
+        'help_text': 'GUL stream mode - `capture` to write the gulcalc streams to the GUL stream directory, or `replay` to run fmcalc and summarycalc from the captured streams without getmodel and gulcalc',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_gul_stream_dir_path': {
+        'name': 'ktools_gul_stream_dir_path',
+        'flag': 'G',
+        'type': str,
+        'help_text': 'GUL stream directory - by default `gul_stream` in the model run directory',
+        'required_on_command_line': False,
+        'required_for_script': False,
+        'preexists': False
+    },
     'execute': {
         'name': 'execute',
         'dest': 'execute',
@@ -790,10 +846,13 @@ if __name__ == '__main__':
             args['model_data_path']
         )
 
-        logger.info('Converting Oasis files to ktools binary files')
         oasis_files_path = os.path.join(model_run_dir_path, 'input', 'csv')
         binary_files_path = os.path.join(model_run_dir_path, 'input')
-        create_binary_files(oasis_files_path, binary_files_path)
+        if get_binary_oasis_files([oasis_files_path, args['oasis_files_path']], binary_files_path):
+            logger.info('Using ktools binary files generated with the Oasis files - skipping conversion')
+        else:
+            logger.info('Converting Oasis files to ktools binary files')
+            create_binary_files(oasis_files_path, binary_files_path)
 
         analysis_settings_json_file_path = os.path.join(model_run_dir_path, 'analysis_settings.json')
         try:
@@ -816,16 +875,173 @@ if __name__ == '__main__':
         )
         ktools_script_path = os.path.join(model_run_dir_path, '{}.sh'.format(ktools_script_name))
 
+        ktools_gul_stream_mode = (
+            args['ktools_gul_stream_mode'] if 'ktools_gul_stream_mode' in args and args['ktools_gul_stream_mode']
+            else None
+        )
+        if ktools_gul_stream_mode is not None and ktools_gul_stream_mode not in OasisKtoolsGulStream.modes:
+            raise OasisException(
+                'Invalid GUL stream mode {} - choices are {}'.format(
+                    ktools_gul_stream_mode, ', '.join('`{}`'.format(m) for m in OasisKtoolsGulStream.modes)
+                )
+            )
+        ktools_gul_stream_dir_path = (
+            args['ktools_gul_stream_dir_path'] if 'ktools_gul_stream_dir_path' in args and args['ktools_gul_stream_dir_path']
+            else os.path.join(model_run_dir_path, 'gul_stream')
+        )
+
+        ktools_gul_stream = None
+        if ktools_gul_stream_mode == 'replay':
+            ktools_gul_stream = OasisKtoolsGulStream.create(ktools_gul_stream_dir_path, 'replay')
+            ktools_gul_stream.load(model_run_dir_path, analysis_settings)
+            if ktools_gul_stream.codec and not OasisKtoolsScriptBuilder.is_work_codec_available(ktools_gul_stream.codec):
+                raise OasisException(
+                    'Cannot replay the GUL streams in {} - the {} command line tool is not installed'.format(
+                        ktools_gul_stream.gul_stream_dir_path, ktools_gul_stream.codec
+                    )
+                )
+            logger.info(
+                'Replaying the GUL streams in {} - using the {} ktools calculation processes of the capture'.format(
+                    ktools_gul_stream.gul_stream_dir_path, ktools_gul_stream.num_processes
+                )
+            )
+
+        ktools_process_budget = (
+            args['ktools_process_budget'] if 'ktools_process_budget' in args and args['ktools_process_budget']
+            else None
+        )
+        if ktools_process_budget is not None and ktools_process_budget < 1:
+            raise OasisException('Invalid ktools process budget {} - should be a positive integer'.format(ktools_process_budget))
+
+        ktools_partition_retries = (
+            args['ktools_partition_retries'] if 'ktools_partition_retries' in args and args['ktools_partition_retries']
+            else 0
+        )
+        resume_ktools_run = 'resume_ktools_run' in args and args['resume_ktools_run']
+
+        partitioned = bool(
+            ('ktools_transport' in args and args['ktools_transport']) or
+            ktools_partition_retries > 0 or
+            resume_ktools_run
+        )
+
         ktools_num_processes = (
             args['ktools_num_processes'] if 'ktools_num_processes' in args and args['ktools_num_processes']
             else 2
         )
+        if ktools_gul_stream is not None:
+            ktools_num_processes = ktools_gul_stream.num_processes
+        elif ktools_num_processes == 'auto':
+            logger.info('Planning the number of ktools calculation processes')
+            # the process budget only applies to unpartitioned runs, and the
+            # partitions of a remote transport run on its nodes - by default
+            # a node each
+            tuner_num_nodes = 1
+            if 'ktools_transport' in args and args['ktools_transport'] and args['ktools_transport'] != 'local':
+                tuner_num_nodes = (
+                    args['ktools_num_nodes'] if 'ktools_num_nodes' in args and args['ktools_num_nodes']
+                    else None
+                )
+            tuner = OasisKtoolsProcessTuner.create(
+                model_run_dir_path,
+                analysis_settings,
+                calibrate=('calibrate_ktools' not in args or args['calibrate_ktools'] != False),
+                max_num_processes=(None if partitioned else ktools_process_budget),
+                num_nodes=tuner_num_nodes
+            )
+            ktools_plan = tuner.plan()
+            ktools_plan_file_path = os.path.join(model_run_dir_path, 'ktools_plan.json')
+            tuner.write_plan(ktools_plan, ktools_plan_file_path)
+            for reason in ktools_plan['reasons']:
+                logger.info('ktools plan: {}'.format(reason))
+            logger.info('ktools plan written to {}'.format(ktools_plan_file_path))
+            ktools_num_processes = ktools_plan['num_processes']
+        else:
+            try:
+                ktools_num_processes = int(ktools_num_processes)
+                if ktools_num_processes < 1:
+                    raise ValueError
+            except ValueError:
+                raise OasisException(
+                    'Invalid number of ktools calculation processes {} - should be a positive integer or `auto`'.format(ktools_num_processes)
+                )
+
+        ktools_executor = (
+            args['ktools_executor'] if 'ktools_executor' in args and args['ktools_executor']
+            else 'bash'
+        )
+        if ktools_executor not in ['bash', 'python']:
+            raise OasisException('Invalid ktools script executor {} - choices are `bash` and `python`'.format(ktools_executor))
+
+        chrome_trace_ktools = 'chrome_trace_ktools' in args and args['chrome_trace_ktools']
+        trace_ktools = ('trace_ktools' in args and args['trace_ktools']) or chrome_trace_ktools
+        if trace_ktools and ktools_executor != 'python':
+            logger.info('Tracing the ktools run - using the ktools orchestrator as the ktools script executor')
+            ktools_executor = 'python'
+        ktools_trace_file_path = os.path.join(model_run_dir_path, 'ktools_trace.json') if trace_ktools else None
+        ktools_chrome_trace_file_path = (
+            os.path.join(model_run_dir_path, 'ktools_trace_chrome.json') if chrome_trace_ktools else None
+        )
+
+        event_partition_file_paths = None
+        if 'balance_event_partitions' in args and args['balance_event_partitions']:
+            logger.info('Planning load-balanced event partitions')
+            try:
+                event_partition_file_paths = OasisEventPartitionPlanner.create(model_run_dir_path).write_partitions(ktools_num_processes)
+            except OasisException as e:
+                logger.warning('Could not plan event partitions - using eve: {}'.format(str(e)))
+
+        ktools_pin_cmds = None
+        if 'pin_ktools_partitions' in args and args['pin_ktools_partitions']:
+            if 'ktools_transport' in args and args['ktools_transport'] and args['ktools_transport'] != 'local':
+                logger.warning(
+                    'Not pinning the ktools partitions - the ktools transport {} runs them on other hosts'.format(args['ktools_transport'])
+                )
+            else:
+                logger.info('Laying out the ktools partitions on the cores and NUMA nodes of the host')
+                try:
+                    cpu_layout = OasisKtoolsCpuLayout.create()
+                    ktools_cpu_layout = cpu_layout.plan(ktools_num_processes)
+                    ktools_cpu_layout_file_path = os.path.join(model_run_dir_path, 'ktools_cpu_layout.json')
+                    cpu_layout.write_layout(ktools_cpu_layout, ktools_cpu_layout_file_path)
+                    ktools_pin_cmds = cpu_layout.get_pin_cmds(ktools_cpu_layout)
+                    for partition_layout, pin_cmd in zip(ktools_cpu_layout, ktools_pin_cmds):
+                        logger.info('ktools partition {}: {}'.format(partition_layout['process_id'], pin_cmd))
+                    logger.info('ktools CPU layout written to {}'.format(ktools_cpu_layout_file_path))
+                except OasisException as e:
+                    logger.warning('Could not pin the ktools partitions: {}'.format(str(e)))
+
+        ktools_work_codec = (
+            args['ktools_work_codec'] if 'ktools_work_codec' in args and args['ktools_work_codec']
+            else None
+        )
+        if ktools_work_codec is not None:
+            if ktools_work_codec not in OasisKtoolsScriptBuilder.work_codecs:
+                raise OasisException(
+                    'Invalid ktools work file codec {} - choices are {}'.format(
+                        ktools_work_codec, ', '.join('`{}`'.format(c) for c in sorted(OasisKtoolsScriptBuilder.work_codecs))
+                    )
+                )
+            if not OasisKtoolsScriptBuilder.is_work_codec_available(ktools_work_codec):
+                logger.warning('Not compressing the ktools work files - the {} command line tool is not installed'.format(ktools_work_codec))
+                ktools_work_codec = None
+
+        if ktools_gul_stream_mode == 'capture':
+            ktools_gul_stream = OasisKtoolsGulStream.create(ktools_gul_stream_dir_path, 'capture', codec=ktools_work_codec)
+            ktools_gul_stream.prepare()
+            logger.info('Capturing the GUL streams to {}'.format(ktools_gul_stream.gul_stream_dir_path))
+
         try:
             logger.info('Generating ktools losses script')
-            genbash(
+            ktools_script_lines = genbash(
                 max_process_id=ktools_num_processes,
                 analysis_settings=analysis_settings,
-                output_filename=ktools_script_path
+                output_filename=ktools_script_path,
+                event_partition_file_paths=event_partition_file_paths,
+                max_num_processes=ktools_process_budget,
+                pin_cmds=ktools_pin_cmds,
+                work_codec=ktools_work_codec,
+                gul_stream=ktools_gul_stream
             )
         except Exception as e:
             raise OasisException(e)
@@ -844,13 +1060,130 @@ if __name__ == '__main__':
         except KeyError:
             pass
 
+        ktools_scratch_space = None
+        if 'ktools_scratch_dir_path' in args and args['ktools_scratch_dir_path']:
+            ktools_scratch_min_free_mb = (
+                args['ktools_scratch_min_free_mb'] if 'ktools_scratch_min_free_mb' in args and args['ktools_scratch_min_free_mb']
+                else None
+            )
+            try:
+                ktools_scratch_space = OasisKtoolsScratchSpace.create(
+                    model_run_dir_path,
+                    args['ktools_scratch_dir_path'],
+                    min_free_mb=ktools_scratch_min_free_mb
+                )
+                logger.info('Placing the ktools fifo and work folders in {}'.format(ktools_scratch_space.place()))
+            except OasisException as e:
+                logger.warning('Not using the ktools scratch directory - the ktools folders are in the model run directory: {}'.format(str(e)))
+                ktools_scratch_space = None
+
+        # the builder of the scripts which are run, for the sizes of their
+        # compressed work files
+        ktools_script_builder = OasisKtoolsScriptBuilder.create(
+            analysis_settings,
+            ktools_num_processes,
+            event_partition_file_paths=event_partition_file_paths,
+            max_num_processes=(None if partitioned else ktools_process_budget),
+            pin_cmds=ktools_pin_cmds,
+            work_codec=ktools_work_codec,
+            gul_stream=ktools_gul_stream
+        )
+        ktools_work_codec_stats_file_path = os.path.join(os.path.abspath(model_run_dir_path), 'ktools_work_codec.json')
+        # the bash executor runs the script from the model run directory
+        model_run_dir_abs_path = os.path.abspath(model_run_dir_path)
+
+        ktools_run_completed = False
+        ktools_run_start_time = time.time()
         try:
-            os.chdir(model_run_dir_path)
-            cmd_str = "bash {}.sh".format(ktools_script_name)
-            logger.info('Running ktools losses script {}'.format(ktools_script_path))
-            subprocess.check_call(cmd_str, stderr=subprocess.STDOUT, shell=True)
-        except (OSError, IOError, subprocess.CalledProcessError) as e:
-            raise OasisException(e)
+            if partitioned:
+                ktools_transport = (
+                    args['ktools_transport'] if 'ktools_transport' in args and args['ktools_transport']
+                    else 'local'
+                )
+                ktools_num_nodes = (
+                    args['ktools_num_nodes'] if 'ktools_num_nodes' in args and args['ktools_num_nodes']
+                    else ktools_num_processes
+                )
+                logger.info(
+                    'Running {} ktools partitions on {} nodes with the {} transport'.format(
+                        ktools_num_processes, ktools_num_nodes, ktools_transport
+                    )
+                )
+                try:
+                    run_ktools_partitions(
+                        model_run_dir_path,
+                        ktools_script_builder,
+                        get_ktools_transport(
+                            ktools_transport,
+                            num_nodes=ktools_num_nodes,
+                            executor=ktools_executor,
+                            nodes_dir_path=(
+                                os.path.join(ktools_scratch_space.run_scratch_dir_path, 'nodes') if ktools_scratch_space is not None
+                                else None
+                            )
+                        ),
+                        os.path.join(model_run_dir_path, '{}_gather.sh'.format(ktools_script_name)),
+                        executor=ktools_executor,
+                        max_retries=ktools_partition_retries,
+                        resume=resume_ktools_run,
+                        trace_file_path=ktools_trace_file_path,
+                        chrome_trace_file_path=ktools_chrome_trace_file_path
+                    )
+                except (OSError, IOError, subprocess.CalledProcessError) as e:
+                    raise OasisException(e)
+            elif ktools_executor == 'python':
+                logger.info('Running ktools losses script {} with the ktools orchestrator'.format(ktools_script_path))
+                try:
+                    run_ktools_orchestrator(
+                        model_run_dir_path,
+                        ktools_script_lines,
+                        trace_file_path=ktools_trace_file_path,
+                        chrome_trace_file_path=ktools_chrome_trace_file_path
+                    )
+                except (OSError, IOError) as e:
+                    raise OasisException(e)
+            else:
+                try:
+                    os.chdir(model_run_dir_path)
+                    cmd_str = "bash {}.sh".format(ktools_script_name)
+                    logger.info('Running ktools losses script {}'.format(ktools_script_path))
+                    subprocess.check_call(cmd_str, stderr=subprocess.STDOUT, shell=True)
+                except (OSError, IOError, subprocess.CalledProcessError) as e:
+                    raise OasisException(e)
+            ktools_run_completed = True
+
+            if ktools_work_codec is not None:
+                work_codec_stats = ktools_script_builder.write_work_codec_stats(
+                    os.path.dirname(ktools_work_codec_stats_file_path),
+                    ktools_work_codec_stats_file_path,
+                    elapsed_time=(time.time() - ktools_run_start_time)
+                )
+                logger.info(
+                    'ktools work files compressed with {}: {} bytes into {} bytes (ratio {}) - written to {}'.format(
+                        ktools_work_codec,
+                        work_codec_stats['uncompressed_bytes'],
+                        work_codec_stats['compressed_bytes'],
+                        work_codec_stats['ratio'],
+                        ktools_work_codec_stats_file_path
+                    )
+                )
+
+            if ktools_gul_stream_mode == 'capture':
+                gul_stream_manifest = ktools_gul_stream.write_manifest(
+                    model_run_dir_abs_path, analysis_settings, ktools_num_processes
+                )
+                logger.info(
+                    'GUL streams captured: {} bytes in {} files - manifest written to {}'.format(
+                        sum(gul_stream_manifest['files'].values()),
+                        len(gul_stream_manifest['files']),
+                        ktools_gul_stream.manifest_file_path
+                    )
+                )
+        finally:
+            if ktools_scratch_space is not None:
+                # the work files of a failed partitioned run are kept for
+                # resuming it
+                ktools_scratch_space.release(keep_work=(partitioned and not ktools_run_completed))
 
         logger.info('Losses generated in {}'.format(os.path.join(model_run_dir_path, 'output')))
     except OasisException as e:
@@ -17,8 +17,18 @@ following arguments (in no particular order)
                               -b /path/to/source/to/canonical/exposures/transformation/file
                               -c /path/to/canonical/exposures/validation/file
                               -d /path/to/canonical/to/model/exposures/transformation/file
-                              -x /path/to/xtrans/executable
+                              [-x /path/to/xtrans/executable]
+                              [-g <exposures transformation engine - 'xtrans' or 'native'>]
+                              [-u /path/to/transformation/plans/cache/directory]
+                              [--stream_exposures]
                               [-o /path/to/oasis/files/directory]
+                              [-n <number of keys rows per chunk in streaming mode>]
+                              [-m <memory ceiling (MB) for the canonical exposures index in streaming mode>]
+                              [-t <Oasis files format - 'csv', 'bin' or 'both'>]
+                              [-w <number of keys lookup worker processes>]
+                              [-q /path/to/keys/lookup/cache/file]
+                              [-z <maximum number of keys lookup cache entries>]
+                              [-Q <comma-separated keys lookup cache columns>]
 
 When calling the script this way paths can be given relative to the
 script, in particular, file paths should include the filename and
@@ -29,6 +39,45 @@ model keys server repository. The path to the Oasis files directory is
 optional - by default the script will create a timestamped folder in
 ``omdk/runs`` with the prefix ``OasisFiles``.
 
+The following options are also optional:
+
+* ``-g``, ``-x`` - the exposures transformation engine and the path to
+  the ``xtrans`` executable. By default the source -> canonical and
+  canonical -> model exposures transformations are run by ``xtrans``,
+  and the ``xtrans`` path is required. With the ``native`` engine they
+  are run in process by a Python transformer, which falls back to
+  ``xtrans`` for transformation files it does not support.
+* ``--stream_exposures`` - with the ``native`` engine, runs the two
+  exposures transformations and the keys lookup as concurrent stages,
+  with each stage consuming the output of the previous stage chunk by
+  chunk as it is generated.
+* ``-u`` - the transformation plans cache directory. The native engine
+  compiles the transformation and validation files into transformation
+  plans, which are cached for the model - if a plans cache directory is
+  given then the plans are also saved to and reused from it in later
+  runs.
+* ``-n``, ``-m`` - the number of keys rows per chunk and the memory
+  ceiling (MB) of the canonical exposures index. If a chunk size is
+  given then the Oasis files are generated in streaming mode, with the
+  keys processed in chunks of this many rows and the files written chunk
+  by chunk, so that portfolios larger than memory can be processed. In
+  this mode the canonical exposures index is moved to disk if it grows
+  beyond the memory ceiling.
+* ``-t`` - the Oasis files format. By default the files are written as
+  CSV files (``csv``), and any ktools binary files of an earlier
+  generation are removed. They can also be written directly as ktools
+  binary files (``bin``), or in both formats (``both``), in which case
+  ``generate_losses.py`` skips the conversion of the CSV files to binary
+  files.
+* ``-w`` - the number of keys lookup worker processes. If it is greater
+  than 1 then the keys lookup is run in parallel in that many processes.
+* ``-q``, ``-z`` - the keys lookup cache file path and maximum number of
+  entries. If a cache file path is given then only locations which are
+  not in the (persistent) cache are sent to the lookup service.
+* ``-Q`` - the keys lookup cache columns, i.e. the location columns used
+  by the lookup. By default the cache is keyed by all the location
+  columns except the ID.
+
 It is also possible to run the script by defining these arguments in a
 JSON configuration file and calling the script using the path to this
 file using the option ``-f`` and the (relative or absolute) path to the
@@ -52,13 +101,43 @@ The JSON file contain the following keys (in no particular order)
     "canonical_exposures_validation_file_path"
     "canonical_to_model_exposures_transformation_file_path"
     "xtrans_path"
+    "transformation_engine"
+    "stream_exposures"
+    "transformation_plans_cache_path"
     "oasis_files_path"
-
-and the values of these keys should be string paths, given relative to
-the location of the JSON file. The JSON file is usually placed in the
-model keys server repository. The ``"oasis_files_path"`` key is optional
-- by default the script will create a timestamped folder in
-``omdk/runs`` with the prefix ``OasisFiles``.
+    "oasis_files_chunk_size"
+    "oasis_files_max_memory"
+    "oasis_files_format"
+    "keys_lookup_num_processes"
+    "keys_cache_path"
+    "keys_cache_max_entries"
+    "keys_cache_columns"
+
+and the values of the path-related keys should be string paths, given
+relative to the location of the JSON file. The JSON file is usually
+placed in the model keys server repository. The ``"oasis_files_path"``
+key is optional - by default the script will create a timestamped folder
+in ``omdk/runs`` with the prefix ``OasisFiles``.
+
+The following keys are also optional:
+
+* ``"transformation_engine"`` - by default the ``xtrans`` exposures
+  transformation engine is used, and the ``"xtrans_path"`` key is
+  required.
+* ``"stream_exposures"`` - by default the exposures transformations and
+  keys lookup are run in sequence.
+* ``"transformation_plans_cache_path"`` - by default transformation
+  plans are not cached between runs.
+* ``"oasis_files_chunk_size"`` and ``"oasis_files_max_memory"`` - by
+  default the Oasis files are generated in memory.
+* ``"oasis_files_format"`` - by default the Oasis files are written as
+  CSV files.
+* ``"keys_lookup_num_processes"`` - by default the keys lookup is run in
+  a single process.
+* ``"keys_cache_path"`` and ``"keys_cache_max_entries"`` - by default no
+  keys lookup cache is used.
+* ``"keys_cache_columns"`` - by default the keys lookup cache is keyed
+  by all the location columns except the ID.
 """
 
 # BSD 3-Clause License
@@ -206,11 +285,37 @@ SCRIPT_ARGS_METADICT = {
         'name': 'xtrans_path',
         'flag': 'x',
         'type': str,
-        'help_text': 'Path of the xtrans executable which performs the source -> canonical and canonical -> model exposures transformations',
+        'help_text': 'Path of the xtrans executable which performs the source -> canonical and canonical -> model exposures transformations - only required if the xtrans transformation engine is used',
         'required_on_command_line': False,
-        'required_for_script': True,
+        'required_for_script': False,
         'preexists': True
     },
+    'transformation_engine': {
+        'name': 'transformation_engine',
+        'flag': 'g',
+        'type': str,
+        'help_text': 'Exposures transformation engine: choices are `xtrans` (default) and `native` (in process)',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'transformation_plans_cache_path': {
+        'name': 'transformation_plans_cache_path',
+        'flag': 'u',
+        'type': str,
+        'help_text': 'Directory in which compiled exposures transformation plans are cached between runs',
+        'required_on_command_line': False,
+        'required_for_script': False,
+        'preexists': False
+    },
+    'stream_exposures': {
+        'name': 'stream_exposures',
+        'dest': 'stream_exposures',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to run the exposures transformations and keys lookup as concurrent streaming stages',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
     'oasis_files_path': {
         'name': 'oasis_files_path',
         'flag': 'o',
@@ -219,6 +324,63 @@ SCRIPT_ARGS_METADICT = {
         'required_on_command_line': False,
         'required_for_script': False,
         'preexists': False
+    },
+    'oasis_files_chunk_size': {
+        'name': 'oasis_files_chunk_size',
+        'flag': 'n',
+        'type': int,
+        'help_text': 'Number of keys rows per chunk for generating Oasis files in streaming mode - by default the files are generated in memory',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'oasis_files_max_memory': {
+        'name': 'oasis_files_max_memory',
+        'flag': 'm',
+        'type': int,
+        'help_text': 'Memory ceiling (MB) for the canonical exposures index in streaming mode, beyond which the index is moved to disk',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'oasis_files_format': {
+        'name': 'oasis_files_format',
+        'flag': 't',
+        'type': str,
+        'help_text': 'Oasis files format: choices are `csv` (default), `bin` (ktools binary files) and `both`',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'keys_lookup_num_processes': {
+        'name': 'keys_lookup_num_processes',
+        'flag': 'w',
+        'type': int,
+        'help_text': 'Number of worker processes for the keys lookup - by default the lookup is run in a single process',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'keys_cache_path': {
+        'name': 'keys_cache_path',
+        'flag': 'q',
+        'type': str,
+        'help_text': 'Path of a persistent keys lookup cache (SQLite) file - only locations not in the cache are looked up',
+        'required_on_command_line': False,
+        'required_for_script': False,
+        'preexists': False
+    },
+    'keys_cache_max_entries': {
+        'name': 'keys_cache_max_entries',
+        'flag': 'z',
+        'type': int,
+        'help_text': 'Maximum number of keys lookup cache entries, beyond which the least recently used entries are evicted',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'keys_cache_columns': {
+        'name': 'keys_cache_columns',
+        'flag': 'Q',
+        'type': str,
+        'help_text': 'Comma-separated location columns used by the keys lookup, which key the keys lookup cache - by default all the location columns except the ID',
+        'required_on_command_line': False,
+        'required_for_script': False
     }
 }
 
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisKeysLookupCache'
+]
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+if os.getcwd().split(os.path.sep)[-1] == 'keys':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+
+class OasisKeysLookupCache(object):
+    """
+    A persistent, size-bounded cache of keys lookup results, stored in a
+    SQLite database file. Entries are keyed by model key (supplier ID, model
+    ID and model version ID) and a hash of the location's attributes, and
+    hold all the keys records returned by the lookup service for a location
+    (including unsuccessful lookups). If a maximum number of entries is set
+    then the least recently used entries beyond this size are evicted by
+    `evict`, which is called once per lookup, after all its entries have
+    been stored.
+    """
+
+    def __init__(self, cache_file_path, max_entries=None):
+        self._cache_file_path = os.path.abspath(cache_file_path)
+        self._max_entries = int(max_entries) if max_entries else None
+
+        try:
+            self._db = sqlite3.connect(self._cache_file_path)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS keys_lookup_cache ('
+                'model_key TEXT NOT NULL, '
+                'location_hash TEXT NOT NULL, '
+                'records TEXT NOT NULL, '
+                'last_used REAL NOT NULL, '
+                'PRIMARY KEY (model_key, location_hash))'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS keys_lookup_cache_last_used ON keys_lookup_cache (last_used)'
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            raise OasisException('Error opening keys lookup cache {}: {}'.format(self._cache_file_path, str(e)))
+
+
+    def __repr__(self):
+        return '{}: {}'.format(self.__class__, self.__dict__)
+
+
+    @property
+    def cache_file_path(self):
+        """
+        Keys lookup cache file path property.
+
+            :getter: Gets the cache file path
+        """
+        return self._cache_file_path
+
+
+    @property
+    def max_entries(self):
+        """
+        Keys lookup cache maximum number of entries property.
+
+            :getter: Gets the maximum number of entries (``None`` if unbounded)
+        """
+        return self._max_entries
+
+
+    @classmethod
+    def get_model_key(cls, model_info):
+        """
+        Returns the model key for a model info dict (as returned by
+        ``OasisKeysLookupFactory.get_model_info``), in the same format as the
+        ``OasisModel`` key, ``<supplier ID>/<model ID>/<model version ID>``.
+        """
+        return '{}/{}/{}'.format(model_info['supplier_id'], model_info['model_id'], model_info['model_version_id'])
+
+
+    @classmethod
+    def get_location_hashes(cls, loc_df, columns=None, loc_id_column='id'):
+        """
+        Returns a list of the hashes of the given locations (rows of the
+        model exposures dataframe ``loc_df``), in row order. By default the
+        hash is computed from all the location columns except the location
+        ID column, so that the same location under a different ID in a later
+        run still hits the cache - a subset of columns, i.e. the ones used by
+        the lookup, can be given instead with ``columns``. The values are
+        normalised before they are hashed (see ``get_hash_value``).
+        """
+        columns = sorted(c.lower() for c in columns) if columns else sorted(c for c in loc_df.columns if c != loc_id_column)
+
+        missing = [c for c in columns if c not in loc_df.columns]
+        if missing:
+            raise OasisException('Keys lookup cache columns not in the model exposures: {}'.format(', '.join(missing)))
+
+        prefix = u'\x1e'.join(columns)
+
+        return [
+            hashlib.sha1(
+                u'\x1e'.join([prefix] + [cls.get_hash_value(v) for v in row]).encode('utf-8')
+            ).hexdigest()
+            for row in loc_df[columns].values.tolist()
+        ]
+
+
+    @staticmethod
+    def get_hash_value(value):
+        """
+        Returns the string which is hashed for a location attribute value.
+        Integral floats are given as integers and missing values (``NaN``)
+        as ``None``, so that a column which is read as floats from one file
+        (e.g. because it has missing values) and as integers from another
+        gives the same hashes.
+        """
+        if isinstance(value, float):
+            if value != value:
+                return u'None'
+            if value.is_integer():
+                return u'{}'.format(int(value))
+        return u'{}'.format(value)
+
+
+    def get(self, model_key, location_hashes, batch_size=500):
+        """
+        Returns a dict of the cached keys records for the given model key and
+        location hashes, keyed by location hash - hashes not in the cache are
+        not in the dict. The cache hits are marked as used.
+        """
+        hits = {}
+        location_hashes = list(set(location_hashes))
+        now = time.time()
+
+        try:
+            for i in range(0, len(location_hashes), batch_size):
+                batch = location_hashes[i:i + batch_size]
+                params = ','.join('?' * len(batch))
+
+                rows = self._db.execute(
+                    'SELECT location_hash, records FROM keys_lookup_cache '
+                    'WHERE model_key = ? AND location_hash IN ({})'.format(params),
+                    [model_key] + batch
+                ).fetchall()
+                if not rows:
+                    continue
+
+                hits.update((h, json.loads(records)) for h, records in rows)
+
+                self._db.execute(
+                    'UPDATE keys_lookup_cache SET last_used = ? '
+                    'WHERE model_key = ? AND location_hash IN ({})'.format(','.join('?' * len(rows))),
+                    [now, model_key] + [h for h, _ in rows]
+                )
+            self._db.commit()
+        except sqlite3.Error as e:
+            raise OasisException('Error reading keys lookup cache {}: {}'.format(self._cache_file_path, str(e)))
+
+        return hits
+
+
+    def put(self, model_key, entries):
+        """
+        Stores an iterable of ``(location hash, keys records)`` pairs in the
+        cache for the given model key. The cache is not evicted here, as the
+        entry count is a full table scan - `evict` should be called once all
+        the entries for a lookup have been stored.
+        """
+        now = time.time()
+
+        try:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO keys_lookup_cache (model_key, location_hash, records, last_used) '
+                'VALUES (?, ?, ?, ?)',
+                (
+                    (model_key, h, json.dumps(records, default=lambda o: o.item() if hasattr(o, 'item') else str(o)), now)
+                    for h, records in entries
+                )
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            raise OasisException('Error writing keys lookup cache {}: {}'.format(self._cache_file_path, str(e)))
+
+
+    def evict(self):
+        """
+        Evicts the least recently used entries beyond the maximum cache size,
+        if one is set. Returns the number of entries evicted.
+        """
+        if not self._max_entries:
+            return 0
+
+        try:
+            n = self._db.execute('SELECT COUNT(*) FROM keys_lookup_cache').fetchone()[0] - self._max_entries
+            if n <= 0:
+                return 0
+
+            self._db.execute(
+                'DELETE FROM keys_lookup_cache WHERE rowid IN '
+                '(SELECT rowid FROM keys_lookup_cache ORDER BY last_used LIMIT ?)',
+                (n,)
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            raise OasisException('Error evicting keys lookup cache {} entries: {}'.format(self._cache_file_path, str(e)))
+
+        return n
+
+
+    def close(self):
+        """
+        Closes the cache database connection.
+        """
+        self._db.close()
@@ -38,6 +38,9 @@ import csv
 import io
 import json
 import importlib
+import itertools
+import multiprocessing
+import numpy as np
 import os
 import pandas as pd
 import sys
@@ -47,6 +50,36 @@ if os.getcwd().split(os.path.sep)[-1] == 'keys':
 
 from oasis_utils import OasisException
 
+from OasisKeysLookupCache import OasisKeysLookupCache
+
+
+_worker_lookup = None
+
+
+def _init_keys_lookup_worker(model_keys_data_path, model_version_file_path, lookup_package_path):
+    """
+    Keys lookup process pool initializer - creates the lookup service
+    instance once per worker process.
+    """
+    global _worker_lookup
+    _, _worker_lookup = OasisKeysLookupFactory.create(
+        model_keys_data_path=model_keys_data_path,
+        model_version_file_path=model_version_file_path,
+        lookup_package_path=lookup_package_path
+    )
+
+
+def _get_keys_lookup_worker_records(args):
+    """
+    Keys lookup process pool task - runs the worker's lookup service
+    instance on a partition of the model exposures and returns the records
+    as a list.
+    """
+    loc_df, success_only = args
+    return list(OasisKeysLookupFactory.filter_keys_records(
+        _worker_lookup.process_locations(loc_df), success_only=success_only
+    ))
+
 
 class OasisKeysLookupFactory(object):
     """
@@ -118,6 +151,34 @@ class OasisKeysLookupFactory(object):
         return loc_df
 
 
+    @classmethod
+    def get_model_exposures_frames(cls, model_exposures_chunks):
+        """
+        Generates model exposures dataframes from an iterable of chunks of
+        model exposures - strings with the contents of a model exposures
+        file, each with the header. The chunks are parsed with the column
+        types of the first non-empty chunk, so that a column has the same
+        type in all the dataframes, unless a chunk's values do not fit these
+        types (e.g. missing values in an integer column), in which case its
+        types are inferred.
+        """
+        dtype = None
+
+        for model_exposures in model_exposures_chunks:
+            try:
+                loc_df = pd.read_csv(io.StringIO(model_exposures), dtype=dtype)
+            except (TypeError, ValueError):
+                loc_df = pd.read_csv(io.StringIO(model_exposures))
+
+            if dtype is None and len(loc_df):
+                dtype = loc_df.dtypes.to_dict()
+
+            loc_df = loc_df.where(loc_df.notnull(), None)
+            loc_df.columns = map(str.lower, loc_df.columns)
+
+            yield loc_df
+
+
     @classmethod
     def write_oasis_keys_file(cls, records, output_file_path):
         """
@@ -174,13 +235,229 @@ class OasisKeysLookupFactory(object):
         return model_info, klc
 
 
+    @classmethod
+    def filter_keys_records(cls, record_containers, success_only=True):
+        """
+        Generates keys records from an iterable of the record containers
+        (single records or lists/tuples/sets of records) yielded by a lookup
+        service's ``process_locations`` method, optionally filtering out
+        records with unsuccessful lookups.
+        """
+        for record_container in record_containers:
+            if type(record_container) in [list, tuple, set]:
+                for r in record_container:
+                    if success_only:
+                        if r['status'].lower() == 'success':
+                            yield r
+                    else:
+                        yield r
+            elif type(record_container) == dict:
+                if success_only:
+                    if record_container['status'].lower() == 'success':
+                        yield record_container
+                else:
+                    yield record_container
+
+
+    @classmethod
+    def get_keys_lookup_pool(
+        cls,
+        model_keys_data_path=None,
+        model_version_file_path=None,
+        lookup_package_path=None,
+        num_processes=2
+    ):
+        """
+        Returns a pool of ``num_processes`` keys lookup worker processes. Each
+        worker creates its own instance of the lookup service once, using the
+        `create` method and the given model keys data, model version file and
+        lookup package paths.
+        """
+        if not all([model_keys_data_path, model_version_file_path, lookup_package_path]):
+            raise OasisException(
+                'The model keys data, model version file and lookup package paths are '
+                'required for a parallel keys lookup'
+            )
+
+        return multiprocessing.Pool(
+            processes=num_processes,
+            initializer=_init_keys_lookup_worker,
+            initargs=tuple(map(os.path.abspath, [model_keys_data_path, model_version_file_path, lookup_package_path]))
+        )
+
+
+    @classmethod
+    def get_keys_pooled(cls, pool, model_loc_df, success_only=True, num_partitions=8):
+        """
+        Generates keys records for the given model exposures dataframe using
+        a pool of keys lookup worker processes (see `get_keys_lookup_pool`).
+        The exposures are split into ``num_partitions`` contiguous partitions,
+        and the records for each partition are yielded in partition order, so
+        the record order is the same as for a single process lookup.
+        """
+        num_partitions = max(min(len(model_loc_df), num_partitions), 1)
+        partitions = [
+            model_loc_df.iloc[indices] for indices in np.array_split(np.arange(len(model_loc_df)), num_partitions)
+        ]
+
+        try:
+            for records in pool.imap(_get_keys_lookup_worker_records, [(p, success_only) for p in partitions]):
+                for r in records:
+                    yield r
+        except Exception as e:
+            raise OasisException('Error in parallel keys lookup: {}'.format(str(e)))
+
+
+    @classmethod
+    def get_keys_parallel(
+        cls,
+        model_loc_df,
+        model_keys_data_path=None,
+        model_version_file_path=None,
+        lookup_package_path=None,
+        success_only=True,
+        num_processes=2,
+        partitions_per_process=4
+    ):
+        """
+        Generates keys records for the given model exposures dataframe, or
+        iterable of dataframes, using a pool of ``num_processes`` worker
+        processes (see `get_keys_lookup_pool`), which is created once for all
+        the dataframes. Each dataframe is split into
+        ``num_processes * partitions_per_process`` contiguous partitions (see
+        `get_keys_pooled`), so the record order is the same as for a single
+        process lookup.
+        """
+        model_loc_dfs = [model_loc_df] if isinstance(model_loc_df, pd.DataFrame) else model_loc_df
+
+        pool = cls.get_keys_lookup_pool(
+            model_keys_data_path=model_keys_data_path,
+            model_version_file_path=model_version_file_path,
+            lookup_package_path=lookup_package_path,
+            num_processes=num_processes
+        )
+        try:
+            for loc_df in model_loc_dfs:
+                for r in cls.get_keys_pooled(
+                    pool, loc_df, success_only=success_only, num_partitions=num_processes * partitions_per_process
+                ):
+                    yield r
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+    @classmethod
+    def get_keys_cached(
+        cls,
+        model_loc_df,
+        keys_cache_path,
+        keys_cache_max_entries=None,
+        lookup=None,
+        success_only=True,
+        num_processes=1,
+        model_keys_data_path=None,
+        model_version_file_path=None,
+        lookup_package_path=None,
+        cache_columns=None,
+        batch_size=100000
+    ):
+        """
+        Generates keys records for the given model exposures dataframe, or
+        iterable of dataframes, using the persistent keys lookup cache at
+        ``keys_cache_path`` (see ``OasisKeysLookupCache``), bounded by the
+        optional ``keys_cache_max_entries``. Cache entries are keyed by the
+        model key from the model version file (which is required) and a hash
+        of the location's attributes. The locations are processed in batches
+        of ``batch_size`` - in each batch only the locations which are not in
+        the cache are sent to the lookup service (run in a pool of worker
+        processes if ``num_processes`` is greater than 1, see
+        `get_keys_lookup_pool`), and their records are stored in the cache.
+        The records are yielded in location order, with the cached records
+        given the location IDs of the current exposures. The cache and the
+        worker pool are opened once for all the dataframes, and the cache is
+        only evicted once all the records have been stored.
+
+        The optional ``cache_columns`` argument is the list of location
+        columns to hash for the cache key - by default all columns except the
+        location ID are used.
+        """
+        if not model_version_file_path:
+            raise OasisException('The model version file path is required for a cached keys lookup')
+
+        model_key = OasisKeysLookupCache.get_model_key(cls.get_model_info(os.path.abspath(model_version_file_path)))
+
+        model_loc_dfs = [model_loc_df] if isinstance(model_loc_df, pd.DataFrame) else model_loc_df
+
+        cache = OasisKeysLookupCache(keys_cache_path, max_entries=keys_cache_max_entries)
+        pool = None
+        try:
+            if num_processes > 1:
+                pool = cls.get_keys_lookup_pool(
+                    model_keys_data_path=model_keys_data_path,
+                    model_version_file_path=model_version_file_path,
+                    lookup_package_path=lookup_package_path,
+                    num_processes=num_processes
+                )
+
+            for loc_df in model_loc_dfs:
+                for i in range(0, len(loc_df), batch_size):
+                    batch_df = loc_df.iloc[i:i + batch_size]
+                    loc_ids = batch_df['id'].tolist()
+                    hashes = cache.get_location_hashes(batch_df, columns=cache_columns)
+                    cached = cache.get(model_key, hashes)
+
+                    misses = [h not in cached for h in hashes]
+                    looked_up = {}
+
+                    if any(misses):
+                        miss_df = batch_df[misses]
+                        records = (
+                            cls.get_keys_pooled(pool, miss_df, success_only=False, num_partitions=num_processes * 4) if pool
+                            else cls.filter_keys_records(lookup.process_locations(miss_df), success_only=False)
+                        )
+                        for r in records:
+                            looked_up.setdefault(r['id'], []).append(r)
+
+                        cache.put(
+                            model_key,
+                            [(h, looked_up.get(loc_id, [])) for loc_id, h, miss in zip(loc_ids, hashes, misses) if miss]
+                        )
+
+                    for loc_id, h in zip(loc_ids, hashes):
+                        loc_records = (
+                            [dict(r, id=loc_id) for r in cached[h]] if h in cached
+                            else looked_up.get(loc_id, [])
+                        )
+                        for r in cls.filter_keys_records([loc_records], success_only=success_only):
+                            yield r
+
+            if pool:
+                pool.close()
+            cache.evict()
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+            cache.close()
+
+
     @classmethod
     def get_keys(
         cls,
         lookup=None,
         model_exposures=None,
         model_exposures_file_path=None,
-        success_only=True
+        success_only=True,
+        num_processes=1,
+        model_keys_data_path=None,
+        model_version_file_path=None,
+        lookup_package_path=None,
+        keys_cache_path=None,
+        keys_cache_max_entries=None,
+        keys_cache_columns=None,
+        model_exposures_chunks=None
     ):
         """
         Generates keys keys records (JSON) for the given model and supplier -
@@ -191,31 +468,78 @@ class OasisKeysLookupFactory(object):
         The optional keyword argument ``success_only`` indicates whether only
         records with successful lookups should be returned (default), or all
         records.
+
+        If ``num_processes`` is greater than 1 the lookup is run in parallel
+        in that many worker processes (see `get_keys_parallel`), in which
+        case the model keys data, model version file and lookup package paths
+        are also required, so that each worker can create its own lookup
+        service instance.
+
+        If a ``keys_cache_path`` is given then the lookup results are cached
+        in a persistent keys lookup cache at that path, bounded by the
+        optional ``keys_cache_max_entries``, and only the locations not in the
+        cache are looked up (see `get_keys_cached`). The cache is keyed by the
+        model key from the model version file, so the model version file path
+        is also required. The optional ``keys_cache_columns`` - a list of
+        location columns, or a string of comma-separated columns - are the
+        columns hashed for the cache key (by default all the columns except
+        the location ID).
+
+        The model exposures can also be given as an iterable of chunks
+        ``model_exposures_chunks`` - strings with the contents of a model
+        exposures file, each with the header (see
+        `get_model_exposures_frames`) - in which case the records are
+        generated chunk by chunk, and each chunk is only read when the
+        records of the previous chunks have been consumed. This allows the
+        lookup to start while the model exposures are still being generated.
+        The worker pool and the cache are shared by all the chunks.
         """
-        if not any([model_exposures, model_exposures_file_path]):
+        if model_exposures_chunks is None and not any([model_exposures, model_exposures_file_path]):
             raise OasisException('No model exposures provided')
 
-        model_loc_df = (
-            cls.get_model_exposures(
-                model_exposures_file_path=os.path.abspath(model_exposures_file_path)
-            ) if model_exposures_file_path
-            else cls.get_model_exposures(model_exposures=model_exposures)
-        )
-
-        for record_container in lookup.process_locations(model_loc_df):
-            if type(record_container) in [list, tuple, set]:
-                for r in record_container:
-                    if success_only:
-                        if r['status'].lower() == 'success':
-                            yield r
-                    else:
-                        yield r
-            elif type(record_container) == dict:
-                if success_only:
-                    if record_container['status'].lower() == 'success':
-                        yield record_container
-                else:
-                    yield record_container
+        if isinstance(keys_cache_columns, basestring):
+            keys_cache_columns = [c.strip() for c in keys_cache_columns.split(',') if c.strip()]
+
+        if model_exposures_chunks is not None:
+            model_loc_df = cls.get_model_exposures_frames(model_exposures_chunks)
+        elif model_exposures_file_path:
+            model_loc_df = cls.get_model_exposures(model_exposures_file_path=os.path.abspath(model_exposures_file_path))
+        else:
+            model_loc_df = cls.get_model_exposures(model_exposures=model_exposures)
+
+        num_processes = int(num_processes) if num_processes else 1
+
+        if keys_cache_path:
+            return cls.get_keys_cached(
+                model_loc_df,
+                keys_cache_path,
+                keys_cache_max_entries=keys_cache_max_entries,
+                lookup=lookup,
+                success_only=success_only,
+                num_processes=num_processes,
+                model_keys_data_path=model_keys_data_path,
+                model_version_file_path=model_version_file_path,
+                lookup_package_path=lookup_package_path,
+                cache_columns=keys_cache_columns
+            )
+
+        if num_processes > 1:
+            return cls.get_keys_parallel(
+                model_loc_df,
+                model_keys_data_path=model_keys_data_path,
+                model_version_file_path=model_version_file_path,
+                lookup_package_path=lookup_package_path,
+                success_only=success_only,
+                num_processes=num_processes
+            )
+
+        if model_exposures_chunks is not None:
+            return itertools.chain.from_iterable(
+                cls.filter_keys_records(lookup.process_locations(loc_df), success_only=success_only)
+                for loc_df in model_loc_df
+            )
+
+        return cls.filter_keys_records(lookup.process_locations(model_loc_df), success_only=success_only)
 
 
     @classmethod
@@ -226,7 +550,15 @@ class OasisKeysLookupFactory(object):
         model_exposures_file_path=None,
         success_only=True,
         output_file_path=None,
-        format='oasis_keys'
+        format='oasis_keys',
+        num_processes=1,
+        model_keys_data_path=None,
+        model_version_file_path=None,
+        lookup_package_path=None,
+        keys_cache_path=None,
+        keys_cache_max_entries=None,
+        keys_cache_columns=None,
+        model_exposures_chunks=None
     ):
         """
         Writes the keys keys records generated by the lookup service for the
@@ -241,13 +573,23 @@ class OasisKeysLookupFactory(object):
         records with successful lookups should be returned (default), or all
         records.
 
+        The optional keyword argument ``num_processes`` sets the number of
+        worker processes for the lookup - if greater than 1 the model keys
+        data, model version file and lookup package paths are also required
+        (see `get_keys`). The optional keyword arguments ``keys_cache_path``,
+        ``keys_cache_max_entries`` and ``keys_cache_columns`` set a
+        persistent keys lookup cache to use for the lookup, and the location
+        columns which key it (see `get_keys`). The model exposures can
+        also be given as an iterable of chunks ``model_exposures_chunks`` (see
+        `get_keys`), which are looked up and written chunk by chunk.
+
         Returns a pair ``(f, n)`` where ``f`` is the output file object
         and ``n`` is the number of records written to the file.
         """
         if not lookup:
             raise OasisException('No keys lookup service provided')
 
-        if not any([model_exposures, model_exposures_file_path]):
+        if not any([model_exposures, model_exposures_file_path]) and model_exposures_chunks is None:
             raise OasisException('No model exposures or model exposures file path provided')
 
         model_exposures_file_path = os.path.abspath(model_exposures_file_path) if model_exposures_file_path else None    
@@ -257,7 +599,15 @@ class OasisKeysLookupFactory(object):
             lookup=lookup,
             model_exposures=model_exposures,
             model_exposures_file_path=model_exposures_file_path,
-            success_only=success_only
+            success_only=success_only,
+            num_processes=num_processes,
+            model_keys_data_path=model_keys_data_path,
+            model_version_file_path=model_version_file_path,
+            lookup_package_path=lookup_package_path,
+            keys_cache_path=keys_cache_path,
+            keys_cache_max_entries=keys_cache_max_entries,
+            keys_cache_columns=keys_cache_columns,
+            model_exposures_chunks=model_exposures_chunks
         )
 
         if format == 'oasis_keys':
@@ -1 +1,2 @@
-from .OasisKeysLookupFactory import *
\ No newline at end of file
+from .OasisKeysLookupCache import *
+from .OasisKeysLookupFactory import *
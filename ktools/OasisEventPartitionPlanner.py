@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisEventPartitionPlanner'
+]
+
+import heapq
+import logging
+import os
+import sys
+
+import numpy as np
+
+if os.getcwd().split(os.path.sep)[-1] == 'ktools':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+
+class OasisEventPartitionPlanner(object):
+    """
+    Plans load-balanced partitions of the event set of a model run for the
+    ktools calculation processes, as an alternative to ``eve``, which
+    splits the events into partitions of equal numbers of events.
+
+    The cost of an event is estimated from the model footprint
+    (``static/footprint.idx`` and ``static/footprint.bin``) and the
+    portfolio's area perils in ``input/items.bin`` - each footprint row of
+    the event in an area peril of the portfolio costs the number of items
+    in that area peril, as ``getmodel`` and ``gulcalc`` produce outputs for
+    every item of every area peril hit by the event, plus a fixed cost per
+    event. The events (``input/events.bin``) are then assigned to
+    partitions greedily, most expensive first, each to the partition with
+    the lowest total cost so far, and each partition is written as a
+    ktools event stream (``int32`` event IDs, in ascending order) which can
+    be fed to ``getmodel`` in place of the output of ``eve``.
+
+    Only uncompressed footprints are supported.
+    """
+
+    footprint_header_dtype = np.dtype([
+        ('num_intensity_bins', '<i4'),
+        ('has_intensity_uncertainty', '<i4')
+    ])
+
+    footprint_row_dtype = np.dtype([
+        ('areaperil_id', '<u4'),
+        ('intensity_bin_id', '<i4'),
+        ('probability', '<f4')
+    ])
+
+    # The footprint index records are written by ktools either packed (20
+    # bytes) or with the event ID padded to 8 bytes (24 bytes)
+    footprint_index_dtypes = [
+        np.dtype([('event_id', '<i4'), ('offset', '<i8'), ('size', '<i8')]),
+        np.dtype({'names': ['event_id', 'offset', 'size'], 'formats': ['<i4', '<i8', '<i8'], 'offsets': [0, 8, 16]})
+    ]
+
+    items_dtype = np.dtype([
+        ('item_id', '<i4'),
+        ('coverage_id', '<i4'),
+        ('areaperil_id', '<u4'),
+        ('vulnerability_id', '<i4'),
+        ('group_id', '<i4')
+    ])
+
+    event_cost = 1.0
+
+    block_rows = 1 << 22
+
+    def __init__(self, model_run_dir_path):
+        self._model_run_dir_path = model_run_dir_path
+        self.logger = logging.getLogger()
+
+
+    @classmethod
+    def create(cls, model_run_dir_path):
+        return cls(model_run_dir_path=model_run_dir_path)
+
+
+    @property
+    def model_run_dir_path(self):
+        """
+        Model run directory path property - getter only.
+
+            :getter: Gets the model run directory path
+        """
+        return self._model_run_dir_path
+
+
+    def _get_file_path(self, *candidates):
+        for fp in candidates:
+            fp = os.path.join(self._model_run_dir_path, fp)
+            if os.path.exists(fp):
+                return fp
+        raise OasisException(
+            'Event partitioning requires {} in the model run directory {}'.format(
+                ' or '.join(candidates), self._model_run_dir_path
+            )
+        )
+
+
+    def get_event_ids(self):
+        """
+        Returns the event IDs of the model run event set
+        (``input/events.bin``, or ``static/events.bin``).
+        """
+        return np.fromfile(self._get_file_path(os.path.join('input', 'events.bin'), os.path.join('static', 'events.bin')), dtype='<i4')
+
+
+    def get_portfolio_areaperils(self):
+        """
+        Returns the (sorted) area peril IDs of the portfolio items
+        (``input/items.bin``) and the number of items in each.
+        """
+        items = np.fromfile(self._get_file_path(os.path.join('input', 'items.bin')), dtype=self.items_dtype)
+        return np.unique(items['areaperil_id'], return_counts=True)
+
+
+    def get_footprint_index(self):
+        """
+        Returns the footprint index (``static/footprint.idx``) records -
+        event ID, byte offset in ``static/footprint.bin`` and byte size of
+        the footprint of each event - sorted by offset.
+        """
+        static_path = os.path.join(self._model_run_dir_path, 'static')
+        if (
+            not os.path.exists(os.path.join(static_path, 'footprint.idx')) and
+            os.path.exists(os.path.join(static_path, 'footprint.idx.z'))
+        ):
+            raise OasisException('Event partitioning does not support compressed footprints (footprint.bin.z)')
+
+        index_fp = self._get_file_path(os.path.join('static', 'footprint.idx'))
+        footprint_size = os.path.getsize(self._get_file_path(os.path.join('static', 'footprint.bin')))
+        index_size = os.path.getsize(index_fp)
+
+        for dtype in self.footprint_index_dtypes:
+            if index_size % dtype.itemsize:
+                continue
+            index = np.fromfile(index_fp, dtype=dtype)
+            if not len(index):
+                return index
+            index = index[np.argsort(index['offset'], kind='mergesort')]
+            starts = index['offset'] - self.footprint_header_dtype.itemsize
+            if (
+                (index['event_id'] > 0).all() and
+                (starts >= 0).all() and
+                not (starts % self.footprint_row_dtype.itemsize).any() and
+                not (index['size'] % self.footprint_row_dtype.itemsize).any() and
+                (index['offset'] + index['size'] <= footprint_size).all()
+            ):
+                return index
+
+        raise OasisException('Invalid or unsupported footprint index file {}'.format(index_fp))
+
+
+    def get_event_costs(self, event_ids=None):
+        """
+        Returns the estimated costs of the given events (by default the
+        events of the model run event set), as an array of floats.
+        """
+        event_ids = self.get_event_ids() if event_ids is None else np.asarray(event_ids, dtype='<i4')
+        areaperil_ids, item_counts = self.get_portfolio_areaperils()
+        index = self.get_footprint_index()
+
+        costs = np.full(len(event_ids), self.event_cost)
+        if not len(index) or not index['size'].any() or not len(areaperil_ids) or not len(event_ids):
+            return costs
+
+        rows = np.memmap(
+            self._get_file_path(os.path.join('static', 'footprint.bin')),
+            dtype=self.footprint_row_dtype,
+            mode='r',
+            offset=self.footprint_header_dtype.itemsize
+        )
+
+        starts = (index['offset'] - self.footprint_header_dtype.itemsize) // self.footprint_row_dtype.itemsize
+        ends = starts + index['size'] // self.footprint_row_dtype.itemsize
+        event_row_costs = np.zeros(len(index))
+
+        # The footprint is read in blocks of (about) ``block_rows`` rows,
+        # each a run of consecutive events in the file
+        i = 0
+        while i < len(index):
+            j = i + 1 + np.searchsorted(ends[i + 1:], starts[i] + self.block_rows, side='right')
+            j = min(max(j, i + 1), len(index))
+            base = starts[i]
+            block = rows[base:max(ends[i:j].max(), base)]['areaperil_id']
+            pos = np.searchsorted(areaperil_ids, block)
+            pos[pos == len(areaperil_ids)] = 0
+            weights = np.where(areaperil_ids[pos] == block, item_counts[pos], 0)
+            cumulative = np.concatenate([[0], np.cumsum(weights)])
+            event_row_costs[i:j] = cumulative[ends[i:j] - base] - cumulative[starts[i:j] - base]
+            i = j
+
+        order = np.argsort(index['event_id'], kind='mergesort')
+        pos = np.searchsorted(index['event_id'][order], event_ids)
+        pos[pos == len(order)] = 0
+        found = index['event_id'][order][pos] == event_ids
+        costs[found] += event_row_costs[order][pos][found]
+
+        return costs
+
+
+    def plan(self, num_partitions, event_ids=None, costs=None):
+        """
+        Returns the given number of event partitions - arrays of event IDs,
+        in ascending order - of the given events (by default the events of
+        the model run event set), balanced by estimated cost.
+        """
+        if num_partitions < 1:
+            raise OasisException('Invalid number of event partitions: {}'.format(num_partitions))
+
+        event_ids = self.get_event_ids() if event_ids is None else np.asarray(event_ids, dtype='<i4')
+        costs = self.get_event_costs(event_ids) if costs is None else np.asarray(costs, dtype=float)
+
+        loads = [(0.0, p) for p in range(num_partitions)]
+        assignments = np.empty(len(event_ids), dtype=np.int64)
+        for k in np.lexsort((event_ids, -costs)):
+            load, p = heapq.heappop(loads)
+            assignments[k] = p
+            heapq.heappush(loads, (load + costs[k], p))
+
+        partition_costs = np.bincount(assignments, weights=costs, minlength=num_partitions)
+        if len(event_ids):
+            self.logger.info(
+                'Planned {} event partitions of {} events - estimated partition costs {:.0f} (min) {:.0f} (mean) {:.0f} (max)'.format(
+                    num_partitions, len(event_ids),
+                    partition_costs.min(), partition_costs.mean(), partition_costs.max()
+                )
+            )
+
+        return [np.sort(event_ids[assignments == p]) for p in range(num_partitions)]
+
+
+    def write_partitions(self, num_partitions, partitions_dir_path=os.path.join('input', 'event_partitions')):
+        """
+        Plans the given number of event partitions of the model run event
+        set and writes them as ktools event streams ``events_P<n>.bin`` in
+        the given folder (relative to the model run directory). Returns the
+        file paths, relative to the model run directory, in process order.
+        """
+        partitions = self.plan(num_partitions)
+
+        abs_partitions_dir_path = os.path.join(self._model_run_dir_path, partitions_dir_path)
+        if not os.path.exists(abs_partitions_dir_path):
+            os.makedirs(abs_partitions_dir_path)
+
+        file_paths = []
+        for p, event_ids in enumerate(partitions, 1):
+            fp = os.path.join(partitions_dir_path, 'events_P{}.bin'.format(p))
+            event_ids.astype('<i4').tofile(os.path.join(self._model_run_dir_path, fp))
+            file_paths.append(fp)
+
+        return file_paths
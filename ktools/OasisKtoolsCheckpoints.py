@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisKtoolsPartitionCheckpoints'
+]
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+
+if os.getcwd().split(os.path.sep)[-1] == 'ktools':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+
+class OasisKtoolsPartitionCheckpoints(object):
+    """
+    Checkpoints of the ktools processes (partitions) of a model run which
+    are run separately (see ``OasisKtoolsScriptBuilder.build_partition``).
+    When all the output files of a partition are in the model run directory
+    the partition is marked complete by a checkpoint file
+    (``work/checkpoints/P<n>.json`` by default), which records a
+    fingerprint of the partition script and the sizes of the output files.
+    The checkpoint file is written to a temporary file first and then
+    renamed, so a partition is either marked complete or it is not, even if
+    the run is killed while marking it.
+
+    A partition is complete if its checkpoint file exists, the fingerprint
+    matches that of its current script and output files, and the output
+    files are still there with the recorded sizes - so a resumed run can
+    skip the complete partitions and only run the others.
+    """
+
+    def __init__(self, model_run_dir_path, checkpoints_dir_path=os.path.join('work', 'checkpoints')):
+        self._model_run_dir_path = model_run_dir_path
+        self._checkpoints_dir_path = os.path.join(model_run_dir_path, checkpoints_dir_path)
+
+
+    @classmethod
+    def create(cls, model_run_dir_path, checkpoints_dir_path=os.path.join('work', 'checkpoints')):
+        return cls(model_run_dir_path, checkpoints_dir_path=checkpoints_dir_path)
+
+
+    @property
+    def checkpoints_dir_path(self):
+        """
+        Checkpoints directory path property - getter only.
+
+            :getter: Gets the path of the directory of the checkpoint files
+        """
+        return self._checkpoints_dir_path
+
+
+    @staticmethod
+    def get_fingerprint(script_lines, output_file_paths):
+        """
+        Returns the fingerprint (a SHA-1 hex digest) of a partition, from the
+        lines of its script and the paths of its output files.
+        """
+        h = hashlib.sha1()
+        for l in list(script_lines) + [''] + list(output_file_paths):
+            h.update(u'{}\n'.format(l).encode('utf-8'))
+        return h.hexdigest()
+
+
+    def get_checkpoint_file_path(self, process_id):
+        return os.path.join(self._checkpoints_dir_path, 'P{}.json'.format(process_id))
+
+
+    def is_complete(self, process_id, script_lines, output_file_paths):
+        """
+        Checks whether a partition has been marked complete, and whether its
+        output files are still as they were when it was marked.
+        """
+        try:
+            with io.open(self.get_checkpoint_file_path(process_id), 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+
+        if checkpoint.get('fingerprint') != self.get_fingerprint(script_lines, output_file_paths):
+            return False
+
+        file_sizes = checkpoint.get('file_sizes') or {}
+        for fp in output_file_paths:
+            try:
+                if os.path.getsize(os.path.join(self._model_run_dir_path, fp)) != file_sizes.get(fp):
+                    return False
+            except OSError:
+                return False
+
+        return True
+
+
+    def mark_complete(self, process_id, script_lines, output_file_paths):
+        """
+        Marks a partition complete - all its output files must be in the
+        model run directory.
+        """
+        try:
+            file_sizes = dict(
+                (fp, os.path.getsize(os.path.join(self._model_run_dir_path, fp))) for fp in output_file_paths
+            )
+        except OSError as e:
+            raise OasisException('Cannot mark ktools partition {} complete - missing output file: {}'.format(process_id, str(e)))
+
+        if not os.path.exists(self._checkpoints_dir_path):
+            os.makedirs(self._checkpoints_dir_path)
+
+        checkpoint_file_path = self.get_checkpoint_file_path(process_id)
+        tmp_file_path = '{}.tmp'.format(checkpoint_file_path)
+        with io.open(tmp_file_path, 'w', encoding='utf-8') as f:
+            f.write(u'{}'.format(json.dumps(
+                {
+                    'process_id': process_id,
+                    'fingerprint': self.get_fingerprint(script_lines, output_file_paths),
+                    'file_sizes': file_sizes
+                },
+                indent=4,
+                sort_keys=True
+            )))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_file_path, checkpoint_file_path)
+
+
+    def clear(self):
+        """
+        Removes all the checkpoints, e.g. when the run is complete.
+        """
+        if os.path.exists(self._checkpoints_dir_path):
+            shutil.rmtree(self._checkpoints_dir_path)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisKtoolsCpuLayout'
+]
+
+import glob
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+
+if os.getcwd().split(os.path.sep)[-1] == 'ktools':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+
+class OasisKtoolsCpuLayout(object):
+    """
+    Lays out the ktools calculation processes (partitions) of a model run
+    on the cores and NUMA nodes of the host, so that the whole chain of a
+    partition - ``eve -> getmodel -> gulcalc -> fmcalc -> summarycalc`` and
+    its ``tee`` and output processes - can be pinned to a core set and
+    allocate its memory on a NUMA node, and is not moved between sockets by
+    the scheduler.
+
+    The NUMA nodes and their cores are read from
+    ``/sys/devices/system/node`` (only the cores available to this process
+    are used) - if the host has no NUMA information then all the available
+    cores are taken as a single node. The partitions are spread round-robin
+    across the nodes, and the cores of a node are split evenly between the
+    partitions on it - if a node has at least as many partitions as cores
+    then its partitions share all its cores, so that the processes of a
+    chain are not confined to a single core.
+
+    A partition's commands are pinned by prefixing them with ``numactl``
+    (cores, and preferring the memory of the node - allocations fall back
+    to other nodes when it is full) or, if ``numactl`` is not installed,
+    ``taskset`` (cores only) - see ``get_pin_cmds``.
+    """
+
+    numa_nodes_path = '/sys/devices/system/node'
+
+    pin_tools = ['numactl', 'taskset']
+
+    def __init__(self, numa_nodes=None, pin_tool=None):
+        self._numa_nodes = numa_nodes if numa_nodes is not None else self.get_numa_nodes()
+        self._pin_tool = pin_tool or self.get_pin_tool()
+        if not self._numa_nodes:
+            raise OasisException('No cores found for laying out the ktools processes')
+        if self._pin_tool not in self.pin_tools:
+            raise OasisException(
+                'No CPU pinning tool found for the ktools processes - install one of {}'.format(', '.join(self.pin_tools))
+            )
+
+
+    @classmethod
+    def create(cls, numa_nodes=None, pin_tool=None):
+        return cls(numa_nodes=numa_nodes, pin_tool=pin_tool)
+
+
+    @property
+    def numa_nodes(self):
+        """
+        NUMA nodes property - getter only.
+
+            :getter: Gets the NUMA nodes of the host as a dict of node ID
+                     to the sorted list of the node's (available) core IDs
+        """
+        return self._numa_nodes
+
+
+    @property
+    def pin_tool(self):
+        """
+        Pinning tool property - getter only.
+
+            :getter: Gets the command used to pin the ktools processes -
+                     ``numactl`` or ``taskset``
+        """
+        return self._pin_tool
+
+
+    @staticmethod
+    def parse_cpu_list(cpu_list):
+        """
+        Returns the core IDs of a Linux CPU list string, e.g. ``0-3,8``.
+        """
+        cpus = []
+        for part in cpu_list.strip().split(','):
+            if not part:
+                continue
+            if '-' in part:
+                first, last = part.split('-')
+                cpus.extend(range(int(first), int(last) + 1))
+            else:
+                cpus.append(int(part))
+        return cpus
+
+
+    @staticmethod
+    def format_cpu_list(cpus):
+        """
+        Returns a Linux CPU list string, e.g. ``0-3,8``, of core IDs.
+        """
+        ranges = []
+        for cpu in sorted(set(cpus)):
+            if ranges and cpu == ranges[-1][1] + 1:
+                ranges[-1][1] = cpu
+            else:
+                ranges.append([cpu, cpu])
+        return ','.join(
+            '{}'.format(first) if first == last else '{}-{}'.format(first, last)
+            for first, last in ranges
+        )
+
+
+    @classmethod
+    def get_numa_nodes(cls):
+        """
+        Returns the NUMA nodes of the host as a dict of node ID to the sorted
+        list of the node's core IDs which are available to this process.
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            available_cpus = set(os.sched_getaffinity(0))
+        else:
+            available_cpus = set(range(multiprocessing.cpu_count()))
+
+        numa_nodes = {}
+        for node_path in glob.glob(os.path.join(cls.numa_nodes_path, 'node[0-9]*')):
+            m = re.match(r'^node(\d+)$', os.path.basename(node_path))
+            if not m:
+                continue
+            try:
+                with io.open(os.path.join(node_path, 'cpulist'), 'r', encoding='utf-8') as f:
+                    cpus = [cpu for cpu in cls.parse_cpu_list(f.read()) if cpu in available_cpus]
+            except (IOError, OSError, ValueError):
+                continue
+            if cpus:
+                numa_nodes[int(m.group(1))] = sorted(cpus)
+
+        if not numa_nodes:
+            numa_nodes[0] = sorted(available_cpus)
+        return numa_nodes
+
+
+    @classmethod
+    def get_pin_tool(cls):
+        """
+        Returns the first pinning tool (``numactl`` or ``taskset``) found on
+        the ``PATH``, or ``None``.
+        """
+        for tool in cls.pin_tools:
+            for path in os.environ.get('PATH', '').split(os.pathsep):
+                if path and os.access(os.path.join(path, tool), os.X_OK):
+                    return tool
+        return None
+
+
+    def plan(self, num_partitions):
+        """
+        Returns the layout of the given number of partitions, as a list of
+        dicts, in partition order, of the partition (process) ID, the NUMA
+        node and the core IDs of each partition.
+        """
+        node_ids = sorted(self._numa_nodes)
+        node_partitions = dict((node_id, []) for node_id in node_ids)
+        for process_id in range(1, num_partitions + 1):
+            node_partitions[node_ids[(process_id - 1) % len(node_ids)]].append(process_id)
+
+        layout = {}
+        for node_id, process_ids in node_partitions.items():
+            cpus = self._numa_nodes[node_id]
+            for i, process_id in enumerate(process_ids):
+                if len(process_ids) >= len(cpus):
+                    partition_cpus = list(cpus)
+                else:
+                    partition_cpus = cpus[i * len(cpus) // len(process_ids):(i + 1) * len(cpus) // len(process_ids)]
+                layout[process_id] = {
+                    'process_id': process_id,
+                    'numa_node': node_id,
+                    'cpus': partition_cpus
+                }
+        return [layout[process_id] for process_id in range(1, num_partitions + 1)]
+
+
+    def get_pin_cmd(self, partition_layout):
+        """
+        Returns the command prefix which pins a command to the cores of a
+        partition (and, with ``numactl``, prefers the memory of its NUMA
+        node).
+        """
+        cpu_list = self.format_cpu_list(partition_layout['cpus'])
+        if self._pin_tool == 'numactl':
+            return 'numactl --physcpubind={} --preferred={}'.format(cpu_list, partition_layout['numa_node'])
+        return 'taskset -c {}'.format(cpu_list)
+
+
+    def get_pin_cmds(self, layout):
+        """
+        Returns the command prefixes of the partitions of a layout (see
+        ``plan``), in partition order - these can be given to the
+        ``OasisKtoolsScriptBuilder``.
+        """
+        return [self.get_pin_cmd(partition_layout) for partition_layout in layout]
+
+
+    def write_layout(self, layout, layout_file_path):
+        """
+        Writes a layout (see ``plan``) to a JSON file, with the NUMA nodes
+        of the host, the pinning tool and the pinning command of each
+        partition.
+        """
+        with io.open(layout_file_path, 'w', encoding='utf-8') as f:
+            f.write(u'{}'.format(json.dumps(
+                {
+                    'numa_nodes': dict(('{}'.format(node_id), cpus) for node_id, cpus in self._numa_nodes.items()),
+                    'pin_tool': self._pin_tool,
+                    'partitions': [
+                        dict(partition_layout, pin_cmd=self.get_pin_cmd(partition_layout))
+                        for partition_layout in layout
+                    ]
+                },
+                indent=4,
+                sort_keys=True
+            )))
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisKtoolsGulStream'
+]
+
+import hashlib
+import io
+import json
+import os
+import sys
+
+if os.getcwd().split(os.path.sep)[-1] == 'ktools':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+from OasisKtoolsScriptBuilder import OasisKtoolsScriptBuilder
+
+
+class OasisKtoolsGulStream(object):
+    """
+    The captured ground up loss (GUL) streams of a model run - the item
+    and coverage streams written by ``gulcalc`` for each calculation
+    process (partition) - which can be replayed into ``fmcalc`` and
+    ``summarycalc`` by later runs with other financial terms or summary
+    options, without running ``eve``, ``getmodel`` and ``gulcalc`` again
+    (see ``OasisKtoolsScriptBuilder``).
+
+    A capture run writes the streams of each process to
+    ``P<n>_items.bin`` and ``P<n>_coverages.bin`` in the GUL stream
+    directory, compressed with one of the work file codecs of
+    ``OasisKtoolsScriptBuilder`` (``work_codecs``) if a codec is given, as
+    they are computed, and when the run is complete writes a manifest
+    (``gul_stream.json``) with the number of processes, the codec, the
+    sizes of the stream files and the settings and inputs which determine
+    the streams - the number of samples, the GUL threshold, the model
+    settings of the analysis settings, and digests of the model run's
+    ``items.bin``, ``coverages.bin`` and ``events.bin``. A replay run reads
+    the manifest (see ``load``) and fails if the streams are incomplete or
+    were captured with other settings or inputs - a replay run has the
+    number of processes of the capture run.
+    """
+
+    modes = ['capture', 'replay']
+
+    streams = ['items', 'coverages']
+
+    manifest_file_name = 'gul_stream.json'
+
+    # The model run input files which determine the GUL streams
+    input_file_names = ['items.bin', 'coverages.bin', 'events.bin']
+
+    def __init__(self, gul_stream_dir_path, mode, codec=None):
+        if mode not in self.modes:
+            raise OasisException(
+                'Invalid GUL stream mode {} - choices are {}'.format(mode, ', '.join('`{}`'.format(m) for m in self.modes))
+            )
+        if codec and codec not in OasisKtoolsScriptBuilder.work_codecs:
+            raise OasisException(
+                'Invalid GUL stream codec {} - choices are {}'.format(codec, ', '.join(sorted(OasisKtoolsScriptBuilder.work_codecs)))
+            )
+        self._gul_stream_dir_path = os.path.abspath(gul_stream_dir_path)
+        self._mode = mode
+        self._codec = codec or None
+        self._num_processes = None
+
+
+    @classmethod
+    def create(cls, gul_stream_dir_path, mode, codec=None):
+        return cls(gul_stream_dir_path, mode, codec=codec)
+
+
+    @property
+    def gul_stream_dir_path(self):
+        """
+        GUL stream directory path property - getter only.
+
+            :getter: Gets the path of the directory of the stream files and
+                     the manifest
+        """
+        return self._gul_stream_dir_path
+
+
+    @property
+    def mode(self):
+        """
+        Mode property - getter only.
+
+            :getter: Gets the mode - ``capture`` or ``replay``
+        """
+        return self._mode
+
+
+    @property
+    def codec(self):
+        """
+        Codec property - getter only.
+
+            :getter: Gets the name of the codec of the stream files (see
+                     ``OasisKtoolsScriptBuilder.work_codecs``), or ``None``
+                     if they are not compressed - for replay, as read from
+                     the manifest
+        """
+        return self._codec
+
+
+    @property
+    def num_processes(self):
+        """
+        Number of processes property - getter only.
+
+            :getter: Gets the number of calculation processes of the
+                     captured streams (once the manifest has been read, for
+                     replay), or ``None``
+        """
+        return self._num_processes
+
+
+    @property
+    def manifest_file_path(self):
+        """
+        Manifest file path property - getter only.
+
+            :getter: Gets the path of the manifest of the captured streams
+        """
+        return os.path.join(self._gul_stream_dir_path, self.manifest_file_name)
+
+
+    def get_file_path(self, process_id, stream):
+        """
+        Returns the path of the file of a stream (``items`` or
+        ``coverages``) of a process.
+        """
+        file_name = 'P{}_{}.bin'.format(process_id, stream)
+        if self._codec:
+            file_name = '{}.{}'.format(file_name, OasisKtoolsScriptBuilder.work_codecs[self._codec][2])
+        return os.path.join(self._gul_stream_dir_path, file_name)
+
+
+    @staticmethod
+    def get_gul_settings(analysis_settings):
+        """
+        Returns the analysis settings which determine the GUL streams - the
+        number of samples, the GUL threshold and the model settings.
+        """
+        return {
+            'number_of_samples': analysis_settings.get('number_of_samples', 0),
+            'gul_threshold': analysis_settings.get('gul_threshold', 0),
+            'model_settings': analysis_settings.get('model_settings', {})
+        }
+
+
+    def get_input_digests(self, model_run_dir_path):
+        """
+        Returns the MD5 digests of the model run input files which determine
+        the GUL streams, by file name - ``None`` for a missing file.
+        """
+        digests = {}
+        for file_name in self.input_file_names:
+            file_path = os.path.join(model_run_dir_path, 'input', file_name)
+            if not os.path.exists(file_path):
+                digests[file_name] = None
+                continue
+            md5 = hashlib.md5()
+            with io.open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    md5.update(chunk)
+            digests[file_name] = md5.hexdigest()
+        return digests
+
+
+    def prepare(self):
+        """
+        Prepares the GUL stream directory for a capture run - creates it if
+        it does not exist, and removes the manifest of an earlier capture,
+        so that the streams are not replayed until the capture is complete.
+        """
+        try:
+            if not os.path.exists(self._gul_stream_dir_path):
+                os.makedirs(self._gul_stream_dir_path)
+            if os.path.exists(self.manifest_file_path):
+                os.remove(self.manifest_file_path)
+        except OSError as e:
+            raise OasisException('Error preparing the GUL stream directory {}: {}'.format(self._gul_stream_dir_path, e))
+
+
+    def write_manifest(self, model_run_dir_path, analysis_settings, num_processes):
+        """
+        Writes the manifest of the streams captured by a complete capture run
+        with the given analysis settings and number of processes, and
+        returns it as a dict.
+        """
+        self._num_processes = num_processes
+        files = {}
+        for process_id in range(1, num_processes + 1):
+            for stream in self.streams:
+                file_path = self.get_file_path(process_id, stream)
+                if not os.path.exists(file_path):
+                    raise OasisException('GUL stream file {} was not written by the capture run'.format(file_path))
+                files[os.path.basename(file_path)] = os.path.getsize(file_path)
+        manifest = {
+            'num_processes': num_processes,
+            'codec': self._codec,
+            'gul_settings': self.get_gul_settings(analysis_settings),
+            'inputs': self.get_input_digests(model_run_dir_path),
+            'files': files
+        }
+        with io.open(self.manifest_file_path, 'w', encoding='utf-8') as f:
+            f.write(u'{}'.format(json.dumps(manifest, indent=4, sort_keys=True)))
+        return manifest
+
+
+    def load(self, model_run_dir_path, analysis_settings):
+        """
+        Reads the manifest of captured streams for a replay run with the
+        given analysis settings in the given model run directory, which sets
+        the codec and number of processes of the streams, and checks that
+        the streams are complete and were captured with the same GUL
+        settings and inputs. Returns the manifest as a dict.
+        """
+        try:
+            with io.open(self.manifest_file_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            raise OasisException(
+                'No complete GUL stream capture in {} - run a capture first: {}'.format(self._gul_stream_dir_path, e)
+            )
+
+        gul_settings = self.get_gul_settings(analysis_settings)
+        for key in sorted(gul_settings):
+            if manifest['gul_settings'].get(key) != gul_settings[key]:
+                raise OasisException(
+                    'The GUL streams in {} were captured with another `{}` ({}) - it is {} in the analysis settings'.format(
+                        self._gul_stream_dir_path, key, json.dumps(manifest['gul_settings'].get(key)), json.dumps(gul_settings[key])
+                    )
+                )
+        input_digests = self.get_input_digests(model_run_dir_path)
+        for file_name in self.input_file_names:
+            if input_digests[file_name] and manifest['inputs'].get(file_name) and input_digests[file_name] != manifest['inputs'][file_name]:
+                raise OasisException(
+                    'The GUL streams in {} were captured with another input file {}'.format(self._gul_stream_dir_path, file_name)
+                )
+
+        self._codec = manifest['codec']
+        self._num_processes = manifest['num_processes']
+        for process_id in range(1, self._num_processes + 1):
+            for stream in self.streams:
+                file_path = self.get_file_path(process_id, stream)
+                if not os.path.exists(file_path) or os.path.getsize(file_path) != manifest['files'].get(os.path.basename(file_path)):
+                    raise OasisException('GUL stream file {} is missing or incomplete'.format(file_path))
+        return manifest
@@ -0,0 +1,1433 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisKtoolsOrchestrator'
+]
+
+import errno
+import glob
+import io
+import json
+import logging
+import os
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+if os.getcwd().split(os.path.sep)[-1] == 'ktools':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+
+_pid_assignment_re = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)=\$!$')
+
+_actions = ('mkdir', 'mkfifo', 'rm', 'rmdir')
+
+# Commands which run another command, pinned to cores or NUMA nodes (see
+# ``OasisKtoolsCpuLayout``), and the number of their own arguments
+# (``None`` if all their own arguments are options)
+_wrappers = {'numactl': None, 'taskset': 2}
+
+
+def _native_str(s):
+    if isinstance(s, str):
+        return s
+    return s.encode('utf-8') if sys.version_info[0] < 3 else s.decode('utf-8')
+
+
+# ``fcntl`` command to set the size of a pipe buffer (Linux only)
+_F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031) if fcntl is not None and sys.platform.startswith('linux') else None
+
+_SPLICE_F_MOVE = 1
+
+
+def _get_program_index(argv):
+    # the index in a command of the program it runs, skipping any pinning
+    # command which wraps it
+    if argv[0] in _wrappers:
+        num_args = _wrappers[argv[0]]
+        if num_args is not None:
+            if len(argv) > num_args + 1:
+                return num_args + 1
+        else:
+            for i, arg in enumerate(argv[1:], 1):
+                if not arg.startswith('-'):
+                    return i
+    return 0
+
+
+def _get_program_name(argv):
+    # the name of the program run by a command, skipping any pinning
+    # command which wraps it
+    return argv[_get_program_index(argv)]
+
+
+def _set_cloexec(fd, cloexec=True):
+    if fcntl is None:
+        return
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    flags = (flags | fcntl.FD_CLOEXEC) if cloexec else (flags & ~fcntl.FD_CLOEXEC)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags)
+
+
+def _close_fd(fd):
+    try:
+        os.close(fd)
+    except OSError:
+        pass
+
+
+def _set_pipe_size(fd, size):
+    if _F_SETPIPE_SZ is None or not size:
+        return
+    try:
+        fcntl.fcntl(fd, _F_SETPIPE_SZ, size)
+    except (IOError, OSError):
+        # Over ``/proc/sys/fs/pipe-max-size`` or the user's pipe buffer
+        # limit - the pipe keeps its default size
+        pass
+
+
+def _load_splice():
+    # The libc ``tee`` and ``splice`` calls (Linux only - Python has no
+    # bindings for them), or ``None`` if they are not available
+    if ctypes is None or not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        tee, splice = libc.tee, libc.splice
+    except (OSError, AttributeError):
+        return None
+    tee.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_uint]
+    tee.restype = ctypes.c_ssize_t
+    splice.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+    splice.restype = ctypes.c_ssize_t
+    return tee, splice
+
+
+def _call(fn, *args):
+    # Calls a libc function, retrying on ``EINTR`` and raising ``OSError``
+    # on other errors
+    while True:
+        n = fn(*args)
+        if n >= 0:
+            return n
+        e = ctypes.get_errno()
+        if e != errno.EINTR:
+            raise OSError(e, os.strerror(e))
+
+
+def _read_all(fd, size):
+    data = b''
+    while len(data) < size:
+        try:
+            chunk = os.read(fd, size - len(data))
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _write_all(fd, data):
+    while data:
+        try:
+            data = data[os.write(fd, data):]
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+
+
+def _fan_out_kernel(splice_fns, in_fd, pipe_fds, out_fd, size):
+    """
+    Copies one chunk of the input pipe to the output pipes and moves it to
+    the last output (a pipe or a file) in the kernel - ``tee`` duplicates
+    the data in the input pipe into each output pipe without consuming it,
+    and ``splice`` then moves it to the last output. If an output pipe took
+    less than the whole chunk the rest of the chunk is read and written in
+    userspace. Returns the number of bytes copied, which is ``0`` at the end
+    of the input.
+    """
+    tee, splice = splice_fns
+    if not pipe_fds:
+        return _call(splice, in_fd, None, out_fd, None, size, _SPLICE_F_MOVE)
+
+    n = _call(tee, in_fd, pipe_fds[0], size, 0)
+    if not n:
+        return 0
+    short = []
+    for fd in pipe_fds[1:]:
+        m = _call(tee, in_fd, fd, n, 0)
+        if m < n:
+            short.append((fd, m))
+
+    if short:
+        data = _read_all(in_fd, n)
+        _write_all(out_fd, data)
+        for fd, m in short:
+            _write_all(fd, data[m:])
+    else:
+        moved = 0
+        while moved < n:
+            try:
+                moved += _call(splice, in_fd, None, out_fd, None, n - moved, _SPLICE_F_MOVE)
+            except OSError as e:
+                # The chunk is already in the output pipes, so if the kernel
+                # can't splice to the last output the rest of it is written
+                # to it in userspace
+                if e.errno != errno.EINVAL:
+                    raise
+                _write_all(out_fd, _read_all(in_fd, n - moved))
+                break
+    return n
+
+
+def _fan_out(node, in_fd, pipe_fds, file_fds, splice_fns, chunk_size, exits):
+    """
+    Copies the input of a fan-out node to all its outputs until the end of
+    the input, then closes them and puts the node and its exit code on the
+    ``exits`` queue - ``1`` on an error, or ``-SIGPIPE`` if a reader closed
+    its end early, as for a ``tee`` process. The bytes read and written are
+    recorded in the node's ``io``.
+    """
+    exit_code = 0
+    copied = 0
+    out_fds = pipe_fds + file_fds
+    try:
+        if splice_fns and len(file_fds) <= 1 and out_fds:
+            try:
+                while True:
+                    n = _fan_out_kernel(splice_fns, in_fd, out_fds[:-1], out_fds[-1], chunk_size)
+                    if not n:
+                        break
+                    copied += n
+                return
+            except OSError as e:
+                # ``EINVAL`` if the kernel can't splice to the output (some
+                # filesystems), ``ENOSYS`` if the calls are not available -
+                # nothing has been consumed from the input in either case
+                if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                    raise
+        while True:
+            data = _read_all(in_fd, chunk_size)
+            if not data:
+                break
+            for fd in out_fds:
+                _write_all(fd, data)
+            copied += len(data)
+    except (IOError, OSError) as e:
+        exit_code = -signal.SIGPIPE if e.errno == errno.EPIPE else 1
+    finally:
+        for fd in [in_fd] + pipe_fds + file_fds:
+            _close_fd(fd)
+        node.io = (copied, copied * len(out_fds))
+        exits.put((node, exit_code))
+
+
+def _relay_pipe(src_fd, dst_fd):
+    """
+    Copies the data of a pipe from the writer's pipe to the reader's, until
+    the writer closes its end or the reader closes its end (in which case
+    the writer gets ``SIGPIPE`` or ``EPIPE`` as usual).
+    """
+    try:
+        while True:
+            try:
+                data = os.read(src_fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not data:
+                break
+            while data:
+                try:
+                    data = data[os.write(dst_fd, data):]
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+    except OSError:
+        pass
+    finally:
+        _close_fd(src_fd)
+        _close_fd(dst_fd)
+
+
+def _read_process_io(pid):
+    """
+    Returns the bytes read and written by a process - the ``rchar`` and
+    ``wchar`` counters of ``/proc/<pid>/io`` (Linux only), which count the
+    data passed to its ``read`` and ``write`` calls on pipes and files alike
+    - or ``None`` if they are not available. A child's counters can still
+    be read after it has exited, until it is reaped.
+    """
+    try:
+        with io.open('/proc/{}/io'.format(pid), 'rb') as f:
+            counters = dict(
+                (k.strip(), int(v)) for k, v in (l.decode('ascii').split(':', 1) for l in f if b':' in l)
+            )
+        return counters['rchar'], counters['wchar']
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+# ``prctl`` option which makes a process the reaper of its orphaned
+# descendants (Linux only)
+_PR_SET_CHILD_SUBREAPER = 36
+
+# The launcher of traced processes - ``bash`` forks a subshell for the
+# command, reports its PID and exits, which leaves the subshell a child of
+# the orchestrator. The subshell runs the command once the gate pipe is
+# closed, after the launcher has been reaped - otherwise the launcher could
+# reap the command itself if it exited first
+_launcher_script = (
+    '{{ exec {gate_w}>&- {report_w}>&-; read -r -u {gate_r} _; exec "$@" {gate_r}<&-; }} <&0 & '
+    'echo $! >&{report_w}'
+)
+
+
+def _set_child_subreaper(on):
+    """
+    Makes this process the reaper of its orphaned descendants (Linux only),
+    or stops it being one, and returns whether it could.
+    """
+    if ctypes is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        return libc.prctl(_PR_SET_CHILD_SUBREAPER, 1 if on else 0, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def _find_program(name):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if path and os.access(os.path.join(path, name), os.X_OK):
+            return os.path.join(path, name)
+    return None
+
+
+def _make_fifo(path):
+    try:
+        os.mkfifo(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _relay_fifo(src_fd, path):
+    """
+    Copies the data of a pipe to a filesystem fifo, which is opened (and so
+    blocks) until its reader opens it, as the writer of the fifo in the
+    script would.
+    """
+    try:
+        _make_fifo(path)
+        while True:
+            try:
+                dst_fd = os.open(path, os.O_WRONLY | getattr(os, 'O_CLOEXEC', 0))
+                break
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+    except OSError:
+        _close_fd(src_fd)
+        return
+    _set_cloexec(dst_fd)
+    _relay_pipe(src_fd, dst_fd)
+
+
+class _Pipe(object):
+    """
+    An anonymous pipe standing in for a fifo of the script, or joining two
+    stages of a pipeline. The pipe is only created when the first of its
+    ends is needed, and the orchestrator's copy of each end is closed once
+    the process using it has been started, so that readers see end-of-file
+    when their writer exits.
+
+    A fifo which is read from a work folder (by the ``-K`` option of
+    ``leccalc`` or ``aalsummary``), and so must exist in the filesystem, is
+    a filesystem fifo at ``path``, which a relay thread writes the writer's
+    pipe to.
+    """
+
+    __slots__ = ('name', 'fds', 'claims', 'nodes', 'relay', 'path')
+
+    def __init__(self, name):
+        self.name = name
+        self.fds = None
+        self.claims = [0, 0]
+        self.nodes = [None, None]
+        self.relay = None
+        self.path = None
+
+    def claim(self, end, node=None):
+        if self.claims[end]:
+            raise OasisException(
+                'Fifo {} has more than one {} in the ktools script'.format(self.name, 'reader' if end == 0 else 'writer')
+            )
+        self.claims[end] = 1
+        self.nodes[end] = node
+
+    def get_fd(self, end):
+        if self.fds is None:
+            self.fds = list(os.pipe())
+            for fd in self.fds:
+                _set_cloexec(fd)
+            if self.path is not None:
+                src_fd, self.fds[0] = self.fds[0], None
+                self.relay = threading.Thread(target=_relay_fifo, args=(src_fd, self.path))
+                self.relay.daemon = True
+                self.relay.start()
+            for i in (0, 1):
+                if not self.claims[i]:
+                    self.release(i)
+        return self.fds[end]
+
+    def release(self, end):
+        if self.fds is not None and self.fds[end] is not None:
+            _close_fd(self.fds[end])
+            self.fds[end] = None
+
+
+class _Node(object):
+    """
+    A process of the ktools graph - one stage of a pipeline. A fan-out node
+    is a ``tee`` command which is run by a thread of the orchestrator
+    instead of a process. The filesystem fifos read by a node from its
+    work folders are created before it is started.
+    """
+
+    __slots__ = (
+        'name', 'argv', 'command', 'line_no', 'group', 'stdin', 'stdout', 'fd_args', 'process', 'pid', 'exit_code',
+        'start_time', 'end_time', 'rusage', 'io', 'fan_out', 'thread', 'fs_fifos'
+    )
+
+    def __init__(self, argv, command, line_no, group):
+        self.name = _get_program_name(argv)
+        self.argv = argv
+        self.command = command
+        self.line_no = line_no
+        self.group = group
+        self.stdin = None
+        self.stdout = None
+        self.fd_args = {}
+        self.process = None
+        self.pid = None
+        self.exit_code = None
+        self.start_time = None
+        self.end_time = None
+        self.rusage = None
+        self.io = None
+        self.fan_out = False
+        self.thread = None
+        self.fs_fifos = []
+
+
+class _Group(object):
+    """
+    A unit of scheduling - either the processes of a pipeline, which are
+    started together, or an in-process filesystem action.
+    """
+
+    __slots__ = ('nodes', 'action', 'command', 'line_no', 'deps', 'pipes', 'component', 'started', 'done')
+
+    def __init__(self, command, line_no, nodes=None, action=None):
+        self.nodes = nodes or []
+        self.action = action
+        self.command = command
+        self.line_no = line_no
+        self.deps = []
+        self.pipes = []
+        self.component = None
+        self.started = False
+        self.done = False
+
+
+class OasisKtoolsOrchestrator(object):
+    """
+    An in-process executor for ktools losses scripts (see ``genbash`` in
+    ``generate_losses.py``), which runs the script's
+    eve -> getmodel -> gulcalc -> fmcalc -> summarycalc -> tee ->
+    eltcalc/pltcalc/aalcalc graph as a process DAG without a shell.
+
+    The script is read as a graph rather than run line by line - fifos
+    created with ``mkfifo`` become anonymous pipes wired directly between
+    the processes (fifo paths in command arguments are passed as
+    ``/dev/fd/<n>``), the ``mkdir``/``rm``/``rmdir`` lines are run in
+    process, and every stage of a pipeline is a separate node with its own
+    exit code. Instead of honouring the script's ``wait`` barriers each
+    command is started as soon as the files it reads are complete - the
+    files written (by ``>`` redirection or as arguments of ``tee`` and
+    other commands) by earlier commands, and the ``work/<name>`` folders
+    read by the ``-K<name>`` option of ``aalsummary`` and ``leccalc``
+    (fifos in these folders stay filesystem fifos, as they are read by
+    listing the folder, e.g. the decompressed work files of ``leccalc``). Only
+    commands for which no such input can be found wait for the processes
+    named in the preceding ``wait`` lines, and the filesystem actions wait
+    for all the commands before them.
+
+    Children are reaped as they exit - if any process fails then the
+    remaining processes are terminated and an ``OasisException`` naming
+    the failed process, its script line and its exit code is raised.
+    Supported script syntax is what ``genbash`` generates: comments,
+    pipelines with ``<``, ``>`` and ``>>`` redirections, ``&``,
+    ``<var>=$!`` assignments, ``wait`` lines (``wait -n`` is read as
+    ``wait``) and ``(`` ... ``)`` subshells - ``set`` lines (shell
+    options such as ``-e``) are ignored, as the exit code of every process
+    is checked anyway, as are ``:`` lines.
+
+    The start and end times and CPU times of the processes of a run are
+    recorded, and can be written as a JSON trace or a Chrome trace (see
+    ``get_trace``). In trace mode the bytes read and written by each
+    process are also recorded, from its I/O counters (see
+    ``_read_process_io``), which are read when it has exited and before it
+    is reaped, so that the pipes between the processes are still direct.
+    The counters are only available on Linux with Python 3, which has
+    ``os.waitid`` to wait for a child without reaping it.
+
+    In trace mode the peak RSS of each process is also recorded, on Linux -
+    the peak RSS of a child includes that of the image it was forked from,
+    so rather than being forked from the orchestrator (and reporting at
+    least its RSS) each process is started by a ``bash`` launcher, which
+    forks it and exits, and the orchestrator, as the reaper of its orphaned
+    descendants, reaps it. The peak RSS of a process then includes at most
+    that of ``bash`` (a few MB).
+
+    Unless ``fan_out`` is unset the ``tee`` commands of the script (which
+    copy the summarycalc streams into the fifos of the summary outputs) are
+    not run as processes - the orchestrator copies their input to their
+    outputs itself, in a thread per command, using the Linux ``tee`` and
+    ``splice`` calls, so that the data is duplicated between the pipe
+    buffers in the kernel rather than read and written by a process, and
+    with the buffers of the pipes enlarged to ``pipe_buffer_size`` bytes.
+    Where the calls are not available the data is copied by reading and
+    writing it.
+    """
+
+    # Pipe buffer size for the pipes of fan-out nodes, limited by
+    # ``/proc/sys/fs/pipe-max-size`` (1 MiB by default) for unprivileged
+    # users
+    pipe_buffer_size = 1 << 20
+
+    def __init__(self, run_dir_path, script_lines=None, trace=False, fan_out=True):
+        self._run_dir_path = os.path.abspath(run_dir_path)
+        self._trace = trace
+        self._launcher = None
+        self._fan_out = fan_out
+        self._fan_out_exits = queue.Queue()
+        self._splice_fns = _load_splice() if fan_out else None
+        self._start_time = None
+        self._end_time = None
+
+        self._groups = []
+        self._nodes = []
+        self._fifos = {}
+        self._writers = {}
+        self._pid_vars = {}
+        self._barrier = []
+        self._last_action = None
+        self._last_groups = None
+        self._scopes = []
+        self._line_no = 0
+
+        self.logger = logging.getLogger()
+
+        if script_lines:
+            self.add_script_lines(script_lines)
+
+
+    @classmethod
+    def create(cls, run_dir_path, script_lines=None, script_file_path=None, trace=False, fan_out=True):
+        orchestrator = cls(run_dir_path, script_lines=script_lines, trace=trace, fan_out=fan_out)
+        if script_file_path:
+            orchestrator.load_script_file(script_file_path)
+        return orchestrator
+
+
+    @property
+    def run_dir_path(self):
+        """
+        Model run directory path property - getter only.
+
+            :getter: Gets the model run directory path, in which the
+                     processes are run and relative paths are resolved
+        """
+        return self._run_dir_path
+
+
+    @property
+    def nodes(self):
+        """
+        Process nodes property - getter only.
+
+            :getter: Gets the process nodes of the graph, in script order -
+                     each has ``name``, ``command``, ``line_no`` and (once
+                     run) ``exit_code`` attributes
+        """
+        return self._nodes
+
+
+    @property
+    def trace(self):
+        """
+        Trace mode property - getter only.
+
+            :getter: Gets whether the bytes read and written and the peak
+                     RSS of each process are recorded (see ``get_trace``)
+        """
+        return self._trace
+
+
+    @property
+    def fan_out(self):
+        """
+        Fan-out mode property - getter only.
+
+            :getter: Gets whether the ``tee`` commands of the script are run
+                     by the orchestrator instead of as processes
+        """
+        return self._fan_out
+
+
+    def load_script_file(self, script_file_path):
+        """
+        Adds the lines of a ktools losses script file to the graph.
+        """
+        with io.open(script_file_path, 'r', encoding='utf-8') as f:
+            self.add_script_lines(f.read().splitlines())
+
+
+    def add_script_lines(self, script_lines):
+        """
+        Adds ktools losses script lines to the graph.
+        """
+        for line in script_lines:
+            self._line_no += 1
+            self._add_line(_native_str(line).strip(), self._line_no)
+
+
+    def _add_line(self, line, line_no):
+        if not line or line.startswith('#'):
+            return
+
+        try:
+            tokens = shlex.split(line)
+        except ValueError as e:
+            raise OasisException('Invalid ktools script line {}: {}: {}'.format(line_no, line, e))
+
+        statements = []
+        statement = []
+        for t in tokens:
+            if t in ('&', ';'):
+                if statement:
+                    statements.append((statement, t == '&'))
+                statement = []
+            elif t in ('&&', '||') or t.startswith('$(') or t.startswith('`') or t.startswith('2>'):
+                raise OasisException('Unsupported shell syntax in ktools script line {}: {}'.format(line_no, line))
+            else:
+                statement.append(t)
+        if statement:
+            statements.append((statement, False))
+
+        for statement, background in statements:
+            m = _pid_assignment_re.match(statement[0])
+            if m and len(statement) == 1:
+                if self._last_groups is None:
+                    raise OasisException('No background command for `{}` in ktools script line {}'.format(statement[0], line_no))
+                self._pid_vars[m.group(1)] = self._last_groups
+            elif statement == ['(']:
+                self._scopes.append((self._barrier, len(self._groups)))
+                self._barrier = list(self._barrier)
+            elif statement == [')']:
+                self._end_subshell(background, line, line_no)
+            elif statement[0] == ':':
+                # No-op commands (the opening of filesystem fifos, to release
+                # their writers) are ignored, as the orchestrator releases
+                # the writers itself
+                continue
+            elif statement[0] == 'wait':
+                self._add_wait(statement[1:], line, line_no)
+            elif statement[0] == 'set':
+                continue
+            elif statement[0] in _actions:
+                self._add_action(statement, line, line_no)
+            else:
+                self._add_pipeline(statement, background, line, line_no)
+
+
+    def _path(self, path):
+        return os.path.normpath(path)
+
+
+    def _add_wait(self, args, line, line_no):
+        args = [a for a in args if a != '-n']
+        if not args:
+            # a bare wait in a subshell only waits for the subshell's own
+            # processes
+            start = self._scopes[-1][1] if self._scopes else 0
+            self._barrier = [g for g in self._groups[start:] if g.nodes]
+            return
+        for arg in args:
+            if not arg.startswith('$') or arg[1:] not in self._pid_vars:
+                raise OasisException('Unknown process `{}` in ktools script line {}: {}'.format(arg, line_no, line))
+            for group in self._pid_vars[arg[1:]]:
+                if group not in self._barrier:
+                    self._barrier.append(group)
+
+
+    def _end_subshell(self, background, line, line_no):
+        # The commands of a subshell are added to the graph like any other
+        # (their dependencies are their input files), and the subshell's
+        # PID stands for all of them
+        if not self._scopes:
+            raise OasisException('Unmatched `)` in ktools script line {}: {}'.format(line_no, line))
+        barrier, start = self._scopes.pop()
+        groups = [g for g in self._groups[start:] if g.nodes]
+        self._barrier = barrier
+        self._last_groups = groups
+        if not background:
+            self._barrier.extend(g for g in groups if g not in self._barrier)
+
+
+    def _add_action(self, argv, line, line_no):
+        name = argv[0]
+        flags = ''.join(a[1:] for a in argv[1:] if a.startswith('-'))
+        paths = [a for a in argv[1:] if not a.startswith('-')]
+
+        if name == 'mkfifo':
+            for p in paths:
+                self._fifos[self._path(p)] = _Pipe(p)
+            return
+
+        if name == 'rm' and paths and all(self._path(p) in self._fifos for p in paths):
+            return
+
+        run_dir_path = self._run_dir_path
+        logger = self.logger
+
+        def action():
+            for p in paths:
+                targets = sorted(glob.glob(os.path.join(run_dir_path, p))) if glob.has_magic(p) else [os.path.join(run_dir_path, p)]
+                for target in targets:
+                    try:
+                        if name == 'mkdir' and 'p' in flags:
+                            os.makedirs(target)
+                        elif name == 'mkdir':
+                            os.mkdir(target)
+                        elif name == 'rmdir':
+                            os.rmdir(target)
+                        elif os.path.isdir(target) and not os.path.islink(target):
+                            if 'r' not in flags.lower():
+                                raise OSError(errno.EISDIR, os.strerror(errno.EISDIR), target)
+                            shutil.rmtree(target)
+                        else:
+                            os.remove(target)
+                    except OSError as e:
+                        # As in the script, failed filesystem commands are
+                        # reported but do not stop the run
+                        if e.errno == errno.EEXIST and 'p' in flags:
+                            continue
+                        if e.errno == errno.ENOENT and (name != 'rm' or 'f' in flags):
+                            continue
+                        logger.warning('ktools script line {}: {}: {}'.format(line_no, line, e))
+
+        group = _Group(line, line_no, action=action)
+        group.deps = list(self._groups)
+        self._groups.append(group)
+        self._last_action = group
+
+
+    def _add_pipeline(self, argv, background, line, line_no):
+        stages = [[]]
+        for t in argv:
+            if t == '|':
+                stages.append([])
+            else:
+                stages[-1].append(t)
+
+        group = _Group(line, line_no)
+        reads = set()
+        read_dirs = set()
+        writes = set()
+        pipe = None
+
+        for i, stage in enumerate(stages):
+            args = []
+            redirects = {}
+            it = iter(stage)
+            for t in it:
+                for op in ('>>', '>', '<'):
+                    if t.startswith(op):
+                        target = t[len(op):] or next(it, None)
+                        if not target:
+                            raise OasisException('Missing redirection target in ktools script line {}: {}'.format(line_no, line))
+                        redirects[op] = target
+                        break
+                else:
+                    args.append(t)
+            if not args:
+                raise OasisException('Empty command in ktools script line {}: {}'.format(line_no, line))
+
+            node = _Node(args, line, line_no, group)
+
+            if pipe is not None:
+                node.stdin = pipe
+                pipe.claim(0, node)
+            elif '<' in redirects:
+                p = self._path(redirects['<'])
+                if p in self._fifos:
+                    node.stdin = self._fifos[p]
+                    node.stdin.claim(0, node)
+                else:
+                    node.stdin = ('<', redirects['<'])
+                    reads.add(p)
+
+            if i < len(stages) - 1:
+                pipe = node.stdout = _Pipe(
+                    '{}|{}'.format(node.name, _get_program_name(stages[i + 1]) if stages[i + 1] else '')
+                )
+                pipe.claim(1, node)
+                group.pipes.append(pipe)
+            else:
+                op = '>>' if '>>' in redirects else ('>' if '>' in redirects else None)
+                if op:
+                    p = self._path(redirects[op])
+                    if p in self._fifos:
+                        node.stdout = self._fifos[p]
+                        node.stdout.claim(1, node)
+                    else:
+                        node.stdout = (op, redirects[op])
+                        if redirects[op] != os.devnull:
+                            writes.add(p)
+                            # Appends to a file follow its earlier writers
+                            if op == '>>' and p in self._writers:
+                                reads.add(p)
+
+            for j, a in enumerate(args[1:], 1):
+                p = self._path(a) if not a.startswith('-') else None
+                if p in self._fifos:
+                    # Fifos named in arguments are always outputs in ktools
+                    # scripts (``tee``, ``summarycalc``, ``gulcalc``)
+                    node.fd_args[j] = self._fifos[p]
+                    node.fd_args[j].claim(1, node)
+                elif a.startswith('-K') and (len(a) > 2 or j + 1 < len(args)):
+                    d = self._path(os.path.join('work', a[2:] or args[j + 1]))
+                    read_dirs.add(d)
+                    for fifo_path, fifo in sorted(self._fifos.items()):
+                        if fifo_path.startswith(d + os.path.sep) and not fifo.claims[0]:
+                            fifo.path = os.path.join(self._run_dir_path, fifo_path)
+                            fifo.claim(0, node)
+                            node.fs_fifos.append(fifo)
+                elif p in self._writers:
+                    reads.add(p)
+                elif p and '/' in a and a != os.devnull:
+                    writes.add(p)
+
+            for f in [node.stdin, node.stdout] + list(node.fd_args.values()):
+                if isinstance(f, _Pipe) and f not in group.pipes:
+                    group.pipes.append(f)
+
+            # Only a plain ``tee`` (no options, such as ``-a``) reading a
+            # fifo is fanned out
+            k = _get_program_index(args)
+            node.fan_out = (
+                self._fan_out and len(stages) == 1 and node.name == 'tee' and isinstance(node.stdin, _Pipe) and
+                not any(a.startswith('-') for a in args[k + 1:])
+            )
+
+            group.nodes.append(node)
+
+        deps = []
+        for p in reads:
+            # input files which the script does not write have no writers
+            deps.extend(self._writers.get(p, []))
+        for d in read_dirs:
+            for p, writers in self._writers.items():
+                if p.startswith(d + os.path.sep):
+                    deps.extend(writers)
+        if not deps:
+            deps = list(self._barrier)
+        if self._last_action is not None:
+            deps.append(self._last_action)
+        for g in deps:
+            if g not in group.deps:
+                group.deps.append(g)
+
+        for p in writes:
+            self._writers.setdefault(p, []).append(group)
+
+        self._groups.append(group)
+        self._nodes.extend(group.nodes)
+        self._last_groups = [group]
+
+        if not background:
+            self._barrier.append(group)
+
+
+    def _set_components(self):
+        # Groups joined by pipes are started together, one connected
+        # component at a time, so that the orchestrator only holds open the
+        # ends of the pipes of one component
+        parents = {}
+
+        def find(g):
+            while parents.get(g, g) is not g:
+                g = parents[g]
+            return g
+
+        owners = {}
+        for group in self._groups:
+            for pipe in group.pipes:
+                if pipe in owners:
+                    parents[find(group)] = find(owners[pipe])
+                else:
+                    owners[pipe] = group
+
+        order = {}
+        for i, group in enumerate(self._groups):
+            group.component = order.setdefault(find(group), i)
+
+
+    def _popen_kwargs(self, keep_fds):
+        if sys.version_info[0] >= 3:
+            return {'pass_fds': tuple(keep_fds)}
+
+        def preexec():
+            signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+            for fd in keep_fds:
+                _set_cloexec(fd, False)
+
+        return {'preexec_fn': preexec, 'close_fds': False}
+
+
+    def _open_file(self, spec):
+        op, path = spec
+        flags = {
+            '<': os.O_RDONLY,
+            '>': os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            '>>': os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        }[op]
+        fd = os.open(os.path.join(self._run_dir_path, path), flags, 0o666)
+        _set_cloexec(fd)
+        return fd
+
+
+    def _start_group(self, group, running):
+        if group.action is not None:
+            self.logger.debug('ktools script line {}: {}'.format(group.line_no, group.command))
+            group.action()
+            group.started = group.done = True
+            return
+
+        group.started = True
+        opened = []
+        try:
+            for node in group.nodes:
+                if isinstance(node.stdin, _Pipe):
+                    stdin = node.stdin.get_fd(0)
+                elif node.stdin:
+                    stdin = self._open_file(node.stdin)
+                    opened.append(stdin)
+                else:
+                    stdin = os.open(os.devnull, os.O_RDONLY)
+                    opened.append(stdin)
+
+                if isinstance(node.stdout, _Pipe):
+                    stdout = node.stdout.get_fd(1)
+                elif node.stdout:
+                    stdout = self._open_file(node.stdout)
+                    opened.append(stdout)
+                else:
+                    stdout = None
+
+                if node.fan_out:
+                    self._start_fan_out(node, stdin, stdout, running)
+                    continue
+
+                argv = list(node.argv)
+                keep_fds = []
+                for j, pipe in node.fd_args.items():
+                    fd = pipe.get_fd(1)
+                    argv[j] = '/dev/fd/{}'.format(fd)
+                    keep_fds.append(fd)
+
+                self.logger.debug('Starting ktools process {} (script line {})'.format(node.name, node.line_no))
+                node.start_time = time.time()
+                try:
+                    for fifo in node.fs_fifos:
+                        _make_fifo(fifo.path)
+                    if self._launcher:
+                        node.pid = self._launch(argv, stdin, stdout, keep_fds)
+                    else:
+                        node.process = subprocess.Popen(
+                            argv, cwd=self._run_dir_path, stdin=stdin, stdout=stdout, **self._popen_kwargs(keep_fds)
+                        )
+                        node.pid = node.process.pid
+                except (OSError, ValueError) as e:
+                    raise OasisException(
+                        'Error starting ktools process {} (script line {}: {}): {}'.format(node.name, node.line_no, node.command, e)
+                    )
+                running[node.pid] = node
+
+                self._release(node)
+        finally:
+            for fd in opened:
+                _close_fd(fd)
+
+
+    def _launch(self, argv, stdin, stdout, keep_fds):
+        # Starts a command with the launcher, and returns its PID
+        if os.path.sep not in argv[0] and not _find_program(argv[0]):
+            raise OSError(errno.ENOENT, 'No such file or directory: {}'.format(argv[0]))
+        report_r, report_w = os.pipe()
+        gate_r, gate_w = os.pipe()
+        fds = [report_r, report_w, gate_r, gate_w]
+        for fd in fds:
+            _set_cloexec(fd)
+        try:
+            launcher = subprocess.Popen(
+                [self._launcher, '-c', _launcher_script.format(report_w=report_w, gate_r=gate_r, gate_w=gate_w), 'bash'] + argv,
+                cwd=self._run_dir_path, stdin=stdin, stdout=stdout,
+                **self._popen_kwargs(list(keep_fds) + [report_w, gate_r, gate_w])
+            )
+            fds.remove(report_w)
+            _close_fd(report_w)
+            # EOF once both the launcher and the subshell have closed the
+            # report pipe
+            pid = _read_all(report_r, 64)
+            launcher.wait()
+            try:
+                return int(pid)
+            except ValueError:
+                raise OSError(
+                    errno.ECHILD, 'The launcher exited with code {} without starting the command'.format(launcher.returncode)
+                )
+        finally:
+            for fd in fds:
+                _close_fd(fd)
+
+
+    def _release(self, node):
+        for pipe, end in [(node.stdin, 0), (node.stdout, 1)] + [(p, 1) for p in node.fd_args.values()]:
+            if isinstance(pipe, _Pipe):
+                pipe.release(end)
+
+
+    def _start_fan_out(self, node, stdin, stdout, running):
+        # The fan-out thread gets its own copies of the ends of the pipes, as
+        # the orchestrator's are released as for a process
+        fds = []
+        try:
+            in_fd = os.dup(stdin)
+            fds.append(in_fd)
+            pipe_fds = []
+            file_fds = []
+            if isinstance(node.stdout, _Pipe):
+                pipe_fds.append(os.dup(stdout))
+                fds.append(pipe_fds[-1])
+            elif node.stdout and node.stdout[1] != os.devnull:
+                file_fds.append(os.dup(stdout))
+                fds.append(file_fds[-1])
+            k = _get_program_index(node.argv)
+            for j, a in enumerate(node.argv[k + 1:], k + 1):
+                if j in node.fd_args:
+                    pipe_fds.append(os.dup(node.fd_args[j].get_fd(1)))
+                    fds.append(pipe_fds[-1])
+                else:
+                    file_fds.append(self._open_file(('>', a)))
+                    fds.append(file_fds[-1])
+        except OSError as e:
+            for fd in fds:
+                _close_fd(fd)
+            raise OasisException(
+                'Error starting ktools fan-out {} (script line {}: {}): {}'.format(node.name, node.line_no, node.command, e)
+            )
+        for fd in fds:
+            _set_cloexec(fd)
+        for fd in [in_fd] + pipe_fds:
+            _set_pipe_size(fd, self.pipe_buffer_size)
+
+        self.logger.debug('Starting ktools fan-out {} (script line {})'.format(node.name, node.line_no))
+        node.start_time = time.time()
+        node.thread = threading.Thread(
+            target=_fan_out,
+            args=(node, in_fd, pipe_fds, file_fds, self._splice_fns, self.pipe_buffer_size, self._fan_out_exits)
+        )
+        node.thread.daemon = True
+        node.thread.start()
+        running[node] = node
+
+        self._release(node)
+
+
+    def _wait_any(self, running=None):
+        # Returns the key in ``running`` (the PID of a child process, or a
+        # fan-out node), exit status and resource usage (or ``None`` where
+        # ``wait4`` is not available, and for fan-outs) of the next child or
+        # fan-out to exit
+        fan_outs = running is not None and any(isinstance(k, _Node) for k in running)
+        while True:
+            if fan_outs:
+                # Poll both the children and the fan-outs
+                try:
+                    return self._get_fan_out_exit(timeout=None)
+                except queue.Empty:
+                    pass
+                if len(running) > sum(1 for k in running if isinstance(k, _Node)):
+                    try:
+                        pid, status, rusage = self._wait_child(running, os.WNOHANG)
+                    except OSError as e:
+                        if e.errno not in (errno.EINTR, errno.ECHILD):
+                            raise
+                        pid = 0
+                    if pid:
+                        return pid, status, rusage
+                try:
+                    return self._get_fan_out_exit(timeout=0.01)
+                except queue.Empty:
+                    continue
+            try:
+                return self._wait_child(running)
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+
+
+    def _wait_child(self, running=None, options=0):
+        # Returns the PID, exit status and resource usage of the next child
+        # to exit (a PID of ``0`` if ``options`` has ``os.WNOHANG`` and none
+        # has) - in trace mode the I/O counters of the child are read before
+        # it is reaped
+        pid = -1
+        if self._trace and hasattr(os, 'waitid'):
+            result = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOWAIT | options)
+            if result is None or not result.si_pid:
+                return 0, 0, None
+            pid, options = result.si_pid, 0
+            node = running.get(pid) if running else None
+            if node is not None:
+                node.io = _read_process_io(pid)
+        if hasattr(os, 'wait4'):
+            return os.wait4(pid, options)
+        (pid, status), rusage = os.waitpid(pid, options), None
+        return pid, status, rusage
+
+
+    def _get_fan_out_exit(self, timeout=None):
+        # The exit code of a fan-out is returned as a wait status
+        if timeout is None:
+            node, exit_code = self._fan_out_exits.get_nowait()
+        else:
+            node, exit_code = self._fan_out_exits.get(timeout=timeout)
+        return node, (-exit_code if exit_code < 0 else exit_code << 8), None
+
+
+    def _stop(self, running):
+        for group in self._groups:
+            for pipe in group.pipes:
+                pipe.release(0)
+                pipe.release(1)
+        for node in list(running.values()):
+            if node.pid is None:
+                continue
+            try:
+                os.kill(node.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        # Fan-outs exit once their writer and readers have
+        while running:
+            pid, status, rusage = self._wait_any(running)
+            node = running.pop(pid, None)
+            if node is not None:
+                self._set_exit_code(node, status, rusage)
+        for group in self._groups:
+            for pipe in group.pipes:
+                if pipe.relay is not None:
+                    while pipe.path is not None and pipe.relay.is_alive():
+                        # A relay to a filesystem fifo whose reader has not
+                        # opened it is still blocked in its open
+                        try:
+                            _close_fd(os.open(pipe.path, os.O_RDONLY | os.O_NONBLOCK))
+                        except OSError:
+                            pass
+                        pipe.relay.join(0.1)
+                    pipe.relay.join()
+            for node in group.nodes:
+                if node.thread is not None:
+                    node.thread.join()
+
+
+    def _set_exit_code(self, node, status, rusage=None):
+        node.end_time = time.time()
+        node.rusage = rusage
+        node.exit_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        if node.process is not None:
+            node.process.returncode = node.exit_code
+
+
+    def run(self):
+        """
+        Runs the graph in the model run directory, and returns the process
+        nodes once all have exited successfully.
+        """
+        if any(g.pipes for g in self._groups) and not os.path.isdir('/dev/fd'):
+            raise OasisException('The ktools orchestrator requires /dev/fd to pass pipes to ktools processes')
+
+        self._set_components()
+
+        # The launcher is only needed to measure the peak RSS of the
+        # processes
+        self._launcher = None
+        if self._trace:
+            launcher = _find_program('bash')
+            if launcher and _set_child_subreaper(True):
+                self._launcher = launcher
+
+        self._start_time = time.time()
+        running = {}
+        failed = []
+        try:
+            while True:
+                ready = True
+                while ready:
+                    ready = [
+                        g for g in self._groups
+                        if not g.started and all(d.done for d in g.deps)
+                    ]
+                    ready.sort(key=lambda g: (g.component, g.line_no))
+                    for group in ready:
+                        self._start_group(group, running)
+                    # Actions are done as soon as they are started, which
+                    # may make other groups ready
+                    ready = [g for g in ready if g.action is not None]
+
+                if not running:
+                    if any(not g.done for g in self._groups):
+                        raise OasisException('Unsatisfiable dependencies in the ktools script')
+                    break
+
+                pid, status, rusage = self._wait_any(running)
+                node = running.pop(pid, None)
+                if node is None:
+                    continue
+                self._set_exit_code(node, status, rusage)
+                if node.exit_code != 0:
+                    failed.append(node)
+                    break
+
+                group = node.group
+                if all(n.exit_code is not None for n in group.nodes):
+                    group.done = all(n.exit_code == 0 for n in group.nodes)
+        finally:
+            self._stop(running)
+            self._end_time = time.time()
+            if self._launcher:
+                _set_child_subreaper(False)
+
+        if failed:
+            # A failure usually also kills the processes piped to and from
+            # the failed process, so the first failure reaped is reported
+            node = failed[0]
+            raise OasisException(
+                'ktools process {} (script line {}: {}) failed with {}'.format(
+                    node.name, node.line_no, node.command,
+                    'signal {}'.format(-node.exit_code) if node.exit_code < 0 else 'exit code {}'.format(node.exit_code)
+                )
+            )
+
+        return self._nodes
+
+
+    def _get_trace_file(self, f):
+        if isinstance(f, _Pipe):
+            return f.name
+        return f[1] if f else None
+
+
+    def get_trace(self):
+        """
+        Returns the trace of the last run, as a dict - the start and end
+        times of the run, and
+
+            ``processes``: the script line and command, OS PID, whether it is
+            a fan-out, start and end times (seconds since the epoch), elapsed
+            time, user and system CPU times (seconds), exit code and
+            stdin/stdout of each process which was started, the size of its
+            stdout file if any, and, if the orchestrator was created with
+            ``trace`` set, its peak RSS (KB) and the bytes it read and wrote
+            (pipes and files)
+
+            ``pipes``: the name (the fifo path, or ``<writer>|<reader>`` for
+            the pipes between the stages of a pipeline), and the writer and
+            reader (the indexes of their processes in ``processes``) of each
+            fifo and pipe
+
+        CPU times are only available where ``os.wait4`` is, the peak RSS in
+        trace mode on Linux, where the processes are started by the launcher
+        (see the class docs), and the bytes read and written in trace mode on
+        Linux with Python 3 (see ``_read_process_io``), and for the fan-outs
+        of ``tee`` commands. The CPU times and peak RSS of the fan-outs,
+        which are threads of the orchestrator, are not available.
+        """
+        processes = []
+        process_ids = {}
+        for node in self._nodes:
+            if node.start_time is None:
+                continue
+            process_ids[node] = len(processes)
+            ru = node.rusage
+            stdout_bytes = None
+            if node.stdout and not isinstance(node.stdout, _Pipe) and node.stdout[1] != os.devnull:
+                try:
+                    stdout_bytes = os.path.getsize(os.path.join(self._run_dir_path, node.stdout[1]))
+                except OSError:
+                    pass
+            processes.append({
+                'name': node.name,
+                'line_no': node.line_no,
+                'command': node.command,
+                'pid': node.pid,
+                'fan_out': node.fan_out,
+                'start_time': node.start_time,
+                'end_time': node.end_time,
+                'elapsed_time': (node.end_time - node.start_time) if node.end_time is not None else None,
+                'user_cpu_time': ru.ru_utime if ru else None,
+                'system_cpu_time': ru.ru_stime if ru else None,
+                'max_rss_kb': ru.ru_maxrss if ru and self._launcher else None,
+                'exit_code': node.exit_code,
+                'stdin': self._get_trace_file(node.stdin),
+                'stdout': self._get_trace_file(node.stdout),
+                'stdout_bytes': stdout_bytes,
+                'bytes_read': node.io[0] if node.io else None,
+                'bytes_written': node.io[1] if node.io else None
+            })
+
+        pipes = []
+        seen = set()
+        for group in self._groups:
+            for pipe in group.pipes:
+                if pipe in seen or pipe.fds is None:
+                    continue
+                seen.add(pipe)
+                pipes.append({
+                    'name': pipe.name,
+                    'writer': process_ids.get(pipe.nodes[1]),
+                    'reader': process_ids.get(pipe.nodes[0])
+                })
+
+        return {
+            'run_dir_path': self._run_dir_path,
+            'start_time': self._start_time,
+            'end_time': self._end_time,
+            'elapsed_time': (self._end_time - self._start_time) if self._end_time is not None else None,
+            'processes': processes,
+            'pipes': pipes
+        }
+
+
+    def write_trace(self, trace_file_path):
+        """
+        Writes the trace of the last run (see ``get_trace``) to a JSON file.
+        """
+        with io.open(trace_file_path, 'w', encoding='utf-8') as f:
+            f.write(u'{}'.format(json.dumps(self.get_trace(), indent=4, sort_keys=True)))
+
+
+    def write_chrome_trace(self, trace_file_path):
+        """
+        Writes the trace of the last run (see ``get_trace``) as a Chrome
+        trace (Trace Event Format) JSON file, which can be loaded in
+        ``chrome://tracing`` or Perfetto - each script line is shown as a
+        process and each of its processes as a thread, with the process
+        resource usage and byte counts as event arguments.
+        """
+        trace = self.get_trace()
+        t0 = trace['start_time'] or 0
+
+        events = []
+        lines = set()
+        for p in trace['processes']:
+            if p['line_no'] not in lines:
+                lines.add(p['line_no'])
+                events.append({
+                    'name': 'process_name', 'ph': 'M', 'pid': p['line_no'],
+                    'args': {'name': 'line {}: {}'.format(p['line_no'], p['command'])}
+                })
+            args = dict(
+                (k, p[k]) for k in [
+                    'exit_code', 'user_cpu_time', 'system_cpu_time', 'max_rss_kb', 'stdin', 'stdout', 'stdout_bytes',
+                    'bytes_read', 'bytes_written'
+                ]
+            )
+            events.append({
+                'name': p['name'],
+                'cat': 'ktools',
+                'ph': 'X',
+                'ts': int((p['start_time'] - t0) * 1e6),
+                'dur': int((p['elapsed_time'] or 0) * 1e6),
+                'pid': p['line_no'],
+                'tid': p['pid'] or 0,
+                'args': args
+            })
+
+        with io.open(trace_file_path, 'w', encoding='utf-8') as f:
+            f.write(u'{}'.format(json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, indent=4, sort_keys=True)))
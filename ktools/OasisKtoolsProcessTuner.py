@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisKtoolsProcessTuner'
+]
+
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+
+import numpy as np
+
+if os.getcwd().split(os.path.sep)[-1] == 'ktools':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+from OasisEventPartitionPlanner import OasisEventPartitionPlanner
+from OasisKtoolsOrchestrator import OasisKtoolsOrchestrator
+from OasisKtoolsScriptBuilder import OasisKtoolsScriptBuilder
+
+
+class OasisKtoolsProcessTuner(object):
+    """
+    Chooses the number of ktools calculation processes for a model run from
+    the available cores and memory of the host, the number of items and
+    events of the model run, the number of samples, and the topology of a
+    calculation process - the ``eve -> getmodel -> gulcalc -> fmcalc ->
+    summarycalc`` chain and the summary outputs (``tee``, ``eltcalc``,
+    ``pltcalc``, ``aalcalc`` etc.) of the analysis settings, every one of
+    which is a separate OS process per calculation process.
+
+    The CPU and memory use of a calculation process are estimated from its
+    processes (see ``cpu_weights``) and from the number of items and
+    samples or, if the event set is large enough for it to be worth it
+    (``calibration_min_events``), measured by a calibration run of a single
+    calculation process on a sample of the events with the ktools
+    orchestrator. The number of processes is then the largest which fits
+    the cores and ``memory_fraction`` of the available memory of the
+    ``num_nodes`` nodes which run them (each taken to be like this host,
+    or with a node per process if ``num_nodes`` is ``None``), which gives
+    each process at least ``min_events_per_process`` events and, if a
+    process budget (``max_num_processes``) is given, whose script keeps
+    within the budget (see ``OasisKtoolsScriptBuilder``).
+
+    The plan - the number of processes, the inputs and the limits which
+    determined it - is returned as a dict (see ``plan``), and can be
+    written to the model run directory as JSON.
+    """
+
+    # Estimated number of cores used by each ktools process of a
+    # calculation process, by name - other processes (``eve``, ``cat``,
+    # ``tee``, ``eltcalc``, ``pltcalc``, ``aalcalc`` etc.) mostly wait on
+    # their inputs
+    cpu_weights = {
+        'getmodel': 0.5,
+        'gulcalc': 1.0,
+        'fmcalc': 0.5,
+        'summarycalc': 0.25
+    }
+
+    default_cpu_weight = 0.1
+
+    # Estimated base memory of a ktools process (KB), and the bytes per
+    # item and sample held by gulcalc and fmcalc for an event
+    process_memory_kb = 8 * 1024
+
+    item_sample_bytes = 8
+
+    memory_fraction = 0.8
+
+    min_events_per_process = 1
+
+    calibration_num_events = 100
+
+    calibration_min_events = 10000
+
+    def __init__(self, model_run_dir_path, analysis_settings, calibrate=True, max_num_processes=None, num_nodes=1):
+        self._model_run_dir_path = model_run_dir_path
+        self._analysis_settings = analysis_settings
+        self._calibrate = calibrate
+        self._max_num_processes = max_num_processes
+        self._num_nodes = num_nodes
+        self.logger = logging.getLogger()
+
+
+    @classmethod
+    def create(cls, model_run_dir_path, analysis_settings, calibrate=True, max_num_processes=None, num_nodes=1):
+        return cls(
+            model_run_dir_path,
+            analysis_settings,
+            calibrate=calibrate,
+            max_num_processes=max_num_processes,
+            num_nodes=num_nodes
+        )
+
+
+    @property
+    def model_run_dir_path(self):
+        """
+        Model run directory path property - getter only.
+
+            :getter: Gets the model run directory path
+        """
+        return self._model_run_dir_path
+
+
+    @staticmethod
+    def get_num_cores():
+        """
+        Returns the number of cores available to this process.
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            return len(os.sched_getaffinity(0))
+        return multiprocessing.cpu_count()
+
+
+    @staticmethod
+    def get_available_memory_kb():
+        """
+        Returns the available memory of the host (KB), or ``None`` if it
+        is not known.
+        """
+        try:
+            with io.open('/proc/meminfo', 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1])
+        except (IOError, OSError, ValueError):
+            pass
+        try:
+            return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 1024
+        except (AttributeError, OSError, ValueError):
+            return None
+
+
+    def _get_file_path(self, *candidates):
+        for fp in candidates:
+            fp = os.path.join(self._model_run_dir_path, fp)
+            if os.path.exists(fp):
+                return fp
+        raise OasisException(
+            'Tuning the number of ktools processes requires {} in the model run directory {}'.format(
+                ' or '.join(candidates), self._model_run_dir_path
+            )
+        )
+
+
+    def get_num_items(self):
+        """
+        Returns the number of items of the model run (``input/items.bin``).
+        """
+        return (
+            os.path.getsize(self._get_file_path(os.path.join('input', 'items.bin'))) //
+            OasisEventPartitionPlanner.items_dtype.itemsize
+        )
+
+
+    def get_events_file_path(self):
+        """
+        Returns the path of the event set of the model run
+        (``input/events.bin``, or ``static/events.bin``).
+        """
+        return self._get_file_path(os.path.join('input', 'events.bin'), os.path.join('static', 'events.bin'))
+
+
+    def get_num_events(self):
+        """
+        Returns the number of events of the model run.
+        """
+        return os.path.getsize(self.get_events_file_path()) // 4
+
+
+    def get_process_names(self):
+        """
+        Returns the names of the ktools processes of a calculation process,
+        from the script of a partition (see
+        ``OasisKtoolsScriptBuilder.build_partition``).
+        """
+        script_lines = OasisKtoolsScriptBuilder.create(self._analysis_settings, 1).build_partition(1)
+        return [node.name for node in OasisKtoolsOrchestrator.create(self._model_run_dir_path, script_lines=script_lines).nodes]
+
+
+    def estimate(self, process_names, num_items, number_of_samples):
+        """
+        Returns the estimated number of cores and memory (KB) used by a
+        calculation process with the given ktools processes.
+        """
+        cpu = sum(self.cpu_weights.get(name, self.default_cpu_weight) for name in process_names)
+        item_buffers = sum(1 for name in process_names if name in ('gulcalc', 'fmcalc'))
+        memory_kb = (
+            len(process_names) * self.process_memory_kb +
+            item_buffers * num_items * (number_of_samples + 3) * self.item_sample_bytes // 1024
+        )
+        return cpu, memory_kb
+
+
+    def get_budget_num_processes(self, max_num_processes):
+        """
+        Returns the largest number of calculation processes whose script
+        keeps within the given budget of concurrent processes, deferring
+        summary sets if need be (see
+        ``OasisKtoolsScriptBuilder.get_peak_num_processes``) - at least 1.
+        """
+        lo, hi = 1, max(max_num_processes, 1)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            builder = OasisKtoolsScriptBuilder.create(self._analysis_settings, mid, max_num_processes=max_num_processes)
+            if builder.get_peak_num_processes() <= max_num_processes:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+
+    def calibrate(self, num_events=None):
+        """
+        Runs a single calculation process on an evenly spaced sample of the
+        events of the model run with the ktools orchestrator, in a
+        ``calibration`` folder of the model run directory (which is removed
+        afterwards), and returns the measured number of cores and peak
+        memory (KB) it used, the number of events in the sample, the elapsed
+        time and the number of ``tee`` fan-outs, which run in the
+        orchestrator and are not counted. The peak memory is the sum of the
+        peak RSS of the processes, which is only recorded on Linux (see
+        ``OasisKtoolsOrchestrator.get_trace``), and is ``None`` elsewhere.
+        """
+        num_events = num_events or self.calibration_num_events
+        event_ids = np.fromfile(self.get_events_file_path(), dtype='<i4')
+        if not len(event_ids):
+            raise OasisException('No events to calibrate with')
+        step = max(len(event_ids) // num_events, 1)
+        sample = np.sort(event_ids[::step][:num_events])
+
+        calibration_path = os.path.join(self._model_run_dir_path, 'calibration')
+        if os.path.exists(calibration_path):
+            shutil.rmtree(calibration_path)
+        os.mkdir(calibration_path)
+        try:
+            for d in ['input', 'static']:
+                os.symlink(os.path.abspath(os.path.join(self._model_run_dir_path, d)), os.path.join(calibration_path, d))
+            for d in ['fifo', 'output', 'work']:
+                os.mkdir(os.path.join(calibration_path, d))
+            sample.astype('<i4').tofile(os.path.join(calibration_path, 'events_sample.bin'))
+
+            script_lines = OasisKtoolsScriptBuilder.create(
+                self._analysis_settings, 1, event_partition_file_paths=['events_sample.bin']
+            ).build_partition(1)
+            # the peak RSS of the processes is only recorded in trace mode
+            orchestrator = OasisKtoolsOrchestrator.create(calibration_path, script_lines=script_lines, trace=True)
+            orchestrator.run()
+            trace = orchestrator.get_trace()
+        finally:
+            shutil.rmtree(calibration_path, ignore_errors=True)
+
+        # the fan-outs of ``tee`` commands are threads of the orchestrator,
+        # with no resource usage of their own
+        processes = [p for p in trace['processes'] if not p['fan_out']]
+        if any(p['user_cpu_time'] is None for p in processes):
+            raise OasisException('Process resource usage is not available on this platform')
+        elapsed_time = max(trace['elapsed_time'], 1e-3)
+        cpu = sum(p['user_cpu_time'] + p['system_cpu_time'] for p in processes) / elapsed_time
+        return {
+            'num_events': len(sample),
+            'elapsed_time': trace['elapsed_time'],
+            'cpu': cpu,
+            'memory_kb': (
+                sum(p['max_rss_kb'] for p in processes)
+                if all(p['max_rss_kb'] is not None for p in processes) else None
+            ),
+            'num_fan_outs': len(trace['processes']) - len(processes)
+        }
+
+
+    def plan(self):
+        """
+        Plans the number of ktools calculation processes for the model run,
+        and returns the plan as a dict - ``num_processes``, the inputs it
+        was chosen from, the estimated or measured CPU (cores) and memory
+        use of a calculation process, the limits on the number of processes
+        from the cores, memory, events and process budget, and the reasons
+        for the choice.
+        """
+        reasons = []
+
+        num_cores = self.get_num_cores()
+        memory_kb = self.get_available_memory_kb()
+        num_items = self.get_num_items()
+        num_events = self.get_num_events()
+        number_of_samples = self._analysis_settings.get('number_of_samples', 0) or 0
+        process_names = self.get_process_names()
+
+        cpu, process_memory_kb = self.estimate(process_names, num_items, number_of_samples)
+        calibration = None
+        if self._calibrate and num_events >= self.calibration_min_events:
+            try:
+                calibration = self.calibrate()
+            except (OasisException, OSError, IOError) as e:
+                self.logger.warning('ktools calibration run failed - using estimates: {}'.format(str(e)))
+                reasons.append('calibration run failed ({}) - using estimates'.format(str(e)))
+        elif self._calibrate:
+            reasons.append(
+                'no calibration run - {} events is fewer than {}'.format(num_events, self.calibration_min_events)
+            )
+
+        if calibration:
+            # A calibration process is short, so it can under-use its
+            # chain, but not by using fewer cores than one
+            cpu = max(calibration['cpu'], 1.0)
+            if calibration['memory_kb'] is not None:
+                process_memory_kb = calibration['memory_kb']
+            reasons.append(
+                'calibration run of {} events took {:.2f}s, using {:.2f} cores and {} KB{} per calculation process'.format(
+                    calibration['num_events'], calibration['elapsed_time'], calibration['cpu'], process_memory_kb,
+                    ' (estimated - the peak RSS is not available)' if calibration['memory_kb'] is None else ''
+                )
+            )
+            if calibration['num_fan_outs']:
+                reasons.append(
+                    '{} tee fan-out(s) not counted in the calibration CPU - they run in the ktools orchestrator'.format(
+                        calibration['num_fan_outs']
+                    )
+                )
+        else:
+            reasons.append(
+                'estimated {:.2f} cores and {} KB per calculation process of {} ktools processes ({} items, {} samples)'.format(
+                    cpu, process_memory_kb, len(process_names), num_items, number_of_samples
+                )
+            )
+
+        # the cores and memory limits are per node - with a node per
+        # process they do not limit the number of processes
+        limits = {
+            'cpu': max(int(num_cores / cpu), 1) * self._num_nodes if self._num_nodes else None,
+            'memory': (
+                max(int(memory_kb * self.memory_fraction // max(process_memory_kb, 1)), 1) * self._num_nodes
+                if memory_kb is not None and self._num_nodes else None
+            ),
+            'events': max(num_events // self.min_events_per_process, 1)
+        }
+        if self._num_nodes != 1:
+            reasons.append(
+                'calculation processes run on {}'.format(
+                    '{} nodes'.format(self._num_nodes) if self._num_nodes else 'a node each'
+                )
+            )
+        if self._max_num_processes:
+            limits['budget'] = self.get_budget_num_processes(self._max_num_processes)
+
+        num_processes = min(v for v in limits.values() if v is not None)
+        binding = sorted(k for k, v in limits.items() if v == num_processes)
+        reasons.append(
+            '{} processes - limited by {} ({})'.format(
+                num_processes,
+                ' and '.join(binding),
+                ', '.join('{}: {}'.format(k, limits[k]) for k in sorted(limits) if limits[k] is not None)
+            )
+        )
+
+        return {
+            'num_processes': num_processes,
+            'num_cores': num_cores,
+            'available_memory_kb': memory_kb,
+            'num_nodes': self._num_nodes,
+            'max_num_processes': self._max_num_processes,
+            'num_items': num_items,
+            'num_events': num_events,
+            'number_of_samples': number_of_samples,
+            'processes_per_calculation_process': len(process_names),
+            'calculation_process_cpu': cpu,
+            'calculation_process_memory_kb': process_memory_kb,
+            'calibration': calibration,
+            'limits': limits,
+            'reasons': reasons
+        }
+
+
+    def write_plan(self, plan, plan_file_path):
+        """
+        Writes a plan (see ``plan``) to a JSON file.
+        """
+        with io.open(plan_file_path, 'w', encoding='utf-8') as f:
+            f.write(u'{}'.format(json.dumps(plan, indent=4, sort_keys=True)))
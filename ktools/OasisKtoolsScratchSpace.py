@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisKtoolsScratchSpace'
+]
+
+import hashlib
+import os
+import shutil
+import sys
+
+if os.getcwd().split(os.path.sep)[-1] == 'ktools':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+
+class OasisKtoolsScratchSpace(object):
+    """
+    Places the ``fifo`` and ``work`` folders of a model run - the ktools
+    fifos, the ``work/kat`` intermediates and the ``aalcalc`` and
+    ``leccalc`` work folders - on a scratch volume, e.g. ``/dev/shm`` or a
+    local NVMe disk, instead of in the model run directory, which may be on
+    slow shared storage. Only the ``output`` files of the run (and its
+    inputs) are written to the model run directory.
+
+    The folders are kept in a scratch folder of the model run in the
+    scratch directory, named after the model run directory (see
+    ``run_scratch_dir_path``), and are linked into the model run directory
+    in place of its own ``fifo`` and ``work`` folders, so that the ktools
+    scripts, which use paths relative to the model run directory, run
+    unchanged. As the scratch folder of a model run is always the same, a
+    resumed run finds the work files of the earlier run.
+
+    The free space of the scratch volume is checked against a minimum
+    (``min_free_mb``) before the folders are placed on it - files on a
+    tmpfs such as ``/dev/shm`` take memory. ``release`` puts empty folders
+    back in the model run directory and removes the scratch folder.
+    """
+
+    folder_names = ['fifo', 'work']
+
+    default_min_free_mb = 1024
+
+    def __init__(self, model_run_dir_path, scratch_dir_path, min_free_mb=None):
+        self._model_run_dir_path = os.path.abspath(model_run_dir_path)
+        self._scratch_dir_path = os.path.abspath(scratch_dir_path)
+        self._min_free_mb = min_free_mb if min_free_mb is not None else self.default_min_free_mb
+        self._run_scratch_dir_path = os.path.join(
+            self._scratch_dir_path,
+            '{}-{}'.format(
+                os.path.basename(self._model_run_dir_path),
+                hashlib.md5(self._model_run_dir_path.encode('utf-8')).hexdigest()[:8]
+            )
+        )
+
+
+    @classmethod
+    def create(cls, model_run_dir_path, scratch_dir_path, min_free_mb=None):
+        return cls(model_run_dir_path, scratch_dir_path, min_free_mb=min_free_mb)
+
+
+    @property
+    def model_run_dir_path(self):
+        """
+        Model run directory path property - getter only.
+
+            :getter: Gets the model run directory path
+        """
+        return self._model_run_dir_path
+
+
+    @property
+    def scratch_dir_path(self):
+        """
+        Scratch directory path property - getter only.
+
+            :getter: Gets the scratch directory path, e.g. ``/dev/shm``
+        """
+        return self._scratch_dir_path
+
+
+    @property
+    def min_free_mb(self):
+        """
+        Minimum free space property - getter only.
+
+            :getter: Gets the minimum free space (MB) of the scratch volume
+                     for placing the folders on it
+        """
+        return self._min_free_mb
+
+
+    @property
+    def run_scratch_dir_path(self):
+        """
+        Model run scratch folder path property - getter only.
+
+            :getter: Gets the path of the scratch folder of the model run -
+                     ``<model run directory name>-<hash of its path>`` in
+                     the scratch directory
+        """
+        return self._run_scratch_dir_path
+
+
+    @staticmethod
+    def get_free_mb(path):
+        """
+        Returns the free space (MB) of the volume of a path, or ``None`` if
+        it is not known.
+        """
+        if not hasattr(os, 'statvfs'):
+            return None
+        try:
+            st = os.statvfs(path)
+        except OSError:
+            return None
+        return st.f_bavail * st.f_frsize // (1024 * 1024)
+
+
+    def check_free_space(self):
+        """
+        Checks that the scratch directory exists and that its volume has at
+        least the minimum free space, and returns the free space (MB), or
+        ``None`` if it is not known.
+        """
+        if not os.path.isdir(self._scratch_dir_path):
+            raise OasisException('The ktools scratch directory {} does not exist'.format(self._scratch_dir_path))
+        free_mb = self.get_free_mb(self._scratch_dir_path)
+        if free_mb is not None and free_mb < self._min_free_mb:
+            raise OasisException(
+                'The ktools scratch directory {} has {} MB free - at least {} MB is required'.format(
+                    self._scratch_dir_path, free_mb, self._min_free_mb
+                )
+            )
+        return free_mb
+
+
+    def is_placed(self):
+        """
+        Returns whether the folders of the model run are on the scratch
+        volume.
+        """
+        return all(
+            os.path.islink(os.path.join(self._model_run_dir_path, d)) and
+            os.path.realpath(os.path.join(self._model_run_dir_path, d)) ==
+            os.path.realpath(os.path.join(self._run_scratch_dir_path, d))
+            for d in self.folder_names
+        )
+
+
+    def place(self):
+        """
+        Places the folders of the model run on the scratch volume, after
+        checking its free space - any files already in the folders of the
+        model run directory are moved to the scratch folder. Returns the
+        path of the scratch folder of the model run.
+        """
+        self.check_free_space()
+        if not hasattr(os, 'symlink'):
+            raise OasisException('Placing the ktools folders in a scratch directory requires symlinks')
+
+        try:
+            for d in self.folder_names:
+                link_path = os.path.join(self._model_run_dir_path, d)
+                target_path = os.path.join(self._run_scratch_dir_path, d)
+                if os.path.islink(link_path) and os.path.realpath(link_path) == os.path.realpath(target_path):
+                    continue
+                if not os.path.isdir(target_path):
+                    os.makedirs(target_path)
+                if os.path.islink(link_path):
+                    os.remove(link_path)
+                elif os.path.isdir(link_path):
+                    for fn in os.listdir(link_path):
+                        dst = os.path.join(target_path, fn)
+                        if os.path.isdir(dst) and not os.path.islink(dst):
+                            shutil.rmtree(dst)
+                        elif os.path.lexists(dst):
+                            os.remove(dst)
+                        shutil.move(os.path.join(link_path, fn), dst)
+                    os.rmdir(link_path)
+                os.symlink(target_path, link_path)
+        except (IOError, OSError) as e:
+            raise OasisException('Error placing the ktools folders in {}: {}'.format(self._run_scratch_dir_path, e))
+
+        return self._run_scratch_dir_path
+
+
+    def release(self, keep_work=False):
+        """
+        Replaces the links to the scratch folders in the model run
+        directory with empty folders and removes the scratch folder of the
+        model run - unless ``keep_work`` is set, in which case the ``work``
+        folder (e.g. of a failed partitioned run, which can be resumed) is
+        kept on the scratch volume, and only the ``fifo`` folder is removed.
+        """
+        try:
+            for d in self.folder_names:
+                if keep_work and d == 'work':
+                    continue
+                link_path = os.path.join(self._model_run_dir_path, d)
+                if os.path.islink(link_path):
+                    os.remove(link_path)
+                    os.mkdir(link_path)
+                shutil.rmtree(os.path.join(self._run_scratch_dir_path, d), ignore_errors=True)
+            if not keep_work:
+                shutil.rmtree(self._run_scratch_dir_path, ignore_errors=True)
+        except (IOError, OSError) as e:
+            raise OasisException('Error releasing the ktools scratch folder {}: {}'.format(self._run_scratch_dir_path, e))
@@ -0,0 +1,1311 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisKtoolsScriptBuilder'
+]
+
+import io
+import json
+import os
+import sys
+
+if os.getcwd().split(os.path.sep)[-1] == 'ktools':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+
+class _Script(object):
+    """
+    The lines and process counters of a script being built - a new one is
+    used for each build, so that builds do not share any state. A checked
+    script fails as soon as any of its processes fails - every background
+    process is counted, and waited for with ``wait -n`` (bash 4.3+). The
+    summary sets of a script which are deferred to keep it within a process
+    budget are given as ``(runtype, summary set ID)`` pairs.
+    """
+
+    __slots__ = (
+        'lines', 'checked', 'deferred',
+        'pid_count', 'apid_count', 'lpid_count', 'kpid_count', 'spid_count', 'dpid_count', 'opid_count',
+        'gpid_count'
+    )
+
+    def __init__(self, checked=False, deferred=None):
+        self.lines = []
+        self.checked = checked
+        self.deferred = deferred or set()
+        self.pid_count = 0
+        self.apid_count = 0
+        self.lpid_count = 0
+        self.kpid_count = 0
+        self.spid_count = 0
+        self.dpid_count = 0
+        self.opid_count = 0
+        self.gpid_count = 0
+
+    def add(self, cmd):
+        self.lines.append(cmd)
+
+
+class OasisKtoolsScriptBuilder(object):
+    """
+    Builds the ktools losses (bash) script for an Oasis model, given its
+    analysis settings and the number of ktools calculation processes to use.
+    By default each process gets its events from ``eve``, but the events of
+    each process can also be read from a file of event IDs, e.g. a
+    load-balanced event partition (see ``OasisEventPartitionPlanner``).
+
+    There is no global barrier between the calculations and the final
+    ``kat``, ``aalsummary`` and ``leccalc`` steps - the processes of each
+    summary set run in a subshell of their own, which runs the set's final
+    steps as soon as the set's work files are complete, so that a set with
+    few outputs does not wait for the slowest set. Instead of a ``kat`` of
+    all the processes' ``eltcalc``, ``pltcalc`` and ``summarycalc`` work
+    files after the calculations, the subshell appends the work files of
+    each process to the set's output files as soon as the process's
+    outputs are complete, in process order - with ``cat``, which copies
+    within the kernel (``copy_file_range``) where the filesystem supports
+    it - so that only the merge of the last process is left after the
+    calculations. The scripts of single processes and the gather script
+    (see ``build_gather``) still use ``kat``.
+
+    Every summary set of every process has its own ``tee`` and output
+    processes, so the number of concurrent processes grows with the number
+    of processes times the number of summary sets. If a process budget (a
+    maximum number of concurrent processes) is given then the summary sets
+    are deferred, starting from the last, until the expected peak number of
+    processes of the script is within the budget - the ``summarycalc``
+    output of a deferred set is written to a work file instead of a fifo,
+    and the set's output processes and final steps are run from the work
+    files after the calculations, in batches which fit in the budget (see
+    ``get_peak_num_processes``). The budget only applies to the full
+    script, not to the scripts of single processes (partitions).
+
+    The commands of each process - the events, model, ``fmcalc`` and
+    ``summarycalc`` processes and the process's ``tee`` and output
+    processes - can be pinned to a core set and NUMA node by prefixing them
+    with a per-process pinning command, e.g. ``numactl`` or ``taskset``
+    (see ``OasisKtoolsCpuLayout``).
+
+    The ``leccalc`` work files - the whole summarycalc stream of a summary
+    set, which can be very large - can be compressed with a streaming codec
+    (see ``work_codecs``): the ``tee`` of the set writes the stream to a
+    compressor process, which writes the compressed work file
+    (``P<n>.bin.<ext>``), and for ``leccalc`` each work file is replaced by
+    a fifo (``P<n>.bin``) fed by a decompressor process, so that the
+    uncompressed stream is never written to disk - ``leccalc`` reads each
+    work file once, in sequence. The uncompressed and compressed sizes of
+    the work files are recorded in ``work/codec_stats`` (see
+    ``get_work_codec_stats``). The work files of deferred summary sets,
+    which are read by all the set's output processes, are not compressed.
+
+    The ground up loss (GUL) streams of ``gulcalc`` can be captured to, or
+    replayed from, files (see ``OasisKtoolsGulStream``). In capture mode
+    ``gulcalc`` writes both its item and coverage streams for each process,
+    which are written to the process's stream files - through compressor
+    processes if the streams have a codec - by ``tee`` processes which
+    also feed ``fmcalc`` and the GUL ``summarycalc`` as usual. In replay
+    mode there is no ``eve``, ``getmodel`` or ``gulcalc`` - ``fmcalc`` and
+    the GUL ``summarycalc`` read the stream files of each process instead,
+    and so a replay can use other financial terms and summary options but
+    must have the number of processes of the capture.
+
+    The script is built in memory and written in a single call. All the
+    state of a build is local to the build, so builders (and a single
+    builder) can be used from many threads at once, e.g. to generate the
+    scripts for a batch of analyses.
+    """
+
+    # Streaming codecs for the leccalc work files - the compression and
+    # decompression commands (standard input to standard output) and the
+    # file extension
+    work_codecs = {
+        'lz4': ('lz4 -1 -q -c', 'lz4 -d -q -c', 'lz4'),
+        'zstd': ('zstd -1 -q -c', 'zstd -d -q -c', 'zst'),
+        'gzip': ('gzip -1 -c', 'gzip -d -c', 'gz')
+    }
+
+    def __init__(self, analysis_settings, max_process_id, get_getmodel_cmd=None, event_partition_file_paths=None, max_num_processes=None, pin_cmds=None, work_codec=None, gul_stream=None):
+        if event_partition_file_paths and len(event_partition_file_paths) != max_process_id:
+            raise OasisException(
+                'The number of event partition files ({}) is not the number of ktools calculation processes ({})'.format(
+                    len(event_partition_file_paths), max_process_id
+                )
+            )
+        if pin_cmds and len(pin_cmds) != max_process_id:
+            raise OasisException(
+                'The number of pinning commands ({}) is not the number of ktools calculation processes ({})'.format(
+                    len(pin_cmds), max_process_id
+                )
+            )
+        if work_codec and work_codec not in self.work_codecs:
+            raise OasisException(
+                'Invalid ktools work file codec {} - choices are {}'.format(work_codec, ', '.join(sorted(self.work_codecs)))
+            )
+        self._analysis_settings = analysis_settings
+        self._max_process_id = max_process_id
+        self._get_getmodel_cmd = get_getmodel_cmd or self.get_getmodel_cmd
+        self._event_partition_file_paths = event_partition_file_paths
+        self._max_num_processes = max_num_processes
+        self._pin_cmds = pin_cmds
+        self._work_codec = work_codec or None
+        self._gul_stream = gul_stream
+
+
+    @classmethod
+    def create(cls, analysis_settings, max_process_id, get_getmodel_cmd=None, event_partition_file_paths=None, max_num_processes=None, pin_cmds=None, work_codec=None, gul_stream=None):
+        return cls(
+            analysis_settings=analysis_settings,
+            max_process_id=max_process_id,
+            get_getmodel_cmd=get_getmodel_cmd,
+            event_partition_file_paths=event_partition_file_paths,
+            max_num_processes=max_num_processes,
+            pin_cmds=pin_cmds,
+            work_codec=work_codec,
+            gul_stream=gul_stream
+        )
+
+
+    @property
+    def analysis_settings(self):
+        """
+        Analysis settings property - getter only.
+
+            :getter: Gets the model analysis settings dict
+        """
+        return self._analysis_settings
+
+
+    @property
+    def max_process_id(self):
+        """
+        Number of ktools calculation processes property - getter only.
+
+            :getter: Gets the number of ktools calculation processes
+        """
+        return self._max_process_id
+
+
+    @property
+    def event_partition_file_paths(self):
+        """
+        Event partition file paths property - getter only.
+
+            :getter: Gets the paths of the event ID files of the processes,
+                     relative to the model run directory, in process order,
+                     or ``None`` if the events are partitioned by ``eve``
+        """
+        return self._event_partition_file_paths
+
+
+    @property
+    def max_num_processes(self):
+        """
+        Process budget property - getter only.
+
+            :getter: Gets the maximum number of concurrent processes of the
+                     script, or ``None`` if there is no budget
+        """
+        return self._max_num_processes
+
+
+    @property
+    def pin_cmds(self):
+        """
+        Pinning commands property - getter only.
+
+            :getter: Gets the command prefixes which pin the commands of
+                     each process to its cores, in process order, or
+                     ``None`` if the processes are not pinned
+        """
+        return self._pin_cmds
+
+
+    @property
+    def work_codec(self):
+        """
+        Work file codec property - getter only.
+
+            :getter: Gets the name of the codec of the ``leccalc`` work
+                     files (see ``work_codecs``), or ``None`` if they are
+                     not compressed
+        """
+        return self._work_codec
+
+
+    @property
+    def gul_stream(self):
+        """
+        GUL stream property - getter only.
+
+            :getter: Gets the ``OasisKtoolsGulStream`` which the GUL
+                     streams are captured to or replayed from, or ``None``
+        """
+        return self._gul_stream
+
+
+    def get_events_cmd(self, process_id):
+        """
+        Returns the command which writes the event IDs of a process.
+        """
+        if self._event_partition_file_paths:
+            return "cat {}".format(self._event_partition_file_paths[process_id - 1])
+        return "eve {} {}".format(process_id, self._max_process_id)
+
+
+    @staticmethod
+    def get_getmodel_cmd(
+            process_id_, max_process_id,
+            number_of_samples, gul_threshold,
+            use_random_number_file,
+            coverage_output, item_output):
+        """
+        Returns the default getmodel -> gulcalc command of a process.
+        """
+        #pylint: disable=I0011, W0613
+        cmd = "getmodel | gulcalc -S{} -L{}".format(number_of_samples, gul_threshold)
+
+        if use_random_number_file:
+            cmd = cmd + " -r"
+        if coverage_output != "":
+            cmd = cmd + " -c {}".format(coverage_output)
+        if item_output != "":
+            cmd = cmd + " -i {}".format(item_output)
+
+        return cmd
+
+
+    @staticmethod
+    def leccalc_enabled(lec_options):
+        for option in lec_options["outputs"]:
+            if lec_options["outputs"][option]:
+                return True
+        return False
+
+
+    def get_deferred_summary_sets(self):
+        """
+        Returns the ``(runtype, summary set ID)`` pairs of the summary sets
+        which the full script defers to keep within the process budget, in
+        script order.
+        """
+        deferred = []
+        if self._max_num_processes:
+            for runtype, summary in reversed(self._get_summary_sets()):
+                if self._get_peak_num_processes(deferred) <= self._max_num_processes:
+                    break
+                deferred.insert(0, (runtype, summary["id"]))
+        return deferred
+
+
+    def get_peak_num_processes(self):
+        """
+        Returns the expected peak number of concurrent processes (ktools
+        processes and subshells) of the full script - the larger of the
+        number during the calculations, when the event, model, ``fmcalc``
+        and ``summarycalc`` processes of all the processes run along with
+        the ``tee`` and output processes of the summary sets which are not
+        deferred, and the number after the calculations, when the final
+        steps of these sets run along with a batch of the deferred sets'
+        processes.
+        """
+        return self._get_peak_num_processes(self.get_deferred_summary_sets())
+
+
+    def build(self):
+        """
+        Builds the script and returns its lines (without line endings).
+        """
+        return self._build(
+            range(1, self._max_process_id + 1), compute=True, gather=True,
+            deferred=set(self.get_deferred_summary_sets())
+        )
+
+
+    def build_partition(self, process_id):
+        """
+        Builds the script of a single process (partition), for running it
+        separately from the other processes, e.g. on another node - the
+        script runs the process's calculations, up to the work files listed
+        by ``get_partition_output_file_paths``, but not the ``kat``,
+        ``aalsummary`` and ``leccalc`` steps. The script exits with an error
+        as soon as any of its processes fails, so that a failed partition
+        can be detected and retried. Returns the script lines.
+        """
+        if not 1 <= process_id <= self._max_process_id:
+            raise OasisException('Invalid ktools process ID {} - the number of processes is {}'.format(process_id, self._max_process_id))
+        return self._build([process_id], compute=True, gather=False)
+
+
+    def build_gather(self):
+        """
+        Builds the script which completes a run from the work files of all
+        the processes (see ``build_partition``) - the ``kat``,
+        ``aalsummary`` and ``leccalc`` steps. Returns the script lines.
+        """
+        return self._build([], compute=False, gather=True)
+
+
+    def get_partition_output_file_paths(self, process_id):
+        """
+        Returns the paths, relative to the model run directory, of the work
+        files written by a process (partition) and read by the ``kat``,
+        ``aalsummary`` and ``leccalc`` steps.
+        """
+        file_paths = []
+        for runtype in ["il", "gul"]:
+            if not self._analysis_settings.get("{}_output".format(runtype)):
+                continue
+            for summary in self._summaries(runtype):
+                summary_set = summary["id"]
+                for output in ["eltcalc", "summarycalc", "pltcalc"]:
+                    if summary.get(output):
+                        file_paths.append("work/kat/{}_S{}_{}_P{}".format(runtype, summary_set, output, process_id))
+                if summary.get("aalcalc"):
+                    file_paths.append("work/{}_S{}_aalcalc/P{}.bin".format(runtype, summary_set, process_id))
+                if summary.get("lec_output") and self.leccalc_enabled(summary["leccalc"]):
+                    if self._work_codec:
+                        file_paths.append(self._get_compressed_file_path(runtype, summary, process_id))
+                        file_paths.append(self._get_codec_stats_file_path(runtype, summary, process_id))
+                    else:
+                        file_paths.append("work/{}_S{}_summaryleccalc/P{}.bin".format(runtype, summary_set, process_id))
+        return file_paths
+
+
+    def get_work_codec_stats(self, model_run_dir_path):
+        """
+        Returns the uncompressed and compressed sizes (bytes) of the
+        compressed ``leccalc`` work files of a run of the script in the
+        given model run directory, as read from ``work/codec_stats``, as a
+        dict of ``<runtype>_S<summary set ID>`` to a dict of the
+        ``uncompressed_bytes`` and ``compressed_bytes`` of the set's work
+        files. Sets whose sizes were not recorded are left out.
+        """
+        stats = {}
+        for runtype, summary in self._get_summary_sets():
+            if not self._is_compressed(_Script(), runtype, summary):
+                continue
+            uncompressed_bytes = 0
+            compressed_bytes = None
+            try:
+                for process_id in range(1, self._max_process_id + 1):
+                    with io.open(os.path.join(model_run_dir_path, self._get_codec_stats_file_path(runtype, summary, process_id)), 'r', encoding='utf-8') as f:
+                        uncompressed_bytes += int(f.read().split()[0])
+                with io.open(os.path.join(model_run_dir_path, self._get_codec_stats_file_path(runtype, summary)), 'r', encoding='utf-8') as f:
+                    # ``wc -c`` of the compressed files - the last line is
+                    # the total if there is more than one file
+                    compressed_bytes = int(f.read().splitlines()[-1].split()[0])
+            except (IOError, OSError, ValueError, IndexError):
+                continue
+            stats["{}_S{}".format(runtype, summary["id"])] = {
+                "uncompressed_bytes": uncompressed_bytes,
+                "compressed_bytes": compressed_bytes
+            }
+        return stats
+
+
+    def write_work_codec_stats(self, model_run_dir_path, stats_file_path, elapsed_time=None):
+        """
+        Writes the sizes of the compressed ``leccalc`` work files of a run
+        of the script (see ``get_work_codec_stats``) to a JSON file, with
+        the codec, the total uncompressed and compressed sizes, the
+        compression ratio and, if the elapsed time (seconds) of the run is
+        given, the throughput - the uncompressed MB of work files written
+        per second of the run - and returns them as a dict.
+        """
+        summary_sets = self.get_work_codec_stats(model_run_dir_path)
+        uncompressed_bytes = sum(stats["uncompressed_bytes"] for stats in summary_sets.values())
+        compressed_bytes = sum(stats["compressed_bytes"] for stats in summary_sets.values())
+        for stats in summary_sets.values():
+            stats["ratio"] = (
+                round(float(stats["uncompressed_bytes"]) / stats["compressed_bytes"], 3) if stats["compressed_bytes"] else None
+            )
+        work_codec_stats = {
+            "codec": self._work_codec,
+            "summary_sets": summary_sets,
+            "uncompressed_bytes": uncompressed_bytes,
+            "compressed_bytes": compressed_bytes,
+            "ratio": round(float(uncompressed_bytes) / compressed_bytes, 3) if compressed_bytes else None,
+            "elapsed_time": round(elapsed_time, 3) if elapsed_time is not None else None,
+            "throughput_mb_per_s": (
+                round(uncompressed_bytes / (1024.0 * 1024) / elapsed_time, 3) if elapsed_time else None
+            )
+        }
+        with io.open(stats_file_path, 'w', encoding='utf-8') as f:
+            f.write(u'{}'.format(json.dumps(work_codec_stats, indent=4, sort_keys=True)))
+        return work_codec_stats
+
+
+    @classmethod
+    def is_work_codec_available(cls, work_codec):
+        """
+        Returns whether the command line tool of a work file codec (see
+        ``work_codecs``) is found on the ``PATH``.
+        """
+        tool = cls.work_codecs[work_codec][0].split()[0]
+        for path in os.environ.get('PATH', '').split(os.pathsep):
+            if path and os.access(os.path.join(path, tool), os.X_OK):
+                return True
+        return False
+
+
+    def _build(self, process_ids, compute=True, gather=True, deferred=None):
+        analysis_settings = self._analysis_settings
+        max_process_id = self._max_process_id
+
+        script = _Script(checked=(compute and not gather), deferred=deferred)
+
+        gul_threshold = 0
+        number_of_samples = 0
+        use_random_number_file = False
+        gul_output = False
+        il_output = False
+
+        if "gul_threshold" in analysis_settings:
+            gul_threshold = analysis_settings["gul_threshold"]
+
+        if "number_of_samples" in analysis_settings:
+            number_of_samples = analysis_settings["number_of_samples"]
+
+        if "model_settings" in analysis_settings:
+            if "use_random_number_file" in analysis_settings["model_settings"]:
+                if analysis_settings["model_settings"]["use_random_number_file"]:
+                    use_random_number_file = True
+
+        if "gul_output" in analysis_settings:
+            gul_output = analysis_settings["gul_output"]
+
+        if "il_output" in analysis_settings:
+            il_output = analysis_settings["il_output"]
+
+        script.add("#!/bin/bash")
+        if script.checked:
+            script.add("set -e -o pipefail")
+
+        script.add("")
+
+        script.add("rm -R -f output/*")
+        if compute:
+            script.add("rm -R -f fifo/*")
+            script.add("rm -R -f work/*")
+        script.add("")
+
+        if compute:
+            script.add("mkdir work/kat")
+            if any(self._is_compressed(script, runtype, summary) for runtype, summary in self._get_summary_sets()):
+                script.add("mkdir work/codec_stats")
+
+            if gul_output:
+                self._do_make_fifos(script, "gul", process_ids)
+                self._create_workfolders(script, "gul")
+
+            script.add("")
+
+            if il_output:
+                self._do_make_fifos(script, "il", process_ids)
+                self._create_workfolders(script, "il")
+
+            script.add("")
+            script.add("# --- Do insured loss computes ---")
+            script.add("")
+            if il_output:
+                self._do_computes(script, "il", process_ids, gather=gather)
+
+            script.add("")
+            script.add("# --- Do ground up loss  computes ---")
+            script.add("")
+            if gul_output:
+                self._do_computes(script, "gul", process_ids, gather=gather)
+
+            script.add("")
+
+            if self._gul_stream:
+                self._do_gul_stream_fifos(script, "mkfifo", process_ids)
+
+            for process_id in process_ids:
+                if self._gul_stream:
+                    self._do_gul_stream_process(
+                        script, process_id,
+                        number_of_samples, gul_threshold, use_random_number_file)
+
+                elif gul_output and il_output:
+                    getmodel_cmd = self._get_getmodel_cmd(
+                        process_id, max_process_id,
+                        number_of_samples, gul_threshold, use_random_number_file,
+                        "fifo/gul_P{}".format(process_id),
+                        "-")
+                    self._do_background_process(
+                        script,
+                        self._pin(process_id, "{1} | {2} | fmcalc > fifo/il_P{0}  &".format(
+                            process_id, self.get_events_cmd(process_id), getmodel_cmd)))
+
+                else:
+                    #  Now the mainprocessing
+                    if gul_output:
+                        if "gul_summaries" in analysis_settings:
+                            getmodel_cmd = self._get_getmodel_cmd(
+                                process_id, max_process_id,
+                                number_of_samples, gul_threshold,
+                                use_random_number_file,
+                                "-",
+                                "")
+                            self._do_background_process(
+                                script,
+                                self._pin(process_id, "{1} | {2} > fifo/gul_P{0}  &".format(
+                                    process_id, self.get_events_cmd(process_id), getmodel_cmd)))
+
+                    if il_output:
+                        if "il_summaries" in analysis_settings:
+                            getmodel_cmd = self._get_getmodel_cmd(
+                                process_id, max_process_id,
+                                number_of_samples, gul_threshold,
+                                use_random_number_file,
+                                "",
+                                "-")
+                            self._do_background_process(
+                                script,
+                                self._pin(process_id, "{1} | {2} | fmcalc > fifo/il_P{0}  &".format(
+                                    process_id, self.get_events_cmd(process_id), getmodel_cmd)))
+
+            script.add("")
+
+            if gather:
+                if script.deferred:
+                    # waits for the calculations, which write the work
+                    # files of the deferred summary sets
+                    self._do_waits(script, "pid", script.pid_count)
+                    self._do_deferred_summary_sets(script, process_ids)
+                # waits for the summary sets, which run their own kat,
+                # aalsummary and leccalc steps
+                self._do_waits(script, "spid", script.spid_count)
+            else:
+                self._do_waits(script, "pid", script.pid_count)
+            # waits for the GUL stream compressors
+            self._do_waits(script, "gpid", script.gpid_count)
+
+        if gather and not compute:
+            script.add("")
+            script.add("# --- Do insured loss kats ---")
+            script.add("")
+            if il_output:
+                self._do_kats(script, "il")
+
+            script.add("")
+            script.add("# --- Do ground up loss kats ---")
+            script.add("")
+            if gul_output:
+                self._do_kats(script, "gul")
+
+            script.add("")
+            # aalsummary and leccalc do not read the kat outputs, and so run
+            # alongside the kats
+            if il_output:
+                self._do_post_wait_processing(script, "il")
+            if gul_output:
+                self._do_post_wait_processing(script, "gul")
+
+            self._do_waits(script, "kpid", script.kpid_count)
+            self._do_waits(script, "apid", script.apid_count)    # waits for aalcalc
+            self._do_waits(script, "lpid", script.lpid_count)    # waits for leccalc
+
+        if gul_output:
+            if compute:
+                self._do_remove_fifos(script, "gul", process_ids)
+            if gather:
+                self._remove_workfolders(script, "gul")
+
+        script.add("")
+
+        if il_output:
+            if compute:
+                self._do_remove_fifos(script, "il", process_ids)
+            if gather:
+                self._remove_workfolders(script, "il")
+
+        if compute and self._gul_stream:
+            script.add("")
+            self._do_gul_stream_fifos(script, "rm", process_ids)
+
+        return script.lines
+
+
+    def write(self, output_file_path, lines=None):
+        """
+        Builds the script (or takes the given script lines, e.g. of a
+        partition script) and writes it to the given file path, replacing
+        any existing file, in a single buffered write. Returns the lines of
+        the script.
+        """
+        if lines is None:
+            lines = self.build()
+        with io.open(output_file_path, 'w', encoding='utf-8') as f:
+            f.write(u''.join(u'{}\n'.format(l) for l in lines))
+        return lines
+
+
+    def _summaries(self, runtype):
+        return [
+            summary for summary in self._analysis_settings.get("{}_summaries".format(runtype), [])
+            if "id" in summary
+        ]
+
+
+    def _get_summary_sets(self):
+        # the (runtype, summary) pairs of the full script, in script order
+        return [
+            (runtype, summary)
+            for runtype in ["il", "gul"] if self._analysis_settings.get("{}_output".format(runtype))
+            for summary in self._summaries(runtype)
+        ]
+
+
+    @staticmethod
+    def _get_summary_output_names(summary):
+        return [output for output in ["eltcalc", "summarycalc", "pltcalc", "aalcalc"] if summary.get(output)]
+
+
+    @staticmethod
+    def _get_summary_merge_output_names(summary):
+        # the outputs which are concatenated across the processes, in the
+        # order of the kats
+        return [output for output in ["eltcalc", "pltcalc", "summarycalc"] if summary.get(output)]
+
+
+    def _get_num_summary_final_steps(self, summary):
+        num_steps = len([output for output in ["eltcalc", "pltcalc", "summarycalc", "aalcalc"] if summary.get(output)])
+        if summary.get("lec_output") and "leccalc" in summary and self.leccalc_enabled(summary["leccalc"]):
+            num_steps += 1
+        return num_steps
+
+
+    def _get_num_calculation_processes(self):
+        # the processes of the events -> getmodel -> gulcalc -> fmcalc
+        # pipelines and summarycalc of a single process
+        analysis_settings = self._analysis_settings
+        gul_output = analysis_settings.get("gul_output")
+        il_output = analysis_settings.get("il_output")
+        num_model_processes = self._get_getmodel_cmd(
+            1, self._max_process_id, 0, 0, False, "-", "").count("|") + 1
+
+        num_processes = 0
+        gul_stream = self._gul_stream
+        if gul_stream and gul_stream.mode == "capture":
+            # the item and coverage tees, and their compressors
+            num_processes = num_model_processes + 2
+            if il_output and "il_summaries" in analysis_settings:
+                num_processes += 1
+            if gul_stream.codec:
+                num_processes += 2
+        elif gul_stream:
+            if il_output and "il_summaries" in analysis_settings:
+                num_processes += 2 if gul_stream.codec else 1
+            if gul_output and "gul_summaries" in analysis_settings:
+                num_processes += 1
+        elif gul_output and il_output:
+            num_processes = num_model_processes + 2
+        else:
+            if gul_output and "gul_summaries" in analysis_settings:
+                num_processes += num_model_processes + 1
+            if il_output and "il_summaries" in analysis_settings:
+                num_processes += num_model_processes + 2
+        for runtype in ["il", "gul"]:
+            if analysis_settings.get("{}_output".format(runtype)) and "{}_summaries".format(runtype) in analysis_settings:
+                num_processes += 1
+        return num_processes
+
+
+    def _get_deferred_batch_size(self, deferred):
+        # the deferred processes run alongside the final steps of the other
+        # summary sets (and their subshells)
+        num_final_processes = sum(
+            1 + self._get_num_summary_final_steps(summary)
+            for runtype, summary in self._get_summary_sets() if (runtype, summary["id"]) not in deferred
+        )
+        return max(1, (self._max_num_processes or 0) - num_final_processes)
+
+
+    def _get_peak_num_processes(self, deferred):
+        num_processes = self._max_process_id
+        num_compute_processes = num_processes * self._get_num_calculation_processes()
+        num_final_processes = 0
+        num_deferred_outputs = 0
+        num_deferred_final_steps = 0
+        for runtype, summary in self._get_summary_sets():
+            num_outputs = num_processes * len(self._get_summary_output_names(summary))
+            num_final_steps = self._get_num_summary_final_steps(summary)
+            if self._is_compressed(_Script(deferred=deferred), runtype, summary):
+                # the compressor and the byte count of each process, and
+                # later the decompressor of each process and the subshell
+                # of leccalc
+                num_outputs += 2 * num_processes
+                num_final_steps += num_processes + 1
+            if (runtype, summary["id"]) in deferred:
+                num_deferred_outputs += num_outputs
+                num_deferred_final_steps += num_final_steps
+            else:
+                # the subshell, tees, outputs and merge (one at a time) of
+                # the set, and later the subshell and the rest of the final
+                # steps
+                num_merge_outputs = len(self._get_summary_merge_output_names(summary))
+                num_compute_processes += 1 + num_processes + num_outputs + min(1, num_merge_outputs)
+                num_final_processes += 1 + num_final_steps - num_merge_outputs
+
+        num_deferred_processes = 0
+        if deferred:
+            num_deferred_processes = min(
+                self._get_deferred_batch_size(deferred),
+                max(num_deferred_outputs, num_deferred_final_steps)
+            )
+        return max(num_compute_processes, num_final_processes + num_deferred_processes)
+
+
+    def _get_summary_file_path(self, runtype, summary, process_id):
+        # the summarycalc output of a deferred summary set, which is also the
+        # set's leccalc input if it has one
+        if summary.get("lec_output") and self.leccalc_enabled(summary["leccalc"]):
+            return "work/{}_S{}_summaryleccalc/P{}.bin".format(runtype, summary["id"], process_id)
+        return "work/{}_S{}_summary_P{}.bin".format(runtype, summary["id"], process_id)
+
+
+    def _is_compressed(self, script, runtype, summary):
+        # whether the leccalc work files of a summary set are compressed
+        return bool(
+            self._work_codec and summary.get("lec_output") and "leccalc" in summary and
+            self.leccalc_enabled(summary["leccalc"]) and (runtype, summary["id"]) not in script.deferred
+        )
+
+
+    def _get_compressed_file_path(self, runtype, summary, process_id):
+        return "work/{}_S{}_summaryleccalc/P{}.bin.{}".format(
+            runtype, summary["id"], process_id, self.work_codecs[self._work_codec][2])
+
+
+    def _get_codec_stats_file_path(self, runtype, summary, process_id=None):
+        # the uncompressed size of the work file of a process, or the
+        # compressed sizes of the work files of all the processes
+        if process_id is None:
+            return "work/codec_stats/{}_S{}_compressed".format(runtype, summary["id"])
+        return "work/codec_stats/{}_S{}_P{}_uncompressed".format(runtype, summary["id"], process_id)
+
+
+    def _do_post_wait_processing(self, script, runtype):
+        for summary in self._summaries(runtype):
+            self._do_summary_post_processing(script, runtype, summary)
+
+
+    def _do_summary_post_processing(self, script, runtype, summary, counted=True):
+        summary_set = summary["id"]
+        if summary.get("aalcalc"):
+            cmd = "aalsummary -K{0}_S{1}_aalcalc > output/{0}_S{1}_aalcalc.csv &".format(runtype, summary_set)
+            if counted:
+                script.apid_count = script.apid_count + 1
+                cmd = cmd + " apid{}=$!".format(script.apid_count)
+            script.add(cmd)
+        if summary.get("lec_output"):
+            if "leccalc" in summary:
+                if self.leccalc_enabled(summary["leccalc"]):
+                    return_period_option = ""
+                    if summary["leccalc"]["return_period_file"]:
+                        return_period_option = "-r"
+                    compressed = self._is_compressed(script, runtype, summary)
+                    if compressed:
+                        self._do_decompressions(script, runtype, summary)
+                    cmd = "leccalc {} -K{}_S{}_summaryleccalc".format(return_period_option, runtype, summary_set)
+                    for option in summary["leccalc"]["outputs"]:
+                        switch = ""
+                        if summary["leccalc"]["outputs"][option]:
+                            if option == "full_uncertainty_aep":
+                                switch = "-F"
+                            if option == "wheatsheaf_aep":
+                                switch = "-W"
+                            if option == "sample_mean_aep":
+                                switch = "-S"
+                            if option == "full_uncertainty_oep":
+                                switch = "-f"
+                            if option == "wheatsheaf_oep":
+                                switch = "-w"
+                            if option == "sample_mean_oep":
+                                switch = "-s"
+                            if option == "wheatsheaf_mean_aep":
+                                switch = "-M"
+                            if option == "wheatsheaf_mean_oep":
+                                switch = "-m"
+                            cmd = cmd + " {} output/{}_S{}_leccalc_{}.csv".format(switch, runtype, summary_set, option)
+                    if compressed:
+                        # leccalc runs in a subshell which then opens and
+                        # closes the decompressors' fifos, so that a
+                        # decompressor whose fifo leccalc did not open
+                        # (if it failed) is not left blocked
+                        script.add("(")
+                        script.add(cmd)
+                        for process_id in range(1, self._max_process_id + 1):
+                            script.add(": <> work/{}_S{}_summaryleccalc/P{}.bin".format(runtype, summary_set, process_id))
+                        cmd = ")"
+                    if counted:
+                        script.lpid_count = script.lpid_count + 1
+                        cmd = cmd + "  &  lpid{}=$!".format(script.lpid_count)
+                    else:
+                        cmd = cmd + "  &"
+                    script.add(cmd)
+
+
+    def _do_decompressions(self, script, runtype, summary):
+        # records the compressed sizes of the set's leccalc work files, and
+        # replaces each work file with a fifo fed by a decompressor
+        process_ids = range(1, self._max_process_id + 1)
+        script.add("wc -c {} > {}".format(
+            " ".join(self._get_compressed_file_path(runtype, summary, process_id) for process_id in process_ids),
+            self._get_codec_stats_file_path(runtype, summary)))
+        for process_id in process_ids:
+            script.add("mkfifo work/{}_S{}_summaryleccalc/P{}.bin".format(runtype, summary["id"], process_id))
+        for process_id in process_ids:
+            script.add("{} < {} > work/{}_S{}_summaryleccalc/P{}.bin &".format(
+                self.work_codecs[self._work_codec][1], self._get_compressed_file_path(runtype, summary, process_id),
+                runtype, summary["id"], process_id))
+
+
+    def _do_fifos(self, script, action, runtype, process_id):
+        if "{}_summaries".format(runtype) not in self._analysis_settings:
+            return
+
+        script.add("{} fifo/{}_P{}".format(action, runtype, process_id))
+        script.add("")
+        for summary in self._summaries(runtype):
+            summary_set = summary["id"]
+            if (runtype, summary_set) in script.deferred:
+                continue
+            script.add(
+                "{} fifo/{}_S{}_summary_P{}".format(
+                    action, runtype, summary_set, process_id))
+            if summary.get("eltcalc"):
+                script.add(
+                    "{} fifo/{}_S{}_summaryeltcalc_P{}".format(
+                        action, runtype, summary_set, process_id))
+                script.add(
+                    "{} fifo/{}_S{}_eltcalc_P{}".format(
+                        action, runtype, summary_set, process_id))
+            if summary.get("summarycalc"):
+                script.add(
+                    "{} fifo/{}_S{}_summarysummarycalc_P{}".format(
+                        action, runtype, summary_set, process_id))
+                script.add(
+                    "{} fifo/{}_S{}_summarycalc_P{}".format(
+                        action, runtype, summary_set, process_id))
+            if summary.get("pltcalc"):
+                script.add(
+                    "{} fifo/{}_S{}_summarypltcalc_P{}".format(
+                        action, runtype, summary_set, process_id))
+                script.add(
+                    "{} fifo/{}_S{}_pltcalc_P{}".format(
+                        action, runtype, summary_set, process_id))
+            if summary.get("aalcalc"):
+                script.add(
+                    "{} fifo/{}_S{}_summaryaalcalc_P{}".format(
+                        action, runtype, summary_set, process_id))
+            if self._is_compressed(script, runtype, summary):
+                script.add(
+                    "{} fifo/{}_S{}_summaryleccalc_P{}".format(
+                        action, runtype, summary_set, process_id))
+                script.add(
+                    "{} fifo/{}_S{}_summaryleccalcbytes_P{}".format(
+                        action, runtype, summary_set, process_id))
+
+        script.add("")
+
+
+    def _do_make_fifos(self, script, runtype, process_ids):
+        for process_id in process_ids:
+            self._do_fifos(script, "mkfifo", runtype, process_id)
+
+
+    def _do_remove_fifos(self, script, runtype, process_ids):
+        for process_id in process_ids:
+            self._do_fifos(script, "rm", runtype, process_id)
+
+
+    def _create_workfolders(self, script, runtype):
+        for summary in self._summaries(runtype):
+            summary_set = summary["id"]
+            if summary.get("lec_output"):
+                if self.leccalc_enabled(summary["leccalc"]):
+                    script.add(
+                        "mkdir work/{}_S{}_summaryleccalc".format(
+                            runtype, summary_set))
+            if summary.get("aalcalc") is True:
+                script.add("mkdir work/{}_S{}_aalcalc".format(runtype, summary_set))
+
+
+    def _remove_workfolders(self, script, runtype):
+        script.add("rm -rf work/kat")
+        for summary in self._summaries(runtype):
+            summary_set = summary["id"]
+            if (runtype, summary_set) in script.deferred and not (
+                    summary.get("lec_output") and self.leccalc_enabled(summary["leccalc"])):
+                script.add("rm work/{}_S{}_summary_P*.bin".format(runtype, summary_set))
+            if summary.get("lec_output"):
+                if self.leccalc_enabled(summary["leccalc"]):
+                    script.add(
+                        "rm work/{}_S{}_summaryleccalc/*".format(
+                            runtype, summary_set))
+                    script.add(
+                        "rmdir work/{}_S{}_summaryleccalc".format(
+                            runtype, summary_set))
+            if summary.get("aalcalc"):
+                script.add(
+                    "rm work/{}_S{}_aalcalc/*".format(
+                        runtype, summary_set))
+                script.add("rmdir work/{}_S{}_aalcalc".format(
+                    runtype, summary_set))
+
+
+    def _do_kats(self, script, runtype):
+        anykats = False
+        for summary in self._summaries(runtype):
+            if self._do_summary_kats(script, runtype, summary):
+                anykats = True
+
+        return anykats
+
+
+    def _do_summary_kats(self, script, runtype, summary, counted=True):
+        anykats = False
+        summary_set = summary["id"]
+        for output in ["eltcalc", "pltcalc", "summarycalc"]:
+            if summary.get(output):
+                anykats = True
+                cmd = "kat "
+                for process_id in range(1, self._max_process_id + 1):
+                    cmd = cmd + "work/kat/{}_S{}_{}_P{} ".format(
+                        runtype, summary_set, output, process_id)
+                cmd = cmd + "> output/{}_S{}_{}.csv &".format(
+                    runtype, summary_set, output)
+                if counted:
+                    script.kpid_count = script.kpid_count + 1
+                    cmd = cmd + " kpid{}=$!".format(script.kpid_count)
+                script.add(cmd)
+
+        return anykats
+
+
+    def _do_summarycalcs(self, script, runtype, process_id):
+        summarycalc_switch = "-g"
+        if runtype == "il":
+            summarycalc_switch = "-f"
+        if "{}_summaries".format(runtype) in self._analysis_settings:
+            cmd = "summarycalc {} ".format(summarycalc_switch)
+            for summary in self._summaries(runtype):
+                summary_set = summary["id"]
+                if (runtype, summary_set) in script.deferred:
+                    cmd = cmd + "-{} {} ".format(
+                        summary_set, self._get_summary_file_path(runtype, summary, process_id))
+                else:
+                    cmd = cmd + "-{0} fifo/{1}_S{0}_summary_P{2} ".format(
+                        summary_set, runtype, process_id)
+            cmd = cmd + " < fifo/{}_P{} &".format(runtype, process_id)
+            self._do_background_process(script, self._pin(process_id, cmd))
+
+
+    def _do_tees(self, script, runtype, process_id):
+        for summary in self._summaries(runtype):
+            self._do_summary_tee(script, runtype, summary, process_id)
+
+
+    def _do_summary_tee(self, script, runtype, summary, process_id, counted=True):
+        summary_set = summary["id"]
+        cmd = "tee < fifo/{}_S{}_summary_P{} ".format(
+            runtype, summary_set, process_id)
+        if summary.get("eltcalc"):
+            cmd = cmd + "fifo/{}_S{}_summaryeltcalc_P{} ".format(
+                runtype, summary_set, process_id)
+        if summary.get("pltcalc"):
+            cmd = cmd + "fifo/{}_S{}_summarypltcalc_P{} ".format(
+                runtype, summary_set, process_id)
+        if summary.get("summarycalc"):
+            cmd = cmd + "fifo/{}_S{}_summarysummarycalc_P{} ".format(
+                runtype, summary_set, process_id)
+        if summary.get("aalcalc"):
+            cmd = cmd + "fifo/{}_S{}_summaryaalcalc_P{} ".format(
+                runtype, summary_set, process_id)
+        if self._is_compressed(script, runtype, summary):
+            cmd = cmd + "fifo/{0}_S{1}_summaryleccalc_P{2} fifo/{0}_S{1}_summaryleccalcbytes_P{2} ".format(
+                runtype, summary_set, process_id)
+        elif summary.get("lec_output") and self.leccalc_enabled(summary["leccalc"]):
+            cmd = cmd + "work/{}_S{}_summaryleccalc/P{}.bin ".format(
+                runtype, summary_set, process_id)
+        cmd = self._pin(process_id, cmd + " > /dev/null &")
+        if counted:
+            script.pid_count = script.pid_count + 1
+            cmd = cmd + " pid{}=$!".format(script.pid_count)
+        script.add(cmd)
+
+
+    def _do_any(self, script, runtype, process_id):
+        if "{}_summaries".format(runtype) not in self._analysis_settings:
+            return
+
+        for summary in self._analysis_settings["{}_summaries".format(runtype)]:
+            if "id" in summary:
+                self._do_summary_outputs(script, runtype, summary, process_id)
+
+            script.add("")
+
+
+    def _do_summary_outputs(self, script, runtype, summary, process_id, counted=True):
+        for _, cmd in self._get_summary_output_cmds(script, runtype, summary, process_id):
+            if counted:
+                script.pid_count = script.pid_count + 1
+                cmd = cmd + " pid{}=$!".format(script.pid_count)
+            script.add(cmd)
+
+
+    def _get_summary_output_cmds(self, script, runtype, summary, process_id):
+        # the (output, command) pairs of the output processes of a summary
+        # set of a process
+        summary_set = summary["id"]
+        deferred = (runtype, summary_set) in script.deferred
+        cmds = []
+        for output, cmd_name in [
+            ("eltcalc", "eltcalc"), ("summarycalc", "summarycalctocsv"), ("pltcalc", "pltcalc"), ("aalcalc", "aalcalc")
+        ]:
+            if not summary.get(output):
+                continue
+            if deferred:
+                input_path = self._get_summary_file_path(runtype, summary, process_id)
+            else:
+                input_path = "fifo/{}_S{}_summary{}_P{}".format(runtype, summary_set, output, process_id)
+            if output == "aalcalc":
+                cmds.append((output, self._pin(process_id,
+                    "aalcalc < {3} > work/{0}_S{1}_aalcalc/P{2}.bin &".format(
+                        runtype, summary_set, process_id, input_path))))
+                continue
+            cmd = cmd_name
+            if process_id != 1:
+                cmd = cmd + " -s"
+            cmds.append((output, self._pin(process_id,
+                "{3} < {4} > work/kat/{0}_S{1}_{5}_P{2} &".format(
+                    runtype, summary_set, process_id, cmd, input_path, output))))
+        if self._is_compressed(script, runtype, summary):
+            cmds.append(("leccalc", self._pin(process_id,
+                "{} < fifo/{}_S{}_summaryleccalc_P{} > {} &".format(
+                    self.work_codecs[self._work_codec][0], runtype, summary_set, process_id,
+                    self._get_compressed_file_path(runtype, summary, process_id)))))
+            cmds.append(("leccalc", self._pin(process_id,
+                "wc -c < fifo/{}_S{}_summaryleccalcbytes_P{} > {} &".format(
+                    runtype, summary_set, process_id, self._get_codec_stats_file_path(runtype, summary, process_id)))))
+        return cmds
+
+
+    def _do_gul_stream_fifos(self, script, action, process_ids):
+        if self._gul_stream.mode != "capture":
+            return
+        for process_id in process_ids:
+            for stream in self._gul_stream.streams:
+                script.add("{} fifo/gul_stream_{}_P{}".format(action, stream, process_id))
+                if self._gul_stream.codec:
+                    script.add("{} fifo/gul_stream_{}_capture_P{}".format(action, stream, process_id))
+        script.add("")
+
+
+    def _do_gul_stream_process(self, script, process_id, number_of_samples, gul_threshold, use_random_number_file):
+        # the calculations of a process which capture the GUL streams to, or
+        # replay them from, the process's stream files
+        analysis_settings = self._analysis_settings
+        gul_stream = self._gul_stream
+        il = analysis_settings.get("il_output") and "il_summaries" in analysis_settings
+        gul = analysis_settings.get("gul_output") and "gul_summaries" in analysis_settings
+        outputs = {
+            "items": "| fmcalc > fifo/il_P{}".format(process_id) if il else "> /dev/null",
+            "coverages": "> fifo/gul_P{}".format(process_id) if gul else "> /dev/null"
+        }
+
+        if gul_stream.mode == "capture":
+            getmodel_cmd = self._get_getmodel_cmd(
+                process_id, self._max_process_id,
+                number_of_samples, gul_threshold, use_random_number_file,
+                "fifo/gul_stream_coverages_P{}".format(process_id),
+                "fifo/gul_stream_items_P{}".format(process_id))
+            self._do_background_process(
+                script,
+                self._pin(process_id, "{} | {} &".format(self.get_events_cmd(process_id), getmodel_cmd)))
+            for stream in gul_stream.streams:
+                if gul_stream.codec:
+                    capture_path = "fifo/gul_stream_{}_capture_P{}".format(stream, process_id)
+                    script.gpid_count = script.gpid_count + 1
+                    script.add(self._pin(process_id, "{} < {} > {} & gpid{}=$!".format(
+                        self.work_codecs[gul_stream.codec][0], capture_path,
+                        gul_stream.get_file_path(process_id, stream), script.gpid_count)))
+                else:
+                    capture_path = gul_stream.get_file_path(process_id, stream)
+                self._do_background_process(
+                    script,
+                    self._pin(process_id, "tee < fifo/gul_stream_{}_P{} {} {} &".format(
+                        stream, process_id, capture_path, outputs[stream])))
+            return
+
+        for stream in gul_stream.streams:
+            if (stream == "items" and not il) or (stream == "coverages" and not gul):
+                continue
+            file_path = gul_stream.get_file_path(process_id, stream)
+            if gul_stream.codec:
+                cmd = "{} < {} {} &".format(self.work_codecs[gul_stream.codec][1], file_path, outputs[stream])
+            elif stream == "items":
+                cmd = "fmcalc < {} > fifo/il_P{} &".format(file_path, process_id)
+            else:
+                cmd = "cat {} {} &".format(file_path, outputs[stream])
+            self._do_background_process(script, self._pin(process_id, cmd))
+
+
+    def _pin(self, process_id, cmd):
+        # prefixes every command of a pipeline of a process with the
+        # process's pinning command
+        if not self._pin_cmds:
+            return cmd
+        pin_cmd = self._pin_cmds[process_id - 1]
+        return " | ".join("{} {}".format(pin_cmd, stage.lstrip()) for stage in cmd.split(" | "))
+
+
+    def _do_summary_set(self, script, runtype, summary, process_ids):
+        # the consumers and tees of a summary set run in a subshell, which
+        # merges the outputs of each process as soon as they are complete,
+        # and then waits for the rest and runs the set's aalsummary and
+        # leccalc steps, so that these start as soon as the set's own work
+        # files are complete rather than after a barrier on all the sets
+        script.spid_count = script.spid_count + 1
+        script.add("# --- {} summary set {} ---".format(runtype, summary["id"]))
+        script.add("(")
+        output_pids = {}
+        for process_id in process_ids:
+            for output, cmd in self._get_summary_output_cmds(script, runtype, summary, process_id):
+                if output in self._get_summary_merge_output_names(summary):
+                    script.opid_count = script.opid_count + 1
+                    output_pids[(output, process_id)] = script.opid_count
+                    cmd = cmd + " opid{}=$!".format(script.opid_count)
+                script.add(cmd)
+        for process_id in process_ids:
+            self._do_summary_tee(script, runtype, summary, process_id, counted=False)
+        self._do_summary_merges(script, runtype, summary, process_ids, output_pids)
+        script.add("wait")
+        self._do_summary_post_processing(script, runtype, summary, counted=False)
+        script.add("wait")
+        script.add(") & spid{}=$!".format(script.spid_count))
+        script.add("")
+
+
+    def _do_summary_merges(self, script, runtype, summary, process_ids, output_pids):
+        # appends the work files of each process to the summary set's output
+        # files once the process's output processes have exited, in process
+        # order - the first process's files (which have the headers) replace
+        # the output files
+        summary_set = summary["id"]
+        outputs = self._get_summary_merge_output_names(summary)
+        if not outputs:
+            return
+        for process_id in process_ids:
+            script.add("wait " + "".join("$opid{} ".format(output_pids[(output, process_id)]) for output in outputs))
+            for output in outputs:
+                script.add("cat work/kat/{0}_S{1}_{2}_P{3} {4} output/{0}_S{1}_{2}.csv".format(
+                    runtype, summary_set, output, process_id, ">" if process_id == process_ids[0] else ">>"))
+
+
+    def _do_computes(self, script, runtype, process_ids, gather=False):
+        if gather:
+            for summary in self._summaries(runtype):
+                if (runtype, summary["id"]) not in script.deferred:
+                    self._do_summary_set(script, runtype, summary, process_ids)
+        else:
+            for process_id in process_ids:
+                self._do_any(script, runtype, process_id)
+
+            for process_id in process_ids:
+                self._do_tees(script, runtype, process_id)
+
+        for process_id in process_ids:
+            self._do_summarycalcs(script, runtype, process_id)
+
+
+    def _do_deferred_summary_sets(self, script, process_ids):
+        # the output processes and then the final steps of the deferred
+        # summary sets, from their work files
+        script.add("# --- Do deferred summary sets ---")
+        script.add("")
+        cmds = []
+        final_steps = _Script(deferred=script.deferred)
+        for runtype, summary in self._get_summary_sets():
+            if (runtype, summary["id"]) in script.deferred:
+                for process_id in process_ids:
+                    cmds.extend(cmd for _, cmd in self._get_summary_output_cmds(script, runtype, summary, process_id))
+                self._do_summary_kats(final_steps, runtype, summary, counted=False)
+                self._do_summary_post_processing(final_steps, runtype, summary, counted=False)
+
+        batch_size = self._get_deferred_batch_size(script.deferred)
+        self._do_batches(script, cmds, batch_size)
+        self._do_batches(script, final_steps.lines, batch_size)
+
+
+    def _do_batches(self, script, cmds, batch_size):
+        for i in range(0, len(cmds), batch_size):
+            first_pid = script.dpid_count + 1
+            for cmd in cmds[i:i + batch_size]:
+                script.dpid_count = script.dpid_count + 1
+                script.add(cmd + " dpid{}=$!".format(script.dpid_count))
+            script.add(
+                "wait " + "".join("$dpid{} ".format(pid) for pid in range(first_pid, script.dpid_count + 1)))
+            script.add("")
+
+
+    def _do_background_process(self, script, cmd):
+        # a background process without a PID variable (except in a checked
+        # script, where every background process is counted, and in a script
+        # with deferred summary sets, which wait for the calculations)
+        if script.checked or script.deferred:
+            script.pid_count = script.pid_count + 1
+            cmd = cmd + " pid{}=$!".format(script.pid_count)
+        script.add(cmd)
+
+
+    def _do_waits(self, script, wait_variable, wait_count):
+        if wait_count > 0:
+            if script.checked:
+                # wait for the processes in the order in which they exit, as
+                # the readers and writers of the fifos of a failed process
+                # can block forever
+                for _ in range(wait_count):
+                    script.add("wait -n")
+            else:
+                cmd = "wait "
+                for pid in range(1, wait_count + 1):
+                    cmd = cmd + "${}{} ".format(wait_variable, pid)
+                script.add(cmd)
+            script.add("")
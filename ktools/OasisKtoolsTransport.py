@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+# BSD 3-Clause License
+# 
+# Copyright (c) 2017-2020, Oasis Loss Modelling Framework
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+__all__ = [
+    'OasisKtoolsPartitionsError',
+    'OasisKtoolsTransportInterface',
+    'OasisLocalKtoolsTransport'
+]
+
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import sys
+
+from interface import (
+    implements,
+    Interface,
+)
+
+if os.getcwd().split(os.path.sep)[-1] == 'ktools':
+    sys.path.insert(0, os.path.abspath(os.pardir))
+
+from oasis_utils import OasisException
+
+from OasisKtoolsOrchestrator import OasisKtoolsOrchestrator
+
+
+class OasisKtoolsPartitionsError(OasisException):
+    """
+    Raised by a ktools transport when some of the partitions of a model run
+    fail - ``process_ids`` are the process IDs of the failed partitions, so
+    that they can be retried (the other partitions are complete).
+    """
+
+    def __init__(self, msg, process_ids=None):
+        super(OasisKtoolsPartitionsError, self).__init__(msg)
+        self.process_ids = sorted(process_ids or [])
+
+
+class OasisKtoolsTransportInterface(Interface):
+    """
+    An interface for defining the behaviour of a ktools transport, which
+    runs the per-process (partition) ktools scripts of a model run on worker
+    nodes and gathers their outputs back into the model run directory (see
+    ``OasisKtoolsScriptBuilder.build_partition``).
+    """
+
+    def run_partitions(self, model_run_dir_path, partitions):
+        """
+        Runs the given partitions of a model run on the worker nodes, and
+        returns when the output files of all of them are in the model run
+        directory. ``partitions`` is a list of triples
+        ``(process_id, script_lines, output_file_paths)`` - the lines of the
+        partition's ktools script, which should be run in a directory with
+        the ``input`` and ``static`` folders of the model run, and the paths
+        (relative to the model run directory) of the output files of the
+        partition which should be gathered. Raises an
+        ``OasisKtoolsPartitionsError`` with the process IDs of the failed
+        partitions if any partitions fail - the output files of the other
+        partitions should be in the model run directory.
+        """
+        pass
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.symlink(src, dst)
+    except (AttributeError, NotImplementedError, OSError):
+        shutil.copytree(src, dst)
+
+
+def _run_local_ktools_partition(args):
+    """
+    Local ktools transport process pool task - runs a partition in its own
+    node directory, moves its output files into the model run directory
+    and returns the process ID and an error message (or ``None``).
+    """
+    model_run_dir_path, node_dir_path, process_id, script_lines, output_file_paths, executor = args
+    try:
+        if os.path.exists(node_dir_path):
+            shutil.rmtree(node_dir_path)
+        os.makedirs(node_dir_path)
+        for d in ['input', 'static']:
+            _link_or_copy(os.path.join(model_run_dir_path, d), os.path.join(node_dir_path, d))
+        for d in ['fifo', 'output', 'work']:
+            os.mkdir(os.path.join(node_dir_path, d))
+
+        script_path = os.path.join(node_dir_path, 'run_ktools.sh')
+        with io.open(script_path, 'w', encoding='utf-8') as f:
+            f.write(u''.join(u'{}\n'.format(l) for l in script_lines))
+
+        if executor == 'python':
+            OasisKtoolsOrchestrator.create(node_dir_path, script_lines=script_lines).run()
+        else:
+            p = subprocess.Popen(['bash', script_path], cwd=node_dir_path, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+            if p.wait() != 0:
+                try:
+                    os.killpg(p.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+                raise OasisException('ktools partition script failed with exit code {}'.format(p.returncode))
+
+        missing = [fp for fp in output_file_paths if not os.path.exists(os.path.join(node_dir_path, fp))]
+        if missing:
+            raise OasisException('Missing partition output files {}'.format(', '.join(missing)))
+
+        for fp in output_file_paths:
+            dst = os.path.join(model_run_dir_path, fp)
+            if not os.path.exists(os.path.dirname(dst)):
+                try:
+                    os.makedirs(os.path.dirname(dst))
+                except OSError:
+                    if not os.path.isdir(os.path.dirname(dst)):
+                        raise
+            shutil.move(os.path.join(node_dir_path, fp), dst)
+
+        shutil.rmtree(node_dir_path)
+    except Exception as e:
+        return process_id, str(e) or repr(e)
+
+    return process_id, None
+
+
+class OasisLocalKtoolsTransport(implements(OasisKtoolsTransportInterface)):
+    """
+    A local stand-in for a multi-node ktools transport, for testing - each
+    worker node is a process of a local process pool, and each partition is
+    run in its own node directory (``nodes/P<n>`` in the model run
+    directory by default), with links to (or, where links are not
+    supported, copies of) the model run ``input`` and ``static`` folders.
+    The output files of a partition are moved into the model run directory
+    when the partition completes, and the node directory is removed - the
+    node directories of failed partitions are kept. With the ``bash``
+    executor each partition script is run in its own process group, and
+    any processes left by a failed script are terminated.
+    """
+
+    def __init__(self, num_nodes=2, executor='bash', nodes_dir_path=None):
+        self._num_nodes = num_nodes
+        self._executor = executor
+        self._nodes_dir_path = nodes_dir_path
+        self.logger = logging.getLogger()
+
+
+    @classmethod
+    def create(cls, num_nodes=2, executor='bash', nodes_dir_path=None):
+        return cls(num_nodes=num_nodes, executor=executor, nodes_dir_path=nodes_dir_path)
+
+
+    @property
+    def num_nodes(self):
+        """
+        Number of worker nodes property - getter only.
+
+            :getter: Gets the number of worker nodes (pool processes)
+        """
+        return self._num_nodes
+
+
+    @property
+    def executor(self):
+        """
+        Partition script executor property - getter only.
+
+            :getter: Gets the partition script executor - ``bash`` or
+                     ``python`` (the ktools orchestrator)
+        """
+        return self._executor
+
+
+    def run_partitions(self, model_run_dir_path, partitions):
+        model_run_dir_path = os.path.abspath(model_run_dir_path)
+        nodes_dir_path = os.path.abspath(self._nodes_dir_path or os.path.join(model_run_dir_path, 'nodes'))
+
+        tasks = [
+            (
+                model_run_dir_path,
+                os.path.join(nodes_dir_path, 'P{}'.format(process_id)),
+                process_id, list(script_lines), list(output_file_paths),
+                self._executor
+            )
+            for process_id, script_lines, output_file_paths in partitions
+        ]
+
+        errors = []
+        pool = multiprocessing.Pool(processes=max(min(self._num_nodes, len(tasks)), 1))
+        try:
+            for process_id, error in pool.imap_unordered(_run_local_ktools_partition, tasks):
+                if error:
+                    self.logger.error('ktools partition {} failed: {}'.format(process_id, error))
+                    errors.append((process_id, error))
+                else:
+                    self.logger.info('ktools partition {} completed'.format(process_id))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        if errors:
+            raise OasisKtoolsPartitionsError(
+                'ktools partitions {} failed: {}'.format(
+                    ', '.join(str(p) for p, _ in sorted(errors)), sorted(errors)[0][1]
+                ),
+                process_ids=[p for p, _ in errors]
+            )
+
+        try:
+            os.rmdir(nodes_dir_path)
+        except OSError:
+            pass
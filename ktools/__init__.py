@@ -0,0 +1,9 @@
+from .OasisKtoolsOrchestrator import *
+from .OasisKtoolsScriptBuilder import *
+from .OasisEventPartitionPlanner import *
+from .OasisKtoolsTransport import *
+from .OasisKtoolsCheckpoints import *
+from .OasisKtoolsProcessTuner import *
+from .OasisKtoolsCpuLayout import *
+from .OasisKtoolsScratchSpace import *
+from .OasisKtoolsGulStream import *
@@ -19,12 +19,38 @@ following arguments (in no particular order)
                    -b /path/to/source/to/canonical/exposures/transformation/file
                    -c /path/to/canonical/exposures/validation/file
                    -d /path/to/canonical/to/model/exposures/transformation/file
-                   -x /path/to/xtrans/executable
+                   [-x /path/to/xtrans/executable]
+                   [-g <exposures transformation engine - 'xtrans' or 'native'>]
+                   [-u /path/to/transformation/plans/cache/directory]
+                   [--stream_exposures]
                    -j /path/to/analysis/settings/json/file
                    -m /path/to/model/data
                    [-r /path/to/model/run/directory]
                    [-s <ktools script name (without file extension)>]
-                   [-n <number of ktools calculation processes to use>]
+                   [-n <number of ktools calculation processes to use, or 'auto'>]
+                   [--calibrate_ktools | --no-calibrate_ktools]
+                   [-B <maximum number of concurrent ktools processes>]
+                   [-E <ktools script executor - 'bash' or 'python'>]
+                   [-T <ktools transport - 'local' or transport class path>]
+                   [-N <number of ktools transport nodes>]
+                   [-R <number of retries of failed ktools partitions>]
+                   [--resume_ktools_run]
+                   [--trace_ktools]
+                   [--chrome_trace_ktools]
+                   [--balance_event_partitions]
+                   [--pin_ktools_partitions]
+                   [-S /path/to/ktools/scratch/directory]
+                   [-F <minimum free space of the ktools scratch directory (MB)>]
+                   [-C <ktools work file codec - 'lz4', 'zstd' or 'gzip'>]
+                   [-M <GUL stream mode - 'capture' or 'replay'>]
+                   [-G /path/to/gul/stream/directory]
+                   [-K <number of keys rows per chunk in streaming mode>]
+                   [-O <memory ceiling (MB) for the canonical exposures index in streaming mode>]
+                   [-t <Oasis files format - 'csv', 'bin' or 'both'>]
+                   [-w <number of keys lookup worker processes>]
+                   [-q /path/to/keys/lookup/cache/file]
+                   [-z <maximum number of keys lookup cache entries>]
+                   [-Q <comma-separated keys lookup cache columns>]
 
 When calling the script this way paths can be given relative to the
 script, in particular, file paths should include the filename and
@@ -34,10 +60,89 @@ transformation and validation files, and analysis settings JSON file,
 will usually be located in the model keys server repository. The path to
 the model run directory is optional - by default the script will create
 a timestamped folder in ``omdk/runs`` with the prefix ``ProgOasis``. The
-ktools script name and number of calculation processes are also optional
-- by default the script will create a ktools script named
+ktools script name and number of calculation processes are also
+optional - by default the script will create a ktools script named
 ``run_tools.sh`` and set the number of calculation processes to 2.
 
+The following options are also optional (see ``generate_oasis_files.py``
+and ``generate_losses.py`` for the details):
+
+* ``-g``, ``-x`` - the exposures transformation engine and the path to
+  the ``xtrans`` executable. By default the source -> canonical and
+  canonical -> model exposures transformations are run by ``xtrans``,
+  and the ``xtrans`` path is required. With the ``native`` engine they
+  are run in process by a Python transformer, which falls back to
+  ``xtrans`` for transformation files it does not support.
+* ``--stream_exposures`` - with the ``native`` engine, runs the two
+  exposures transformations and the keys lookup as concurrent stages,
+  with each stage consuming the output of the previous stage chunk by
+  chunk as it is generated.
+* ``-u`` - the transformation plans cache directory, to which the
+  compiled exposures transformation plans are saved, and from which they
+  are reused in later runs.
+* ``-n auto`` - chooses the number of ktools calculation processes from
+  the host and the model run, with a short calibration run for large
+  event sets (unless ``--no-calibrate_ktools`` is given), within the
+  process budget (``-B``) and the nodes of a remote ktools transport
+  (``-N``), and writes the plan to ``ktools_plan.json`` in the model run
+  directory.
+* ``-B`` - the ktools process budget. If given then the ktools script
+  defers and batches the outputs of summary sets to run at most about
+  this many concurrent processes.
+* ``-E`` - the ktools script executor. By default the ktools script is
+  run with ``bash``, and it can also be run by the in-process ktools
+  orchestrator (``python``).
+* ``-T``, ``-N`` - the ktools transport and its number of nodes. If a
+  transport is given then the ktools calculation processes are run
+  separately, on the worker nodes of the transport (``local`` is a local
+  multi-process stand-in), and their outputs are gathered back for the
+  final steps of the run.
+* ``-R`` - the number of retries of failed ktools calculation processes
+  (partitions).
+* ``--resume_ktools_run`` - skips the partitions completed by an earlier
+  run in the same model run directory.
+* ``--trace_ktools`` - traces the ktools processes (timings, CPU times,
+  peak RSS on Linux and bytes read and written) with the ktools
+  orchestrator, and writes the trace to ``ktools_trace.json`` in the
+  model run directory.
+* ``--chrome_trace_ktools`` - also writes the trace as a Chrome trace,
+  to ``ktools_trace_chrome.json``.
+* ``--balance_event_partitions`` - splits the events between the ktools
+  calculation processes by estimated cost instead of by number.
+* ``--pin_ktools_partitions`` - pins each ktools calculation process
+  (partition) to a core set and NUMA node, spread evenly across the
+  sockets of the host, and writes the layout to
+  ``ktools_cpu_layout.json`` in the model run directory.
+* ``-S``, ``-F`` - the ktools scratch directory, e.g. ``/dev/shm``, and
+  its minimum free space. The ktools fifo and work folders are placed in
+  the scratch directory, if it has the minimum free space, so that only
+  the output files are written to the model run directory.
+* ``-C`` - the ktools work file codec (``lz4``, ``zstd`` or ``gzip``).
+  The ``leccalc`` work files are compressed with it, and the compression
+  ratio and throughput are written to ``ktools_work_codec.json`` in the
+  model run directory.
+* ``-M``, ``-G`` - the GUL stream mode and directory (by default
+  ``gul_stream`` in the model run directory). With ``capture`` the
+  ``gulcalc`` streams of the run are written to the directory, and with
+  ``replay`` ``fmcalc`` and ``summarycalc`` are run from the captured
+  streams, without ``getmodel`` and ``gulcalc``, e.g. for other
+  financial terms or summary options.
+* ``-K``, ``-O`` - the number of keys rows per chunk and the memory
+  ceiling (MB) of the canonical exposures index (``-n``, ``-m`` of
+  ``generate_oasis_files.py``). If a chunk size is given then the Oasis
+  files are generated in streaming mode, in bounded memory.
+* ``-t`` - the Oasis files format. By default the Oasis files are
+  written as CSV files and converted to ktools binary files for the
+  model run.
+* ``-w`` - the number of keys lookup worker processes. If it is greater
+  than 1 then the keys lookup is run in parallel in that many processes.
+* ``-q``, ``-z`` - the keys lookup cache file path and maximum number of
+  entries. If a cache file path is given then only locations which are
+  not in the (persistent) cache are sent to the lookup service.
+* ``-Q`` - the keys lookup cache columns, i.e. the location columns used
+  by the lookup. By default the cache is keyed by all the location
+  columns except the ID.
+
 It is also possible to run the script by defining these arguments in a
 JSON configuration file and calling the script using the path to this
 file using the option ``-f`` and the (relative or absolute) path to the
@@ -61,20 +166,92 @@ The JSON file should contain the following keys (in no particular order)
     "canonical_exposures_validation_file_path"
     "canonical_to_model_exposures_transformation_file_path"
     "xtrans_path"
+    "transformation_engine"
+    "stream_exposures"
+    "transformation_plans_cache_path"
     "analysis_settings_json_file_path"
     "model_data_path"
     "model_run_dir_path"
     "ktools_script_name"
     "ktools_num_processes"
+    "calibrate_ktools"
+    "ktools_process_budget"
+    "ktools_executor"
+    "ktools_transport"
+    "ktools_num_nodes"
+    "ktools_partition_retries"
+    "resume_ktools_run"
+    "trace_ktools"
+    "chrome_trace_ktools"
+    "balance_event_partitions"
+    "pin_ktools_partitions"
+    "ktools_scratch_dir_path"
+    "ktools_scratch_min_free_mb"
+    "ktools_work_codec"
+    "ktools_gul_stream_mode"
+    "ktools_gul_stream_dir_path"
+    "oasis_files_chunk_size"
+    "oasis_files_max_memory"
+    "oasis_files_format"
+    "keys_lookup_num_processes"
+    "keys_cache_path"
+    "keys_cache_max_entries"
+    "keys_cache_columns"
 
 and the values of the path-related keys should be string paths, given
-relative to the location of the JSON file. The JSON file is usually placed in the model keys server
-repository. The ``"model_run_dir_path"`` key is optional - by default
-the script will create a timestamped folder in ``omdk/runs`` with the
-prefix ``ProgOasis``. The ``"ktools_script_name"`` and
-``"ktools_num_processes"`` keys are optional - by default the script
-will create a ktools script named ``run_tools.sh`` and set the number of
-calculation processes to 2.
+relative to the location of the JSON file. The JSON file is usually
+placed in the model keys server repository. The ``"model_run_dir_path"``
+key is optional - by default the script will create a timestamped folder
+in ``omdk/runs`` with the prefix ``ProgOasis``. The
+``"ktools_script_name"`` and ``"ktools_num_processes"`` keys are
+optional - by default the script will create a ktools script named
+``run_tools.sh`` and set the number of calculation processes to 2 - the
+number of calculation processes can also be ``"auto"``.
+
+The following keys are also optional:
+
+* ``"transformation_engine"`` - by default the ``xtrans`` exposures
+  transformation engine is used, and the ``"xtrans_path"`` key is
+  required.
+* ``"stream_exposures"`` - by default the exposures transformations and
+  keys lookup are run in sequence.
+* ``"transformation_plans_cache_path"`` - by default transformation
+  plans are not cached between runs.
+* ``"calibrate_ktools"`` - by default the ``auto`` number of calculation
+  processes may be calibrated.
+* ``"ktools_process_budget"`` - by default the number of concurrent
+  ktools processes is not limited.
+* ``"ktools_executor"`` - by default the ktools script is run with
+  ``bash``.
+* ``"ktools_transport"`` and ``"ktools_num_nodes"`` - by default all the
+  ktools calculation processes are run on the local host by the ktools
+  script.
+* ``"ktools_partition_retries"`` - by default failed partitions are not
+  retried.
+* ``"resume_ktools_run"`` - by default the ktools run is not resumed.
+* ``"trace_ktools"`` and ``"chrome_trace_ktools"`` - by default the
+  ktools run is not traced.
+* ``"balance_event_partitions"`` - by default the events are partitioned
+  by ``eve``.
+* ``"pin_ktools_partitions"`` - by default the ktools processes are not
+  pinned.
+* ``"ktools_scratch_dir_path"`` and ``"ktools_scratch_min_free_mb"`` -
+  by default the ktools fifo and work folders are in the model run
+  directory.
+* ``"ktools_work_codec"`` - by default the ktools work files are not
+  compressed.
+* ``"ktools_gul_stream_mode"`` and ``"ktools_gul_stream_dir_path"`` - by
+  default the GUL streams are neither captured nor replayed.
+* ``"oasis_files_chunk_size"`` and ``"oasis_files_max_memory"`` - by
+  default the Oasis files are generated in memory.
+* ``"oasis_files_format"`` - by default the Oasis files are written as
+  CSV files.
+* ``"keys_lookup_num_processes"`` - by default the keys lookup is run in
+  a single process.
+* ``"keys_cache_path"`` and ``"keys_cache_max_entries"`` - by default no
+  keys lookup cache is used.
+* ``"keys_cache_columns"`` - by default the keys lookup cache is keyed
+  by all the location columns except the ID.
 
 You can define a separate JSON configuration file for each model,
 provided you have the model keys server repository and other required
@@ -235,11 +412,37 @@ SCRIPT_ARGS_METADICT = {
         'name': 'xtrans_path',
         'flag': 'x',
         'type': str,
-        'help_text': 'Path of the xtrans executable which performs the source -> canonical and canonical -> model exposures transformations',
+        'help_text': 'Path of the xtrans executable which performs the source -> canonical and canonical -> model exposures transformations - only required if the xtrans transformation engine is used',
         'required_on_command_line': False,
-        'required_for_script': True,
+        'required_for_script': False,
         'preexists': True
     },
+    'transformation_engine': {
+        'name': 'transformation_engine',
+        'flag': 'g',
+        'type': str,
+        'help_text': 'Exposures transformation engine: choices are `xtrans` (default) and `native` (in process)',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'transformation_plans_cache_path': {
+        'name': 'transformation_plans_cache_path',
+        'flag': 'u',
+        'type': str,
+        'help_text': 'Directory in which compiled exposures transformation plans are cached between runs',
+        'required_on_command_line': False,
+        'required_for_script': False,
+        'preexists': False
+    },
+    'stream_exposures': {
+        'name': 'stream_exposures',
+        'dest': 'stream_exposures',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to run the exposures transformations and keys lookup as concurrent streaming stages',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
     'analysis_settings_json_file_path': {
         'name': 'analysis_settings_json_file_path',
         'flag': 'j',
@@ -279,7 +482,200 @@ SCRIPT_ARGS_METADICT = {
         'name': 'ktools_num_processes',
         'flag': 'n',
         'type': str,
-        'help_text': 'Number of ktools calculation processes/streams to use',
+        'help_text': 'Number of ktools calculation processes/streams to use, or `auto` to choose it from the host and the model run',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'calibrate_ktools': {
+        'name': 'calibrate_ktools',
+        'dest': 'calibrate_ktools',
+        'type': bool,
+        'default': True,
+        'help_text': 'Whether the `auto` number of ktools calculation processes may be calibrated with a short run on a sample of the events',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_process_budget': {
+        'name': 'ktools_process_budget',
+        'flag': 'B',
+        'type': int,
+        'help_text': 'Maximum number of concurrent ktools processes - summary set outputs are deferred and batched to keep within it',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_executor': {
+        'name': 'ktools_executor',
+        'flag': 'E',
+        'type': str,
+        'help_text': 'ktools script executor: choices are `bash` (default) and `python` (in-process ktools orchestrator)',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_transport': {
+        'name': 'ktools_transport',
+        'flag': 'T',
+        'type': str,
+        'help_text': 'Transport for running the ktools calculation processes on several nodes: `local` (local multi-process stand-in) or the full path of a transport class',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_num_nodes': {
+        'name': 'ktools_num_nodes',
+        'flag': 'N',
+        'type': int,
+        'help_text': 'Number of nodes for the ktools transport - by default the number of ktools calculation processes',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_partition_retries': {
+        'name': 'ktools_partition_retries',
+        'flag': 'R',
+        'type': int,
+        'help_text': 'Number of times to retry failed ktools calculation processes (partitions) - by default 0',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'resume_ktools_run': {
+        'name': 'resume_ktools_run',
+        'dest': 'resume_ktools_run',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to resume the ktools run in the model run directory, skipping the ktools calculation processes (partitions) it completed',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'trace_ktools': {
+        'name': 'trace_ktools',
+        'dest': 'trace_ktools',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to trace the ktools processes (timings, CPU time, peak RSS on Linux and bytes read and written) and write the trace to `ktools_trace.json` in the model run directory',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'chrome_trace_ktools': {
+        'name': 'chrome_trace_ktools',
+        'dest': 'chrome_trace_ktools',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to also write the ktools trace as a Chrome trace to `ktools_trace_chrome.json` in the model run directory',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'balance_event_partitions': {
+        'name': 'balance_event_partitions',
+        'dest': 'balance_event_partitions',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to partition the events between the ktools calculation processes by estimated cost instead of by number',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'pin_ktools_partitions': {
+        'name': 'pin_ktools_partitions',
+        'dest': 'pin_ktools_partitions',
+        'type': bool,
+        'default': False,
+        'help_text': 'Whether to pin the ktools calculation processes (partitions) to core sets and NUMA nodes, spread evenly across the sockets',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_scratch_dir_path': {
+        'name': 'ktools_scratch_dir_path',
+        'flag': 'S',
+        'type': str,
+        'help_text': 'Scratch directory (e.g. `/dev/shm` or a local disk) for the ktools fifo and work folders',
+        'required_on_command_line': False,
+        'required_for_script': False,
+        'preexists': False
+    },
+    'ktools_scratch_min_free_mb': {
+        'name': 'ktools_scratch_min_free_mb',
+        'flag': 'F',
+        'type': int,
+        'help_text': 'Minimum free space (MB) of the ktools scratch directory for using it - by default 1024',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_work_codec': {
+        'name': 'ktools_work_codec',
+        'flag': 'C',
+        'type': str,
+        'help_text': 'Codec for compressing the ktools leccalc work files - `lz4`, `zstd` or `gzip` - by default the work files are not compressed',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_gul_stream_mode': {
+        'name': 'ktools_gul_stream_mode',
+        'flag': 'M',
+        'type': str,
+        'help_text': 'GUL stream mode - `capture` to write the gulcalc streams to the GUL stream directory, or `replay` to run fmcalc and summarycalc from the captured streams without getmodel and gulcalc',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'ktools_gul_stream_dir_path': {
+        'name': 'ktools_gul_stream_dir_path',
+        'flag': 'G',
+        'type': str,
+        'help_text': 'GUL stream directory - by default `gul_stream` in the model run directory',
+        'required_on_command_line': False,
+        'required_for_script': False,
+        'preexists': False
+    },
+    'oasis_files_chunk_size': {
+        'name': 'oasis_files_chunk_size',
+        'flag': 'K',
+        'type': int,
+        'help_text': 'Number of keys rows per chunk for generating Oasis files in streaming mode - by default the files are generated in memory',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'oasis_files_max_memory': {
+        'name': 'oasis_files_max_memory',
+        'flag': 'O',
+        'type': int,
+        'help_text': 'Memory ceiling (MB) for the canonical exposures index in streaming mode, beyond which the index is moved to disk',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'oasis_files_format': {
+        'name': 'oasis_files_format',
+        'flag': 't',
+        'type': str,
+        'help_text': 'Oasis files format: choices are `csv` (default), `bin` (ktools binary files) and `both`',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'keys_lookup_num_processes': {
+        'name': 'keys_lookup_num_processes',
+        'flag': 'w',
+        'type': int,
+        'help_text': 'Number of worker processes for the keys lookup - by default the lookup is run in a single process',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'keys_cache_path': {
+        'name': 'keys_cache_path',
+        'flag': 'q',
+        'type': str,
+        'help_text': 'Path of a persistent keys lookup cache (SQLite) file - only locations not in the cache are looked up',
+        'required_on_command_line': False,
+        'required_for_script': False,
+        'preexists': False
+    },
+    'keys_cache_max_entries': {
+        'name': 'keys_cache_max_entries',
+        'flag': 'z',
+        'type': int,
+        'help_text': 'Maximum number of keys lookup cache entries, beyond which the least recently used entries are evicted',
+        'required_on_command_line': False,
+        'required_for_script': False
+    },
+    'keys_cache_columns': {
+        'name': 'keys_cache_columns',
+        'flag': 'Q',
+        'type': str,
+        'help_text': 'Comma-separated location columns used by the keys lookup, which key the keys lookup cache - by default all the location columns except the ID',
         'required_on_command_line': False,
         'required_for_script': False
     }
@@ -342,7 +738,6 @@ if __name__ == '__main__':
               " -b {}"
               " -c {}"
               " -d {}"
-              " -x {}"
               " -o {}"
         ).format(
             args['keys_data_path'],
@@ -354,10 +749,45 @@ if __name__ == '__main__':
             args['source_to_canonical_exposures_transformation_file_path'],
             args['canonical_exposures_validation_file_path'],
             args['canonical_to_model_exposures_transformation_file_path'],
-            args['xtrans_path'],
             tmp_oasis_files_path
         )
 
+        if 'xtrans_path' in args and args['xtrans_path']:
+            cmd_str += ' -x {}'.format(args['xtrans_path'])
+
+        if 'transformation_engine' in args and args['transformation_engine']:
+            cmd_str += ' -g {}'.format(args['transformation_engine'])
+
+        if 'stream_exposures' in args and args['stream_exposures']:
+            cmd_str += ' --stream_exposures'
+
+        if 'transformation_plans_cache_path' in args and args['transformation_plans_cache_path']:
+            cmd_str += ' -u {}'.format(args['transformation_plans_cache_path'])
+
+        if 'oasis_files_chunk_size' in args and args['oasis_files_chunk_size']:
+            cmd_str += ' -n {}'.format(args['oasis_files_chunk_size'])
+
+        if 'oasis_files_max_memory' in args and args['oasis_files_max_memory']:
+            cmd_str += ' -m {}'.format(args['oasis_files_max_memory'])
+
+        if 'oasis_files_format' in args and args['oasis_files_format']:
+            cmd_str += ' -t {}'.format(args['oasis_files_format'])
+
+        if 'keys_lookup_num_processes' in args and args['keys_lookup_num_processes']:
+            cmd_str += ' -w {}'.format(args['keys_lookup_num_processes'])
+
+        if 'keys_cache_path' in args and args['keys_cache_path']:
+            cmd_str += ' -q {}'.format(args['keys_cache_path'])
+
+        if 'keys_cache_max_entries' in args and args['keys_cache_max_entries']:
+            cmd_str += ' -z {}'.format(args['keys_cache_max_entries'])
+
+        if 'keys_cache_columns' in args and args['keys_cache_columns']:
+            keys_cache_columns = args['keys_cache_columns']
+            if isinstance(keys_cache_columns, list):
+                keys_cache_columns = ','.join(keys_cache_columns)
+            cmd_str += ' -Q {}'.format(keys_cache_columns)
+
         try:
             logger.info('Calling script `generate_oasis_files.py` - to generate Oasis input files')
             subprocess.check_call(cmd_str, stderr=subprocess.STDOUT, shell=True)
@@ -391,6 +821,54 @@ if __name__ == '__main__':
             ktools_num_processes
         )
 
+        if 'calibrate_ktools' in args and args['calibrate_ktools'] == False:
+            cmd_str += ' --no-calibrate_ktools'
+
+        if 'ktools_process_budget' in args and args['ktools_process_budget']:
+            cmd_str += ' -B {}'.format(args['ktools_process_budget'])
+
+        if 'ktools_executor' in args and args['ktools_executor']:
+            cmd_str += ' -E {}'.format(args['ktools_executor'])
+
+        if 'ktools_transport' in args and args['ktools_transport']:
+            cmd_str += ' -T {}'.format(args['ktools_transport'])
+
+        if 'ktools_num_nodes' in args and args['ktools_num_nodes']:
+            cmd_str += ' -N {}'.format(args['ktools_num_nodes'])
+
+        if 'ktools_partition_retries' in args and args['ktools_partition_retries']:
+            cmd_str += ' -R {}'.format(args['ktools_partition_retries'])
+
+        if 'resume_ktools_run' in args and args['resume_ktools_run']:
+            cmd_str += ' --resume_ktools_run'
+
+        if 'trace_ktools' in args and args['trace_ktools']:
+            cmd_str += ' --trace_ktools'
+
+        if 'chrome_trace_ktools' in args and args['chrome_trace_ktools']:
+            cmd_str += ' --chrome_trace_ktools'
+
+        if 'balance_event_partitions' in args and args['balance_event_partitions']:
+            cmd_str += ' --balance_event_partitions'
+
+        if 'pin_ktools_partitions' in args and args['pin_ktools_partitions']:
+            cmd_str += ' --pin_ktools_partitions'
+
+        if 'ktools_scratch_dir_path' in args and args['ktools_scratch_dir_path']:
+            cmd_str += ' -S {}'.format(args['ktools_scratch_dir_path'])
+
+        if 'ktools_scratch_min_free_mb' in args and args['ktools_scratch_min_free_mb']:
+            cmd_str += ' -F {}'.format(args['ktools_scratch_min_free_mb'])
+
+        if 'ktools_work_codec' in args and args['ktools_work_codec']:
+            cmd_str += ' -C {}'.format(args['ktools_work_codec'])
+
+        if 'ktools_gul_stream_mode' in args and args['ktools_gul_stream_mode']:
+            cmd_str += ' -M {}'.format(args['ktools_gul_stream_mode'])
+
+        if 'ktools_gul_stream_dir_path' in args and args['ktools_gul_stream_dir_path']:
+            cmd_str += ' -G {}'.format(args['ktools_gul_stream_dir_path'])
+
         try:
             logger.info('Calling script `generate_losses.py` to generate model ktools losses script')
             subprocess.check_call(cmd_str, stderr=subprocess.STDOUT, shell=True)
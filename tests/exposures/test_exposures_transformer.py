@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+"""
+Golden tests of the native exposures transformer against the output of
+``xtrans`` - the expected files in ``data/xtrans`` are what ``xtrans``
+writes for the source and canonical files there, with the ``-s`` option for
+the source -> canonical transformation.
+"""
+
+import io
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR_PATH = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR_PATH = os.path.join(TESTS_DIR_PATH, 'data', 'xtrans')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(TESTS_DIR_PATH)), 'exposures'))
+
+from oasis_utils import OasisException
+
+from OasisExposuresTransformer import OasisExposuresTransformer
+
+
+def _data(file_name):
+    return os.path.join(DATA_DIR_PATH, file_name)
+
+
+def _read_bytes(file_path):
+    with io.open(file_path, 'rb') as f:
+        return f.read()
+
+
+def _expected_bytes(file_name):
+    # ``xtrans`` ends lines with ``Environment.NewLine``
+    return _read_bytes(_data(file_name)).replace(b'\n', os.linesep.encode('utf-8'))
+
+
+def _xtrans_chunks_output(values, sequence_numbers=False):
+    """
+    Returns the lines ``xtrans`` writes for ``chunks.xslt`` and a source file
+    with a column ``N`` of the given values - ``xtrans`` transforms the first
+    50001 rows, and then every 50000 rows, as separate documents, so that
+    ``position()`` and ``last()`` restart in every chunk.
+    """
+    chunks = [values[:50001]] + [values[i:i + 50000] for i in range(50001, len(values), 50000)]
+    lines = [u'ROW_ID,N,POS,LAST' if sequence_numbers else u'N,POS,LAST']
+    row_id = 1
+    for chunk in chunks:
+        for pos, value in enumerate(chunk, 1):
+            line = u'{},{},{}'.format(value, pos, len(chunk))
+            if sequence_numbers:
+                line = u'{},{}'.format(row_id, line)
+                row_id += 1
+            lines.append(line)
+    return u''.join(l + os.linesep for l in lines).encode('utf-8')
+
+
+class ExposuresTransformerGoldenTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir_path, ignore_errors=True)
+
+    def _tmp(self, file_name):
+        return os.path.join(self.tmp_dir_path, file_name)
+
+    def _write_chunks_source(self, values):
+        source_file_path = self._tmp('chunks.csv')
+        with io.open(source_file_path, 'w', encoding='utf-8') as f:
+            f.write(u'N\n')
+            for value in values:
+                f.write(u'{}\n'.format(value))
+        return source_file_path
+
+    def test_source_to_canonical_with_sequence_numbers_matches_xtrans(self):
+        transformer = OasisExposuresTransformer.create(_data('source_to_canonical.xslt'), _data('source_loc.xsd'))
+        num_rows = transformer.transform(_data('source_loc.csv'), self._tmp('canonical_loc.csv'), sequence_numbers=True)
+
+        self.assertEqual(num_rows, 5)
+        self.assertEqual(_read_bytes(self._tmp('canonical_loc.csv')), _expected_bytes('canonical_loc.csv'))
+
+    def test_canonical_to_model_matches_xtrans(self):
+        transformer = OasisExposuresTransformer.create(_data('canonical_to_model.xslt'), _data('canonical_loc.xsd'))
+        num_rows = transformer.transform(_data('canonical_loc.csv'), self._tmp('model_loc.csv'))
+
+        self.assertEqual(num_rows, 5)
+        self.assertEqual(_read_bytes(self._tmp('model_loc.csv')), _expected_bytes('model_loc.csv'))
+
+    def test_streamed_transformations_match_xtrans(self):
+        source_to_canonical = OasisExposuresTransformer.create(_data('source_to_canonical.xslt'), _data('source_loc.xsd'))
+        canonical_to_model = OasisExposuresTransformer.create(_data('canonical_to_model.xslt'), _data('canonical_loc.xsd'))
+
+        canonical_chunks = OasisExposuresTransformer.write_chunks(
+            source_to_canonical.iter_transform(
+                OasisExposuresTransformer.read_chunks(_data('source_loc.csv')),
+                sequence_numbers=True
+            ),
+            self._tmp('canonical_loc.csv')
+        )
+        model_chunks = OasisExposuresTransformer.write_chunks(
+            canonical_to_model.iter_transform(
+                OasisExposuresTransformer.iter_record_chunks(
+                    OasisExposuresTransformer.split_lines(itertools.chain.from_iterable(canonical_chunks))
+                )
+            ),
+            self._tmp('model_loc.csv')
+        )
+        for _ in model_chunks:
+            pass
+
+        self.assertEqual(_read_bytes(self._tmp('canonical_loc.csv')), _expected_bytes('canonical_loc.csv'))
+        self.assertEqual(_read_bytes(self._tmp('model_loc.csv')), _expected_bytes('model_loc.csv'))
+
+    def test_records_keep_quotes_and_blank_first_value_drops_second_value(self):
+        chunks = list(OasisExposuresTransformer.iter_record_chunks([
+            u'A,B,C',
+            u'"x, y","say ""hi""",',
+            u',2,3'
+        ]))
+
+        self.assertEqual(chunks, [[
+            [(u'A', u'"x, y"'), (u'B', u'"say ""hi"""')],
+            [(u'B', u'3')]
+        ]])
+
+    def test_chunk_boundaries_match_xtrans(self):
+        transformer = OasisExposuresTransformer.create(_data('chunks.xslt'), _data('chunks.xsd'))
+
+        for num_rows in (50000, 50001, 50002, 100002):
+            values = list(range(1, num_rows + 1))
+            source_file_path = self._write_chunks_source(values)
+            for sequence_numbers in (False, True):
+                transformer.transform(source_file_path, self._tmp('out.csv'), sequence_numbers=sequence_numbers)
+                self.assertEqual(
+                    _read_bytes(self._tmp('out.csv')),
+                    _xtrans_chunks_output(values, sequence_numbers=sequence_numbers),
+                    '{} rows, sequence numbers {}'.format(num_rows, sequence_numbers)
+                )
+
+    def test_streamed_chunk_boundaries_match_xtrans(self):
+        transformer = OasisExposuresTransformer.create(_data('chunks.xslt'), _data('chunks.xsd'))
+        values = list(range(1, 100003))
+        source_file_path = self._write_chunks_source(values)
+
+        chunks = list(OasisExposuresTransformer.write_chunks(
+            transformer.iter_transform(OasisExposuresTransformer.read_chunks(source_file_path), sequence_numbers=True),
+            self._tmp('out.csv')
+        ))
+
+        self.assertEqual([len(lines) for lines in chunks], [50002, 50000, 1])
+        self.assertEqual(_read_bytes(self._tmp('out.csv')), _xtrans_chunks_output(values, sequence_numbers=True))
+
+    def test_only_first_chunk_is_validated(self):
+        transformer = OasisExposuresTransformer.create(_data('chunks.xslt'), _data('chunks.xsd'))
+
+        values = list(range(1, 50003))
+        values[50001] = u'x'
+        transformer.transform(self._write_chunks_source(values), self._tmp('out.csv'))
+        self.assertEqual(_read_bytes(self._tmp('out.csv')), _xtrans_chunks_output(values))
+
+        values[50001] = 50002
+        values[50000] = u'x'
+        with self.assertRaises(OasisException):
+            transformer.transform(self._write_chunks_source(values), self._tmp('out.csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
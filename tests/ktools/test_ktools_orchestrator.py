@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR_PATH = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(TESTS_DIR_PATH)), 'ktools'))
+
+from OasisKtoolsOrchestrator import OasisKtoolsOrchestrator, _find_program
+
+
+class KtoolsOrchestratorTraceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir_path, ignore_errors=True)
+
+    @unittest.skipUnless(sys.platform.startswith('linux') and _find_program('bash'), 'requires Linux and bash')
+    def test_peak_rss_excludes_the_orchestrator_image(self):
+        # A parent holding a large buffer - a process forked from it would
+        # report at least its RSS
+        buffer_size = 256 * 1024 * 1024
+        buffer = bytearray(buffer_size)
+        for i in range(0, buffer_size, 4096):
+            buffer[i] = 1
+
+        orchestrator = OasisKtoolsOrchestrator.create(
+            self.run_dir_path,
+            script_lines=['true &', 'sleep 0.1 | cat > out &', 'wait'],
+            trace=True
+        )
+        orchestrator.run()
+
+        processes = orchestrator.get_trace()['processes']
+        self.assertEqual(sorted(p['name'] for p in processes), ['cat', 'sleep', 'true'])
+        for p in processes:
+            self.assertEqual(p['exit_code'], 0)
+            self.assertIsNotNone(p['max_rss_kb'])
+            self.assertLess(p['max_rss_kb'], 32 * 1024, p['name'])
+
+        del buffer
+
+    def test_peak_rss_is_only_recorded_in_trace_mode(self):
+        orchestrator = OasisKtoolsOrchestrator.create(self.run_dir_path, script_lines=['true &', 'wait'])
+        orchestrator.run()
+
+        self.assertEqual([p['max_rss_kb'] for p in orchestrator.get_trace()['processes']], [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TESTS_DIR_PATH = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(TESTS_DIR_PATH)), 'ktools'))
+
+from OasisKtoolsOrchestrator import _find_program
+from OasisKtoolsProcessTuner import OasisKtoolsProcessTuner
+
+# Stand-ins for the ktools programs of a ground up loss calculation process
+# - ``summarycalc -g -1 <fifo>`` writes its summary to a fifo
+FAKE_KTOOLS = {
+    'getmodel': 'exec cat',
+    'gulcalc': 'exec cat',
+    'summarycalc': 'exec cat > "$3"',
+    'eltcalc': 'exec cat'
+}
+
+
+@unittest.skipUnless(sys.platform.startswith('linux') and _find_program('bash'), 'requires Linux and bash')
+class KtoolsProcessTunerCalibrationTests(unittest.TestCase):
+
+    analysis_settings = {
+        'number_of_samples': 10,
+        'gul_output': True,
+        'gul_summaries': [{'id': 1, 'eltcalc': True}]
+    }
+
+    def setUp(self):
+        self.tmp_dir_path = tempfile.mkdtemp()
+
+        bin_path = os.path.join(self.tmp_dir_path, 'bin')
+        os.mkdir(bin_path)
+        for name, command in FAKE_KTOOLS.items():
+            program_path = os.path.join(bin_path, name)
+            with io.open(program_path, 'w', encoding='utf-8') as f:
+                f.write(u'#!/bin/sh\n{}\n'.format(command))
+            os.chmod(program_path, os.stat(program_path).st_mode | stat.S_IXUSR)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = os.pathsep.join([bin_path, self.path])
+
+        self.model_run_dir_path = os.path.join(self.tmp_dir_path, 'run')
+        for d in ['input', 'static', 'fifo', 'output', 'work']:
+            os.makedirs(os.path.join(self.model_run_dir_path, d))
+        np.arange(1, 1001, dtype='<i4').tofile(os.path.join(self.model_run_dir_path, 'input', 'events.bin'))
+        np.zeros(100 * 5, dtype='<i4').tofile(os.path.join(self.model_run_dir_path, 'input', 'items.bin'))
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.tmp_dir_path, ignore_errors=True)
+
+    def test_calibration_of_a_partition_with_a_tee_leaves_out_the_fan_out(self):
+        tuner = OasisKtoolsProcessTuner.create(self.model_run_dir_path, self.analysis_settings)
+        self.assertIn('tee', tuner.get_process_names())
+
+        calibration = tuner.calibrate(num_events=50)
+
+        self.assertEqual(calibration['num_events'], 50)
+        self.assertEqual(calibration['num_fan_outs'], 1)
+        self.assertGreaterEqual(calibration['cpu'], 0)
+        self.assertGreater(calibration['memory_kb'], 0)
+        self.assertFalse(os.path.exists(os.path.join(self.model_run_dir_path, 'calibration')))
+
+    def test_plan_takes_the_calibrated_peak_rss_of_the_processes_only(self):
+        # A parent holding a large buffer - the peak RSS of a process forked
+        # from it would include its RSS
+        buffer_size = 256 * 1024 * 1024
+        buffer = bytearray(buffer_size)
+        for i in range(0, buffer_size, 4096):
+            buffer[i] = 1
+
+        tuner = OasisKtoolsProcessTuner.create(self.model_run_dir_path, self.analysis_settings)
+        tuner.calibration_min_events = 1
+        plan = tuner.plan()
+
+        calibration = plan['calibration']
+        self.assertIsNotNone(calibration)
+        self.assertEqual(plan['calculation_process_memory_kb'], calibration['memory_kb'])
+        self.assertLess(calibration['memory_kb'], 64 * 1024)
+        self.assertIn(
+            '1 tee fan-out(s) not counted in the calibration CPU - they run in the ktools orchestrator', plan['reasons']
+        )
+
+        del buffer
+
+
+if __name__ == '__main__':
+    unittest.main()